@@ -0,0 +1,258 @@
+"""
+Defesa Civil Araruna - Agregação temporal durante a conversão
+Reduz a série (horária → diária, diária → mensal, mensal → anual) com
+soma, média ou máximo sem gerar a tabela completa: cada fatia é reduzida
+aos seus períodos (reduzir_fatia, também nos processos trabalhadores) e
+o AcumuladorTemporal soma essas parciais na grade do período. Como as
+fatias seguem a ordem do tempo, um período é entregue assim que a
+primeira fatia do período seguinte chega; só a tabela agregada é escrita.
+A soma de uma taxa (ex.: kg m-2 s-1) sai como total em mm no período.
+"""
+
+import numpy as np
+import xarray as xr
+
+import indices_extremos
+import motor_tabular
+import subconjunto
+
+
+# Período de destino -> unidade do datetime64 que trunca a data no início do período
+PERIODOS = {
+    "diario": "D",
+    "mensal": "M",
+    "anual": "Y",
+}
+
+ESTATISTICAS = ("soma", "media", "maximo", "contagem")
+
+# Acumuladores necessários para cada estatística
+_CAMPOS = {
+    "soma": ("soma", "contagem"),
+    "media": ("soma", "contagem"),
+    "maximo": ("maximo",),
+    "contagem": ("contagem",),
+}
+
+SUFIXOS_LIMITES = ("_bnds", "_bounds", "_bnd")
+
+
+class ErroAgregacao(subconjunto.ErroSubconjunto):
+    """Agregação impossível para o arquivo (vira HTTP 400 no servidor)"""
+
+
+def _lista(estatistica) -> list[str]:
+    estatisticas = [estatistica] if isinstance(estatistica, str) else list(estatistica)
+    for e in estatisticas:
+        if e not in ESTATISTICAS:
+            raise ErroAgregacao(f"Estatística desconhecida: {e}")
+    return estatisticas
+
+
+def _campos(estatistica) -> set[str]:
+    return {c for e in _lista(estatistica) for c in _CAMPOS[e]}
+
+
+def dimensao_tempo(ds) -> str:
+    """Dimensão de tempo (datetime64) do dataset"""
+    dim = subconjunto.encontrar_coordenada(ds, subconjunto.NOMES_TEMPO)
+    if dim is None or dim not in ds.variables:
+        raise ErroAgregacao("Arquivo não possui coordenada de tempo para agregar")
+    if not np.issubdtype(ds[dim].dtype, np.datetime64):
+        raise ErroAgregacao("Agregação temporal só é suportada para datas do calendário padrão")
+    return dim
+
+
+def rotulos_periodo(tempos: np.ndarray, periodo: str) -> np.ndarray:
+    """Início do período de cada data (datetime64[ns])"""
+    if periodo not in PERIODOS:
+        raise ErroAgregacao(f"Período de agregação desconhecido: {periodo}")
+    return tempos.astype(f"datetime64[{PERIODOS[periodo]}]").astype("datetime64[ns]")
+
+
+def variaveis_agregaveis(ds, dim: str) -> list:
+    """Variáveis numéricas com a dimensão de tempo, sem os limites (time_bnds)"""
+    limites = {v.attrs.get(a) for v in ds.variables.values() for a in ("bounds", "climatology")}
+    return [
+        nome for nome, var in ds.data_vars.items()
+        if dim in var.dims and var.dtype.kind in "fiu"
+        and nome not in limites and not str(nome).endswith(SUFIXOS_LIMITES)
+    ]
+
+
+def fator_soma_mm(var, tempos: np.ndarray) -> float:
+    """
+    Multiplicador que leva a soma de uma taxa para mm acumulados: as taxas
+    de indices_extremos.FATORES_UNIDADE viram mm por dia e são multiplicadas
+    pela duração do passo de tempo (em dias). Quantidades ("m") e demais
+    unidades já podem ser somadas: 1.
+    """
+    unidade = str(var.attrs.get("units", "")).strip()
+    fator = indices_extremos.FATORES_UNIDADE.get(unidade)
+    if fator is None or unidade == "m":
+        return 1.0
+    if tempos.size > 1:
+        fator *= float(np.median(np.diff(tempos)) / np.timedelta64(1, "D"))
+    return fator
+
+
+def preparar(ds, periodo: str):
+    """Restringe o dataset às variáveis que entram na agregação"""
+    if periodo not in PERIODOS:
+        raise ErroAgregacao(f"Período de agregação desconhecido: {periodo}")
+    variaveis = variaveis_agregaveis(ds, dimensao_tempo(ds))
+    if not variaveis:
+        raise ErroAgregacao("Nenhuma variável numérica com dimensão de tempo para agregar")
+    return ds[variaveis]
+
+
+def reduzir_fatia(ds, periodo: str, estatistica) -> dict:
+    """
+    Reduz uma fatia aos seus períodos: {"periodos", "variaveis": {nome:
+    {campo: array (período, demais dimensões)}}}. Valores NaN são ignorados.
+    """
+    dim = dimensao_tempo(ds)
+    campos = _campos(estatistica)
+    rotulos = rotulos_periodo(ds[dim].values, periodo)
+    inicios = np.flatnonzero(np.r_[True, rotulos[1:] != rotulos[:-1]])
+
+    parcial = {"periodos": rotulos[inicios], "variaveis": {}}
+    for nome, var in ds.data_vars.items():
+        valores = np.moveaxis(np.asarray(var.values), var.dims.index(dim), 0)
+        validos = ~np.isnan(valores) if valores.dtype.kind == "f" else np.ones(valores.shape, bool)
+        reduzidos = {}
+        if "soma" in campos:
+            reduzidos["soma"] = np.add.reduceat(
+                np.where(validos, valores, 0), inicios, axis=0, dtype=np.float64
+            )
+        if "contagem" in campos:
+            reduzidos["contagem"] = np.add.reduceat(validos, inicios, axis=0, dtype=np.int32)
+        if "maximo" in campos:
+            reduzidos["maximo"] = np.fmax.reduceat(valores.astype(np.float64), inicios, axis=0)
+        parcial["variaveis"][str(nome)] = reduzidos
+    return parcial
+
+
+class AcumuladorTemporal:
+    """
+    Acumula as parciais de reduzir_fatia na grade inteira de cada período
+    aberto e entrega os períodos concluídos como Datasets (um por período).
+    A soma é convertida para mm na entrega (fator_soma_mm): a conversão é
+    linear, então equivale a converter cada valor antes de somar.
+    """
+
+    def __init__(self, ds, periodo: str, estatistica="soma"):
+        self.ds = ds
+        self.dim = dimensao_tempo(ds)
+        self.periodo = periodo
+        self.estatisticas = _lista(estatistica)
+        self.campos = _campos(estatistica)
+        tempos = ds[self.dim].values
+        self.fatores_soma = {str(nome): fator_soma_mm(var, tempos) for nome, var in ds.data_vars.items()}
+        # Só dá para fechar períodos no caminho se as fatias andam no tempo
+        self.em_ordem = list(ds.dims)[0] == self.dim and bool(np.all(tempos[1:] >= tempos[:-1]))
+        self._abertos: dict = {}
+        self._atual = None
+
+    def _outras_dims(self, nome) -> list:
+        return [d for d in self.ds[nome].dims if d != self.dim]
+
+    def _novo_periodo(self) -> dict:
+        acumulado = {}
+        for nome in self.ds.data_vars:
+            forma = [int(self.ds.sizes[d]) for d in self._outras_dims(nome)]
+            campos = {}
+            if "soma" in self.campos:
+                campos["soma"] = np.zeros(forma, np.float64)
+            if "contagem" in self.campos:
+                campos["contagem"] = np.zeros(forma, np.int32)
+            if "maximo" in self.campos:
+                campos["maximo"] = np.full(forma, np.nan)
+            acumulado[str(nome)] = campos
+        return acumulado
+
+    def reduzir(self, ds_fatia) -> dict:
+        """reduzir_fatia com o período e as estatísticas do acumulador"""
+        return reduzir_fatia(ds_fatia, self.periodo, self.estatisticas)
+
+    def adicionar(self, fatia: dict, parcial: dict):
+        """Soma a parcial de uma fatia (dict dim -> slice) aos períodos abertos"""
+        regioes = {
+            str(nome): tuple(fatia.get(d, slice(None)) for d in self._outras_dims(nome))
+            for nome in self.ds.data_vars
+        }
+        for k, rotulo in enumerate(parcial["periodos"]):
+            acumulado = self._abertos.get(rotulo)
+            if acumulado is None:
+                acumulado = self._abertos[rotulo] = self._novo_periodo()
+            for nome, reduzidos in parcial["variaveis"].items():
+                destino, regiao = acumulado[nome], regioes[nome]
+                if "soma" in reduzidos:
+                    destino["soma"][regiao] += reduzidos["soma"][k]
+                if "contagem" in reduzidos:
+                    destino["contagem"][regiao] += reduzidos["contagem"][k]
+                if "maximo" in reduzidos:
+                    np.fmax(destino["maximo"][regiao], reduzidos["maximo"][k],
+                            out=destino["maximo"][regiao])
+        if len(parcial["periodos"]):
+            self._atual = parcial["periodos"][0]
+
+    def _valores(self, campos: dict, estatistica: str, dtype, fator_soma: float = 1.0) -> np.ndarray:
+        if estatistica == "contagem":
+            return campos["contagem"]
+        if estatistica == "maximo":
+            valores = campos["maximo"]
+        else:
+            vazios = campos["contagem"] == 0
+            with np.errstate(invalid="ignore", divide="ignore"):
+                valores = campos["soma"] / campos["contagem"] if estatistica == "media" else campos["soma"] * fator_soma
+            valores[vazios] = np.nan
+        return valores.astype(dtype if dtype.kind == "f" else np.float64, copy=False)
+
+    def _dataset(self, rotulo) -> xr.Dataset:
+        """Dataset de um período: tempo = início do período"""
+        acumulado = self._abertos.pop(rotulo)
+        variaveis = {}
+        for nome, var in self.ds.data_vars.items():
+            dims = [self.dim] + self._outras_dims(nome)
+            for estatistica in self.estatisticas:
+                coluna = str(nome) if len(self.estatisticas) == 1 else f"{nome}_{estatistica}"
+                fator = self.fatores_soma[str(nome)]
+                valores = self._valores(acumulado[str(nome)], estatistica, var.dtype, fator)
+                attrs = {**var.attrs, "units": "mm"} if estatistica == "soma" and fator != 1.0 else var.attrs
+                variaveis[coluna] = (dims, valores[np.newaxis], attrs)
+        coords = {self.dim: np.array([rotulo], dtype="datetime64[ns]")}
+        for nome, coord in self.ds.coords.items():
+            if nome != self.dim and self.dim not in coord.dims:
+                coords[nome] = coord.variable
+        return xr.Dataset(variaveis, coords=coords)
+
+    def concluidos(self):
+        """Gera os períodos que nenhuma fatia futura pode mais alterar"""
+        if not self.em_ordem or self._atual is None:
+            return
+        for rotulo in sorted(r for r in self._abertos if r < self._atual):
+            yield self._dataset(rotulo)
+
+    def finalizar(self):
+        """Gera os períodos restantes, em ordem"""
+        for rotulo in sorted(self._abertos):
+            yield self._dataset(rotulo)
+
+
+def iterar_agregado(ds, parciais, periodo: str, estatistica="soma", esparso: bool = False,
+                    transformar=None):
+    """
+    Gera os lotes (motor_tabular) da tabela agregada a partir de
+    (fatia, parcial) na ordem das fatias, um período por lote.
+    `transformar(ds_periodo)` pode acrescentar colunas a cada período
+    (ex.: anomalias da climatologia) antes da tabela.
+    """
+    transformar = transformar or (lambda ds_periodo: ds_periodo)
+    acumulador = AcumuladorTemporal(ds, periodo, estatistica)
+    for fatia, parcial in parciais:
+        acumulador.adicionar(fatia, parcial)
+        for ds_periodo in acumulador.concluidos():
+            yield motor_tabular.tabela_da_fatia(transformar(ds_periodo), esparso)
+    for ds_periodo in acumulador.finalizar():
+        yield motor_tabular.tabela_da_fatia(transformar(ds_periodo), esparso)
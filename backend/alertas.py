@@ -0,0 +1,178 @@
+"""
+Defesa Civil Araruna - Varredura de alertas de chuva
+Para triagem de previsões: em vez da tabela completa, cada fatia é
+comparada de uma vez com os limiares (30/50/80 mm por padrão) e só as
+células e tempos que passam do menor limiar viram linhas, com a chuva
+em mm no passo de tempo e o maior nível atingido. As contagens por
+nível (ocorrências e células distintas) são acumuladas durante a
+varredura e saem no log e no endpoint /api/netcdf/alertas.
+"""
+
+import numpy as np
+
+import agregacao_temporal
+import indices_extremos
+import motor_tabular
+import subconjunto
+
+
+LIMIARES_PADRAO = (30.0, 50.0, 80.0)
+
+MAXIMO_LIMIARES = 10
+
+COLUNA_NIVEL = "alerta_mm"
+
+# Unidades de taxa: o total do passo depende da sua duração
+# (as demais, como "m" do ERA5, já são o acumulado do passo)
+_TAXAS = {u for u in indices_extremos.FATORES_UNIDADE if u != "m"} | {
+    "mm/day", "mm day-1", "mm d-1",
+}
+
+
+class ErroAlertas(subconjunto.ErroSubconjunto):
+    """Varredura de alertas impossível para o arquivo (vira HTTP 400 no servidor)"""
+
+
+def ler_limiares(texto: str | None) -> list[float]:
+    """Limiares em mm a partir de "30,50,80" (vazio = LIMIARES_PADRAO)"""
+    if not texto or not str(texto).strip():
+        return list(LIMIARES_PADRAO)
+    try:
+        limiares = sorted({float(parte) for parte in str(texto).replace(";", ",").split(",") if parte.strip()})
+    except ValueError:
+        raise ErroAlertas(f"Limiares inválidos: {texto!r} (use mm separados por vírgula, ex.: 30,50,80)")
+    if not limiares or limiares[0] <= 0:
+        raise ErroAlertas("Os limiares de alerta devem ser maiores que zero")
+    if len(limiares) > MAXIMO_LIMIARES:
+        raise ErroAlertas(f"No máximo {MAXIMO_LIMIARES} limiares de alerta")
+    return limiares
+
+
+def validar(opcoes: dict | None):
+    """Erro se os alertas foram pedidos junto com outro modo de saída"""
+    opcoes = opcoes or {}
+    if opcoes.get("alertas") and any(
+        opcoes.get(modo) for modo in ("agregacao", "indices", "spi", "climatologia")
+    ):
+        raise ErroAlertas(
+            "A varredura de alertas não pode ser combinada com agregação, índices, SPI ou climatologia"
+        )
+
+
+def preparar(ds):
+    """Restringe o dataset à variável de chuva"""
+    try:
+        nome = indices_extremos.variavel_precipitacao(ds)
+    except subconjunto.ErroSubconjunto as e:
+        raise ErroAlertas(str(e))
+    return ds[[nome]]
+
+
+def fator_mm_passo(ds) -> float:
+    """Multiplicador que leva a chuva para mm acumulados no passo de tempo"""
+    var = ds[list(ds.data_vars)[0]]
+    fator = indices_extremos.fator_mm_dia(var)
+    if str(var.attrs.get("units", "")).strip() not in _TAXAS:
+        return fator
+    tempos = ds[agregacao_temporal.dimensao_tempo(ds)].values
+    if tempos.size < 2:
+        return fator
+    return fator * (np.median(np.diff(tempos)) / np.timedelta64(1, "D"))
+
+
+def tabela_alertas(ds, limiares: list, fator: float) -> dict[str, np.ndarray]:
+    """
+    Lote só com as linhas da fatia em que a chuva (mm no passo) alcança o
+    menor limiar: dimensões, coordenadas auxiliares, <var>_mm e o maior
+    limiar alcançado (alerta_mm). Linhas na mesma ordem da tabela completa.
+    """
+    nome = list(ds.data_vars)[0]
+    var = ds[nome]
+    dims = list(var.dims)
+    mm = np.asarray(var.values, dtype=np.float64)
+    if fator != 1.0:
+        mm = mm * fator
+    with np.errstate(invalid="ignore"):
+        posicoes = np.nonzero(mm >= limiares[0])  # NaN fica de fora
+
+    lote = motor_tabular.tabela_das_posicoes(ds.drop_vars(nome), dims, posicoes)
+    valores = mm[posicoes]
+    niveis = np.asarray(limiares, dtype=np.float64)
+    lote[f"{nome}_mm"] = valores.astype(np.float32)
+    lote[COLUNA_NIVEL] = niveis[np.searchsorted(niveis, valores, side="right") - 1].astype(np.float32)
+    return lote
+
+
+class ContagemAlertas:
+    """Ocorrências e células distintas por nível, somadas lote a lote"""
+
+    def __init__(self, limiares: list, coluna_valor: str, dim_tempo: str, colunas_celula: list):
+        self.limiares = list(limiares)
+        self.coluna_valor = coluna_valor
+        self.dim_tempo = dim_tempo
+        self.colunas_celula = list(colunas_celula)
+        self.ocorrencias = np.zeros(len(self.limiares), dtype=np.int64)
+        self._celulas = [None] * len(self.limiares)
+        self.maximo_mm = None
+        self.inicio = None
+        self.fim = None
+
+    def adicionar(self, lote: dict):
+        niveis = lote[COLUNA_NIVEL]
+        if not len(niveis):
+            return
+        maximo = float(lote[self.coluna_valor].max())
+        self.maximo_mm = maximo if self.maximo_mm is None else max(self.maximo_mm, maximo)
+        if self.dim_tempo in lote:
+            tempos = lote[self.dim_tempo]
+            self.inicio = tempos.min() if self.inicio is None else min(self.inicio, tempos.min())
+            self.fim = tempos.max() if self.fim is None else max(self.fim, tempos.max())
+
+        celulas = np.column_stack([lote[c] for c in self.colunas_celula]) if self.colunas_celula else None
+        for i, limiar in enumerate(self.limiares):
+            atingiu = niveis >= limiar
+            self.ocorrencias[i] += int(atingiu.sum())
+            if celulas is None or not atingiu.any():
+                continue
+            novas = np.unique(celulas[atingiu], axis=0)
+            anteriores = self._celulas[i]
+            self._celulas[i] = novas if anteriores is None else np.unique(np.concatenate([anteriores, novas]), axis=0)
+
+    def resumo(self) -> dict:
+        """Contagens por nível, em forma de JSON"""
+        def _data(valor):
+            if valor is None:
+                return None
+            if np.issubdtype(np.asarray(valor).dtype, np.datetime64):
+                return str(np.datetime_as_string(valor, unit="s"))
+            return str(valor)
+
+        return {
+            "limiares_mm": self.limiares,
+            "niveis": [
+                {
+                    "limiar_mm": limiar,
+                    "ocorrencias": int(self.ocorrencias[i]),
+                    "celulas": 0 if self._celulas[i] is None else int(len(self._celulas[i])),
+                }
+                for i, limiar in enumerate(self.limiares)
+            ],
+            "maximo_mm": None if self.maximo_mm is None else round(self.maximo_mm, 2),
+            "primeiro_alerta": _data(self.inicio),
+            "ultimo_alerta": _data(self.fim),
+        }
+
+    def descrever(self) -> str:
+        """Uma linha por nível para o log"""
+        return " | ".join(
+            f"≥ {limiar:g} mm: {int(self.ocorrencias[i]):,} ocorrências em "
+            f"{0 if self._celulas[i] is None else len(self._celulas[i]):,} células"
+            for i, limiar in enumerate(self.limiares)
+        )
+
+
+def contagem_para(ds, limiares: list) -> ContagemAlertas:
+    """Contagem vazia para a grade de `ds` (células = dimensões fora o tempo)"""
+    nome = list(ds.data_vars)[0]
+    dim = agregacao_temporal.dimensao_tempo(ds)
+    return ContagemAlertas(limiares, f"{nome}_mm", dim, [str(d) for d in ds[nome].dims if d != dim])
@@ -0,0 +1,12 @@
+"""
+Defesa Civil Araruna - Benchmarks da conversão
+Mede cada etapa da conversão (abrir, extrair fatias, montar a tabela,
+codificar e gravar CSV/XLSX/XML) e as funções de ponta a ponta do
+servidor, do desktop e do conversor local sobre arquivos sintéticos
+determinísticos, e grava linhas/s, MB/s e pico de memória em JSON para
+comparar resultados ao longo do tempo.
+
+Uso (na pasta backend):
+    python -m benchmarks.executar --tamanhos 10k,1m --formatos csv,xlsx,xml
+    python -m benchmarks.gerador 100m
+"""
@@ -0,0 +1,434 @@
+"""
+Defesa Civil Araruna - Execução dos benchmarks
+Para cada tamanho: gera (ou reaproveita) o NetCDF sintético, mede as
+etapas da conversão fatia por fatia dentro do código do servidor e do
+desktop (abrir, extrair, montar a tabela, codificar e gravar em cada
+formato) e depois as funções de ponta a ponta (main.converter_grande_netcdf, o
+_converter_arquivo do desktop e o criar_excel_com_logo do conversor
+local). O resultado vai para um JSON com linhas/s, MB/s e pico de RSS.
+
+Uso (na pasta backend):
+    python -m benchmarks.executar --tamanhos 10k,1m,10m --formatos csv,xlsx,xml
+"""
+
+import argparse
+import contextlib
+import functools
+import gc
+import importlib
+import io
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+import copia_zarr
+import escritores
+import grupos_variaveis
+import motor_tabular
+import planejador_fatias
+import reducao_espacial
+
+from benchmarks import gerador
+from benchmarks.medicao import Medidor, pico_processo
+
+PASTA_RESULTADOS = gerador.PASTA_DADOS.parent / "resultados"
+
+FORMATOS = ("csv", "xlsx", "xml")
+
+# Acima disso a escrita leva tempo demais (ou o Excel não comporta):
+# a etapa é pulada e o motivo vai para o JSON. --sem-limite desliga.
+LIMITE_LINHAS = {
+    "xlsxwriter": 2_000_000,   # EscritorXLSX do servidor
+    "openpyxl": 500_000,       # desktop (Excel) e criar_excel_com_logo, célula a célula
+    "xml": 500_000,            # desktop: árvore inteira em memória, linha a linha
+}
+
+FORMATO_DESKTOP = {"csv": "CSV", "xlsx": "Excel", "xml": "XML"}
+ESCRITA_DESKTOP = {"csv": None, "xlsx": "openpyxl", "xml": "xml"}
+
+
+def _tamanho_saida(caminho) -> int:
+    caminho = Path(caminho)
+    if caminho.is_dir():
+        return sum(p.stat().st_size for p in caminho.rglob("*") if p.is_file())
+    return caminho.stat().st_size if caminho.exists() else 0
+
+
+def _bytes_lote(lote: dict) -> int:
+    return sum(np.asarray(coluna).nbytes for coluna in lote.values())
+
+
+def _pulado(motivo: str) -> dict:
+    return {"pulado": motivo}
+
+
+def _acima_do_limite(escrita: str | None, linhas: int, sem_limite: bool) -> str | None:
+    limite = LIMITE_LINHAS.get(escrita)
+    if sem_limite or limite is None or linhas <= limite:
+        return None
+    return f"{linhas:,} linhas acima do limite de {limite:,} ({escrita}); use --sem-limite"
+
+
+class _DesktopSemTela:
+    """
+    ConversorApp sem janela: só o necessário para chamar _converter_arquivo
+    e _escrever_xml (log e barra de progresso viram no-ops). Criada sob
+    demanda porque conversor_desktop exige tkinter.
+    """
+
+    _classe = None
+
+    @classmethod
+    def criar(cls):
+        if cls._classe is None:
+            import conversor_desktop
+
+            class SemTela(conversor_desktop.ConversorApp):
+                def __init__(self):
+                    self.cancelar = False
+
+                def _log(self, msg, tag=None):
+                    pass
+
+                def _atualizar_progresso(self, arq, tot, msg):
+                    pass
+
+            cls._classe = SemTela
+        return cls._classe()
+
+
+@contextlib.contextmanager
+def _instrumentado(medidor: Medidor, formato: str, desktop=None):
+    """
+    Durante o bloco, as funções compartilhadas da conversão medem cada
+    chamada no `medidor`: a leitura da fatia (reducao_espacial.reduzir,
+    carregada aqui), motor_tabular (tabela_da_fatia, para_dataframe), os
+    escritores e o _escrever_xml do desktop. O laço medido é o do próprio
+    servidor ou desktop; ao sair, as originais voltam.
+    """
+    originais = []
+
+    def trocar(alvo, nome, medir):
+        original = getattr(alvo, nome)
+        originais.append((alvo, nome, original))
+        setattr(alvo, nome, functools.wraps(original)(lambda *args, **kwargs: medir(original, *args, **kwargs)))
+
+    def extracao(original, *args, **kwargs):
+        with medidor.etapa(f"extracao[{formato}]") as contagem:
+            ds_fatia = original(*args, **kwargs).load()
+            contagem["bytes"] = ds_fatia.nbytes
+        return ds_fatia
+
+    def tabela(original, *args, **kwargs):
+        with medidor.etapa(f"tabela[{formato}]") as contagem:
+            lote = original(*args, **kwargs)
+            contagem.update(linhas=motor_tabular.linhas_do_lote(lote), bytes=_bytes_lote(lote))
+        return lote
+
+    def dataframe(original, lote):
+        with medidor.etapa(f"dataframe[{formato}]") as contagem:
+            contagem.update(linhas=motor_tabular.linhas_do_lote(lote), bytes=_bytes_lote(lote))
+            return original(lote)
+
+    def codificar_csv(original, lote, *args, **kwargs):
+        with medidor.etapa("codificar_csv") as contagem:
+            dados = original(lote, *args, **kwargs)
+            contagem.update(linhas=motor_tabular.linhas_do_lote(lote), bytes=len(dados))
+        return dados
+
+    def gravar_csv(original, escritor, dados, linhas):
+        with medidor.etapa("gravar_csv") as contagem:
+            contagem.update(linhas=linhas, bytes=len(dados))
+            return original(escritor, dados, linhas)
+
+    def codificar_xlsx(original, escritor, lote):
+        with medidor.etapa("codificar_xlsx") as contagem:
+            contagem.update(linhas=motor_tabular.linhas_do_lote(lote), bytes=_bytes_lote(lote))
+            return original(escritor, lote)
+
+    def gravar_xlsx(original, escritor):
+        with medidor.etapa("gravar_xlsx") as contagem:
+            original(escritor)
+            contagem.update(linhas=escritor.total_linhas, bytes=_tamanho_saida(escritor.wb.filename))
+
+    def codificar_xml(original, df, caminho, *args, **kwargs):
+        # O desktop monta a árvore inteira e a grava na mesma chamada
+        with medidor.etapa("codificar_xml") as contagem:
+            original(df, caminho, *args, **kwargs)
+            contagem.update(linhas=len(df), bytes=_tamanho_saida(caminho))
+
+    trocar(reducao_espacial, "reduzir", extracao)
+    trocar(motor_tabular, "tabela_da_fatia", tabela)
+    trocar(motor_tabular, "para_dataframe", dataframe)
+    trocar(escritores, "codificar_csv", codificar_csv)
+    trocar(escritores.EscritorCSV, "escrever_codificado", gravar_csv)
+    trocar(escritores.EscritorXLSX, "escrever", codificar_xlsx)
+    trocar(escritores.EscritorXLSX, "fechar", gravar_xlsx)
+    if desktop is not None:
+        trocar(desktop, "_escrever_xml", codificar_xml)
+    try:
+        yield
+    finally:
+        for alvo, nome, original in reversed(originais):
+            if alvo is desktop:
+                delattr(alvo, nome)
+            else:
+                setattr(alvo, nome, original)
+
+
+def _importar(importar):
+    """Importa o alvo com a saída padrão silenciada (ImportError segue adiante)"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        return importar()
+
+
+def medir_etapas(caminho_nc: Path, formatos: list, pasta: Path, sem_limite: bool) -> dict:
+    """
+    Etapas da conversão medidas dentro do código real, fatia por fatia
+    (ver _instrumentado): CSV e XLSX passam pelo main.escrever_saida do
+    servidor (serial) e XML pelo _converter_arquivo do desktop, o único
+    que grava XML. Leitura e tabela levam o formato no nome, já que cada
+    formato é uma conversão completa.
+    """
+    pulados = {}
+    with Medidor() as medidor:
+        with medidor.etapa("abrir"):
+            ds = copia_zarr.abrir(caminho_nc, "tabela")
+            grupos = grupos_variaveis.agrupar(ds)
+        total = sum(grupos_variaveis.pontos(g["ds"]) for g in grupos)
+        principal = grupos_variaveis.pontos(grupos_variaveis.principal(grupos)["ds"])
+
+        try:
+            for formato in formatos:
+                if formato == "xml":
+                    motivo = _acima_do_limite("xml", principal, sem_limite)
+                    importar = _DesktopSemTela.criar
+                else:
+                    motivo = _acima_do_limite("xlsxwriter" if formato == "xlsx" else None, total, sem_limite)
+                    importar = lambda: importlib.import_module("main")
+                if motivo:
+                    pulados[formato] = motivo
+                    continue
+                try:
+                    alvo = _importar(importar)
+                except ImportError as e:
+                    pulados[formato] = f"módulo indisponível: {e}"
+                    continue
+
+                print(f"[BENCH] etapas {formato}...")
+                with contextlib.redirect_stdout(io.StringIO()):
+                    if formato == "xml":
+                        with _instrumentado(medidor, formato, alvo):
+                            alvo._converter_arquivo(
+                                str(caminho_nc), str(pasta / "etapas.xml"), FORMATO_DESKTOP[formato], 0, 100,
+                                append=False, write_header=True, calcular_stats=False)
+                    else:
+                        tabelas = alvo.tabelas_da_conversao(ds)
+                        destino = pasta / f"etapas{escritores.EXTENSOES[alvo.formato_do_arquivo(formato, tabelas)]}"
+                        with _instrumentado(medidor, formato):
+                            for _ in alvo.escrever_saida(ds, formato, str(destino), tabelas, str(caminho_nc)):
+                                pass
+                gc.collect()
+        finally:
+            ds.close()
+
+    etapas = medidor.resultado()
+    for formato, motivo in pulados.items():
+        etapas[f"codificar_{formato}"] = _pulado(motivo)
+    return etapas
+
+
+def _funcao_servidor(main, caminho_nc: Path, formato: str, pasta: Path, contagem: dict):
+    ds = main.abrir_dataset(str(caminho_nc))
+    try:
+        grupos = main.tabelas_da_conversao(ds)
+        destino = pasta / f"servidor{escritores.EXTENSOES[main.formato_do_arquivo(formato, grupos)]}"
+        contagem["linhas"] = main.converter_grande_netcdf(ds, formato, str(destino), grupos, str(caminho_nc))
+    finally:
+        ds.close()
+    contagem["bytes"] = _tamanho_saida(pasta)
+
+
+def _funcao_desktop(desktop, caminho_nc: Path, formato: str, pasta: Path, contagem: dict):
+    resultado = desktop._converter_arquivo(
+        str(caminho_nc), str(pasta / f"desktop.{formato}"), FORMATO_DESKTOP[formato], 0, 100,
+        append=False, write_header=True, calcular_stats=False)
+    contagem["linhas"] = resultado["linhas"]
+    contagem["bytes"] = _tamanho_saida(pasta)  # inclui as tabelas auxiliares
+
+
+def _funcao_excel_com_logo(converter_local, caminho_nc: Path, pasta: Path, contagem: dict):
+    with xr.open_dataset(caminho_nc) as ds:
+        grupo = grupos_variaveis.principal(grupos_variaveis.agrupar(ds))
+        df = motor_tabular.para_dataframe(
+            motor_tabular.tabela_da_fatia(motor_tabular.completar_coordenadas(grupo["ds"])))
+    saida = converter_local.criar_excel_com_logo(df, caminho_nc.name, str(pasta))
+    contagem.update(linhas=len(df), bytes=_tamanho_saida(saida))
+
+
+def medir_funcoes(caminho_nc: Path, formatos: list, pasta: Path, sem_limite: bool) -> dict:
+    """
+    Funções de ponta a ponta, com a saída padrão silenciada e um processo
+    (as conversões paralelas têm a memória espalhada em outros processos).
+    Os módulos são importados antes da medida; os que não podem ser
+    importados aqui (ex.: sem tkinter ou fastapi) aparecem como pulados.
+    """
+    with xr.open_dataset(caminho_nc) as ds:
+        grupos = grupos_variaveis.agrupar(ds)
+        total = sum(grupos_variaveis.pontos(g["ds"]) for g in grupos)
+        principal = grupos_variaveis.pontos(grupos_variaveis.principal(grupos)["ds"])
+
+    # (nome, motivo para pular, importar o alvo, executar(alvo, pasta, contagem))
+    chamadas = []
+    for formato in formatos:
+        if formato in ("csv", "xlsx"):
+            chamadas.append((
+                f"main.converter_grande_netcdf[{formato}]",
+                _acima_do_limite("xlsxwriter" if formato == "xlsx" else None, total, sem_limite),
+                lambda: importlib.import_module("main"),
+                lambda alvo, p, c, f=formato: _funcao_servidor(alvo, caminho_nc, f, p, c)))
+        chamadas.append((
+            f"conversor_desktop._converter_arquivo[{formato}]",
+            _acima_do_limite(ESCRITA_DESKTOP[formato], principal, sem_limite),
+            _DesktopSemTela.criar,
+            lambda alvo, p, c, f=formato: _funcao_desktop(alvo, caminho_nc, f, p, c)))
+    chamadas.append((
+        "converter_local.criar_excel_com_logo",
+        _acima_do_limite("openpyxl", principal, sem_limite),
+        lambda: importlib.import_module("converter_local"),
+        lambda alvo, p, c: _funcao_excel_com_logo(alvo, caminho_nc, p, c)))
+
+    resultado = {}
+    for nome, motivo, importar, funcao in chamadas:
+        if motivo:
+            resultado[nome] = _pulado(motivo)
+            continue
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                alvo = importar()
+        except ImportError as e:
+            resultado[nome] = _pulado(f"módulo indisponível: {e}")
+            continue
+
+        print(f"[BENCH] {nome}...")
+        subpasta = Path(tempfile.mkdtemp(prefix="func_", dir=pasta))
+        try:
+            with Medidor() as medidor:
+                with medidor.etapa(nome) as contagem, contextlib.redirect_stdout(io.StringIO()):
+                    funcao(alvo, subpasta, contagem)
+            resultado[nome] = medidor.resultado()[nome]
+        finally:
+            shutil.rmtree(subpasta, ignore_errors=True)
+            gc.collect()
+    return resultado
+
+
+def executar(tamanhos: list, formatos: list, semente: int = gerador.SEMENTE_PADRAO, pasta_dados=None,
+             compressao: int = 1, funcoes: bool = True, sem_limite: bool = False) -> dict:
+    """Roda os benchmarks de cada tamanho e devolve o relatório (dict pronto para JSON)"""
+    relatorio = {
+        "gerado_em": datetime.now().isoformat(timespec="seconds"),
+        "plataforma": {
+            "python": platform.python_version(),
+            "sistema": platform.platform(),
+            "cpus": os.cpu_count(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "xarray": xr.__version__,
+        },
+        "orcamento_fatia_mb": planejador_fatias.ORCAMENTO_FATIA_MB,
+        "semente": semente,
+        "compressao": compressao,
+        "resultados": [],
+    }
+    for tamanho in tamanhos:
+        pontos = gerador.ler_pontos(tamanho)
+        inicio = time.perf_counter()
+        caminho_nc = gerador.gerar(pontos, semente, pasta_dados, compressao)
+        geracao = time.perf_counter() - inicio
+        n_tempo, n_lat, n_lon = gerador.forma_para(pontos)
+
+        print(f"[BENCH] {tamanho}: etapas ({', '.join(formatos)})...")
+        with tempfile.TemporaryDirectory(prefix="bench_") as pasta:
+            pasta = Path(pasta)
+            item = {
+                "tamanho": tamanho,
+                "pontos": pontos,
+                "forma": {"time": n_tempo, "lat": n_lat, "lon": n_lon},
+                "arquivo": caminho_nc.name,
+                "arquivo_mb": round(caminho_nc.stat().st_size / (1024 * 1024), 2),
+                "geracao_s": round(geracao, 2),
+                "etapas": medir_etapas(caminho_nc, formatos, pasta, sem_limite),
+            }
+            gc.collect()
+            if funcoes:
+                item["funcoes"] = medir_funcoes(caminho_nc, formatos, pasta, sem_limite)
+        relatorio["resultados"].append(item)
+
+    pico = pico_processo()
+    relatorio["pico_rss_processo_mb"] = None if pico is None else round(pico / (1024 * 1024), 2)
+    return relatorio
+
+
+def _resumir(relatorio: dict):
+    for item in relatorio["resultados"]:
+        print(f"\n[BENCH] {item['tamanho']} ({item['pontos']:,} pontos, {item['arquivo_mb']} MB)")
+        for secao in ("etapas", "funcoes"):
+            for nome, medida in item.get(secao, {}).items():
+                if "pulado" in medida:
+                    print(f"   {nome:<48} pulado: {medida['pulado']}")
+                    continue
+                linhas = f"{medida['linhas_por_s']:>14,.0f} linhas/s" if medida["linhas_por_s"] else " " * 23
+                mb = f"{medida['mb_por_s']:>9.1f} MB/s" if medida["mb_por_s"] else " " * 14
+                print(f"   {nome:<48} {medida['tempo_s']:>9.3f} s {linhas} {mb}  pico {medida['pico_rss_mb']} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks da conversão NetCDF sobre arquivos sintéticos")
+    parser.add_argument("--tamanhos", default="10k,1m",
+                        help=f"Pontos por arquivo, separados por vírgula ({', '.join(gerador.TAMANHOS)} ou um número)")
+    parser.add_argument("--formatos", default=",".join(FORMATOS), help="Formatos: csv,xlsx,xml")
+    parser.add_argument("--saida", default=None,
+                        help=f"Arquivo JSON do resultado (padrão: {PASTA_RESULTADOS}/bench_<data>.json)")
+    parser.add_argument("--pasta-dados", default=None, help="Pasta dos NetCDF sintéticos")
+    parser.add_argument("--semente", type=int, default=gerador.SEMENTE_PADRAO)
+    parser.add_argument("--compressao", type=int, default=1, choices=range(10),
+                        help="Nível zlib do arquivo sintético (0 = sem compressão)")
+    parser.add_argument("--sem-funcoes", action="store_true",
+                        help="Mede só as etapas (sem as funções de ponta a ponta)")
+    parser.add_argument("--sem-limite", action="store_true",
+                        help="Não pula XLSX/XML acima dos limites de linhas")
+    args = parser.parse_args()
+
+    formatos = [f.strip().lower() for f in args.formatos.split(",") if f.strip()]
+    invalidos = sorted(set(formatos) - set(FORMATOS))
+    if invalidos:
+        parser.error(f"Formatos inválidos: {', '.join(invalidos)} (use {', '.join(FORMATOS)})")
+    try:
+        tamanhos = [t.strip() for t in args.tamanhos.split(",") if t.strip()]
+        for tamanho in tamanhos:
+            gerador.ler_pontos(tamanho)
+    except ValueError as e:
+        parser.error(str(e))
+
+    relatorio = executar(tamanhos, formatos, args.semente, args.pasta_dados, args.compressao,
+                         funcoes=not args.sem_funcoes, sem_limite=args.sem_limite)
+    _resumir(relatorio)
+
+    saida = Path(args.saida) if args.saida else PASTA_RESULTADOS / f"bench_{datetime.now():%Y%m%d_%H%M%S}.json"
+    saida.parent.mkdir(parents=True, exist_ok=True)
+    saida.write_text(json.dumps(relatorio, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"\n[BENCH] Resultado: {saida}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+Defesa Civil Araruna - Gerador de NetCDF sintético para os benchmarks
+Precipitação diária (pr, kg m-2 s-1) em grade lat/lon ao redor de
+Araruna, com time_bnds/lat_bnds/lon_bnds, células de "oceano" sempre NaN
+e falhas esparsas, como nos arquivos CMIP/BR-DWGD. O conteúdo depende só
+do número de pontos e da semente: o mesmo pedido gera sempre o mesmo
+arquivo, e o arquivo já gerado é reaproveitado.
+"""
+
+import argparse
+import math
+import re
+import time
+from pathlib import Path
+
+import numpy as np
+
+try:
+    import netCDF4
+    NETCDF4_OK = True
+except ImportError:
+    NETCDF4_OK = False
+
+
+PASTA_DADOS = Path(__file__).resolve().parent.parent / "output" / "benchmarks" / "dados"
+
+SEMENTE_PADRAO = 0
+
+# Nomes aceitos em --tamanhos (qualquer número com sufixo k/m também vale)
+TAMANHOS = {"10k": 10_000, "1m": 1_000_000, "10m": 10_000_000, "100m": 100_000_000, "500m": 500_000_000}
+SUFIXOS = {"": 1, "k": 1_000, "m": 1_000_000, "g": 1_000_000_000}
+
+# Forma: ~sqrt(N) dias (no máximo 30 anos), o resto vira células da grade
+MAX_DIAS = 10958
+MIN_DIAS = 10
+
+# Grade de 0,1° centrada em Araruna-PB
+LAT_CENTRO, LON_CENTRO, RESOLUCAO = -6.53, -35.74, 0.1
+
+# Dias gravados por vez (e sorteados com a mesma semente derivada)
+DIAS_POR_BLOCO = 32
+
+# Fração de células de oceano (NaN na série inteira) e de falhas isoladas
+FRACAO_OCEANO = 0.15
+FRACAO_FALHAS = 0.001
+
+VALOR_AUSENTE = np.float32(1e20)
+SEGUNDOS_DIA = 86400.0
+
+
+def ler_pontos(texto) -> int:
+    """'500m' / '10k' / '2500000' -> número de pontos (tempo x lat x lon)"""
+    texto = str(texto).strip().lower().replace("_", "")
+    if texto in TAMANHOS:
+        return TAMANHOS[texto]
+    achado = re.fullmatch(r"(\d+(?:\.\d+)?)([kmg]?)", texto)
+    if not achado:
+        raise ValueError(f"Tamanho inválido: '{texto}' (use por exemplo 10k, 1m, 500m)")
+    pontos = int(float(achado.group(1)) * SUFIXOS[achado.group(2)])
+    if pontos < MIN_DIAS:
+        raise ValueError(f"Tamanho muito pequeno: {pontos} pontos (mínimo {MIN_DIAS})")
+    return pontos
+
+
+def forma_para(pontos: int) -> tuple[int, int, int]:
+    """(tempo, lat, lon) com pelo menos `pontos` valores e grade quase quadrada"""
+    n_tempo = min(MAX_DIAS, max(MIN_DIAS, round(math.sqrt(pontos))))
+    celulas = math.ceil(pontos / n_tempo)
+    n_lat = max(1, math.isqrt(celulas))
+    n_lon = math.ceil(celulas / n_lat)
+    return n_tempo, n_lat, n_lon
+
+
+def caminho_sintetico(pontos: int, semente: int = SEMENTE_PADRAO, compressao: int = 1, pasta=None) -> Path:
+    return Path(pasta or PASTA_DADOS) / f"sintetico_{pontos}_{semente}_z{compressao}.nc"
+
+
+def _eixo(centro: float, n: int) -> np.ndarray:
+    return (centro + (np.arange(n) - (n - 1) / 2) * RESOLUCAO).round(4)
+
+
+def _limites(eixo: np.ndarray) -> np.ndarray:
+    return np.stack([eixo - RESOLUCAO / 2, eixo + RESOLUCAO / 2], axis=1).round(4)
+
+
+def _bloco_pr(inicio: int, dias: int, oceano: np.ndarray, semente: int) -> np.ndarray:
+    """
+    Chuva de `dias` dias a partir do dia `inicio`: probabilidade de dia
+    chuvoso sazonal (quadra chuvosa em mar-jul), quantidade gama. A semente
+    do bloco é derivada do índice, então o resultado não depende da ordem.
+    """
+    sorteio = np.random.default_rng([semente, 1, inicio // DIAS_POR_BLOCO])
+    forma = (dias,) + oceano.shape
+    dia_ano = (np.arange(inicio, inicio + dias) % 365.25)[:, None, None]
+    prob = 0.15 + 0.35 * np.clip(np.cos(2 * np.pi * (dia_ano - 135) / 365.25), 0, None)
+    chuvoso = sorteio.random(forma, dtype=np.float32) < prob
+    mm = sorteio.gamma(0.8, 9.0, size=forma).astype(np.float32)
+    pr = np.where(chuvoso, mm / np.float32(SEGUNDOS_DIA), np.float32(0))
+    pr[sorteio.random(forma, dtype=np.float32) < FRACAO_FALHAS] = np.nan
+    pr[:, oceano] = np.nan
+    return pr
+
+
+def gerar(pontos: int, semente: int = SEMENTE_PADRAO, pasta=None, compressao: int = 1,
+          refazer: bool = False) -> Path:
+    """
+    Grava (ou reaproveita) o NetCDF sintético com `pontos` valores de pr.
+    compressao: nível zlib (0 = sem compressão, como NetCDF3/CMIP antigos).
+    """
+    if not NETCDF4_OK:
+        raise RuntimeError("netCDF4 não instalado. Execute: pip install netCDF4")
+    caminho = caminho_sintetico(pontos, semente, compressao, pasta)
+    if caminho.exists() and not refazer:
+        return caminho
+    caminho.parent.mkdir(parents=True, exist_ok=True)
+
+    n_tempo, n_lat, n_lon = forma_para(pontos)
+    lat, lon = _eixo(LAT_CENTRO, n_lat), _eixo(LON_CENTRO, n_lon)
+    # Oceano: faixa a leste (como o litoral da Paraíba), fixa pela semente
+    sorteio = np.random.default_rng([semente, 0])
+    limiar = np.quantile(lon, 1 - FRACAO_OCEANO) if n_lon > 1 else np.inf
+    oceano = (lon[None, :] + sorteio.normal(0, RESOLUCAO, (n_lat, 1)) > limiar)
+
+    print(f"[BENCH] Gerando {caminho.name}: tempo={n_tempo} lat={n_lat} lon={n_lon}...")
+    inicio = time.perf_counter()
+    temporario = caminho.with_name(f"_criando_{caminho.name}")
+    compressao_var = dict(zlib=compressao > 0, complevel=compressao or 1)
+    try:
+        with netCDF4.Dataset(temporario, "w", format="NETCDF4") as nc:
+            nc.setncatts({
+                "title": "Precipitação sintética para benchmarks",
+                "source": f"benchmarks.gerador (semente {semente})",
+                "Conventions": "CF-1.8",
+                "frequency": "day",
+            })
+            nc.createDimension("time", None)
+            nc.createDimension("lat", n_lat)
+            nc.createDimension("lon", n_lon)
+            nc.createDimension("bnds", 2)
+
+            unidade_tempo = "days since 1991-01-01 00:00:00"
+            tempo = nc.createVariable("time", "f8", ("time",))
+            tempo.setncatts({"units": unidade_tempo, "calendar": "standard", "standard_name": "time",
+                             "axis": "T", "bounds": "time_bnds"})
+            tempo_bnds = nc.createVariable("time_bnds", "f8", ("time", "bnds"))
+            for nome, eixo, unidade in (("lat", lat, "degrees_north"), ("lon", lon, "degrees_east")):
+                var = nc.createVariable(nome, "f8", (nome,))
+                var.setncatts({"units": unidade, "standard_name": "latitude" if nome == "lat" else "longitude",
+                               "axis": "Y" if nome == "lat" else "X", "bounds": f"{nome}_bnds"})
+                var[:] = eixo
+                nc.createVariable(f"{nome}_bnds", "f8", (nome, "bnds"))[:] = _limites(eixo)
+
+            pr = nc.createVariable("pr", "f4", ("time", "lat", "lon"), fill_value=VALOR_AUSENTE,
+                                   chunksizes=(1, n_lat, n_lon), shuffle=compressao > 0, **compressao_var)
+            pr.setncatts({"standard_name": "precipitation_flux", "long_name": "Precipitation",
+                          "units": "kg m-2 s-1", "cell_methods": "time: mean"})
+
+            for dia in range(0, n_tempo, DIAS_POR_BLOCO):
+                dias = min(DIAS_POR_BLOCO, n_tempo - dia)
+                meio = np.arange(dia, dia + dias) + 0.5
+                tempo[dia:dia + dias] = meio
+                tempo_bnds[dia:dia + dias] = np.stack([meio - 0.5, meio + 0.5], axis=1)
+                pr[dia:dia + dias] = _bloco_pr(dia, dias, oceano, semente)
+        temporario.replace(caminho)
+    except BaseException:
+        temporario.unlink(missing_ok=True)
+        raise
+
+    print(f"[BENCH] Pronto: {caminho.stat().st_size / (1024 * 1024):.1f} MB em "
+          f"{time.perf_counter() - inicio:.1f} s")
+    return caminho
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gera NetCDF sintético de precipitação para os benchmarks")
+    parser.add_argument("tamanhos", nargs="+", help="Número de pontos: 10k, 1m, 10m, 100m, 500m ou um número")
+    parser.add_argument("--semente", type=int, default=SEMENTE_PADRAO)
+    parser.add_argument("--pasta", default=None, help=f"Pasta dos arquivos (padrão: {PASTA_DADOS})")
+    parser.add_argument("--compressao", type=int, default=1, choices=range(10),
+                        help="Nível zlib (0 = sem compressão)")
+    parser.add_argument("--refazer", action="store_true", help="Regera mesmo se o arquivo já existir")
+    args = parser.parse_args()
+    for tamanho in args.tamanhos:
+        print(gerar(ler_pontos(tamanho), args.semente, args.pasta, args.compressao, args.refazer))
+
+
+if __name__ == "__main__":
+    main()
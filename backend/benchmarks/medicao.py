@@ -0,0 +1,132 @@
+"""
+Defesa Civil Araruna - Medição das etapas dos benchmarks
+Tempo, linhas, bytes e pico de memória (RSS) por etapa. As etapas podem
+se intercalar (fatia a fatia: extrair, montar a tabela, codificar...):
+cada uma soma o próprio tempo e uma thread amostra o RSS e o atribui à
+etapa em andamento. O RSS inicial de cada etapa acompanha o pico, já que
+o processo não devolve toda a memória entre uma etapa e outra.
+"""
+
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import psutil
+    PSUTIL_OK = True
+except ImportError:
+    PSUTIL_OK = False
+
+try:
+    import resource
+    RESOURCE_OK = True
+except ImportError:
+    RESOURCE_OK = False
+
+
+# Intervalo entre as amostras de memória
+INTERVALO_AMOSTRA_S = 0.01
+
+MB = 1024 * 1024
+
+
+def rss_atual() -> int | None:
+    """Memória residente do processo em bytes (None se não der para medir)"""
+    if PSUTIL_OK:
+        return psutil.Process().memory_info().rss
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def pico_processo() -> int | None:
+    """Maior RSS do processo desde o início (bytes)"""
+    if not RESOURCE_OK:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return pico if sys.platform == "darwin" else pico * 1024
+
+
+def _mb(valor) -> float | None:
+    return None if valor is None else round(valor / MB, 2)
+
+
+class Medidor:
+    """Acumula as medidas de cada etapa; usar com `with Medidor() as m:`"""
+
+    def __init__(self):
+        self._etapas: dict[str, dict] = {}
+        self._atual: list[str] = []
+        self._lock = threading.Lock()
+        self._parar = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._amostrar, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._parar.set()
+        self._thread.join()
+
+    def _registrar_rss(self):
+        rss = rss_atual()
+        if rss is None:
+            return
+        with self._lock:
+            for nome in self._atual:
+                etapa = self._etapas[nome]
+                etapa["pico_rss"] = max(etapa["pico_rss"] or 0, rss)
+
+    def _amostrar(self):
+        while not self._parar.wait(INTERVALO_AMOSTRA_S):
+            self._registrar_rss()
+
+    @contextmanager
+    def etapa(self, nome: str):
+        """
+        Mede um trecho da etapa `nome` (pode ser chamada várias vezes).
+        O dict entregue recebe "linhas" e "bytes" processados no trecho.
+        """
+        with self._lock:
+            etapa = self._etapas.setdefault(
+                nome, {"tempo": 0.0, "linhas": 0, "bytes": 0, "chamadas": 0,
+                       "rss_inicial": rss_atual(), "pico_rss": None}
+            )
+            self._atual.append(nome)
+        contagem = {"linhas": 0, "bytes": 0}
+        self._registrar_rss()
+        inicio = time.perf_counter()
+        try:
+            yield contagem
+        finally:
+            duracao = time.perf_counter() - inicio
+            self._registrar_rss()
+            with self._lock:
+                self._atual.remove(nome)
+                etapa["tempo"] += duracao
+                etapa["linhas"] += int(contagem["linhas"])
+                etapa["bytes"] += int(contagem["bytes"])
+                etapa["chamadas"] += 1
+
+    def resultado(self) -> dict:
+        """Medidas por etapa, na ordem em que as etapas começaram"""
+        saida = {}
+        for nome, etapa in self._etapas.items():
+            tempo = etapa["tempo"]
+            saida[nome] = {
+                "tempo_s": round(tempo, 4),
+                "chamadas": etapa["chamadas"],
+                "linhas": etapa["linhas"],
+                "mb": _mb(etapa["bytes"]),
+                "linhas_por_s": round(etapa["linhas"] / tempo, 1) if tempo > 0 and etapa["linhas"] else None,
+                "mb_por_s": round(etapa["bytes"] / MB / tempo, 2) if tempo > 0 and etapa["bytes"] else None,
+                "rss_inicial_mb": _mb(etapa["rss_inicial"]),
+                "pico_rss_mb": _mb(etapa["pico_rss"]),
+            }
+        return saida
@@ -0,0 +1,104 @@
+"""
+Defesa Civil Araruna - Cache de resultados de conversão
+Endereçado pelo conteúdo: SHA-256 do upload + formato + opções.
+Limite de tamanho em disco com remoção LRU (pela data de último acesso).
+"""
+
+import os
+import json
+import hashlib
+import threading
+from pathlib import Path
+
+
+CACHE_DIR = Path(__file__).parent / "output" / "cache"
+CACHE_DIR.mkdir(parents=True, exist_ok=True)
+
+# Tamanho máximo ocupado pelo cache (padrão: 2 GB)
+LIMITE_BYTES = int(os.getenv("CACHE_MAX_MB", "2048")) * 1024 * 1024
+
+_lock = threading.Lock()
+_estatisticas = {"acertos": 0, "faltas": 0, "removidos": 0}
+
+
+def calcular_chave(sha256_arquivo: str, formato: str, opcoes: dict | None = None) -> str:
+    """Chave do cache: hash do arquivo enviado + formato + opções de conversão"""
+    descricao = json.dumps(
+        {"arquivo": sha256_arquivo, "formato": formato, "opcoes": opcoes or {}},
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(descricao.encode("utf-8")).hexdigest()
+
+
+def _caminho(chave: str, extensao: str) -> Path:
+    return CACHE_DIR / f"{chave}{extensao}"
+
+
+def buscar(chave: str, *extensoes: str) -> Path | None:
+    """
+    Retorna o arquivo em cache (e marca o acesso) ou None.
+    Aceita mais de uma extensão (ex.: .csv ou .zip, quando há várias tabelas).
+    """
+    with _lock:
+        for extensao in extensoes:
+            caminho = _caminho(chave, extensao)
+            if caminho.is_file():
+                try:
+                    os.utime(caminho, None)  # Atualiza a ordem LRU
+                except OSError:
+                    pass
+                _estatisticas["acertos"] += 1
+                return caminho
+        _estatisticas["faltas"] += 1
+        return None
+
+
+def guardar(chave: str, extensao: str, caminho_origem: str | Path) -> Path:
+    """Move o resultado de uma conversão para o cache e aplica o limite de tamanho"""
+    destino = _caminho(chave, extensao)
+    with _lock:
+        os.replace(caminho_origem, destino)
+        os.utime(destino, None)
+        _aplicar_limite(preservar=destino)
+    return destino
+
+
+def _aplicar_limite(preservar: Path | None = None):
+    """Remove os arquivos menos usados até o cache caber no limite"""
+    arquivos = []
+    total = 0
+    for arquivo in CACHE_DIR.iterdir():
+        if arquivo.is_file():
+            info = arquivo.stat()
+            arquivos.append((info.st_mtime, info.st_size, arquivo))
+            total += info.st_size
+
+    arquivos.sort()
+    for _, tamanho, arquivo in arquivos:
+        if total <= LIMITE_BYTES:
+            break
+        if arquivo == preservar:
+            continue
+        try:
+            arquivo.unlink()
+        except OSError:
+            continue  # Em uso (Windows); tenta de novo na próxima vez
+        total -= tamanho
+        _estatisticas["removidos"] += 1
+        print(f"[CACHE] Removido (LRU): {arquivo.name}")
+
+
+def estatisticas() -> dict:
+    """Contadores de acerto/falta e ocupação atual do cache"""
+    with _lock:
+        entradas = [a for a in CACHE_DIR.iterdir() if a.is_file()]
+        tamanho = sum(a.stat().st_size for a in entradas)
+        consultas = _estatisticas["acertos"] + _estatisticas["faltas"]
+        return {
+            **_estatisticas,
+            "taxa_acerto": round(_estatisticas["acertos"] / consultas, 3) if consultas else None,
+            "entradas": len(entradas),
+            "tamanho_mb": round(tamanho / (1024 * 1024), 2),
+            "limite_mb": round(LIMITE_BYTES / (1024 * 1024), 2),
+        }
@@ -0,0 +1,429 @@
+"""
+Defesa Civil Araruna - Climatologia (normal) em cache e anomalias
+Calcula uma vez, a partir de arquivos .nc históricos, a média e os
+percentis do total mensal de chuva de cada célula e mês do calendário
+(ex.: 1991-2020) e guarda em .npy abertos por memória mapeada. As
+conversões com `climatologia=<id>` agregam o arquivo novo por mês e
+ganham, por célula, a normal, a anomalia, a porcentagem da normal e o
+percentil do mês, lendo da normal só as células e o mês de cada período.
+Com arquivos diários a climatologia guarda também o percentil 95 dos
+dias úmidos de cada célula, que serve de limiar do R95p nos índices de
+extremos sem uma passada extra pelo arquivo convertido.
+
+Uso pela linha de comando:
+    python climatologia.py hist_1991.nc hist_1992.nc ... --inicio 1991 --fim 2020
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import threading
+import uuid
+import warnings
+from pathlib import Path
+
+import numpy as np
+import xarray as xr
+
+import agregacao_temporal
+import copia_zarr
+import indices_extremos
+import planejador_fatias
+import reducao_espacial
+import subconjunto
+
+
+CLIMATOLOGIAS_DIR = Path(__file__).parent / "output" / "climatologias"
+CLIMATOLOGIAS_DIR.mkdir(parents=True, exist_ok=True)
+
+PERCENTIS = (10, 25, 50, 75, 90)
+PERIODO_PADRAO = (1991, 2020)
+
+# Células por bloco no cálculo dos percentis (limita a memória)
+CELULAS_POR_BLOCO = 65536
+
+_memoria: dict[str, "Climatologia"] = {}
+_lock = threading.Lock()
+
+
+class ErroClimatologia(subconjunto.ErroSubconjunto):
+    """Climatologia inválida ou incompatível (vira HTTP 400 no servidor)"""
+
+
+class Climatologia:
+    """Normal guardada em disco: arrays (mês, lat, lon) por memória mapeada"""
+
+    def __init__(self, pasta: Path):
+        self.id = pasta.name
+        self.meta = json.loads((pasta / "meta.json").read_text(encoding="utf-8"))
+        self.lat = np.load(pasta / "lat.npy")
+        self.lon = np.load(pasta / "lon.npy")
+        self.media = np.load(pasta / "media.npy", mmap_mode="r")
+        self.percentis = np.load(pasta / "percentis.npy", mmap_mode="r")
+        p95 = pasta / "p95_umido.npy"
+        self.p95_umido = np.load(p95, mmap_mode="r") if p95.is_file() else None
+
+    @property
+    def variavel(self) -> str:
+        return self.meta["variavel"]
+
+    def _indices(self, valores: np.ndarray, referencia: np.ndarray, nome: str) -> np.ndarray:
+        """Posição de cada coordenada na grade da climatologia"""
+        ordem = np.argsort(referencia)
+        posicoes = np.clip(np.searchsorted(referencia[ordem], valores), 0, len(referencia) - 1)
+        vizinhas = np.clip(posicoes - 1, 0, len(referencia) - 1)
+        escolhidas = np.where(
+            np.abs(referencia[ordem][vizinhas] - valores) < np.abs(referencia[ordem][posicoes] - valores),
+            vizinhas, posicoes)
+        indices = ordem[escolhidas]
+        tolerancia = 1e-3 * (np.abs(np.diff(np.sort(referencia))).min() if referencia.size > 1 else 1.0)
+        if np.any(np.abs(referencia[indices] - valores) > tolerancia):
+            raise ErroClimatologia(
+                f"A grade da conversão ({nome}) não coincide com a da climatologia {self.id}"
+            )
+        return indices
+
+    def _celulas(self, ds) -> dict:
+        """Indexadores (_lat, _lon) que levam a grade da climatologia às células do dataset"""
+        nome_lat = subconjunto.encontrar_coordenada(ds, subconjunto.NOMES_LAT)
+        nome_lon = subconjunto.encontrar_coordenada(ds, subconjunto.NOMES_LON)
+        if nome_lat is None or nome_lon is None:
+            raise ErroClimatologia("O arquivo não tem coordenadas de latitude/longitude")
+        lat, lon = ds[nome_lat], ds[nome_lon]
+        return {
+            "_lat": xr.DataArray(self._indices(np.asarray(lat.values, np.float64), self.lat, nome_lat),
+                                 dims=lat.dims),
+            "_lon": xr.DataArray(self._indices(np.asarray(lon.values, np.float64), self.lon, nome_lon),
+                                 dims=lon.dims),
+        }
+
+    def normais(self, ds, mes: int) -> dict:
+        """
+        {"media", "percentis"} do mês (1-12) nas células do dataset
+        (grade lat/lon ou células de polígono), como DataArrays.
+        """
+        celulas = self._celulas(ds)
+        media = xr.DataArray(self.media[mes - 1], dims=("_lat", "_lon"))
+        percentis = xr.DataArray(self.percentis[:, mes - 1], dims=("percentil", "_lat", "_lon"))
+        return {
+            "media": media.isel(celulas),
+            "percentis": percentis.isel(celulas),
+        }
+
+    def limiar_p95(self, ds, dims: list | None = None) -> np.ndarray:
+        """
+        Percentil 95 dos dias úmidos (mm/dia) nas células do dataset, com
+        as dimensões na ordem `dims` (limiar do R95p em indices_extremos)
+        """
+        if self.p95_umido is None:
+            raise ErroClimatologia(
+                f"A climatologia {self.id} não tem o percentil 95 diário (criada com dados não diários)"
+            )
+        limiar = xr.DataArray(self.p95_umido, dims=("_lat", "_lon")).isel(self._celulas(ds))
+        if dims is not None:
+            limiar = limiar.transpose(*dims)
+        return np.asarray(limiar.values, np.float64)
+
+
+def _pasta(id_climatologia: str) -> Path:
+    return CLIMATOLOGIAS_DIR / id_climatologia
+
+
+def existe(id_climatologia: str) -> bool:
+    return (_pasta(id_climatologia) / "meta.json").is_file()
+
+
+def carregar(id_climatologia: str) -> Climatologia:
+    """Climatologia guardada (mantida aberta no processo)"""
+    with _lock:
+        if id_climatologia in _memoria:
+            return _memoria[id_climatologia]
+    if not existe(id_climatologia):
+        raise ErroClimatologia(f"Climatologia não encontrada: {id_climatologia}")
+    clima = Climatologia(_pasta(id_climatologia))
+    with _lock:
+        _memoria[id_climatologia] = clima
+    return clima
+
+
+def listar() -> list[dict]:
+    """Metadados das climatologias guardadas"""
+    return [
+        {"id": pasta.name, **json.loads((pasta / "meta.json").read_text(encoding="utf-8"))}
+        for pasta in sorted(CLIMATOLOGIAS_DIR.iterdir()) if (pasta / "meta.json").is_file()
+    ]
+
+
+def _abrir_historico(caminho, variavel: str | None, inicio: int, fim: int, nome_arquivo: str):
+    """(dataset lazy (tempo, lat, lon) só com a chuva do período, nomes)"""
+    ds = copia_zarr.abrir(caminho)
+    try:
+        nome = variavel or indices_extremos.variavel_precipitacao(ds)
+        if nome not in ds.data_vars:
+            raise ErroClimatologia(f"Variável {nome} não encontrada em {nome_arquivo}")
+        dim = agregacao_temporal.dimensao_tempo(ds)
+        nome_lat = subconjunto.encontrar_coordenada(ds, subconjunto.NOMES_LAT)
+        nome_lon = subconjunto.encontrar_coordenada(ds, subconjunto.NOMES_LON)
+        if nome_lat is None or nome_lon is None or set(ds[nome].dims) != {dim, nome_lat, nome_lon}:
+            raise ErroClimatologia(f"{nome_arquivo}: a chuva precisa das dimensões tempo, lat e lon")
+        ds = ds[[nome]].sel({dim: slice(f"{inicio}-01-01", f"{fim}-12-31")})
+        return ds.transpose(dim, nome_lat, nome_lon), nome, dim, nome_lat, nome_lon
+    except Exception:
+        ds.close()
+        raise
+
+
+def _esperados(tempos: np.ndarray, anos: np.ndarray, meses: np.ndarray) -> np.ndarray:
+    """Passos de tempo esperados em cada (ano, mês) para o mês estar completo"""
+    passo = np.median(np.diff(tempos)) if tempos.size > 1 else np.timedelta64(1, "D")
+    if passo >= np.timedelta64(28, "D"):
+        return np.ones((len(anos), len(meses)), np.int32)
+    inicio = (anos[:, None] - 1970) * 12 + (meses[None, :] - 1)
+    inicio = inicio.astype("datetime64[M]")
+    dias = ((inicio + 1).astype("datetime64[D]") - inicio.astype("datetime64[D]")).astype(int)
+    return np.round(dias * (np.timedelta64(1, "D") / passo)).astype(np.int32)
+
+
+def criar(caminhos: list, inicio: int = PERIODO_PADRAO[0], fim: int = PERIODO_PADRAO[1],
+          variavel: str | None = None, percentis=PERCENTIS, nomes: list | None = None) -> str:
+    """
+    Calcula a climatologia dos arquivos históricos (mesma grade) e devolve
+    o id. Os totais mensais de cada ano vão para um arquivo temporário
+    mapeado em memória; média e percentis são calculados por blocos de
+    células. O id depende do conteúdo: recalcular os mesmos dados devolve
+    a climatologia já guardada. `nomes` são os nomes originais dos
+    arquivos guardados nos metadados (padrão: os nomes dos caminhos).
+    """
+    if not caminhos:
+        raise ErroClimatologia("Nenhum arquivo histórico informado")
+    if inicio > fim:
+        raise ErroClimatologia("O ano inicial deve ser menor ou igual ao final")
+    percentis = sorted(float(p) for p in percentis)
+    n_anos = fim - inicio + 1
+    nomes = list(nomes) if nomes else [Path(c).name for c in caminhos]
+    if len(nomes) != len(caminhos):
+        raise ValueError("Informe um nome para cada arquivo histórico")
+
+    temporaria = CLIMATOLOGIAS_DIR / f"_criando_{uuid.uuid4().hex}"
+    temporaria.mkdir()
+    try:
+        lat = lon = unidades = None
+        totais = contagens = esperados = None
+        histograma = None
+        diario = True
+        for caminho, nome_arquivo in zip(caminhos, nomes):
+            ds, nome, dim, nome_lat, nome_lon = _abrir_historico(caminho, variavel, inicio, fim, nome_arquivo)
+            try:
+                variavel = variavel or nome
+                if lat is None:
+                    lat = np.asarray(ds[nome_lat].values, np.float64)
+                    lon = np.asarray(ds[nome_lon].values, np.float64)
+                    # Totais de uma taxa (kg m-2 s-1...) em mm, como na agregação mensal
+                    unidades = str(ds[nome].attrs.get("units", ""))
+                    if agregacao_temporal.fator_soma_mm(ds[nome], ds[dim].values) != 1.0:
+                        unidades = "mm"
+                    forma = (n_anos, 12, lat.size, lon.size)
+                    totais = np.lib.format.open_memmap(temporaria / "totais.npy", "w+", np.float32, forma)
+                    contagens = np.lib.format.open_memmap(temporaria / "contagens.npy", "w+", np.int16, forma)
+                    esperados = np.zeros((n_anos, 12), np.int32)
+                    try:
+                        histograma = indices_extremos.HistogramaP95(ds, temporaria / "histograma.npy")
+                    except indices_extremos.ErroIndices:
+                        diario = False  # sem P95 diário (ex.: arquivos mensais)
+                elif (ds[nome_lat].size, ds[nome_lon].size) != (lat.size, lon.size) or \
+                        not np.allclose(ds[nome_lat].values, lat) or not np.allclose(ds[nome_lon].values, lon):
+                    raise ErroClimatologia(f"{nome_arquivo} não está na mesma grade dos demais arquivos")
+
+                tempos = ds[dim].values
+                if tempos.size == 0:
+                    continue
+                esperados = np.maximum(esperados, _esperados(
+                    tempos, np.arange(inicio, fim + 1), np.arange(1, 13)))
+                fator = agregacao_temporal.fator_soma_mm(ds[nome], tempos)
+                print(f"[CLIMATOLOGIA] {nome_arquivo}: {tempos.size:,} passos de tempo")
+                if histograma is not None:
+                    try:
+                        indices_extremos.dimensao_tempo(ds)
+                    except indices_extremos.ErroIndices:
+                        diario = False
+                for fatia in planejador_fatias.planejar(ds):
+                    ds_fatia = ds.isel(fatia).load()
+                    if diario and histograma is not None:
+                        histograma.adicionar(fatia, ds_fatia)
+                    parcial = agregacao_temporal.reduzir_fatia(ds_fatia, "mensal", "soma")
+                    reduzidos = parcial["variaveis"][str(nome)]
+                    regiao = (fatia.get(nome_lat, slice(None)), fatia.get(nome_lon, slice(None)))
+                    for k, periodo in enumerate(parcial["periodos"].astype("datetime64[M]").astype(int)):
+                        ano, mes = divmod(int(periodo), 12)
+                        totais[(ano + 1970 - inicio, mes) + regiao] += reduzidos["soma"][k] * fator
+                        contagens[(ano + 1970 - inicio, mes) + regiao] += reduzidos["contagem"][k]
+            finally:
+                ds.close()
+
+        if totais is None or not contagens.any():
+            raise ErroClimatologia(f"Nenhum dado entre {inicio} e {fim} nos arquivos informados")
+
+        # Média e percentis por blocos de células (mês incompleto = ausente)
+        media = np.full((12, lat.size, lon.size), np.nan, np.float32)
+        quantis = np.full((len(percentis), 12, lat.size, lon.size), np.nan, np.float32)
+        anos_validos = np.zeros((12, lat.size, lon.size), np.int16)
+        celulas = lat.size * lon.size
+        planos_totais = totais.reshape(n_anos, 12, celulas)
+        planos_contagens = contagens.reshape(n_anos, 12, celulas)
+        for inicio_bloco in range(0, celulas, CELULAS_POR_BLOCO):
+            bloco = slice(inicio_bloco, min(inicio_bloco + CELULAS_POR_BLOCO, celulas))
+            valores = np.array(planos_totais[:, :, bloco])
+            valores[np.array(planos_contagens[:, :, bloco]) < esperados[:, :, None]] = np.nan
+            validos = (~np.isnan(valores)).sum(axis=0)
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", RuntimeWarning)  # células sem nenhum ano
+                media.reshape(12, celulas)[:, bloco] = np.nanmean(valores, axis=0)
+                quantis.reshape(len(percentis), 12, celulas)[:, :, bloco] = \
+                    np.nanpercentile(valores, percentis, axis=0)
+            anos_validos.reshape(12, celulas)[:, bloco] = validos
+        p95_umido = histograma.limiares().astype(np.float32) if diario and histograma is not None else None
+        del totais, contagens, planos_totais, planos_contagens, histograma
+        for temporario in ("totais.npy", "contagens.npy", "histograma.npy"):
+            (temporaria / temporario).unlink(missing_ok=True)
+
+        meta = {
+            "variavel": str(variavel),
+            "unidades": unidades,
+            "inicio": inicio,
+            "fim": fim,
+            "percentis": percentis,
+            "arquivos": nomes,
+            "anos_com_dados": int(anos_validos.max()),
+            "p95_umido": p95_umido is not None,
+        }
+        h = hashlib.sha256(json.dumps({k: meta[k] for k in ("variavel", "unidades", "inicio", "fim",
+                                                             "percentis")}).encode())
+        for array in (lat, lon, media, quantis) + ((p95_umido,) if p95_umido is not None else ()):
+            h.update(np.ascontiguousarray(array).tobytes())
+        id_climatologia = h.hexdigest()[:32]
+
+        np.save(temporaria / "lat.npy", lat)
+        np.save(temporaria / "lon.npy", lon)
+        np.save(temporaria / "media.npy", media)
+        np.save(temporaria / "percentis.npy", quantis)
+        np.save(temporaria / "anos.npy", anos_validos)
+        if p95_umido is not None:
+            np.save(temporaria / "p95_umido.npy", p95_umido)
+        (temporaria / "meta.json").write_text(json.dumps(meta, ensure_ascii=False, indent=2), encoding="utf-8")
+
+        destino = _pasta(id_climatologia)
+        if existe(id_climatologia):
+            shutil.rmtree(temporaria)
+        else:
+            os.replace(temporaria, destino)
+        print(f"[CLIMATOLOGIA] {inicio}-{fim} ({meta['anos_com_dados']} anos) → {id_climatologia}")
+        return id_climatologia
+    except Exception:
+        shutil.rmtree(temporaria, ignore_errors=True)
+        raise
+
+
+def limiar_indices(grade, id_climatologia: str) -> np.ndarray:
+    """
+    Limiar do R95p (indices_extremos.iterar_indices) na grade dos índices,
+    a partir do percentil 95 diário guardado na climatologia
+    """
+    nome = list(grade.data_vars)[0]
+    dim = indices_extremos.dimensao_tempo(grade)
+    return carregar(id_climatologia).limiar_p95(grade, [d for d in grade[nome].dims if d != dim])
+
+
+def validar(ds, opcoes: dict | None):
+    """
+    Erro se a climatologia foi pedida com um modo incompatível ou se a
+    grade da conversão (já recortada/reduzida) não está na climatologia
+    """
+    opcoes = opcoes or {}
+    if not opcoes.get("climatologia"):
+        return
+    grade = reducao_espacial.grade_reduzida(ds, reducao_espacial.fatores(ds, opcoes))
+    if opcoes.get("indices"):
+        # Com os índices a climatologia só fornece o limiar do R95p
+        carregar(opcoes["climatologia"]).limiar_p95(grade)
+        return
+    if opcoes.get("agregacao") != "mensal" or opcoes.get("estatistica", "soma") != "soma":
+        raise ErroClimatologia("A anomalia é calculada sobre os totais mensais (agregação mensal com soma)")
+    if opcoes.get("spi"):
+        raise ErroClimatologia("A anomalia não pode ser combinada com o SPI")
+    carregar(opcoes["climatologia"]).normais(grade, 1)
+
+
+def _percentil_do_valor(valores: xr.DataArray, quantis: xr.DataArray, percentis: list) -> xr.DataArray:
+    """
+    Posição aproximada (0-100) do valor entre os percentis da normal,
+    interpolada; abaixo do menor percentil a interpolação parte de zero
+    chuva e acima do maior o valor fica no maior percentil.
+    """
+    q = np.moveaxis(np.asarray(quantis.transpose("percentil", *valores.dims).values, np.float64), 0, -1)
+    v = np.asarray(valores.values, np.float64)
+    acima = (v[..., np.newaxis] >= q).sum(axis=-1)[..., np.newaxis]  # percentis alcançados
+    inferior = np.take_along_axis(np.concatenate([np.zeros_like(q[..., :1]), q], -1), acima, -1)[..., 0]
+    superior = np.take_along_axis(np.concatenate([q, q[..., -1:]], -1), acima, -1)[..., 0]
+    niveis_inferiores = np.asarray([0.0] + list(percentis))
+    niveis_superiores = np.asarray(list(percentis) + [percentis[-1]])
+    acima = acima[..., 0]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        fracao = np.clip(np.where(superior > inferior, (v - inferior) / (superior - inferior), 0.0), 0, 1)
+    posicao = niveis_inferiores[acima] + fracao * (niveis_superiores[acima] - niveis_inferiores[acima])
+    posicao[np.isnan(v) | np.isnan(q).any(axis=-1)] = np.nan
+    return xr.DataArray(posicao.astype(np.float32), dims=valores.dims)
+
+
+def anomalias(ds_periodo, id_climatologia: str):
+    """
+    Acrescenta ao Dataset de um mês (agregacao_temporal) as colunas
+    <var>_normal, <var>_anomalia, <var>_pct_normal e <var>_percentil.
+    """
+    clima = carregar(id_climatologia)
+    dim = agregacao_temporal.dimensao_tempo(ds_periodo)
+    nome = clima.variavel if clima.variavel in ds_periodo.data_vars else None
+    if nome is None:
+        candidatos = list(ds_periodo.data_vars)
+        if len(candidatos) != 1:
+            raise ErroClimatologia(f"Variável {clima.variavel} da climatologia não está na conversão")
+        nome = candidatos[0]
+    unidades = str(ds_periodo[nome].attrs.get("units", ""))
+    if unidades and clima.meta["unidades"] and unidades != clima.meta["unidades"]:
+        raise ErroClimatologia(
+            f"Unidades diferentes: arquivo em {unidades}, climatologia em {clima.meta['unidades']}"
+        )
+
+    mes = int(ds_periodo[dim].values[0].astype("datetime64[M]").astype(int) % 12) + 1
+    normais = clima.normais(ds_periodo, mes)
+    valores = ds_periodo[nome].isel({dim: 0}, drop=True)
+    media = normais["media"].astype(np.float64)
+    dtype = ds_periodo[nome].dtype
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        colunas = {
+            f"{nome}_normal": media,
+            f"{nome}_anomalia": valores - media,
+            f"{nome}_pct_normal": xr.where(media > 0, 100 * valores / media, np.nan),
+            f"{nome}_percentil": _percentil_do_valor(valores, normais["percentis"], clima.meta["percentis"]),
+        }
+    for coluna, valores_coluna in colunas.items():
+        ds_periodo[coluna] = valores_coluna.astype(dtype).expand_dims({dim: ds_periodo[dim].values})
+        ds_periodo[coluna] = ds_periodo[coluna].transpose(*ds_periodo[nome].dims)
+    return ds_periodo
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Climatologia mensal de chuva - Defesa Civil Araruna")
+    parser.add_argument("arquivos", nargs="+", help="Arquivos NetCDF históricos (mesma grade)")
+    parser.add_argument("--inicio", type=int, default=PERIODO_PADRAO[0], help="Ano inicial (padrão: 1991)")
+    parser.add_argument("--fim", type=int, default=PERIODO_PADRAO[1], help="Ano final (padrão: 2020)")
+    parser.add_argument("--variavel", default=None, help="Variável de chuva (padrão: detectada)")
+    args = parser.parse_args()
+    id_climatologia = criar(args.arquivos, args.inicio, args.fim, args.variavel)
+    print(f"Climatologia: {id_climatologia}")
+
+
+if __name__ == "__main__":
+    main()
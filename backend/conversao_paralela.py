@@ -0,0 +1,127 @@
+"""
+Defesa Civil Araruna - Conversão paralela de fatias
+Cada processo trabalhador abre o dataset uma vez e converte fatias
+disjuntas (isel com as fatias de planejador_fatias). O processo principal
+recebe os resultados e os entrega ao escritor na ordem das fatias, então
+a saída é idêntica byte a byte à conversão serial.
+"""
+
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import agregacao_temporal
+import alertas
+import copia_zarr
+import escritores
+import indice_spi
+import motor_tabular
+import reducao_espacial
+import subconjunto
+
+
+# Processos por conversão (1 = serial). No servidor cada job da fila pode
+# abrir seu próprio grupo de processos, então o padrão é conservador.
+TRABALHADORES_PADRAO = max(1, int(os.getenv("CONVERSOR_TRABALHADORES", "1")))
+
+def limitar_trabalhadores(trabalhadores: int, processos_externos: int) -> int:
+    """
+    Trabalhadores de uma conversão que roda ao lado de outras
+    `processos_externos` (ex.: os processos do pool de jobs): somados,
+    não passam do número de núcleos.
+    """
+    return max(1, min(trabalhadores, (os.cpu_count() or 1) // max(1, processos_externos)))
+
+
+# Fatias em andamento por processo (limita a memória do lado do escritor)
+FATIAS_POR_TRABALHADOR = 2
+
+# Dataset aberto no processo trabalhador e opções da conversão (definidos pelo initializer)
+_ds = None
+_opcoes: dict = {}
+_fatores: dict = {}
+
+
+def _iniciar_trabalhador(caminho_nc: str, opcoes: dict | None):
+    """Abre o dataset (já recortado, ou a cópia Zarr) uma vez por processo trabalhador"""
+    global _ds, _opcoes, _fatores
+    _ds = motor_tabular.completar_coordenadas(
+        subconjunto.aplicar_subconjunto(copia_zarr.abrir(caminho_nc, copia_zarr.acesso_das_opcoes(opcoes)), opcoes)
+    )
+    _opcoes = opcoes or {}
+    _fatores = reducao_espacial.fatores(_ds, _opcoes)
+
+
+def _converter_fatia(fatia: dict, saida: str, cabecalho: bool, formato_data: str | None,
+                     variaveis: list | None):
+    """
+    Converte uma fatia (dict dim -> slice) no trabalhador e devolve
+    (linhas, resultado). saida="csv": resultado são os bytes do CSV;
+    saida="lote": as colunas; saida="parcial": a redução da fatia aos
+    períodos de opcoes["agregacao"] (agregacao_temporal.reduzir_fatia).
+    `variaveis` restringe a um grupo de variáveis. Com redução espacial a
+    fatia é reduzida em blocos antes de tudo; com opcoes["spi"] a fatia
+    (série inteira de um bloco de células) vira a tabela do SPI e com
+    opcoes["alertas"] só as linhas acima do menor limiar são devolvidas.
+    """
+    ds = _ds[variaveis] if variaveis else _ds
+    ds_fatia = reducao_espacial.reduzir(
+        ds.isel(fatia), _fatores, _opcoes.get("estatistica_espacial", "media")
+    )
+    if saida == "parcial":
+        parcial = agregacao_temporal.reduzir_fatia(
+            ds_fatia, _opcoes["agregacao"], _opcoes.get("estatistica", "soma")
+        )
+        return 0, parcial
+    if _opcoes.get("spi"):
+        ds_fatia = indice_spi.calcular(ds_fatia)
+    if _opcoes.get("alertas"):
+        lote = alertas.tabela_alertas(ds_fatia, _opcoes["alertas"], alertas.fator_mm_passo(ds))
+    else:
+        lote = motor_tabular.tabela_da_fatia(ds_fatia, bool(_opcoes.get("esparso")))
+    linhas = motor_tabular.linhas_do_lote(lote)
+    if saida == "csv":
+        return linhas, escritores.codificar_csv(lote, cabecalho, formato_data)
+    return linhas, lote
+
+
+def iterar_fatias_paralelas(caminho_nc: str, opcoes: dict | None, fatias, trabalhadores: int,
+                            saida: str = "lote", cabecalho: bool = True,
+                            formato_data: str | None = None, variaveis: list | None = None):
+    """
+    Gera (fatia, linhas, resultado) na ordem de `fatias`, com no máximo
+    FATIAS_POR_TRABALHADOR fatias por processo em andamento.
+    Com saida="csv", só a primeira fatia leva o cabeçalho (se cabecalho=True)
+    e as datas usam `formato_data` (ver escritores.formato_data_csv).
+    `variaveis` seleciona um grupo (grupos_variaveis) do dataset.
+    Ao fechar o gerador (erro ou cancelamento) as fatias pendentes são descartadas.
+    """
+    fatias = iter(fatias)
+    executor = ProcessPoolExecutor(
+        max_workers=trabalhadores,
+        initializer=_iniciar_trabalhador,
+        initargs=(caminho_nc, opcoes),
+    )
+    pendentes = deque()
+    primeira = [cabecalho]
+
+    def _submeter_proxima():
+        fatia = next(fatias, None)
+        if fatia is not None:
+            pendentes.append((fatia, executor.submit(
+                _converter_fatia, fatia, saida, primeira[0], formato_data, variaveis
+            )))
+            primeira[0] = False
+
+    try:
+        for _ in range(trabalhadores * FATIAS_POR_TRABALHADOR):
+            _submeter_proxima()
+
+        while pendentes:
+            fatia, futuro = pendentes.popleft()
+            linhas, resultado = futuro.result()
+            _submeter_proxima()
+            yield fatia, linhas, resultado
+            del resultado
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
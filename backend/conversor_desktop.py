@@ -11,8 +11,10 @@
 
 import os
 import sys
+import re
 import gc
 import threading
+import multiprocessing
 import subprocess
 import xml.etree.ElementTree as ET
 import tkinter as tk
@@ -86,7 +88,8 @@ def _instalar_deps():
         return False
 
 # Só executa a verificação quando rodando como script Python (não no .exe)
-if not getattr(sys, 'frozen', False):
+# e no processo principal (não nos processos da conversão paralela)
+if not getattr(sys, 'frozen', False) and __name__ == '__main__':
     _root_tmp = tk.Tk()
     _root_tmp.withdraw()
     if not _instalar_deps():
@@ -95,9 +98,21 @@ if not getattr(sys, 'frozen', False):
 
 # ── DEPENDÊNCIAS EXTERNAS ────────────────────────────────────────────────────
 try:
-    import xarray as xr
     import pandas as pd
     import numpy as np
+    import motor_tabular
+    import conversao_paralela
+    import planejador_fatias
+    import grupos_variaveis
+    import escritores
+    import subconjunto
+    import agregacao_temporal
+    import alertas
+    import climatologia
+    import reducao_espacial
+    import indices_extremos
+    import indice_spi
+    import copia_zarr
     LIBS_OK = True
 except ImportError as e:
     LIBS_OK = False
@@ -106,7 +121,7 @@ except ImportError as e:
 try:
     import openpyxl
     from openpyxl.styles import PatternFill, Font, Alignment, Border, Side
-    from openpyxl import load_workbook
+    from openpyxl import load_workbook, Workbook
     EXCEL_OK = True
 except ImportError:
     EXCEL_OK = False
@@ -146,6 +161,15 @@ FORMATOS = [
 
 EXT_MAP = {'CSV': '.csv', 'Excel': '.xlsx', 'XML': '.xml'}
 
+AGREGACOES = {
+    'Nenhuma': None,
+    'Diária (de dados horários)': 'diario',
+    'Mensal (de dados diários)': 'mensal',
+    'Anual (de dados mensais)': 'anual',
+}
+ESTATISTICAS = {'Soma': 'soma', 'Média': 'media', 'Máximo': 'maximo'}
+ESTATISTICAS_ESPACIAIS = {'Média': 'media', 'Soma': 'soma', 'Máximo': 'maximo'}
+
 
 # ════════════════════════════════════════════════════════════════════════════
 class ConversorApp:
@@ -185,6 +209,20 @@ class ConversorApp:
         self.var_formato   = tk.StringVar(value='CSV')
         self.var_unificar  = tk.BooleanVar(value=False)
         self.var_resumo    = tk.BooleanVar(value=True)
+        self.var_indices   = tk.BooleanVar(value=False)
+        self.var_r95p      = tk.BooleanVar(value=False)
+        self.var_spi       = tk.BooleanVar(value=False)
+        self.var_esparso   = tk.BooleanVar(value=False)
+        self.var_alertas   = tk.BooleanVar(value=False)
+        self.var_otimizar  = tk.BooleanVar(value=False)
+        self.var_limiares  = tk.StringVar(value='30, 50, 80')
+        self.var_poligono  = tk.StringVar()
+        self.var_agregacao = tk.StringVar(value='Nenhuma')
+        self.var_estatistica = tk.StringVar(value='Soma')
+        self.var_climatologia = tk.StringVar()
+        self.var_fator_espacial = tk.IntVar(value=1)
+        self.var_estat_espacial = tk.StringVar(value='Média')
+        self.var_processos = tk.IntVar(value=max(1, (os.cpu_count() or 2) // 2))
 
         self._setup_style()
         self._build_ui()
@@ -339,6 +377,80 @@ class ConversorApp:
                     self.var_unificar)
         self._check(opts, 'Gerar resumo com cálculo de média anual',
                     self.var_resumo)
+        self._check(opts, 'Gerar índices de extremos de chuva por ano (Rx1day, Rx5day, R20mm, CDD, CWD)',
+                    self.var_indices)
+        self._check(opts, 'Incluir o R95p nos índices (estima o percentil 95: lê a chuva duas vezes)',
+                    self.var_r95p)
+        self._check(opts, 'Gerar SPI-1/3/6/12 (índice de seca) por mês',
+                    self.var_spi)
+        self._check(opts, 'Modo esparso: ignorar células sem dados (NaN)',
+                    self.var_esparso)
+        self._check(opts, 'Otimizar leituras: criar cópia Zarr ao lado do .nc (reaproveitada nas próximas conversões)',
+                    self.var_otimizar)
+
+        alr_row = tk.Frame(opts, bg=C['bg2'])
+        alr_row.pack(anchor='w', pady=3)
+        tk.Checkbutton(
+            alr_row, text='Somente alertas de chuva (mm no passo):', variable=self.var_alertas,
+            font=('Segoe UI', 9), bg=C['bg2'], fg=C['txt'],
+            activebackground=C['bg2'], activeforeground=C['accent'],
+            selectcolor=C['card'], cursor='hand2').pack(side='left')
+        tk.Entry(alr_row, textvariable=self.var_limiares, width=14,
+                 font=('Segoe UI', 9), bg=C['card'], fg=C['txt'],
+                 insertbackground=C['txt'], relief='flat'
+                 ).pack(side='left', padx=(8, 0), ipady=4, ipadx=6)
+
+        pol_row = tk.Frame(opts, bg=C['bg2'])
+        pol_row.pack(fill='x', pady=3)
+        tk.Label(pol_row, text='Polígono (GeoJSON):', font=('Segoe UI', 9),
+                 bg=C['bg2'], fg=C['txt']).pack(side='left')
+        tk.Entry(pol_row, textvariable=self.var_poligono,
+                 font=('Segoe UI', 9), bg=C['card'], fg=C['txt'],
+                 insertbackground=C['txt'], relief='flat'
+                 ).pack(side='left', fill='x', expand=True, padx=(8, 0), ipady=4, ipadx=6)
+        self._botao(pol_row, 'Escolher', self._sel_poligono, C['accent']
+                    ).pack(side='right', padx=(8, 0))
+
+        agr_row = tk.Frame(opts, bg=C['bg2'])
+        agr_row.pack(anchor='w', pady=3)
+        tk.Label(agr_row, text='Agregação temporal:', font=('Segoe UI', 9),
+                 bg=C['bg2'], fg=C['txt']).pack(side='left')
+        ttk.Combobox(agr_row, textvariable=self.var_agregacao, values=list(AGREGACOES),
+                     state='readonly', width=26, font=('Segoe UI', 9)
+                     ).pack(side='left', padx=(8, 0))
+        ttk.Combobox(agr_row, textvariable=self.var_estatistica, values=list(ESTATISTICAS),
+                     state='readonly', width=9, font=('Segoe UI', 9)
+                     ).pack(side='left', padx=(8, 0))
+
+        clim_row = tk.Frame(opts, bg=C['bg2'])
+        clim_row.pack(fill='x', pady=3)
+        tk.Label(clim_row, text='Climatologia (id, anomalia mensal):', font=('Segoe UI', 9),
+                 bg=C['bg2'], fg=C['txt']).pack(side='left')
+        tk.Entry(clim_row, textvariable=self.var_climatologia,
+                 font=('Segoe UI', 9), bg=C['card'], fg=C['txt'],
+                 insertbackground=C['txt'], relief='flat'
+                 ).pack(side='left', fill='x', expand=True, padx=(8, 0), ipady=4, ipadx=6)
+
+        red_row = tk.Frame(opts, bg=C['bg2'])
+        red_row.pack(anchor='w', pady=3)
+        tk.Label(red_row, text='Reduzir resolução (blocos N x N):', font=('Segoe UI', 9),
+                 bg=C['bg2'], fg=C['txt']).pack(side='left')
+        tk.Spinbox(red_row, from_=1, to=50, width=4,
+                   textvariable=self.var_fator_espacial, font=('Segoe UI', 9),
+                   bg=C['card'], fg=C['txt'], buttonbackground=C['card'],
+                   relief='flat').pack(side='left', padx=(8, 0))
+        ttk.Combobox(red_row, textvariable=self.var_estat_espacial, values=list(ESTATISTICAS_ESPACIAIS),
+                     state='readonly', width=9, font=('Segoe UI', 9)
+                     ).pack(side='left', padx=(8, 0))
+
+        proc_row = tk.Frame(opts, bg=C['bg2'])
+        proc_row.pack(anchor='w', pady=3)
+        tk.Label(proc_row, text='Processos em paralelo:', font=('Segoe UI', 9),
+                 bg=C['bg2'], fg=C['txt']).pack(side='left')
+        tk.Spinbox(proc_row, from_=1, to=os.cpu_count() or 1, width=4,
+                   textvariable=self.var_processos, font=('Segoe UI', 9),
+                   bg=C['card'], fg=C['txt'], buttonbackground=C['card'],
+                   relief='flat').pack(side='left', padx=(8, 0))
 
         # ── SEÇÃO: PROGRESSO ───────────────────────────────────────────────
         self._secao(inner, '📊  Progresso da Conversão', px=PX)
@@ -608,6 +720,14 @@ class ConversorApp:
             self.var_destino.set(d)
             self._log(f'Pasta de destino: {d}', 'info')
 
+    def _sel_poligono(self):
+        f = filedialog.askopenfilename(
+            title='Polígono do município (GeoJSON)', parent=self.root,
+            filetypes=[('GeoJSON', '*.geojson *.json'), ('Todos os arquivos', '*.*')])
+        if f:
+            self.var_poligono.set(f)
+            self._log(f'Polígono: {Path(f).name} (só as células dentro dele serão convertidas)', 'info')
+
     def _fmt_size(self, b: int) -> str:
         if b < 1024:       return f'{b} B'
         if b < 1024**2:    return f'{b/1024:.1f} KB'
@@ -693,6 +813,40 @@ class ConversorApp:
         linhas_total = 0
         unificar = self.var_unificar.get()
         gerar_resumo = self.var_resumo.get()
+        gerar_indices = self.var_indices.get()
+        gerar_r95p = gerar_indices and self.var_r95p.get()
+        gerar_spi = self.var_spi.get()
+        try:
+            opcoes = subconjunto.montar_opcoes(poligono=self.var_poligono.get().strip() or None)
+            limiares = alertas.ler_limiares(self.var_limiares.get()) if self.var_alertas.get() else None
+        except subconjunto.ErroSubconjunto as e:
+            self._finalizar(False, f'❌ {e}')
+            return
+        if self.var_esparso.get():
+            opcoes['esparso'] = True
+        agregacao = AGREGACOES.get(self.var_agregacao.get())
+        if agregacao:
+            opcoes['agregacao'] = agregacao
+            opcoes['estatistica'] = ESTATISTICAS.get(self.var_estatistica.get(), 'soma')
+        id_climatologia = self.var_climatologia.get().strip().lower()
+        if id_climatologia:
+            if not climatologia.existe(id_climatologia):
+                self._finalizar(False, f'❌ Climatologia não encontrada: {id_climatologia}')
+                return
+            opcoes['climatologia'] = id_climatologia
+            opcoes.setdefault('agregacao', 'mensal')
+            opcoes.setdefault('estatistica', 'soma')
+        try:
+            fator_espacial = int(self.var_fator_espacial.get())
+        except (tk.TclError, ValueError):
+            fator_espacial = 1
+        if fator_espacial > 1:
+            opcoes['fator_espacial'] = fator_espacial
+            opcoes['estatistica_espacial'] = ESTATISTICAS_ESPACIAIS.get(self.var_estat_espacial.get(), 'media')
+        try:
+            processos = max(1, int(self.var_processos.get()))
+        except (tk.TclError, ValueError):
+            processos = 1
         ext = EXT_MAP.get(fmt, '.csv')
 
         arquivo_unico = None
@@ -716,6 +870,23 @@ class ConversorApp:
             append = unificar and idx > 0
 
             try:
+                if self.var_otimizar.get():
+                    acesso = 'series' if gerar_spi else 'tabela'
+                    if copia_zarr.caminho_leitura(entrada, acesso) == Path(entrada):
+                        self._log('  → Criando cópia Zarr otimizada...', 'dim')
+                        copia_zarr.otimizar(entrada, 'series' if gerar_spi else 'mapas')
+
+                if limiares:
+                    # Triagem: só as linhas acima dos limiares, sem a tabela completa
+                    ap = str(Path(destino) / f'{Path(entrada).stem}_alertas{ext}')
+                    n_alertas = self._gerar_alertas(entrada, ap, fmt, opcoes, limiares, processos,
+                                                    prog_base, 100 / total)
+                    sucessos += 1
+                    linhas_total += n_alertas
+                    self._log(f'  🚨 {n_alertas:,} alertas  →  {Path(ap).name}', 'success')
+                    self._log('')
+                    continue
+
                 res = self._converter_arquivo(
                     entrada=entrada,
                     saida=saida,
@@ -724,7 +895,11 @@ class ConversorApp:
                     prog_peso=100 / total,
                     append=append,
                     write_header=(not unificar or idx == 0),
-                    calcular_stats=gerar_resumo)
+                    calcular_stats=gerar_resumo,
+                    calcular_indices=gerar_indices,
+                    calcular_r95p=gerar_r95p,
+                    processos=processos,
+                    opcoes=opcoes)
 
                 if res['linhas'] > 0:
                     sucessos += 1
@@ -746,6 +921,17 @@ class ConversorApp:
                             self._salvar_resumo(res['stats'], rp, fmt)
                             self._log(f'  📈 Resumo anual → {Path(rp).name}', 'info')
 
+                    if res.get('indices') is not None:
+                        ip = str(Path(destino) / f'{Path(entrada).stem}_indices_extremos{ext}')
+                        self._salvar_calculado(res['indices'], ip, fmt, 'índices')
+                        self._log(f'  🌧 Índices de extremos → {Path(ip).name}', 'info')
+
+                if gerar_spi and not self.cancelar:
+                    sp = str(Path(destino) / f'{Path(entrada).stem}_spi{ext}')
+                    n_spi = self._gerar_spi(entrada, sp, fmt, opcoes, processos)
+                    if n_spi:
+                        self._log(f'  🏜 SPI: {n_spi:,} linhas → {Path(sp).name}', 'info')
+
             except Exception as e:
                 erros.append(f'{nome}: {e}')
                 self._log(f'  ✗  Erro: {e}', 'error')
@@ -774,48 +960,109 @@ class ConversorApp:
     # ── CONVERTER ARQUIVO INDIVIDUAL ─────────────────────────────────────────
     def _converter_arquivo(self, entrada, saida, fmt,
                            prog_offset, prog_peso,
-                           append, write_header, calcular_stats):
+                           append, write_header, calcular_stats, processos=1,
+                           opcoes=None, calcular_indices=False, calcular_r95p=False):
         self._log('  → Abrindo dataset NetCDF...', 'dim')
         self._atualizar_progresso(0, prog_offset, f'Abrindo {Path(entrada).name}...')
 
-        ds = xr.open_dataset(entrada)
+        opcoes = opcoes or {}
+        esparso = bool(opcoes.get('esparso'))
+        agregacao = opcoes.get('agregacao')
+        ds = subconjunto.aplicar_subconjunto(copia_zarr.abrir(entrada), opcoes)
+        if agregacao:
+            ds = agregacao_temporal.preparar(ds, agregacao)
+        reducao_espacial.validar(ds, opcoes)
+        climatologia.validar(ds, opcoes)
 
         if self.cancelar:
             ds.close()
-            return {'linhas': 0, 'stats': None}
+            return {'linhas': 0, 'stats': None, 'indices': None}
 
-        dims    = list(ds.dims.keys())
-        dim0    = dims[0]
-        tam     = ds.dims[dim0]
         vars_l  = list(ds.data_vars.keys())
-        total_pts = 1
-        for d in ds.dims.values():
-            total_pts *= d
-
-        self._log(f'  → Dimensões: {dict(ds.dims)}', 'dim')
+        self._log(f'  → Dimensões: {dict(ds.sizes)}', 'dim')
         self._log(f'  → Variáveis: {vars_l}', 'dim')
 
-        chunk = max(1, tam // (200 if total_pts > 50_000_000 else 20))
-        modo  = 'grande' if total_pts > 50_000_000 else 'normal'
-        self._log(f'  → Modo: {modo}  |  Chunk: {chunk}  |  Pts: {total_pts:,}', 'dim')
-
-        var_precip = 'pr' if 'pr' in ds.data_vars else vars_l[0]
+        # Variáveis com dimensões diferentes (ex.: time_bnds ao lado de pr)
+        # vão para arquivos à parte, sem multiplicar as linhas da tabela principal
+        tabela, variaveis_tabela = ds, None
+        grupos = grupos_variaveis.agrupar(ds)
+        if len(grupos) > 1:
+            grupo = grupos_variaveis.principal(grupos)
+            tabela, variaveis_tabela = grupo['ds'], grupo['variaveis']
+            self._log(f'  → Tabela principal: {grupo["nome"]}  |  '
+                      f'{len(grupos) - 1} tabela(s) auxiliar(es)', 'dim')
+            for aux in grupos:
+                if aux is not grupo:
+                    self._salvar_tabela_auxiliar(aux, entrada, saida, fmt)
+
+        total_pts = grupos_variaveis.pontos(tabela)
+        fatores = reducao_espacial.fatores(tabela, opcoes)
+        estat_espacial = opcoes.get('estatistica_espacial', 'media')
+        if fatores:
+            self._log(f'  → Redução espacial: {fatores} ({estat_espacial})', 'dim')
+        n_chunks = planejador_fatias.contar_fatias(tabela, multiplos=fatores)
+        self._log(f'  → Fatias: {n_chunks:,} (até ~{planejador_fatias.ORCAMENTO_FATIA_MB} MB cada)'
+                  f'  |  Pts: {total_pts:,}', 'dim')
+
+        vars_tabela = list(tabela.data_vars.keys()) or vars_l
+        var_precip = 'pr' if 'pr' in tabela.data_vars else vars_tabela[0]
 
         total_linhas = 0
         df_stats     = None
         primeiro     = write_header
         chunks_data: list[pd.DataFrame] = []
 
-        n_chunks = (tam + chunk - 1) // chunk
+        # Resumo anual: soma e contagem por célula e ano (agregacao_temporal)
+        resumo = None
+        if calcular_stats and agregacao:
+            self._log('  → Resumo anual não é gerado junto com a agregação temporal', 'dim')
+        elif calcular_stats:
+            try:
+                resumo = agregacao_temporal.AcumuladorTemporal(
+                    reducao_espacial.grade_reduzida(tabela[[var_precip]], fatores),
+                    'anual', ['soma', 'contagem'])
+            except agregacao_temporal.ErroAgregacao as e:
+                self._log(f'  ⚠ Estatísticas: {e}', 'warning')
+
+        # Índices de extremos: acumulados nas mesmas fatias da conversão
+        # (o R95p, opcional, precisa de uma passada prévia só com a chuva)
+        indices, df_indices = None, None
+        if calcular_indices and agregacao:
+            self._log('  → Índices de extremos não são gerados junto com a agregação temporal', 'dim')
+        elif calcular_indices:
+            try:
+                indices = self._preparar_indices(tabela, var_precip, fatores, estat_espacial, calcular_r95p)
+            except indices_extremos.ErroIndices as e:
+                self._log(f'  ⚠ Índices de extremos: {e}', 'warning')
+
+        # CSV sem estatísticas: os processos já devolvem o texto codificado
+        saida_fatia = 'csv' if fmt == 'CSV' and resumo is None and indices is None else 'lote'
+        formato_data = escritores.formato_data_csv(tabela) if fmt == 'CSV' else None
+        if agregacao:
+            n_chunks = len(np.unique(agregacao_temporal.rotulos_periodo(
+                tabela[agregacao_temporal.dimensao_tempo(tabela)].values, agregacao)))
+            self._log(f'  → Agregação {agregacao} ({opcoes.get("estatistica", "soma")}): '
+                      f'{n_chunks:,} períodos', 'dim')
+            fatias = self._sem_fatia_lida(
+                self._iterar_agregado(tabela, entrada, opcoes, processos, variaveis_tabela, fatores))
+        elif processos > 1 and n_chunks > 1:
+            self._log(f'  → Conversão paralela: {processos} processos', 'dim')
+            fatias = self._sem_fatia_lida(conversao_paralela.iterar_fatias_paralelas(
+                entrada, opcoes or None,
+                planejador_fatias.planejar(tabela, multiplos=fatores), processos,
+                saida=saida_fatia, cabecalho=primeiro, formato_data=formato_data,
+                variaveis=variaveis_tabela))
+        else:
+            fatias = self._iterar_fatias(tabela, esparso, fatores, estat_espacial)
 
-        for ci, i in enumerate(range(0, tam, chunk)):
+        for ci, (fatia, linhas, parte, ds_fatia) in enumerate(fatias):
             if self.cancelar:
+                fatias.close()
                 ds.close()
-                return {'linhas': 0, 'stats': None}
+                return {'linhas': 0, 'stats': None, 'indices': None}
 
-            fim = min(i + chunk, tam)
-            pct_arq = (i / tam) * 100
-            pct_tot = prog_offset + prog_peso * (i / tam)
+            pct_arq = (ci / n_chunks) * 100
+            pct_tot = prog_offset + prog_peso * (ci / n_chunks)
 
             self._atualizar_progresso(
                 pct_arq, pct_tot,
@@ -828,38 +1075,57 @@ class ConversorApp:
                     f'  → Chunk {ci+1}/{n_chunks}  —  {int(pct_arq)}%  '
                     f'({total_linhas:,} linhas até agora)', tag)
 
-            subset = ds.isel({dim0: slice(i, fim)})
-            df = subset.to_dataframe().reset_index()
-            df = df.replace([np.inf, -np.inf], np.nan)
-
-            # Estatísticas anuais
-            if calcular_stats:
-                try:
-                    col_t = 'time' if 'time' in df.columns else df.columns[0]
-                    df[col_t] = pd.to_datetime(df[col_t])
-                    col_lat = next((c for c in ['latitude', 'lat'] if c in df.columns), None)
-                    col_lon = next((c for c in ['longitude', 'lon'] if c in df.columns), None)
-                    grp = [df[col_t].dt.year]
-                    if col_lat: grp.append(col_lat)
-                    if col_lon: grp.append(col_lon)
-                    cs = df.groupby(grp)[var_precip].agg(['sum', 'count'])
-                    df_stats = cs if df_stats is None else df_stats.add(cs, fill_value=0)
-                except Exception as e:
-                    self._log(f'  ⚠ Estatísticas: {e}', 'warning')
+            if isinstance(parte, bytes):
+                # Mesmo resultado do to_csv(encoding='utf-8-sig', mode=...)
+                novo = primeiro and not append
+                with open(saida, 'wb' if novo else 'ab') as f:
+                    if novo:
+                        f.write(escritores.BOM_UTF8)
+                    f.write(parte)
+                primeiro = False
+                total_linhas += linhas
+                del parte
+                continue
+
+            df = motor_tabular.para_dataframe(parte)
+            del parte
+
+            # Estatísticas anuais e índices: a mesma chuva da fatia, lida uma vez
+            # (na conversão paralela a fatia ficou no processo que a converteu)
+            if resumo is not None or indices is not None:
+                if ds_fatia is None:
+                    chuva = reducao_espacial.reduzir(
+                        tabela[[var_precip]].isel(fatia), fatores, estat_espacial).load()
+                else:
+                    chuva = ds_fatia[[var_precip]]
+                fatia_reduzida = reducao_espacial.fatia_reduzida(fatia, fatores)
+                if resumo is not None:
+                    resumo.adicionar(fatia_reduzida, resumo.reduzir(chuva))
+                if indices is not None:
+                    indices.adicionar(fatia_reduzida, chuva)
+                del chuva
+            del ds_fatia
 
             # Escrita
             if fmt == 'CSV':
                 mode = 'a' if (append or not primeiro) else 'w'
                 df.to_csv(saida, index=False, encoding='utf-8-sig',
-                          mode=mode, header=primeiro)
+                          mode=mode, header=primeiro, date_format=formato_data)
                 primeiro = False
             else:
                 chunks_data.append(df.copy())
 
             total_linhas += len(df)
-            del df, subset
+            del df
             gc.collect()
 
+        if resumo is not None:
+            df_stats = self._tabela_resumo(resumo, var_precip)
+        if indices is not None:
+            lotes = [motor_tabular.para_dataframe(motor_tabular.tabela_da_fatia(a, esparso))
+                     for a in indices.finalizar()]
+            df_indices = pd.concat(lotes, ignore_index=True) if lotes else None
+
         ds.close()
         gc.collect()
 
@@ -913,7 +1179,249 @@ class ConversorApp:
             del df_all
             gc.collect()
 
-        return {'linhas': total_linhas, 'stats': df_stats}
+        return {'linhas': total_linhas, 'stats': df_stats, 'indices': df_indices}
+
+    # ── TABELA AUXILIAR ──────────────────────────────────────────────────────
+    def _salvar_tabela_auxiliar(self, grupo: dict, entrada: str, saida: str, fmt: str):
+        """
+        Grava a tabela de um grupo auxiliar fatia por fatia (planejador_fatias).
+        No Excel as linhas passam para uma nova planilha ao atingir o limite
+        (grupo, grupo_2, ...), como o EscritorXLSX do servidor.
+        """
+        ext = Path(saida).suffix
+        caminho = str(Path(saida).parent / f'{Path(entrada).stem}_{grupo["nome"]}{ext}')
+        tabela = motor_tabular.completar_coordenadas(grupo['ds'])
+        formato_data = escritores.formato_data_csv(tabela) if fmt == 'CSV' else None
+        nome_planilha = re.sub(r'[\[\]:*?/\\]', '_', str(grupo['nome']))[:28] or 'Dados'
+        wb = Workbook(write_only=True) if fmt == 'Excel' else None
+        ws, planilhas, linha_planilha = None, 0, 0
+        partes_xml: list[pd.DataFrame] = []
+        total = 0
+
+        for fatia in planejador_fatias.planejar(tabela):
+            df = motor_tabular.para_dataframe(motor_tabular.tabela_da_fatia(tabela.isel(fatia)))
+            if fmt == 'Excel':
+                valores = df.astype(object).where(df.notna(), None)
+                for registro in valores.itertuples(index=False, name=None):
+                    if ws is None or linha_planilha >= escritores.LINHAS_POR_PLANILHA:
+                        planilhas += 1
+                        ws = wb.create_sheet(nome_planilha if planilhas == 1
+                                             else f'{nome_planilha}_{planilhas}')
+                        ws.append([str(c) for c in df.columns])
+                        linha_planilha = 0
+                    ws.append(registro)
+                    linha_planilha += 1
+            elif fmt == 'XML':
+                partes_xml.append(df)
+            else:
+                df.to_csv(caminho, index=False, encoding='utf-8-sig', mode='a' if total else 'w',
+                          header=not total, date_format=formato_data)
+            total += len(df)
+            del df
+
+        if wb is not None:
+            if ws is None:
+                wb.create_sheet(nome_planilha).append([str(c) for c in tabela.variables])
+            wb.save(caminho)
+        elif fmt == 'XML' and partes_xml:
+            self._escrever_xml(pd.concat(partes_xml, ignore_index=True), caminho)
+        extra = f' em {planilhas} planilhas' if planilhas > 1 else ''
+        self._log(f'  → Tabela {grupo["nome"]}: {total:,} linhas{extra} → {Path(caminho).name}', 'dim')
+
+    # ── RESUMO ANUAL ─────────────────────────────────────────────────────────
+    def _tabela_resumo(self, resumo, var_precip):
+        """sum/count por (ano, lat, lon), no formato esperado por _salvar_resumo"""
+        lotes = [motor_tabular.para_dataframe(motor_tabular.tabela_da_fatia(p))
+                 for p in resumo.finalizar()]
+        if not lotes:
+            return None
+        df = pd.concat(lotes, ignore_index=True)
+        df[resumo.dim] = pd.to_datetime(df[resumo.dim]).dt.year
+        df = df.rename(columns={f'{var_precip}_soma': 'sum', f'{var_precip}_contagem': 'count'})
+        indice = [resumo.dim] + [c for c in ['latitude', 'lat', 'longitude', 'lon'] if c in df.columns]
+        return df.set_index(indice)[['sum', 'count']]
+
+    # ── ÍNDICES DE EXTREMOS ──────────────────────────────────────────────────
+    def _preparar_indices(self, tabela, var_precip, fatores, estat_espacial, calcular_r95p=False):
+        """IndicesExtremos da chuva; com calcular_r95p, o percentil 95 de cada célula já estimado"""
+        precip = tabela[[var_precip]]
+        molde = reducao_espacial.grade_reduzida(precip, fatores)
+        indices_extremos.dimensao_tempo(molde)
+        if not calcular_r95p:
+            return indices_extremos.IndicesExtremos(molde)
+        self._log('  → Índices de extremos: estimando o percentil 95 de cada célula...', 'dim')
+        fatias = (
+            (reducao_espacial.fatia_reduzida(f, fatores),
+             reducao_espacial.reduzir(precip.isel(f), fatores, estat_espacial))
+            for f in planejador_fatias.planejar(precip, multiplos=fatores)
+        )
+        return indices_extremos.IndicesExtremos(molde, indices_extremos.limiares_p95(molde, fatias))
+
+    def _salvar_calculado(self, df: 'pd.DataFrame', path: str, fmt: str, nome: str):
+        try:
+            if fmt == 'CSV':
+                df.to_csv(path, index=False, encoding='utf-8-sig')
+            elif fmt == 'Excel':
+                df.to_excel(path, index=False, engine='openpyxl')
+            elif fmt == 'XML':
+                self._escrever_xml(df, path)
+        except Exception as e:
+            self._log(f'  ⚠ Erro ao salvar {nome}: {e}', 'warning')
+
+    # ── SPI ──────────────────────────────────────────────────────────────────
+    def _gerar_spi(self, entrada, caminho, fmt, opcoes, processos=1):
+        """
+        SPI por célula e mês em um arquivo à parte: fatias com a série
+        inteira de blocos de células, em paralelo quando há processos.
+        Devolve o número de linhas gravadas.
+        """
+        opcoes = {k: v for k, v in (opcoes or {}).items() if k not in ('agregacao', 'estatistica', 'climatologia')}
+        ds = subconjunto.aplicar_subconjunto(copia_zarr.abrir(entrada, 'series'), opcoes)
+        try:
+            precip = indice_spi.preparar(ds)
+            reducao_espacial.validar(precip, opcoes)
+        except subconjunto.ErroSubconjunto as e:
+            ds.close()
+            self._log(f'  ⚠ SPI: {e}', 'warning')
+            return 0
+
+        fatores = reducao_espacial.fatores(precip, opcoes)
+        dim = agregacao_temporal.dimensao_tempo(precip)
+        n_fatias = planejador_fatias.contar_series(precip, dim, multiplos=fatores)
+        fatias = planejador_fatias.planejar_series(precip, dim, multiplos=fatores)
+        self._log(f'  → SPI: {n_fatias:,} bloco(s) de células com a série inteira', 'dim')
+        releituras = planejador_fatias.releituras_series(precip, dim, multiplos=fatores)
+        if releituras > 1:
+            self._log(f'  ⚠ SPI: o arquivo tem chunks de poucos passos de tempo e cada um será lido '
+                      f'{releituras}x; marque "Otimizar leituras" para criar a cópia Zarr por séries', 'warning')
+        if processos > 1 and n_fatias > 1:
+            lotes = (lote for _, _, lote in conversao_paralela.iterar_fatias_paralelas(
+                entrada, {**opcoes, 'spi': True}, fatias, processos, saida='lote',
+                variaveis=list(precip.data_vars)))
+        else:
+            estat_espacial = opcoes.get('estatistica_espacial', 'media')
+            lotes = (motor_tabular.tabela_da_fatia(
+                        indice_spi.calcular(reducao_espacial.reduzir(precip.isel(f), fatores, estat_espacial)),
+                        bool(opcoes.get('esparso')))
+                     for f in fatias)
+
+        total, partes = 0, []
+        for lote in lotes:
+            if self.cancelar:
+                lotes.close()
+                break
+            df = motor_tabular.para_dataframe(lote)
+            if fmt == 'CSV':
+                df.to_csv(caminho, index=False, encoding='utf-8-sig',
+                          mode='a' if total else 'w', header=not total)
+            else:
+                partes.append(df)
+            total += len(df)
+        ds.close()
+        if partes:
+            self._salvar_calculado(pd.concat(partes, ignore_index=True), caminho, fmt, 'SPI')
+        return total
+
+    # ── ALERTAS ──────────────────────────────────────────────────────────────
+    def _gerar_alertas(self, entrada, caminho, fmt, opcoes, limiares, processos=1,
+                       prog_offset=0, prog_peso=100):
+        """
+        Só as células e tempos em que a chuva alcança os limiares, fatia por
+        fatia (em paralelo quando há processos), com as contagens por nível
+        no log. Devolve o número de linhas gravadas.
+        """
+        opcoes = {k: v for k, v in (opcoes or {}).items() if k not in ('agregacao', 'estatistica', 'climatologia')}
+        opcoes['alertas'] = limiares
+        ds = subconjunto.aplicar_subconjunto(copia_zarr.abrir(entrada), opcoes)
+        try:
+            precip = motor_tabular.completar_coordenadas(alertas.preparar(ds))
+            reducao_espacial.validar(precip, opcoes)
+        except Exception:
+            ds.close()
+            raise
+
+        fatores = reducao_espacial.fatores(precip, opcoes)
+        n_fatias = planejador_fatias.contar_fatias(precip, multiplos=fatores)
+        fatias = planejador_fatias.planejar(precip, multiplos=fatores)
+        contagem = alertas.contagem_para(precip, limiares)
+        self._log(f'  → Alertas ≥ {", ".join(f"{l:g}" for l in limiares)} mm: {n_fatias:,} fatia(s)', 'dim')
+        if processos > 1 and n_fatias > 1:
+            lotes = (lote for _, _, lote in conversao_paralela.iterar_fatias_paralelas(
+                entrada, opcoes, fatias, processos, saida='lote',
+                variaveis=list(precip.data_vars)))
+        else:
+            fator = alertas.fator_mm_passo(precip)
+            estat_espacial = opcoes.get('estatistica_espacial', 'media')
+            lotes = (alertas.tabela_alertas(
+                        reducao_espacial.reduzir(precip.isel(f), fatores, estat_espacial), limiares, fator)
+                     for f in fatias)
+
+        total, partes = 0, []
+        for i, lote in enumerate(lotes, 1):
+            if self.cancelar:
+                lotes.close()
+                break
+            contagem.adicionar(lote)
+            df = motor_tabular.para_dataframe(lote)
+            if fmt == 'CSV':
+                df.to_csv(caminho, index=False, encoding='utf-8-sig',
+                          mode='a' if i > 1 else 'w', header=i == 1)
+            else:
+                partes.append(df)
+            total += len(df)
+            pct = i / n_fatias * 100
+            self._atualizar_progresso(pct, prog_offset + pct * prog_peso / 100,
+                                      f'Alertas: fatia {i:,}/{n_fatias:,}')
+        ds.close()
+        if partes:
+            self._salvar_calculado(pd.concat(partes, ignore_index=True), caminho, fmt, 'alertas')
+        for nivel in contagem.resumo()['niveis']:
+            self._log(f'  → ≥ {nivel["limiar_mm"]:g} mm: {nivel["ocorrencias"]:,} ocorrências '
+                      f'em {nivel["celulas"]:,} células', 'info')
+        return total
+
+    # ── AGREGAÇÃO TEMPORAL ───────────────────────────────────────────────────
+    def _iterar_agregado(self, ds, entrada, opcoes, processos, variaveis, fatores=None):
+        """(None, linhas, lote) de cada período agregado (agregacao_temporal)"""
+        agregacao, estatistica = opcoes['agregacao'], opcoes.get('estatistica', 'soma')
+        fatores = fatores or {}
+        estat_espacial = opcoes.get('estatistica_espacial', 'media')
+        fatias = planejador_fatias.planejar(ds, multiplos=fatores)
+        if processos > 1 and planejador_fatias.contar_fatias(ds, multiplos=fatores) > 1:
+            self._log(f'  → Agregação paralela: {processos} processos', 'dim')
+            parciais = ((f, p) for f, _, p in conversao_paralela.iterar_fatias_paralelas(
+                entrada, opcoes, fatias, processos, saida='parcial',
+                variaveis=variaveis or list(ds.data_vars)))
+        else:
+            parciais = ((f, agregacao_temporal.reduzir_fatia(
+                            reducao_espacial.reduzir(ds.isel(f), fatores, estat_espacial),
+                            agregacao, estatistica))
+                        for f in fatias)
+        parciais = ((reducao_espacial.fatia_reduzida(f, fatores), p) for f, p in parciais)
+        for lote in agregacao_temporal.iterar_agregado(
+                reducao_espacial.grade_reduzida(ds, fatores), parciais, agregacao, estatistica,
+                bool(opcoes.get('esparso')),
+                transformar=(lambda ds_periodo: climatologia.anomalias(ds_periodo, opcoes['climatologia']))
+                if opcoes.get('climatologia') else None):
+            yield None, motor_tabular.linhas_do_lote(lote), lote
+
+    # ── FATIAS (SERIAL) ──────────────────────────────────────────────────────
+    def _iterar_fatias(self, ds, esparso=False, fatores=None, estat_espacial='media'):
+        """(fatia, linhas, lote, fatia lida e reduzida), reaproveitada pelo resumo e pelos índices"""
+        ds = motor_tabular.completar_coordenadas(ds)
+        for fatia in planejador_fatias.planejar(ds, multiplos=fatores):
+            ds_fatia = reducao_espacial.reduzir(ds.isel(fatia), fatores or {}, estat_espacial).load()
+            lote = motor_tabular.tabela_da_fatia(ds_fatia, esparso)
+            yield fatia, motor_tabular.linhas_do_lote(lote), lote, ds_fatia
+
+    @staticmethod
+    def _sem_fatia_lida(fatias):
+        """(fatia, linhas, lote, None) para as fatias convertidas em outro processo"""
+        try:
+            for fatia, linhas, lote in fatias:
+                yield fatia, linhas, lote, None
+        finally:
+            fatias.close()
 
     # ── ESCREVER XML ─────────────────────────────────────────────────────────
     def _escrever_xml(self, df: 'pd.DataFrame', path: str, append: bool = False):
@@ -1024,4 +1532,5 @@ def main():
 
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support()  # processos da conversão paralela no .exe
     main()
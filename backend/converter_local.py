@@ -3,7 +3,7 @@ Conversor NetCDF Local - Defesa Civil Araruna
 Script para processar arquivos NetCDF grandes diretamente no computador.
 
 Uso:
-    python converter_local.py arquivo.nc [--formato xlsx|csv] [--output pasta_saida]
+    python converter_local.py arquivo.nc [--formato xlsx|csv|zarr] [--output pasta_saida]
 
 Exemplos:
     python converter_local.py dados.nc
@@ -24,17 +24,38 @@ from openpyxl import Workbook
 from openpyxl.drawing.image import Image as XLImage
 from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
 
+import motor_tabular
+import grupos_variaveis
+import subconjunto
+import planejador_fatias
+import agregacao_temporal
+import alertas
+import climatologia
+import reducao_espacial
+import indices_extremos
+import indice_spi
+import conversao_paralela
+import copia_zarr
+import otimizar_netcdf
+
 
 # Caminho para a logo da prefeitura
 LOGO_PATH = Path(__file__).parent.parent / "public" / "images" / "logo-prefeitura.png"
 
 
-def processar_netcdf(caminho_arquivo: str) -> tuple[xr.Dataset, dict]:
-    """Abrir e processar arquivo NetCDF"""
+def processar_netcdf(caminho_arquivo: str, poligono: str | None = None,
+                     acesso: str = "tabela") -> tuple[xr.Dataset, dict]:
+    """
+    Abrir e processar arquivo NetCDF (poligono: GeoJSON para recortar a grade).
+    Usa a cópia Zarr ao lado do arquivo (--otimizar) quando ela serve ao acesso.
+    """
     print(f"📂 Abrindo arquivo: {caminho_arquivo}")
     print("   Isso pode demorar para arquivos grandes...")
     
-    ds = xr.open_dataset(caminho_arquivo)
+    ds = copia_zarr.abrir(caminho_arquivo, acesso)
+    if poligono:
+        print(f"   Recortando pelo polígono: {poligono}")
+        ds = subconjunto.aplicar_subconjunto(ds, subconjunto.montar_opcoes(poligono=poligono))
     
     metadados = {
         "variaveis": list(ds.data_vars.keys()),
@@ -49,12 +70,55 @@ def processar_netcdf(caminho_arquivo: str) -> tuple[xr.Dataset, dict]:
     return ds, metadados
 
 
-def dataset_para_dataframe(ds: xr.Dataset) -> pd.DataFrame:
-    """Converter Dataset xarray para DataFrame pandas"""
+def dataset_para_dataframe(ds: xr.Dataset, esparso: bool = False, fatores: dict | None = None,
+                           estatistica_espacial: str = "media") -> pd.DataFrame:
+    """
+    Converter Dataset xarray para DataFrame pandas (esparso: sem linhas vazias).
+    Com `fatores` a resolução é reduzida fatia por fatia antes da tabela.
+    """
     print("🔄 Convertendo para tabela...")
     
-    df = ds.to_dataframe().reset_index()
-    df = df.replace([np.inf, -np.inf], np.nan)
+    fatores = {d: k for d, k in (fatores or {}).items() if d in ds.dims}
+    if fatores:
+        print(f"   Redução espacial: {fatores} ({estatistica_espacial})")
+        lotes = [
+            motor_tabular.tabela_da_fatia(
+                reducao_espacial.reduzir(ds.isel(fatia), fatores, estatistica_espacial), esparso)
+            for fatia in planejador_fatias.planejar(ds, multiplos=fatores)
+        ]
+        df = pd.concat([motor_tabular.para_dataframe(lote) for lote in lotes], ignore_index=True)
+    else:
+        df = motor_tabular.para_dataframe(motor_tabular.tabela_da_fatia(ds, esparso))
+    
+    print(f"   Linhas: {len(df):,}")
+    print(f"   Colunas: {len(df.columns)}")
+    
+    return df
+
+
+def agregar_para_dataframe(ds: xr.Dataset, agregacao: str, estatistica: str,
+                           esparso: bool = False, fatores: dict | None = None,
+                           estatistica_espacial: str = "media",
+                           id_climatologia: str | None = None) -> pd.DataFrame:
+    """
+    Agregar no tempo fatia por fatia (só a tabela agregada vai para a memória).
+    Com id_climatologia cada mês ganha a normal, a anomalia e o % da normal.
+    """
+    print(f"🔄 Agregando ({agregacao}, {estatistica})...")
+    
+    fatores = fatores or {}
+    parciais = (
+        (reducao_espacial.fatia_reduzida(fatia, fatores),
+         agregacao_temporal.reduzir_fatia(
+             reducao_espacial.reduzir(ds.isel(fatia), fatores, estatistica_espacial),
+             agregacao, estatistica))
+        for fatia in planejador_fatias.planejar(ds, multiplos=fatores)
+    )
+    lotes = agregacao_temporal.iterar_agregado(
+        reducao_espacial.grade_reduzida(ds, fatores), parciais, agregacao, estatistica, esparso,
+        transformar=(lambda ds_periodo: climatologia.anomalias(ds_periodo, id_climatologia))
+        if id_climatologia else None)
+    df = pd.concat([motor_tabular.para_dataframe(lote) for lote in lotes], ignore_index=True)
     
     print(f"   Linhas: {len(df):,}")
     print(f"   Colunas: {len(df.columns)}")
@@ -62,6 +126,90 @@ def dataset_para_dataframe(ds: xr.Dataset) -> pd.DataFrame:
     return df
 
 
+def indices_para_dataframe(ds: xr.Dataset, esparso: bool = False, fatores: dict | None = None,
+                           estatistica_espacial: str = "media", r95p: bool = False,
+                           id_climatologia: str | None = None) -> pd.DataFrame:
+    """
+    Índices de extremos de chuva por célula e ano, fatia por fatia. O R95p
+    usa o percentil 95 da climatologia (mesma leitura) ou, com r95p, uma
+    passada extra para estimá-lo.
+    """
+    print("🔄 Calculando índices de extremos (Rx1day, Rx5day, R20mm, CDD, CWD"
+          f"{', R95p' if r95p or id_climatologia else ''})...")
+    
+    fatores = fatores or {}
+    grade = reducao_espacial.grade_reduzida(ds, fatores)
+    limiar_p95 = climatologia.limiar_indices(grade, id_climatologia) if id_climatologia else None
+    
+    def fatias():
+        for fatia in planejador_fatias.planejar(ds, multiplos=fatores):
+            yield (reducao_espacial.fatia_reduzida(fatia, fatores),
+                   reducao_espacial.reduzir(ds.isel(fatia), fatores, estatistica_espacial))
+    
+    lotes = indices_extremos.iterar_indices(grade, fatias, esparso, limiar_p95=limiar_p95, estimar_p95=r95p)
+    df = pd.concat([motor_tabular.para_dataframe(lote) for lote in lotes], ignore_index=True)
+    
+    print(f"   Linhas: {len(df):,}")
+    
+    return df
+
+
+def spi_para_dataframe(ds: xr.Dataset, caminho_nc: str, opcoes: dict, processos: int = 1) -> pd.DataFrame:
+    """SPI-1/3/6/12 por célula e mês, um bloco de células (série inteira) por fatia"""
+    print("🔄 Calculando SPI-1/3/6/12...")
+    
+    fatores = reducao_espacial.fatores(ds, opcoes)
+    dim = agregacao_temporal.dimensao_tempo(ds)
+    n_fatias = planejador_fatias.contar_series(ds, dim, multiplos=fatores)
+    fatias = planejador_fatias.planejar_series(ds, dim, multiplos=fatores)
+    print(f"   Blocos de células: {n_fatias:,}  |  Processos: {min(processos, n_fatias)}")
+    releituras = planejador_fatias.releituras_series(ds, dim, multiplos=fatores)
+    if releituras > 1:
+        print(f"   ⚠ Chunks do arquivo com poucos passos de tempo: cada chunk é lido {releituras}x. "
+              f"Crie antes a cópia com --otimizar --layout series")
+    if processos > 1 and n_fatias > 1:
+        lotes = (lote for _, _, lote in conversao_paralela.iterar_fatias_paralelas(
+            caminho_nc, {**opcoes, "spi": True}, fatias, processos, saida="lote",
+            variaveis=list(ds.data_vars)))
+    else:
+        estatistica_espacial = opcoes.get("estatistica_espacial", "media")
+        lotes = (
+            motor_tabular.tabela_da_fatia(
+                indice_spi.calcular(reducao_espacial.reduzir(ds.isel(fatia), fatores, estatistica_espacial)),
+                bool(opcoes.get("esparso")))
+            for fatia in fatias
+        )
+    df = pd.concat([motor_tabular.para_dataframe(lote) for lote in lotes], ignore_index=True)
+    
+    print(f"   Linhas: {len(df):,}")
+    
+    return df
+
+
+def alertas_para_dataframe(ds: xr.Dataset, limiares: list, fatores: dict | None = None,
+                           estatistica_espacial: str = "media") -> pd.DataFrame:
+    """Só as células e tempos com chuva acima dos limiares, fatia por fatia"""
+    print(f"🔄 Varrendo alertas de chuva (≥ {', '.join(f'{l:g}' for l in limiares)} mm)...")
+    
+    fatores = fatores or {}
+    ds = motor_tabular.completar_coordenadas(ds)
+    fator = alertas.fator_mm_passo(ds)
+    contagem = alertas.contagem_para(ds, limiares)
+    partes = []
+    for fatia in planejador_fatias.planejar(ds, multiplos=fatores):
+        lote = alertas.tabela_alertas(
+            reducao_espacial.reduzir(ds.isel(fatia), fatores, estatistica_espacial), limiares, fator)
+        contagem.adicionar(lote)
+        partes.append(motor_tabular.para_dataframe(lote))
+    df = pd.concat(partes, ignore_index=True)
+    
+    for nivel in contagem.resumo()["niveis"]:
+        print(f"   ≥ {nivel['limiar_mm']:g} mm: {nivel['ocorrencias']:,} ocorrências em {nivel['celulas']:,} células")
+    print(f"   Linhas: {len(df):,}")
+    
+    return df
+
+
 def criar_excel_com_logo(df: pd.DataFrame, nome_arquivo: str, caminho_saida: str) -> str:
     """Criar arquivo Excel com logo da prefeitura"""
     print("📊 Criando arquivo Excel...")
@@ -172,14 +320,75 @@ Exemplos:
     python converter_local.py dados.nc
     python converter_local.py dados.nc --formato csv
     python converter_local.py dados.nc --output C:\\Meus_Dados
+    python converter_local.py dados.nc --poligono araruna.geojson --esparso
+    python converter_local.py dados.nc --agregacao mensal --estatistica soma
+    python converter_local.py dados.nc --resolucao 0.25
+    python converter_local.py dados.nc --indices --formato csv
+    python converter_local.py dados.nc --indices --climatologia <id> --formato csv
+    python converter_local.py dados.nc --spi --formato csv --processos 8
+    python converter_local.py dados.nc --climatologia <id> --formato csv
+    python converter_local.py previsao.nc --alertas 30,50,80 --formato csv
+    python converter_local.py dados.nc --otimizar --layout series
+    python converter_local.py dados.nc --otimizar nc --output C:\\Otimizados
+    python converter_local.py dados.nc --formato zarr --layout mapas --chunks time=24
         """
     )
     
     parser.add_argument('arquivo', help='Caminho do arquivo NetCDF (.nc)')
-    parser.add_argument('--formato', choices=['xlsx', 'csv'], default='xlsx',
-                       help='Formato de saída (padrão: xlsx)')
+    parser.add_argument('--formato', choices=['xlsx', 'csv', 'zarr'], default='xlsx',
+                       help='Formato de saída (padrão: xlsx); zarr grava só a seleção, sem tabela')
     parser.add_argument('--output', '-o', default=None,
                        help='Pasta de saída (padrão: mesma pasta do arquivo)')
+    parser.add_argument('--tabela-unica', action='store_true',
+                       help='Uma só tabela com todas as variáveis (padrão: uma tabela '
+                            'por grupo de dimensões, ex.: time_bnds em arquivo separado)')
+    parser.add_argument('--poligono', default=None, metavar='ARQUIVO.geojson',
+                       help='Converter só as células dentro do polígono (ex.: limite do município); '
+                            'a máscara da grade fica em cache para os próximos arquivos')
+    parser.add_argument('--esparso', action='store_true',
+                       help='Omitir as linhas em que todas as variáveis estão sem dados '
+                            '(NaN/_FillValue, ex.: oceano)')
+    parser.add_argument('--agregacao', choices=['diario', 'mensal', 'anual'], default=None,
+                       help='Agregar no tempo durante a conversão: diario (de dados horários), '
+                            'mensal (de diários) ou anual (de mensais)')
+    parser.add_argument('--estatistica', choices=['soma', 'media', 'maximo'], default='soma',
+                       help='Estatística da agregação (padrão: soma; a soma de taxas sai em mm)')
+    parser.add_argument('--indices', action='store_true',
+                       help='Gerar os índices de extremos de chuva por célula e ano (Rx1day, Rx5day, '
+                            'R20mm, CDD, CWD) em vez da série diária')
+    parser.add_argument('--r95p', action='store_true',
+                       help='Com --indices: incluir o R95p estimando o percentil 95 de cada célula '
+                            '(lê a chuva duas vezes; com --climatologia o percentil vem dela)')
+    parser.add_argument('--spi', action='store_true',
+                       help='Gerar o SPI-1/3/6/12 (índice de seca) por célula e mês em vez da série')
+    parser.add_argument('--climatologia', default=None, metavar='ID',
+                       help='Totais mensais com normal, anomalia, %% da normal e percentil da '
+                            'climatologia (criada com python climatologia.py); com --indices, '
+                            'o R95p usa o percentil 95 diário dela')
+    parser.add_argument('--alertas', nargs='?', const='', default=None, metavar='MM,MM,...',
+                       help='Só as células e tempos com chuva acima dos limiares em mm no passo '
+                            '(padrão: 30,50,80), com as contagens por nível')
+    parser.add_argument('--processos', type=int, default=os.cpu_count() or 1, metavar='N',
+                       help='Processos em paralelo para o SPI (padrão: todos os núcleos)')
+    parser.add_argument('--fator-espacial', type=int, default=1, metavar='N',
+                       help='Reduzir a resolução juntando blocos de N x N células')
+    parser.add_argument('--resolucao', type=float, default=None, metavar='GRAUS',
+                       help='Resolução de saída em graus (ex.: 0.25); alternativa a --fator-espacial')
+    parser.add_argument('--estatistica-espacial', choices=['media', 'soma', 'maximo'], default='media',
+                       help='Estatística dos blocos da redução espacial (padrão: media)')
+    parser.add_argument('--otimizar', nargs='?', const='zarr', default=None, choices=['zarr', 'nc'],
+                       help='Otimizar as leituras e sair: zarr (padrão) cria a cópia arquivo.zarr, '
+                            'usada pelas próximas conversões quando o layout favorece; nc regrava '
+                            'em arquivo_otimizado.nc (NetCDF4 zlib/shuffle) e mede a aceleração')
+    parser.add_argument('--layout', choices=list(copia_zarr.PADROES), default=None,
+                       help='Chunks: series (série inteira por bloco de células, para pluviômetros '
+                            'e SPI; padrão no zarr) ou mapas (grade inteira, poucos passos de '
+                            'tempo; padrão no nc)')
+    parser.add_argument('--chunks', default=None, metavar='DIM=N,...',
+                       help='Chunks por dimensão (ex.: time=365,lat=30,lon=30)')
+    parser.add_argument('--nivel', type=int, default=None, choices=range(1, 10), metavar='1-9',
+                       help=f'Nível de compressão (padrão: {copia_zarr.NIVEL_PADRAO} no zarr, '
+                            f'{otimizar_netcdf.NIVEL_PADRAO} no nc)')
     
     args = parser.parse_args()
     
@@ -207,22 +416,130 @@ Exemplos:
     print("=" * 60)
     print()
     
+    if args.otimizar == 'nc':
+        try:
+            relatorio = otimizar_netcdf.otimizar(
+                args.arquivo, otimizar_netcdf.caminho_otimizado(args.arquivo, args.output),
+                args.layout or otimizar_netcdf.LAYOUT_PADRAO, copia_zarr.ler_chunks(args.chunks),
+                args.nivel or otimizar_netcdf.NIVEL_PADRAO,
+            )
+        except Exception as e:
+            print(f"❌ Erro ao otimizar: {e}")
+            sys.exit(1)
+        print(f"✅ Arquivo otimizado: {relatorio['destino']} ({relatorio['tamanho_otimizado_mb']} MB, "
+              f"original {relatorio['tamanho_original_mb']} MB, chunks {relatorio['chunks']})")
+        for acesso, medida in relatorio.get('benchmark', {}).items():
+            print(f"   Leitura {acesso}: {medida['original_s']:.3f} s → {medida['otimizado_s']:.3f} s "
+                  f"(aceleração {medida['aceleracao']}x)")
+        return
+    
+    if args.otimizar:
+        try:
+            meta = copia_zarr.otimizar(args.arquivo, args.layout or 'series', copia_zarr.ler_chunks(args.chunks),
+                                       args.nivel or copia_zarr.NIVEL_PADRAO)
+        except Exception as e:
+            print(f"❌ Erro ao otimizar: {e}")
+            sys.exit(1)
+        print(f"✅ Cópia otimizada: {copia_zarr.caminho_copia(args.arquivo)} "
+              f"({meta['tamanho_bytes'] / (1024 * 1024):.1f} MB, chunks {meta['chunks']})")
+        return
+    
+    if args.climatologia:
+        if not climatologia.existe(args.climatologia):
+            print(f"❌ Erro: Climatologia não encontrada: {args.climatologia}")
+            sys.exit(1)
+        if not args.indices:
+            args.agregacao = args.agregacao or 'mensal'
+    
     try:
         # Processar
-        ds, metadados = processar_netcdf(args.arquivo)
-        df = dataset_para_dataframe(ds)
-        ds.close()
+        ds, metadados = processar_netcdf(args.arquivo, args.poligono, "series" if args.spi else "tabela")
+        modos = {"indices": args.indices, "r95p": args.r95p, "agregacao": args.agregacao, "spi": args.spi,
+                 "climatologia": args.climatologia,
+                 "alertas": alertas.ler_limiares(args.alertas) if args.alertas is not None else None}
+        indices_extremos.validar(modos)
+        indice_spi.validar(modos)
+        alertas.validar(modos)
+        if args.agregacao:
+            ds = agregacao_temporal.preparar(ds, args.agregacao)
+        if args.indices:
+            ds = indices_extremos.preparar(ds)
+            nome_arquivo = nome_arquivo.replace('.nc', '_indices_extremos.nc')
+        if args.spi:
+            ds = indice_spi.preparar(ds)
+            nome_arquivo = nome_arquivo.replace('.nc', '_spi.nc')
+        if modos["alertas"]:
+            ds = alertas.preparar(ds)
+            nome_arquivo = nome_arquivo.replace('.nc', '_alertas.nc')
+        opcoes_reducao = {"estatistica_espacial": args.estatistica_espacial}
+        if args.resolucao:
+            opcoes_reducao["resolucao"] = args.resolucao
+        elif args.fator_espacial > 1:
+            opcoes_reducao["fator_espacial"] = args.fator_espacial
+        if args.poligono:
+            opcoes_reducao["poligono"] = args.poligono
+        reducao_espacial.validar(ds, opcoes_reducao)
+        climatologia.validar(ds, {**opcoes_reducao, **modos, "estatistica": args.estatistica,
+                                  "climatologia": args.climatologia})
+        fatores = reducao_espacial.fatores(ds, opcoes_reducao)
+        
+        if args.formato == 'zarr':
+            opcoes_zarr = {**{k: v for k, v in opcoes_reducao.items() if k != "estatistica_espacial"},
+                           **modos, "esparso": args.esparso, "tabela_unica": args.tabela_unica,
+                           "layout": args.layout or 'series', "chunks": copia_zarr.ler_chunks(args.chunks),
+                           "nivel": args.nivel or copia_zarr.NIVEL_PADRAO}
+            # Nome diferente da cópia otimizada (arquivo.zarr), que fica ao lado do .nc
+            destino = copia_zarr.exportar(ds, Path(caminho_saida) / f"{Path(nome_arquivo).stem}_selecao.zarr",
+                                          opcoes_zarr)
+            ds.close()
+            print()
+            print("=" * 60)
+            print("✅ Conversão concluída!")
+            print(f"📁 Zarr salvo em: {destino}")
+            print("=" * 60)
+            return
         
-        # Converter
-        if args.formato == 'xlsx':
-            arquivo_saida = criar_excel_com_logo(df, nome_arquivo, caminho_saida)
+        # Variáveis com dimensões diferentes viram arquivos separados
+        grupos = [] if args.tabela_unica else grupos_variaveis.agrupar(ds)
+        if len(grupos) > 1:
+            principal = grupos_variaveis.principal(grupos)
+            tabelas = [
+                (g["ds"], nome_arquivo if g is principal else nome_arquivo.replace('.nc', f'_{g["nome"]}.nc'))
+                for g in grupos
+            ]
+            print(f"   Tabelas: {', '.join(g['nome'] for g in grupos)}")
         else:
-            arquivo_saida = criar_csv(df, nome_arquivo, caminho_saida)
+            tabelas = [(ds, nome_arquivo)]
+        
+        arquivos_saida = []
+        for tabela, nome_tabela in tabelas:
+            if args.spi:
+                opcoes_spi = {**opcoes_reducao, "esparso": args.esparso}
+                df = spi_para_dataframe(tabela, args.arquivo, opcoes_spi, args.processos)
+            elif modos["alertas"]:
+                df = alertas_para_dataframe(tabela, modos["alertas"], fatores, args.estatistica_espacial)
+            elif args.indices:
+                df = indices_para_dataframe(tabela, args.esparso, fatores, args.estatistica_espacial,
+                                            args.r95p, args.climatologia)
+            elif args.agregacao:
+                df = agregar_para_dataframe(tabela, args.agregacao, args.estatistica, args.esparso,
+                                            fatores, args.estatistica_espacial, args.climatologia)
+            else:
+                df = dataset_para_dataframe(tabela, args.esparso, fatores, args.estatistica_espacial)
+            
+            # Converter
+            if args.formato == 'xlsx':
+                arquivos_saida.append(criar_excel_com_logo(df, nome_tabela, caminho_saida))
+            else:
+                arquivos_saida.append(criar_csv(df, nome_tabela, caminho_saida))
+            del df
+        ds.close()
         
         print()
         print("=" * 60)
         print(f"✅ Conversão concluída!")
-        print(f"📁 Arquivo salvo em: {arquivo_saida}")
+        for arquivo_saida in arquivos_saida:
+            print(f"📁 Arquivo salvo em: {arquivo_saida}")
         print("=" * 60)
         
     except Exception as e:
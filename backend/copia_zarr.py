@@ -0,0 +1,351 @@
+"""
+Defesa Civil Araruna - Cópia Zarr para leituras repetidas
+Reescreve o NetCDF em um store Zarr com compressão Blosc e chunks
+escolhidos para o acesso dominante: "series" (série inteira de blocos
+de células em cada chunk, para pluviômetros e SPI) ou "mapas" (poucos
+passos de tempo com a grade inteira). A escrita é feita fatia por fatia
+(planejador_fatias), alinhada aos chunks, com memória limitada.
+A cópia fica ao lado do .nc (arquivo.zarr) e é usada no lugar dele nas
+leituras seguintes quando o layout serve ao acesso e o .nc não mudou.
+"""
+
+import json
+import math
+import os
+import shutil
+import uuid
+import warnings
+from datetime import datetime
+from pathlib import Path
+
+import xarray as xr
+
+import agregacao_temporal
+import planejador_fatias
+import subconjunto
+
+try:
+    import zarr
+    from numcodecs import Blosc
+    ZARR_OK = True
+except ImportError:
+    ZARR_OK = False
+
+
+PADROES = ("series", "mapas")
+
+# Tamanho alvo de um chunk (descomprimido)
+CHUNK_ALVO_MB = 4
+
+NIVEL_PADRAO = 5
+
+# Acima disso, ler a série de uma célula da cópia custa mais que do .nc
+LEITURA_SERIE_MAXIMA_MB = 64
+
+ARQUIVO_META = "copia.json"
+
+# Chaves de codificação CF mantidas do arquivo original
+_CHAVES_CF = ("units", "calendar", "dtype", "_FillValue", "scale_factor", "add_offset")
+
+
+class ErroZarr(subconjunto.ErroSubconjunto):
+    """Chunks ou layout inválidos para a cópia Zarr (vira HTTP 400 no servidor)"""
+
+
+def _exigir_zarr():
+    if not ZARR_OK:
+        raise RuntimeError("zarr não instalado. Execute: pip install zarr")
+
+
+def ler_chunks(texto: str | None) -> dict:
+    """Chunks a partir de "time=365,lat=30,lon=30" (0 ou -1 = dimensão inteira)"""
+    chunks = {}
+    for parte in (texto or "").replace(";", ",").split(","):
+        if not parte.strip():
+            continue
+        dim, _, valor = parte.partition("=")
+        try:
+            chunks[dim.strip()] = int(valor)
+        except ValueError:
+            raise ErroZarr(f"Chunk inválido: {parte.strip()!r} (use dim=tamanho, ex.: time=365,lat=30)")
+    return chunks
+
+
+def _dimensao_tempo(ds) -> str | None:
+    try:
+        return agregacao_temporal.dimensao_tempo(ds)
+    except agregacao_temporal.ErroAgregacao:
+        return None
+
+
+def _principal(ds) -> str | None:
+    """Maior variável de dados (define o layout e o planejamento das fatias)"""
+    if not ds.data_vars:
+        return None
+    return max(ds.data_vars, key=lambda nome: ds[nome].size)
+
+
+def _bloco(dims: list, tamanhos: dict, elementos: int) -> dict:
+    """Bloco quase quadrado com no máximo `elementos` (as primeiras dimensões ficam com a sobra)"""
+    bloco = {}
+    restantes = max(1, elementos)
+    for i, dim in enumerate(reversed(dims)):
+        lado = max(1, int(restantes ** (1 / (len(dims) - i))))
+        bloco[dim] = min(tamanhos[dim], lado)
+        restantes = max(1, restantes // bloco[dim])
+    return bloco
+
+
+def chunks_para(ds, padrao: str = "series", chunks: dict | None = None) -> dict:
+    """
+    Tamanho do chunk em cada dimensão. "series": a série inteira no tempo
+    e um bloco de células; "mapas": a grade inteira e poucos passos de
+    tempo (~CHUNK_ALVO_MB por chunk). `chunks` sobrepõe dimensões avulsas.
+    """
+    if padrao not in PADROES:
+        raise ErroZarr(f"Layout desconhecido: {padrao} (use {' ou '.join(PADROES)})")
+    tamanhos = {str(d): int(n) for d, n in ds.sizes.items()}
+    resultado = dict(tamanhos)
+
+    principal = _principal(ds)
+    if principal is not None:
+        var = ds[principal]
+        dims = [str(d) for d in var.dims]
+        elementos = CHUNK_ALVO_MB * 1024 * 1024 // var.dtype.itemsize
+        dim_tempo = _dimensao_tempo(ds)
+        if dim_tempo in dims:
+            demais = [d for d in dims if d != dim_tempo]
+            if padrao == "series":
+                resultado.update(_bloco(demais, tamanhos, elementos // max(1, tamanhos[dim_tempo])))
+            else:
+                celulas = math.prod(tamanhos[d] for d in demais)
+                resultado[dim_tempo] = min(tamanhos[dim_tempo], max(1, elementos // max(1, celulas)))
+        else:
+            resultado.update(_bloco(dims, tamanhos, elementos))
+
+    for dim, tamanho in (chunks or {}).items():
+        if dim not in tamanhos:
+            raise ErroZarr(f"Dimensão {dim} não existe no arquivo (dimensões: {', '.join(tamanhos)})")
+        resultado[dim] = tamanhos[dim] if tamanho <= 0 else min(tamanho, tamanhos[dim])
+    return {d: max(1, n) for d, n in resultado.items()}
+
+
+def _codificacao(ds, chunks: dict, nivel: int) -> dict:
+    """Codificação de cada variável: a do arquivo original + chunks e Blosc"""
+    compressor = Blosc(cname="zstd", clevel=nivel, shuffle=Blosc.SHUFFLE)
+    codificacao = {}
+    for nome, var in ds.variables.items():
+        enc = {k: var.encoding[k] for k in _CHAVES_CF if k in var.encoding}
+        if var.dtype.kind == "M" and "units" not in enc:
+            # Unidade fixa: cada fatia é codificada separadamente
+            enc.update(units="seconds since 1970-01-01", dtype="float64")
+        if var.ndim:
+            enc["chunks"] = tuple(chunks[str(d)] for d in var.dims)
+            enc["compressors"] = (compressor,)
+        codificacao[nome] = enc
+    return codificacao
+
+
+def fatias_alinhadas(ds, chunks: dict, orcamento_mb: float | None = None) -> list:
+    """Fatias alinhadas aos chunks da variável principal (cada chunk é gravado uma vez)"""
+    principal = _principal(ds)
+    if principal is None:
+        return [{}]
+    base = ds[[principal]]
+    multiplos = {d: chunks[str(d)] for d in base.dims}
+    dim_tempo = _dimensao_tempo(ds)
+    if dim_tempo in base.dims and len(base.dims) > 1 and chunks[dim_tempo] >= ds.sizes[dim_tempo]:
+        multiplos.pop(dim_tempo)
+        return list(planejador_fatias.planejar_series(base, dim_tempo, orcamento_mb, multiplos))
+    return list(planejador_fatias.planejar(base, orcamento_mb, multiplos))
+
+
+def escrever(ds, destino, chunks: dict, nivel: int = NIVEL_PADRAO, orcamento_mb: float | None = None):
+    """
+    Grava `ds` em um store Zarr (formato 2, metadados consolidados) fatia
+    por fatia. O store é criado vazio nas dimensões cortadas e depois
+    preenchido por regiões, sem carregar o dataset inteiro.
+    """
+    _exigir_zarr()
+    destino = str(destino)
+    fatias = fatias_alinhadas(ds, chunks, orcamento_mb)
+    cortadas = {d for fatia in fatias for d in fatia}
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")  # avisos do zarr sobre o formato 2
+        modelo = ds.isel({d: slice(0, 0) for d in cortadas})
+        modelo.to_zarr(destino, mode="w", encoding=_codificacao(ds, chunks, nivel),
+                       zarr_format=2, consolidated=False)
+        grupo = zarr.open_group(destino, mode="r+", zarr_format=2)
+        for _, arr in grupo.arrays():
+            dims = arr.attrs.get("_ARRAY_DIMENSIONS", [])
+            if cortadas & set(dims):
+                arr.resize(tuple(int(ds.sizes[d]) for d in dims))
+
+        for i, fatia in enumerate(fatias, 1):
+            print(f"[ZARR] Fatia {i}/{len(fatias)}: {planejador_fatias.descrever(fatia)}")
+            parte = ds.isel(fatia)
+            parte = parte.drop_vars([n for n, v in parte.variables.items() if not cortadas & set(v.dims)])
+            parte = parte.drop_indexes(list(parte.indexes))
+            parte.to_zarr(destino, region=fatia, zarr_format=2, consolidated=False)
+            del parte
+
+        zarr.consolidate_metadata(destino, zarr_format=2)
+
+
+def validar_exportacao(opcoes: dict | None):
+    """Zarr guarda o dataset selecionado, não uma tabela: sem os modos tabulares"""
+    tabulares = ("agregacao", "indices", "spi", "alertas", "climatologia",
+                 "fator_espacial", "resolucao", "esparso", "tabela_unica")
+    pedidos = [modo for modo in tabulares if (opcoes or {}).get(modo)]
+    if pedidos:
+        raise ErroZarr(f"A saída Zarr aceita só a seleção (variáveis, área, período, polígono); "
+                       f"remova: {', '.join(pedidos)}")
+
+
+def exportar(ds, destino, opcoes: dict | None = None) -> Path:
+    """
+    Grava o dataset (já selecionado) como store Zarr em `destino`, com o
+    layout de opcoes["layout"] e os chunks de opcoes["chunks"].
+    """
+    opcoes = opcoes or {}
+    validar_exportacao(opcoes)
+    destino = Path(destino)
+    temporario = destino.with_name(f"_criando_{uuid.uuid4().hex}_{destino.name}")
+    try:
+        tamanhos = chunks_para(ds, opcoes.get("layout", "series"), opcoes.get("chunks"))
+        escrever(ds, temporario, tamanhos, int(opcoes.get("nivel", NIVEL_PADRAO)))
+        if destino.exists():
+            shutil.rmtree(destino)
+        os.replace(temporario, destino)
+    except BaseException:
+        shutil.rmtree(temporario, ignore_errors=True)
+        raise
+    print(f"[ZARR] Gravado: {destino.name} ({tamanho_pasta(destino) / (1024 * 1024):.1f} MB) | chunks {tamanhos}")
+    return destino
+
+
+def caminho_copia(caminho_nc) -> Path:
+    """Onde fica a cópia Zarr de um .nc (ao lado dele)"""
+    return Path(caminho_nc).with_suffix(".zarr")
+
+
+def _assinatura(caminho_nc) -> dict:
+    info = Path(caminho_nc).stat()
+    return {"tamanho": info.st_size, "modificado_ns": info.st_mtime_ns}
+
+
+def tamanho_pasta(pasta) -> int:
+    """Bytes ocupados por um store Zarr"""
+    return sum(f.stat().st_size for f in Path(pasta).rglob("*") if f.is_file())
+
+
+def _descrever(ds, chunks: dict, padrao: str, nivel: int) -> dict:
+    """Layout da cópia e os custos usados para decidir quando ela serve"""
+    meta = {"padrao": padrao, "nivel": nivel, "chunks": chunks, "variavel": None, "dim_tempo": None,
+            "bytes_serie_celula": None, "linhas_bloco_tempo": None,
+            "bytes_por_linha": planejador_fatias.bytes_por_linha(ds)}
+    principal = _principal(ds)
+    dim_tempo = _dimensao_tempo(ds)
+    if principal is None or dim_tempo not in ds[principal].dims:
+        return meta
+    var = ds[principal]
+    demais = [str(d) for d in var.dims if d != dim_tempo]
+    passo = chunks[dim_tempo]
+    n = int(ds.sizes[dim_tempo])
+    meta.update(
+        variavel=str(principal),
+        dim_tempo=str(dim_tempo),
+        # Bytes descomprimidos para ler a série de uma célula
+        bytes_serie_celula=math.ceil(n / passo) * passo * math.prod(chunks[d] for d in demais) * var.dtype.itemsize,
+        # Linhas da tabela em um bloco de chunks no tempo (a grade inteira)
+        linhas_bloco_tempo=passo * math.prod(int(ds.sizes[d]) for d in demais),
+    )
+    return meta
+
+
+def otimizar(caminho_nc, padrao: str = "series", chunks: dict | None = None,
+             nivel: int = NIVEL_PADRAO, orcamento_mb: float | None = None) -> dict:
+    """
+    Cria (ou refaz) a cópia Zarr de um .nc e devolve a descrição dela.
+    O store é montado em uma pasta temporária e só troca a cópia anterior
+    quando está completo.
+    """
+    _exigir_zarr()
+    caminho_nc = Path(caminho_nc)
+    destino = caminho_copia(caminho_nc)
+    temporario = destino.with_name(f"_criando_{uuid.uuid4().hex}_{destino.name}")
+    print(f"[ZARR] Otimizando {caminho_nc.name} (layout {padrao})...")
+    try:
+        with xr.open_dataset(caminho_nc) as ds:
+            tamanhos = chunks_para(ds, padrao, chunks)
+            escrever(ds, temporario, tamanhos, nivel, orcamento_mb)
+            meta = _descrever(ds, tamanhos, padrao, nivel)
+        meta.update(
+            origem=caminho_nc.name,
+            assinatura=_assinatura(caminho_nc),
+            tamanho_bytes=tamanho_pasta(temporario),
+            criado_em=datetime.now().isoformat(timespec="seconds"),
+        )
+        (temporario / ARQUIVO_META).write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+        if destino.exists():
+            shutil.rmtree(destino)
+        os.replace(temporario, destino)
+    except BaseException:
+        shutil.rmtree(temporario, ignore_errors=True)
+        raise
+
+    origem_mb = meta["assinatura"]["tamanho"] / (1024 * 1024)
+    print(f"[ZARR] Cópia pronta: {destino.name} ({meta['tamanho_bytes'] / (1024 * 1024):.1f} MB, "
+          f"original {origem_mb:.1f} MB) | chunks {tamanhos}")
+    return meta
+
+
+def copia_valida(caminho_nc) -> dict | None:
+    """Descrição da cópia Zarr do .nc, se existir e o .nc não tiver mudado"""
+    arquivo = caminho_copia(caminho_nc) / ARQUIVO_META
+    if not ZARR_OK or not arquivo.is_file():
+        return None
+    try:
+        meta = json.loads(arquivo.read_text(encoding="utf-8"))
+        if meta.get("assinatura") != _assinatura(caminho_nc):
+            return None
+    except (OSError, ValueError):
+        return None
+    return meta
+
+
+def serve_para(meta: dict, acesso: str) -> bool:
+    """
+    A cópia é lida uma vez por chunk no acesso? "series": a série de uma
+    célula não descomprime mais que LEITURA_SERIE_MAXIMA_MB; "tabela"
+    (fatias no tempo com a grade inteira): um bloco de chunks no tempo
+    cabe em uma fatia do planejador.
+    """
+    if acesso == "series":
+        custo = meta.get("bytes_serie_celula")
+        return custo is None or custo <= LEITURA_SERIE_MAXIMA_MB * 1024 * 1024
+    linhas = meta.get("linhas_bloco_tempo")
+    return linhas is None or linhas * meta["bytes_por_linha"] <= planejador_fatias.ORCAMENTO_FATIA_MB * 1024 * 1024
+
+
+def acesso_das_opcoes(opcoes: dict | None) -> str:
+    """Padrão de leitura de uma conversão: SPI lê séries; as demais, fatias no tempo"""
+    return "series" if (opcoes or {}).get("spi") else "tabela"
+
+
+def caminho_leitura(caminho_nc, acesso: str = "tabela") -> Path:
+    """A cópia Zarr, se houver uma válida que sirva ao acesso; senão o próprio .nc"""
+    meta = copia_valida(caminho_nc)
+    if meta is not None and serve_para(meta, acesso):
+        return caminho_copia(caminho_nc)
+    return Path(caminho_nc)
+
+
+def abrir(caminho_nc, acesso: str = "tabela") -> xr.Dataset:
+    """Abre o dataset de forma preguiçosa, preferindo a cópia Zarr"""
+    leitura = caminho_leitura(caminho_nc, acesso)
+    if leitura.suffix == ".zarr":
+        print(f"[ZARR] Lendo a cópia otimizada {leitura.name}")
+        return xr.open_dataset(leitura, engine="zarr", consolidated=True, chunks=None)
+    return xr.open_dataset(caminho_nc)
@@ -0,0 +1,305 @@
+"""
+Defesa Civil Araruna - Escritores de saída incrementais
+Cada escritor recebe a tabela de uma fatia por vez e grava no destino
+(caminho ou objeto file-like) sem nunca montar a saída inteira na memória.
+"""
+
+import io
+import re
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import motor_tabular
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PYARROW_OK = True
+except ImportError:
+    PYARROW_OK = False
+
+try:
+    import xlsxwriter
+    XLSXWRITER_OK = True
+except ImportError:
+    XLSXWRITER_OK = False
+
+
+EXTENSOES = {
+    "csv": ".csv",
+    "xlsx": ".xlsx",
+    "parquet": ".parquet",
+    "arrow": ".arrow",
+    "zip": ".zip",
+    "zarr": ".zarr.zip",
+}
+
+MEDIA_TYPES = {
+    "csv": "text/csv",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.file",
+    "zip": "application/zip",
+    "zarr": "application/zip",
+}
+
+FORMATOS_COLUNARES = ("parquet", "arrow")
+
+COMPRESSAO_COLUNAR = "zstd"
+
+BOM_UTF8 = "\ufeff".encode("utf-8")
+
+# Limite de linhas de uma planilha Excel (1.048.576, incluindo o cabeçalho)
+LINHAS_POR_PLANILHA = 1_048_575
+
+
+class BufferDrenavel(io.RawIOBase):
+    """
+    Destino file-like só de escrita que acumula bytes até serem drenados.
+    Permite enviar Parquet/Arrow por StreamingResponse: a cada fatia o
+    escritor grava aqui e o gerador repassa o que foi produzido.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._partes: list[bytes] = []
+        self._posicao = 0
+
+    def writable(self):
+        return True
+
+    def write(self, dados):
+        dados = bytes(dados)
+        self._partes.append(dados)
+        self._posicao += len(dados)
+        return len(dados)
+
+    def tell(self):
+        return self._posicao
+
+    def drenar(self) -> bytes:
+        dados = b"".join(self._partes)
+        self._partes.clear()
+        return dados
+
+
+def formato_data_csv(ds) -> str | None:
+    """
+    Formato das datas no CSV, decidido uma vez para o dataset inteiro.
+    O to_csv escolhe o formato por DataFrame (só a data quando todas as
+    horas são 00:00), o que mudaria de uma fatia para outra.
+    """
+    com_hora = False
+    for var in ds.variables.values():
+        if not np.issubdtype(var.dtype, np.datetime64) or var.ndim > 2:
+            continue
+        valores = var.values.astype("datetime64[ns]").view("i8")
+        valores = valores[valores != np.iinfo(np.int64).min]  # NaT
+        if (valores % 1_000_000_000).any():
+            return None  # frações de segundo: deixa o pandas decidir
+        if (valores % 86_400_000_000_000).any():
+            com_hora = True
+    return "%Y-%m-%d %H:%M:%S" if com_hora else "%Y-%m-%d"
+
+
+def codificar_csv(lote: dict, cabecalho: bool, formato_data: str | None = None) -> bytes:
+    """Linhas de um lote em CSV UTF-8 (sem BOM)"""
+    texto = pd.DataFrame(lote, copy=False).to_csv(
+        index=False, header=cabecalho, date_format=formato_data
+    )
+    return texto.encode("utf-8")
+
+
+class EscritorCSV:
+    """
+    Grava CSV (UTF-8 com BOM, como o to_csv com encoding utf-8-sig),
+    com cabeçalho apenas no primeiro lote.
+    """
+
+    def __init__(self, destino, formato_data: str | None = None):
+        self._fechar_destino = isinstance(destino, (str, Path))
+        self._arquivo = open(destino, "wb") if self._fechar_destino else destino
+        self.formato_data = formato_data
+        self._primeiro = True
+        self.total_linhas = 0
+
+    def escrever(self, lote: dict):
+        """Grava as linhas de um lote (dict coluna -> array)"""
+        self.escrever_codificado(codificar_csv(lote, self._primeiro, self.formato_data),
+                                 motor_tabular.linhas_do_lote(lote))
+
+    def escrever_codificado(self, dados: bytes, linhas: int):
+        """Grava um lote já codificado por codificar_csv (ex.: em outro processo)"""
+        if self._primeiro:
+            self._arquivo.write(BOM_UTF8)
+            self._primeiro = False
+        self._arquivo.write(dados)
+        self.total_linhas += linhas
+
+    def fechar(self):
+        if self._fechar_destino:
+            self._arquivo.close()
+
+
+class EscritorColunar:
+    """
+    Grava Parquet (um row group por fatia) ou Arrow IPC (um record batch
+    por fatia), com compressão zstd. O schema é definido pela primeira fatia.
+    """
+
+    def __init__(self, destino, formato: str):
+        if not PYARROW_OK:
+            raise RuntimeError("pyarrow não instalado. Execute: pip install pyarrow")
+        if formato not in FORMATOS_COLUNARES:
+            raise ValueError(f"Formato colunar desconhecido: {formato}")
+        self.destino = destino
+        self.formato = formato
+        self.schema = None
+        self._writer = None
+        self.total_linhas = 0
+
+    def _abrir(self, schema):
+        self.schema = schema
+        if self.formato == "parquet":
+            self._writer = pq.ParquetWriter(self.destino, schema, compression=COMPRESSAO_COLUNAR)
+        else:
+            opcoes = pa.ipc.IpcWriteOptions(compression=COMPRESSAO_COLUNAR)
+            self._writer = pa.ipc.new_file(self.destino, schema, options=opcoes)
+
+    def escrever(self, lote: dict):
+        """Grava a tabela de uma fatia direto dos arrays numpy do lote"""
+        try:
+            tabela = pa.table(lote)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError):
+            # Tipos que o Arrow não converte direto (ex.: datas cftime)
+            tabela = pa.Table.from_pandas(pd.DataFrame(lote, copy=False), preserve_index=False)
+        if self._writer is None:
+            self._abrir(tabela.schema)
+        elif tabela.schema != self.schema:
+            tabela = tabela.cast(self.schema)
+        if tabela.num_rows == 0:
+            return  # fatia sem linhas (modo esparso): não gera row group vazio
+
+        if self.formato == "parquet":
+            self._writer.write_table(tabela, row_group_size=max(1, tabela.num_rows))
+        else:
+            for lote in tabela.to_batches():
+                self._writer.write_batch(lote)
+        self.total_linhas += tabela.num_rows
+
+    def fechar(self):
+        """Finaliza o arquivo (rodapé do Parquet / Arrow)"""
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+class EscritorXLSX:
+    """
+    Grava XLSX em memória constante (xlsxwriter, constant_memory): as linhas
+    são escritas em ordem, fatia por fatia, e descartadas em seguida.
+    Ao atingir o limite do Excel continua em uma nova planilha
+    (Dados, Dados_2, Dados_3, ...) em vez de truncar. Com nova_tabela()
+    cada grupo de variáveis ganha as suas planilhas.
+    """
+
+    def __init__(self, caminho: str, linhas_por_planilha: int = LINHAS_POR_PLANILHA):
+        if not XLSXWRITER_OK:
+            raise RuntimeError("xlsxwriter não instalado. Execute: pip install xlsxwriter")
+        self.wb = xlsxwriter.Workbook(caminho, {"constant_memory": True})
+        self.fmt_cabecalho = self.wb.add_format({
+            "bold": True, "font_color": "#FFFFFF", "bg_color": "#1E3A5F",
+            "align": "center", "valign": "vcenter",
+        })
+        self.fmt_data = self.wb.add_format({"num_format": "dd/mm/yyyy hh:mm"})
+        self.linhas_por_planilha = linhas_por_planilha
+        self.colunas: list[str] | None = None
+        self.ws = None
+        self.nome_tabela = "Dados"
+        self.planilhas_tabela = 0
+        self.planilhas = 0
+        self.linha = 0
+        self.total_linhas = 0
+
+    def nova_tabela(self, nome: str):
+        """As próximas linhas vão para planilhas novas com esse nome"""
+        # Nome de planilha: até 31 caracteres, sem []:*?/\ (reserva "_N")
+        self.nome_tabela = re.sub(r"[\[\]:*?/\\]", "_", str(nome))[:28] or "Dados"
+        self.colunas = None
+        self.planilhas_tabela = 0
+
+    def _nova_planilha(self):
+        self.planilhas += 1
+        self.planilhas_tabela += 1
+        nome = self.nome_tabela
+        if self.planilhas_tabela > 1:
+            nome = f"{nome}_{self.planilhas_tabela}"
+        self.ws = self.wb.add_worksheet(nome)
+        self.ws.freeze_panes(1, 0)
+        for c, coluna in enumerate(self.colunas):
+            self.ws.write_string(0, c, str(coluna), self.fmt_cabecalho)
+            self.ws.set_column(c, c, max(12, len(str(coluna)) + 4))
+        self.linha = 1
+
+    def _preparar_coluna(self, valores: np.ndarray):
+        """
+        Converte a coluna para lista Python (None = célula vazia) e escolhe
+        o método de escrita uma vez por coluna, não por célula.
+        """
+        if np.issubdtype(valores.dtype, np.datetime64):
+            lista = pd.DatetimeIndex(valores).to_pydatetime().tolist()
+            for i in np.flatnonzero(np.isnat(valores)):
+                lista[i] = None
+            return lista, lambda ws, l, c, v: ws.write_datetime(l, c, v, self.fmt_data)
+        if np.issubdtype(valores.dtype, np.number) or valores.dtype == bool:
+            valores = valores.astype(np.float64)
+            lista = valores.tolist()
+            for i in np.flatnonzero(~np.isfinite(valores)):
+                lista[i] = None
+            return lista, lambda ws, l, c, v: ws.write_number(l, c, v)
+        lista = [None if v is None or (isinstance(v, float) and np.isnan(v)) else str(v)
+                 for v in valores.tolist()]
+        return lista, lambda ws, l, c, v: ws.write_string(l, c, v)
+
+    def escrever(self, lote: dict):
+        """Grava as linhas de um lote (dict coluna -> array)"""
+        if self.colunas is None:
+            self.colunas = [str(c) for c in lote]
+            self._nova_planilha()
+
+        preparadas = [self._preparar_coluna(np.asarray(v)) for v in lote.values()]
+        listas = [p[0] for p in preparadas]
+        metodos = [p[1] for p in preparadas]
+
+        for registro in zip(*listas):
+            if self.linha > self.linhas_por_planilha:
+                self._nova_planilha()
+            ws, linha = self.ws, self.linha
+            for c, valor in enumerate(registro):
+                if valor is not None:
+                    metodos[c](ws, linha, c, valor)
+            self.linha += 1
+            self.total_linhas += 1
+
+    def fechar(self):
+        """Fecha o arquivo (monta o .xlsx a partir dos temporários)"""
+        if self.planilhas == 0:
+            self.colunas = ["sem_dados"]
+            self._nova_planilha()
+        self.wb.close()
+
+
+def criar_escritor(formato: str, destino, ds=None):
+    """
+    Escritor incremental para o formato (destino: caminho ou file-like).
+    `ds` (o dataset a converter) fixa o formato das datas do CSV.
+    """
+    if formato == "csv":
+        return EscritorCSV(destino, formato_data_csv(ds) if ds is not None else None)
+    if formato == "xlsx":
+        return EscritorXLSX(destino)
+    if formato in FORMATOS_COLUNARES:
+        return EscritorColunar(destino, formato)
+    raise ValueError(f"Formato de saída desconhecido: {formato}")
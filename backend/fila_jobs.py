@@ -0,0 +1,188 @@
+"""
+Defesa Civil Araruna - Fila de jobs de conversão
+Executa conversões em um pool de processos limitado, fora do event loop
+"""
+
+import os
+import uuid
+import threading
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+# Número máximo de conversões simultâneas (cada uma ocupa um processo)
+MAX_PROCESSOS = int(os.getenv("CONVERSOR_PROCESSOS", max(1, (os.cpu_count() or 2) // 2)))
+
+# Jobs concluídos são esquecidos depois desse tempo (mesmo prazo dos arquivos)
+VALIDADE_JOB_SEGUNDOS = 7200
+
+_executor: ProcessPoolExecutor | None = None
+_jobs: dict[str, dict] = {}
+_lock = threading.Lock()
+
+
+def obter_executor() -> ProcessPoolExecutor:
+    """Cria o pool de processos na primeira utilização"""
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=MAX_PROCESSOS)
+            print(f"[JOBS] Pool iniciado com {MAX_PROCESSOS} processo(s)")
+        return _executor
+
+
+def _recriar_executor():
+    """Descarta um pool quebrado (ex.: processo morto por falta de memória)"""
+    global _executor
+    with _lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def submeter(funcao, *args):
+    """Submete uma função ao pool e devolve o Future (usado também no modo síncrono)"""
+    try:
+        return obter_executor().submit(funcao, *args)
+    except BrokenProcessPool:
+        _recriar_executor()
+        return obter_executor().submit(funcao, *args)
+
+
+def _novo_job(**info) -> dict:
+    return {
+        "id": uuid.uuid4().hex,
+        "status": "na_fila",
+        "criado_em": datetime.now().isoformat(timespec="seconds"),
+        "concluido_em": None,
+        "erro": None,
+        "resultado": None,
+        **info,
+    }
+
+
+def criar_job(funcao, *args, ao_concluir=None, ao_terminar=None, **info) -> str:
+    """
+    Enfileira uma conversão e devolve o id do job imediatamente.
+    `funcao` deve retornar um dict com o resultado (caminho, nome, tipo).
+    `ao_concluir`, se informado, recebe esse dict no processo principal
+    e devolve o resultado final (ex.: após mover o arquivo para o cache).
+    `ao_terminar` é chamado sem argumentos quando o job termina, com
+    sucesso ou não (ex.: liberar a reserva de um dataset do registro).
+    """
+    limpar_jobs_antigos()
+
+    job = _novo_job(**info)
+    job_id = job["id"]
+
+    future = submeter(funcao, *args)
+    with _lock:
+        _jobs[job_id] = job
+        job["_future"] = future
+        job["_ao_concluir"] = ao_concluir
+
+    if ao_terminar is not None:
+        future.add_done_callback(lambda f: ao_terminar())
+    future.add_done_callback(lambda f, jid=job_id: _finalizar_job(jid, f))
+    return job_id
+
+
+def registrar_job_concluido(resultado: dict, **info) -> str:
+    """Registra um job que já nasce concluído (resultado servido do cache)"""
+    limpar_jobs_antigos()
+
+    job = _novo_job(**info)
+    job["status"] = "concluido"
+    job["concluido_em"] = job["criado_em"]
+    job["resultado"] = resultado
+    with _lock:
+        _jobs[job["id"]] = job
+    return job["id"]
+
+
+def _finalizar_job(job_id: str, future):
+    """
+    Callback chamado pelo pool quando a conversão termina. O `ao_concluir`
+    do job (ex.: mover o arquivo para o cache, trocar o .nc de um dataset)
+    roda fora do lock, para não travar obter_job no event loop.
+    """
+    with _lock:
+        job = _jobs.get(job_id)
+        if job is None:
+            return
+        job.pop("_future", None)
+        ao_concluir = job.pop("_ao_concluir", None)
+
+        if future.cancelled():
+            job["status"] = "cancelado"
+            job["concluido_em"] = datetime.now().isoformat(timespec="seconds")
+            return
+        job["status"] = "processando"
+
+    erro = future.exception()
+    if erro is None:
+        try:
+            resultado = future.result()
+            if ao_concluir is not None:
+                resultado = ao_concluir(resultado)
+        except Exception as e:
+            erro = e
+
+    with _lock:
+        job["concluido_em"] = datetime.now().isoformat(timespec="seconds")
+        if erro is None:
+            job["status"] = "concluido"
+            job["resultado"] = resultado
+            print(f"[JOBS] {job_id} concluído")
+        elif isinstance(erro, MemoryError):
+            job["status"] = "erro"
+            job["erro"] = "Memória insuficiente para converter este arquivo."
+        elif isinstance(erro, BrokenProcessPool):
+            job["status"] = "erro"
+            job["erro"] = "O processo de conversão foi encerrado inesperadamente (provável falta de memória)."
+        else:
+            job["status"] = "erro"
+            job["erro"] = f"{type(erro).__name__}: {erro}"
+
+        if job["status"] == "erro":
+            print(f"[JOBS] {job_id} falhou: {job['erro']}")
+
+    if isinstance(erro, BrokenProcessPool):
+        _recriar_executor()
+
+
+def obter_job(job_id: str) -> dict | None:
+    """Retorna uma cópia pública do estado do job (sem o Future interno)"""
+    with _lock:
+        job = _jobs.get(job_id)
+        if job is None:
+            return None
+        publico = {k: v for k, v in job.items() if not k.startswith("_")}
+        future = job.get("_future")
+
+    if future is not None and future.running():
+        publico["status"] = "processando"
+    return publico
+
+
+def limpar_jobs_antigos():
+    """Esquece jobs finalizados há mais de 2 horas"""
+    agora = datetime.now()
+    with _lock:
+        for job_id in list(_jobs):
+            concluido = _jobs[job_id]["concluido_em"]
+            if concluido is None:
+                continue
+            idade = (agora - datetime.fromisoformat(concluido)).total_seconds()
+            if idade > VALIDADE_JOB_SEGUNDOS:
+                del _jobs[job_id]
+
+
+def encerrar():
+    """Finaliza o pool (chamado no shutdown do servidor)"""
+    global _executor
+    with _lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
@@ -0,0 +1,57 @@
+"""
+Defesa Civil Araruna - Agrupamento de variáveis por dimensões
+O to_dataframe expande todas as variáveis para a união das dimensões:
+time_bnds(time, bnds) ao lado de pr(time, lat, lon) vira bnds × lat × lon
+linhas repetidas. Aqui as variáveis são separadas por assinatura de
+dimensões e cada grupo vira uma tabela própria, com o número real de linhas.
+"""
+
+import math
+
+
+def _nome_grupo(dims: tuple, variaveis: list) -> str:
+    """Nome da tabela: a variável, se for uma só; senão as dimensões"""
+    if len(variaveis) == 1:
+        return str(variaveis[0])
+    if not dims:
+        return "escalares"
+    return "_".join(str(d) for d in dims)
+
+
+def agrupar(ds) -> list[dict]:
+    """
+    Um grupo por assinatura de dimensões, na ordem em que as variáveis
+    aparecem no arquivo: {"nome", "variaveis", "ds"}, com ds = ds[variaveis]
+    (leva só as coordenadas cujas dimensões pertencem ao grupo).
+    Coordenadas auxiliares que não cabem em nenhum grupo viram um grupo próprio.
+    """
+    assinaturas: dict[tuple, list] = {}
+    for nome, var in ds.data_vars.items():
+        assinaturas.setdefault(tuple(var.dims), []).append(nome)
+
+    for nome, coord in ds.coords.items():
+        if nome in ds.dims:
+            continue
+        if not any(set(coord.dims) <= set(dims) for dims in assinaturas):
+            assinaturas.setdefault(tuple(coord.dims), []).append(nome)
+
+    grupos = []
+    usados: set[str] = set()
+    for dims, variaveis in assinaturas.items():
+        nome = _nome_grupo(dims, variaveis)
+        base, n = nome, 2
+        while nome in usados:
+            nome, n = f"{base}_{n}", n + 1
+        usados.add(nome)
+        grupos.append({"nome": nome, "variaveis": variaveis, "ds": ds[variaveis]})
+    return grupos
+
+
+def pontos(ds) -> int:
+    """Linhas que a tabela do dataset terá"""
+    return math.prod(int(n) for n in ds.sizes.values())
+
+
+def principal(grupos: list[dict]) -> dict:
+    """Grupo com mais linhas (a tabela de dados; os demais são auxiliares)"""
+    return max(grupos, key=lambda g: pontos(g["ds"]))
@@ -0,0 +1,182 @@
+"""
+Defesa Civil Araruna - SPI (Índice de Precipitação Padronizado) por célula
+SPI-1/3/6/12 de toda a grade: a chuva é lida em fatias com a série
+inteira de um bloco de células (planejador_fatias.planejar_series), vira
+totais mensais e somas móveis de 1, 3, 6 e 12 meses, e para cada mês do
+calendário uma distribuição gama é ajustada de uma vez para todas as
+células da fatia (estimador de Thom, com a probabilidade de zero à parte).
+As fatias são independentes, então a conversão paralela usa um processo
+por núcleo. A calibração usa todo o período do arquivo.
+"""
+
+import warnings
+
+import numpy as np
+import xarray as xr
+
+import agregacao_temporal
+import indices_extremos
+import subconjunto
+
+try:
+    from scipy.special import gammainc, ndtri
+    SCIPY_OK = True
+except ImportError:
+    SCIPY_OK = False
+
+
+ESCALAS = (1, 3, 6, 12)
+
+# Anos mínimos de cada mês do calendário para ajustar a gama
+ANOS_MINIMOS = 10
+
+# Meses com chuva (> 0) mínimos para o ajuste; abaixo disso o SPI fica vazio
+POSITIVOS_MINIMOS = 3
+
+# SPI limitado a ±3,09 (probabilidades de 0,001 e 0,999)
+SPI_LIMITE = 3.09
+
+
+class ErroSPI(subconjunto.ErroSubconjunto):
+    """SPI impossível para o arquivo (vira HTTP 400 no servidor)"""
+
+
+def colunas(escalas=ESCALAS) -> list[str]:
+    """Nome das colunas de saída, ex.: spi_3"""
+    return [f"spi_{k}" for k in escalas]
+
+
+def _passo(tempos: np.ndarray) -> np.timedelta64:
+    if tempos.size < 2:
+        return np.timedelta64(1, "D")
+    return np.median(np.diff(tempos))
+
+
+def _mensal(passo) -> bool:
+    return passo >= np.timedelta64(28, "D")
+
+
+def validar(opcoes: dict | None):
+    """Erro se o SPI foi pedido junto com outro modo de saída"""
+    opcoes = opcoes or {}
+    if opcoes.get("spi") and (opcoes.get("agregacao") or opcoes.get("indices")):
+        raise ErroSPI("O SPI não pode ser combinado com a agregação temporal nem com os índices de extremos")
+
+
+def preparar(ds):
+    """Restringe o dataset à variável de chuva e confere o tamanho da série"""
+    nome = indices_extremos.variavel_precipitacao(ds)
+    dim = agregacao_temporal.dimensao_tempo(ds)
+    tempos = ds[dim].values
+    if tempos.size and not np.all(tempos[1:] > tempos[:-1]):
+        raise ErroSPI("O SPI exige o tempo em ordem crescente")
+    anos = len(np.unique(tempos.astype("datetime64[Y]")))
+    if anos < ANOS_MINIMOS:
+        raise ErroSPI(f"O SPI precisa de pelo menos {ANOS_MINIMOS} anos de dados (o arquivo tem {anos})")
+    return ds[[nome]]
+
+
+def totais_mensais(ds, nome: str, dim: str) -> tuple[np.ndarray, np.ndarray]:
+    """
+    (meses consecutivos datetime64[M], totais (mês, demais dimensões)).
+    Dados diários/horários são somados no mês; meses com algum passo
+    ausente ficam NaN. Dados mensais são usados como estão.
+    """
+    var = ds[nome]
+    tempos = ds[dim].values
+    passo = _passo(tempos)
+    if _mensal(passo):
+        rotulos = tempos.astype("datetime64[M]")
+        totais = np.moveaxis(np.asarray(var.values), var.dims.index(dim), 0).astype(np.float64)
+    else:
+        parcial = agregacao_temporal.reduzir_fatia(ds[[nome]], "mensal", "soma")["variaveis"][str(nome)]
+        rotulos = agregacao_temporal.rotulos_periodo(tempos, "mensal")
+        rotulos = np.unique(rotulos).astype("datetime64[M]")
+        dias = ((rotulos + 1).astype("datetime64[D]") - rotulos.astype("datetime64[D]")).astype(int)
+        esperados = np.round(dias * (np.timedelta64(1, "D") / passo)).astype(int)
+        forma = (-1,) + (1,) * (parcial["soma"].ndim - 1)
+        totais = parcial["soma"]
+        totais[parcial["contagem"] < esperados.reshape(forma)] = np.nan
+
+    meses = np.arange(rotulos[0], rotulos[-1] + 1) if rotulos.size else rotulos
+    completos = np.full((len(meses),) + totais.shape[1:], np.nan)
+    completos[(rotulos - rotulos[0]).astype(int)] = totais
+    return meses, completos
+
+
+def soma_movel(totais: np.ndarray, k: int) -> np.ndarray:
+    """Soma dos últimos k meses (NaN se faltar algum)"""
+    if k == 1:
+        return totais
+    somas = np.cumsum(np.nan_to_num(totais), axis=0)
+    faltas = np.cumsum(np.isnan(totais), axis=0)
+    zero = np.zeros((1,) + totais.shape[1:])
+    somas, faltas = np.concatenate([zero, somas]), np.concatenate([zero, faltas])
+    resultado = somas[k:] - somas[:-k]
+    resultado[(faltas[k:] - faltas[:-k]) > 0] = np.nan
+    return np.concatenate([np.full((k - 1,) + totais.shape[1:], np.nan), resultado])
+
+
+def _spi_mes(amostras: np.ndarray) -> np.ndarray:
+    """
+    SPI de (anos, células) de um mês do calendário: gama ajustada por
+    célula aos valores positivos, com a fração de zeros à parte.
+    """
+    validos = ~np.isnan(amostras)
+    positivos = validos & (amostras > 0)
+    n_validos = validos.sum(axis=0)
+    n_positivos = positivos.sum(axis=0)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        x = np.where(positivos, amostras, 1.0)
+        media = np.where(positivos, x, 0).sum(axis=0) / n_positivos
+        media_log = np.where(positivos, np.log(x), 0).sum(axis=0) / n_positivos
+        a = np.log(media) - media_log
+        alfa = (1 + np.sqrt(1 + 4 * a / 3)) / (4 * a)
+        beta = media / alfa
+        zeros = (n_validos - n_positivos) / n_validos
+        acumulada = zeros + (1 - zeros) * np.where(positivos, gammainc(alfa, x / beta), 0)
+        spi = np.clip(ndtri(acumulada), -SPI_LIMITE, SPI_LIMITE)
+
+    ajustavel = (n_validos >= ANOS_MINIMOS) & (n_positivos >= POSITIVOS_MINIMOS) & (a > 0)
+    spi[~validos | ~ajustavel] = np.nan
+    return spi
+
+
+def spi(acumulado: np.ndarray, meses: np.ndarray) -> np.ndarray:
+    """SPI de uma série (mês, demais dimensões), ajustado mês a mês do calendário"""
+    resultado = np.full(acumulado.shape, np.nan)
+    mes_do_ano = meses.astype(int) % 12
+    forma = acumulado.shape
+    planos = acumulado.reshape(forma[0], -1)
+    saida = resultado.reshape(forma[0], -1)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        for mes in range(12):
+            linhas = np.flatnonzero(mes_do_ano == mes)
+            if linhas.size:
+                saida[linhas] = _spi_mes(planos[linhas])
+    return resultado
+
+
+def calcular(ds, escalas=ESCALAS) -> xr.Dataset:
+    """
+    SPI de uma fatia com a série inteira: Dataset com spi_<k> por mês e
+    célula, com o tempo por último (tabela ordenada por célula e mês).
+    """
+    if not SCIPY_OK:
+        raise RuntimeError("scipy não instalado. Execute: pip install scipy")
+    nome = list(ds.data_vars)[0]
+    dim = agregacao_temporal.dimensao_tempo(ds)
+    outras = [d for d in ds[nome].dims if d != dim]
+    meses, totais = totais_mensais(ds, nome, dim)
+
+    variaveis = {}
+    for k, coluna in zip(escalas, colunas(escalas)):
+        valores = spi(soma_movel(totais, k), meses)
+        variaveis[coluna] = (outras + [dim], np.moveaxis(valores, 0, -1).astype(np.float32))
+    coords = {dim: meses.astype("datetime64[ns]")}
+    for nome_coord, coord in ds.coords.items():
+        if nome_coord != dim and dim not in coord.dims:
+            coords[nome_coord] = coord.variable
+    return xr.Dataset(variaveis, coords=coords)
@@ -0,0 +1,341 @@
+"""
+Defesa Civil Araruna - Índices de extremos de chuva (ETCCDI) por célula e ano
+Rx1day, Rx5day, R95p, R20mm, CDD e CWD calculados fatia por fatia, sem
+montar a série de cada célula: acumuladores numpy do tamanho da grade
+guardam o máximo do ano, as contagens, os últimos 4 dias (janela do
+Rx5day) e o comprimento da sequência seca/úmida em curso, que continuam
+de uma fatia para a seguinte. A memória depende da grade, não do período.
+
+O R95p precisa do percentil 95 dos dias úmidos de cada célula antes de
+somar a chuva acima dele, por isso é opcional: o limiar vem pronto (ex.:
+da climatologia, que guarda o P95 diário) ou, se pedido, é estimado numa
+passada prévia só com um histograma por célula (HistogramaP95). Sem ele
+os demais índices saem em uma única leitura do arquivo.
+"""
+
+import numpy as np
+import xarray as xr
+
+import agregacao_temporal
+import motor_tabular
+import subconjunto
+
+
+INDICES = ("rx1day", "rx5day", "r95p", "r20mm", "cdd", "cwd")
+
+DIA_UMIDO_MM = 1.0
+LIMIAR_R20MM = 20.0
+JANELA_RX5DAY = 5
+PERCENTIL_R95P = 95
+
+NOMES_PRECIPITACAO = ["pr", "precip", "precipitacao", "prec", "tp", "rain", "chuva"]
+
+# Unidades convertidas para mm/dia (o resto é tratado como mm/dia)
+FATORES_UNIDADE = {
+    "kg m-2 s-1": 86400.0,
+    "kg m**-2 s**-1": 86400.0,
+    "kg/m2/s": 86400.0,
+    "kg m-2 s**-1": 86400.0,
+    "mm/s": 86400.0,
+    "mm s-1": 86400.0,
+    "m": 1000.0,
+    "m/day": 1000.0,
+    "m day-1": 1000.0,
+}
+
+# Histograma do percentil: classes logarítmicas de 1 a 1000 mm
+_BORDAS = np.geomspace(DIA_UMIDO_MM, 1000.0, 129)
+
+
+class ErroIndices(subconjunto.ErroSubconjunto):
+    """Índices impossíveis para o arquivo (vira HTTP 400 no servidor)"""
+
+
+def variavel_precipitacao(ds) -> str:
+    """Variável de chuva: pelo nome ou a única variável com tempo"""
+    dim = agregacao_temporal.dimensao_tempo(ds)
+    candidatas = agregacao_temporal.variaveis_agregaveis(ds, dim)
+    if not candidatas:
+        raise ErroIndices("Nenhuma variável numérica com dimensão de tempo para os índices")
+    for nome in NOMES_PRECIPITACAO:
+        for candidata in candidatas:
+            if str(candidata).lower() == nome:
+                return candidata
+    if len(candidatas) == 1:
+        return candidatas[0]
+    raise ErroIndices(
+        f"Não foi possível identificar a variável de chuva entre {candidatas}: "
+        f"selecione uma com o parâmetro de variáveis"
+    )
+
+
+def dimensao_tempo(ds) -> str:
+    """Dimensão de tempo diária do dataset"""
+    try:
+        dim = agregacao_temporal.dimensao_tempo(ds)
+    except agregacao_temporal.ErroAgregacao as e:
+        raise ErroIndices(str(e))
+    tempos = ds[dim].values
+    if tempos.size > 1:
+        passo = np.median(np.diff(tempos)).astype("timedelta64[h]").astype(int)
+        if passo != 24:
+            raise ErroIndices("Os índices de extremos exigem dados diários")
+    return dim
+
+
+def fator_mm_dia(var) -> float:
+    """Multiplicador que leva a variável para mm/dia"""
+    return FATORES_UNIDADE.get(str(var.attrs.get("units", "")).strip(), 1.0)
+
+
+def preparar(ds):
+    """Restringe o dataset à variável de chuva (diária)"""
+    nome = variavel_precipitacao(ds)
+    dimensao_tempo(ds)
+    return ds[[nome]]
+
+
+def validar(opcoes: dict | None):
+    """Erro se os índices foram pedidos junto com a agregação temporal"""
+    opcoes = opcoes or {}
+    if opcoes.get("indices") and opcoes.get("agregacao"):
+        raise ErroIndices("Os índices de extremos não podem ser combinados com a agregação temporal")
+    if opcoes.get("r95p") and not opcoes.get("indices"):
+        raise ErroIndices("O R95p faz parte dos índices de extremos (indices=true)")
+
+
+def _valores_diarios(ds_fatia, nome: str, dim: str, fator: float) -> np.ndarray:
+    """(tempo, demais dimensões) em mm/dia, float64"""
+    var = ds_fatia[nome]
+    valores = np.moveaxis(np.asarray(var.values), var.dims.index(dim), 0).astype(np.float64)
+    if fator != 1.0:
+        valores *= fator
+    return valores
+
+
+def _histograma(valores: np.ndarray, histograma: np.ndarray):
+    """Soma ao histograma (células, classes) os dias úmidos de (tempo, células)"""
+    n_classes = histograma.shape[1]
+    umidos = valores >= DIA_UMIDO_MM  # NaN fica de fora
+    tempo, celulas = np.nonzero(umidos)
+    classes = np.clip(np.searchsorted(_BORDAS, valores[tempo, celulas], side="right") - 1,
+                      0, n_classes - 1)
+    np.add.at(histograma.reshape(-1), celulas * n_classes + classes, 1)
+
+
+def _percentil(histograma: np.ndarray, percentil: float) -> np.ndarray:
+    """Percentil de cada célula, interpolado (em log) dentro da classe"""
+    acumulado = np.cumsum(histograma, axis=-1)
+    total = acumulado[..., -1]
+    alvo = total * percentil / 100.0
+    classe = np.minimum((acumulado < alvo[..., np.newaxis]).sum(axis=-1), histograma.shape[-1] - 1)
+    antes = np.take_along_axis(acumulado, classe[..., np.newaxis], -1)[..., 0] - \
+        np.take_along_axis(histograma, classe[..., np.newaxis], -1)[..., 0]
+    na_classe = np.take_along_axis(histograma, classe[..., np.newaxis], -1)[..., 0]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        fracao = np.clip((alvo - antes) / na_classe, 0, 1)
+    inferior, superior = _BORDAS[classe], _BORDAS[classe + 1]
+    limiar = inferior * (superior / inferior) ** np.nan_to_num(fracao)
+    limiar[total == 0] = np.nan
+    return limiar
+
+
+class HistogramaP95:
+    """
+    Histograma de 128 classes (~5% de largura) dos dias úmidos (>= 1 mm)
+    de cada célula, somado fatia por fatia, para o percentil 95 sem guardar
+    a série. Com `arquivo` o histograma fica em disco (memória mapeada).
+    """
+
+    def __init__(self, ds, arquivo=None):
+        self.nome = list(ds.data_vars)[0]
+        self.dim = dimensao_tempo(ds)
+        self.outras = [d for d in ds[self.nome].dims if d != self.dim]
+        self.fator = fator_mm_dia(ds[self.nome])
+        forma = tuple(int(ds.sizes[d]) for d in self.outras) + (len(_BORDAS) - 1,)
+        if arquivo is None:
+            self.histograma = np.zeros(forma, np.uint32)
+        else:
+            self.histograma = np.lib.format.open_memmap(arquivo, "w+", np.uint32, forma)
+
+    def adicionar(self, fatia: dict, ds_fatia):
+        """Soma os dias úmidos de uma fatia (dict dim -> slice)"""
+        valores = _valores_diarios(ds_fatia, self.nome, self.dim, self.fator)
+        regiao = tuple(fatia.get(d, slice(None)) for d in self.outras)
+        parte = np.ascontiguousarray(self.histograma[regiao])
+        _histograma(valores.reshape(valores.shape[0], -1), parte.reshape(-1, parte.shape[-1]))
+        self.histograma[regiao] = parte
+
+    def limiares(self, celulas_por_bloco: int = 65536) -> np.ndarray:
+        """Percentil 95 de cada célula (mm/dia; NaN sem dias úmidos), por blocos de células"""
+        classes = self.histograma.shape[-1]
+        planos = self.histograma.reshape(-1, classes)
+        limiar = np.empty(planos.shape[0])
+        for inicio in range(0, planos.shape[0], celulas_por_bloco):
+            bloco = slice(inicio, inicio + celulas_por_bloco)
+            limiar[bloco] = _percentil(np.asarray(planos[bloco]), PERCENTIL_R95P)
+        return limiar.reshape(self.histograma.shape[:-1])
+
+
+def limiares_p95(ds, fatias) -> np.ndarray:
+    """
+    Percentil 95 dos dias úmidos de cada célula em todo o período do
+    dataset, a partir de (fatia, ds_fatia): uma passada inteira pelos dados.
+    """
+    histograma = HistogramaP95(ds)
+    for fatia, ds_fatia in fatias:
+        histograma.adicionar(fatia, ds_fatia)
+    return histograma.limiares()
+
+
+def _sequencias(condicao: np.ndarray, em_curso: np.ndarray) -> np.ndarray:
+    """
+    Comprimento da sequência de dias com `condicao` em cada dia (0 fora
+    dela), continuando a sequência `em_curso` da fatia anterior.
+    """
+    indice = np.arange(condicao.shape[0]).reshape((-1,) + (1,) * (condicao.ndim - 1))
+    ultima_quebra = np.maximum.accumulate(np.where(condicao, -1, indice), axis=0)
+    return np.where(ultima_quebra >= 0, indice - ultima_quebra, em_curso + indice + 1)
+
+
+class IndicesExtremos:
+    """
+    Acumula os índices de cada ano aberto na grade inteira e entrega os
+    anos concluídos como Datasets (dimensão "ano"). As fatias de uma mesma
+    região precisam chegar em ordem de tempo (como no planejador).
+    """
+
+    def __init__(self, ds, limiar_p95: np.ndarray | None = None):
+        self.ds = ds
+        self.nome = list(ds.data_vars)[0]
+        self.dim = dimensao_tempo(ds)
+        self.outras = [d for d in ds[self.nome].dims if d != self.dim]
+        self.forma = [int(ds.sizes[d]) for d in self.outras]
+        self.fator = fator_mm_dia(ds[self.nome])
+        self.limiar_p95 = limiar_p95
+        tempos = ds[self.dim].values
+        if tempos.size > 1 and not np.all(tempos[1:] > tempos[:-1]):
+            raise ErroIndices("Os índices de extremos exigem o tempo em ordem crescente")
+        self.em_ordem = list(ds.dims)[0] == self.dim
+        # Estado que atravessa as fatias
+        self._ultimos = np.full([JANELA_RX5DAY - 1] + self.forma, np.nan)
+        self._seco = np.zeros(self.forma, np.int64)
+        self._umido = np.zeros(self.forma, np.int64)
+        self._abertos: dict = {}
+        self._atual = None
+
+    def _novo_ano(self) -> dict:
+        return {
+            "rx1day": np.full(self.forma, np.nan),
+            "rx5day": np.full(self.forma, np.nan),
+            "r95p": np.zeros(self.forma),
+            "r20mm": np.zeros(self.forma, np.int32),
+            "cdd": np.zeros(self.forma, np.int32),
+            "cwd": np.zeros(self.forma, np.int32),
+            "validos": np.zeros(self.forma, np.int32),
+        }
+
+    def adicionar(self, fatia: dict, ds_fatia):
+        """Atualiza os anos abertos com uma fatia (dict dim -> slice)"""
+        regiao = tuple(fatia.get(d, slice(None)) for d in self.outras)
+        valores = _valores_diarios(ds_fatia, self.nome, self.dim, self.fator)
+        if valores.shape[0] == 0:
+            return
+        anos = ds_fatia[self.dim].values.astype("datetime64[Y]").astype(int) + 1970
+        inicios = np.flatnonzero(np.r_[True, anos[1:] != anos[:-1]])
+        validos = ~np.isnan(valores)
+        umido = validos & (valores >= DIA_UMIDO_MM)
+        seco = validos & (valores < DIA_UMIDO_MM)
+
+        # Rx5day: janelas de 5 dias terminando em cada dia da fatia
+        estendido = np.concatenate([self._ultimos[(slice(None),) + regiao], valores])
+        somas = np.cumsum(np.nan_to_num(estendido), axis=0)
+        faltas = np.cumsum(np.isnan(estendido), axis=0)
+        zero = np.zeros((1,) + valores.shape[1:])
+        somas, faltas = np.concatenate([zero, somas]), np.concatenate([zero, faltas])
+        n = JANELA_RX5DAY
+        janelas = somas[n:] - somas[:-n]
+        janelas[(faltas[n:] - faltas[:-n]) > 0] = np.nan
+        self._ultimos[(slice(None),) + regiao] = estendido[-(n - 1):]
+
+        sequencias_secas = _sequencias(seco, self._seco[regiao])
+        sequencias_umidas = _sequencias(umido, self._umido[regiao])
+        self._seco[regiao] = sequencias_secas[-1]
+        self._umido[regiao] = sequencias_umidas[-1]
+
+        if self.limiar_p95 is not None:
+            with np.errstate(invalid="ignore"):
+                acima = umido & (valores > self.limiar_p95[regiao])
+            chuva_r95p = np.add.reduceat(np.where(acima, valores, 0), inicios, axis=0)
+        reduzidos = {
+            "rx1day": np.fmax.reduceat(valores, inicios, axis=0),
+            "rx5day": np.fmax.reduceat(janelas, inicios, axis=0),
+            "r20mm": np.add.reduceat(valores >= LIMIAR_R20MM, inicios, axis=0, dtype=np.int32),
+            "cdd": np.maximum.reduceat(sequencias_secas, inicios, axis=0),
+            "cwd": np.maximum.reduceat(sequencias_umidas, inicios, axis=0),
+            "validos": np.add.reduceat(validos, inicios, axis=0, dtype=np.int32),
+        }
+
+        for k, ano in enumerate(anos[inicios]):
+            acumulado = self._abertos.get(ano)
+            if acumulado is None:
+                acumulado = self._abertos[ano] = self._novo_ano()
+            for campo in ("rx1day", "rx5day"):
+                np.fmax(acumulado[campo][regiao], reduzidos[campo][k], out=acumulado[campo][regiao])
+            for campo in ("cdd", "cwd"):
+                np.maximum(acumulado[campo][regiao], reduzidos[campo][k], out=acumulado[campo][regiao])
+            acumulado["r20mm"][regiao] += reduzidos["r20mm"][k]
+            acumulado["validos"][regiao] += reduzidos["validos"][k]
+            if self.limiar_p95 is not None:
+                acumulado["r95p"][regiao] += chuva_r95p[k]
+        self._atual = int(anos[0])
+
+    def _dataset(self, ano) -> xr.Dataset:
+        """Dataset de um ano: uma variável por índice, NaN nas células sem dados"""
+        acumulado = self._abertos.pop(ano)
+        vazios = acumulado.pop("validos") == 0
+        if self.limiar_p95 is None:
+            acumulado.pop("r95p")
+        dims = ["ano"] + self.outras
+        variaveis = {}
+        for indice, valores in acumulado.items():
+            valores = valores.astype(np.float32)
+            valores[vazios] = np.nan
+            variaveis[indice] = (dims, valores[np.newaxis])
+        coords = {"ano": np.array([ano], dtype=np.int32)}
+        for nome, coord in self.ds.coords.items():
+            if nome != self.dim and self.dim not in coord.dims:
+                coords[nome] = coord.variable
+        return xr.Dataset(variaveis, coords=coords)
+
+    def concluidos(self):
+        """Gera os anos que nenhuma fatia futura pode mais alterar"""
+        if not self.em_ordem or self._atual is None:
+            return
+        for ano in sorted(a for a in self._abertos if a < self._atual):
+            yield self._dataset(ano)
+
+    def finalizar(self):
+        """Gera os anos restantes, em ordem"""
+        for ano in sorted(self._abertos):
+            yield self._dataset(ano)
+
+
+def iterar_indices(ds, fatias, esparso: bool = False, limiar_p95: np.ndarray | None = None,
+                   estimar_p95: bool = False):
+    """
+    Gera os lotes (motor_tabular) da tabela de índices, um ano por lote.
+    `fatias()` devolve (fatia, ds_fatia) em ordem de tempo e é percorrida
+    uma vez. O R95p sai com `limiar_p95` (mm/dia, na grade de `ds`) ou
+    com estimar_p95=True, que custa uma passada a mais (o histograma).
+    """
+    if limiar_p95 is None and estimar_p95:
+        print("[ÍNDICES] Estimando o percentil 95 dos dias úmidos de cada célula (passada extra)...")
+        limiar_p95 = limiares_p95(ds, fatias())
+    acumulador = IndicesExtremos(ds, limiar_p95)
+    for fatia, ds_fatia in fatias():
+        acumulador.adicionar(fatia, ds_fatia)
+        for ds_ano in acumulador.concluidos():
+            yield motor_tabular.tabela_da_fatia(ds_ano, esparso)
+    for ds_ano in acumulador.finalizar():
+        yield motor_tabular.tabela_da_fatia(ds_ano, esparso)
@@ -0,0 +1,192 @@
+"""
+Defesa Civil Araruna - Inspeção de cabeçalho NetCDF
+Lê apenas metadados (dimensões, variáveis, tipos, atributos) e as
+coordenadas 1-D, sem ler os dados das variáveis. O resultado fica em um
+índice em disco, chaveado pelo SHA-256 do arquivo.
+"""
+
+import json
+import threading
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+import grupos_variaveis
+
+
+INDICE_DIR = Path(__file__).parent / "output" / "metadados"
+INDICE_DIR.mkdir(parents=True, exist_ok=True)
+
+# Largura média estimada de um campo no CSV (valor + separador)
+BYTES_POR_CAMPO_CSV = 12
+
+_memoria: dict[str, dict] = {}
+_lock = threading.Lock()
+
+
+def _para_json(valor):
+    """Converte tipos numpy/pandas em tipos aceitos pelo JSON"""
+    if isinstance(valor, (np.integer,)):
+        return int(valor)
+    if isinstance(valor, (np.floating,)):
+        return None if not np.isfinite(valor) else float(valor)
+    if isinstance(valor, (np.bool_,)):
+        return bool(valor)
+    if isinstance(valor, np.ndarray):
+        return [_para_json(v) for v in valor.tolist()]
+    if isinstance(valor, (list, tuple)):
+        return [_para_json(v) for v in valor]
+    if isinstance(valor, (np.datetime64, pd.Timestamp)):
+        return pd.Timestamp(valor).isoformat()
+    if isinstance(valor, bytes):
+        return valor.decode("utf-8", errors="replace")
+    if isinstance(valor, float) and not np.isfinite(valor):
+        return None
+    if isinstance(valor, (str, int, float, bool)) or valor is None:
+        return valor
+    return str(valor)
+
+
+def _faixa_coordenada(coord) -> dict:
+    """Mínimo, máximo e passo de uma coordenada 1-D já carregada"""
+    valores = coord.values
+    info = {"tamanho": int(valores.size)}
+    if valores.size == 0:
+        return info
+    if np.issubdtype(valores.dtype, np.datetime64):
+        info["min"] = pd.Timestamp(valores.min()).isoformat()
+        info["max"] = pd.Timestamp(valores.max()).isoformat()
+        if valores.size > 1:
+            info["passo"] = str(pd.Timedelta(np.median(np.diff(valores))))
+    elif np.issubdtype(valores.dtype, np.number):
+        info["min"] = _para_json(np.nanmin(valores))
+        info["max"] = _para_json(np.nanmax(valores))
+        if valores.size > 1:
+            info["passo"] = _para_json(np.median(np.diff(valores)))
+            info["crescente"] = bool(valores[-1] >= valores[0])
+    else:
+        info["min"] = _para_json(valores[0])
+        info["max"] = _para_json(valores[-1])
+    return info
+
+
+def _formato_arquivo(caminho_nc: str) -> str:
+    """Identifica o formato pelos bytes iniciais (assinatura do arquivo)"""
+    with open(caminho_nc, "rb") as f:
+        assinatura = f.read(8)
+    if assinatura.startswith(b"\x89HDF"):
+        return "NETCDF4 (HDF5)"
+    if assinatura[:3] == b"CDF":
+        return {1: "NETCDF3_CLASSIC", 2: "NETCDF3_64BIT_OFFSET", 5: "NETCDF3_64BIT_DATA"}.get(
+            assinatura[3], "NETCDF3"
+        )
+    return "desconhecido"
+
+
+def inspecionar(caminho_nc: str) -> dict:
+    """
+    Lê o cabeçalho do arquivo e devolve um resumo em dict.
+    xarray abre as variáveis de forma preguiçosa: só as coordenadas 1-D
+    (índices) são lidas; nenhum dado de variável é carregado.
+    """
+    with xr.open_dataset(caminho_nc) as ds:
+        dimensoes = {str(d): int(n) for d, n in ds.sizes.items()}
+
+        variaveis = {}
+        for nome, var in ds.data_vars.items():
+            encoding = var.encoding
+            variaveis[str(nome)] = {
+                "dims": [str(d) for d in var.dims],
+                "shape": [int(n) for n in var.shape],
+                "dtype": str(var.dtype),
+                "pontos": int(np.prod(var.shape)) if var.shape else 1,
+                "unidade": _para_json(var.attrs.get("units")),
+                "nome_longo": _para_json(var.attrs.get("long_name")),
+                "chunks_disco": _para_json(encoding.get("chunksizes")),
+                "compressao": _para_json(encoding.get("zlib") or encoding.get("compression")),
+                "fill_value": _para_json(encoding.get("_FillValue")),
+            }
+
+        coordenadas = {}
+        for nome, coord in ds.coords.items():
+            item = {"dims": [str(d) for d in coord.dims], "dtype": str(coord.dtype)}
+            if coord.ndim == 1:
+                item.update(_faixa_coordenada(coord))
+            coordenadas[str(nome)] = item
+
+        cobertura = None
+        for nome in ["time", "tempo", "t"]:
+            if nome in coordenadas and "min" in coordenadas[nome]:
+                c = coordenadas[nome]
+                cobertura = {"inicio": c["min"], "fim": c["max"], "passos": c["tamanho"], "passo": c.get("passo")}
+                break
+
+        # Uma tabela por grupo de variáveis com as mesmas dimensões
+        tabelas = []
+        for grupo in grupos_variaveis.agrupar(ds):
+            tabelas.append({
+                "nome": grupo["nome"],
+                "variaveis": [str(v) for v in grupo["variaveis"]],
+                "linhas": grupos_variaveis.pontos(grupo["ds"]),
+                "colunas": len(set(grupo["ds"].variables) | set(grupo["ds"].dims)),
+            })
+        linhas = sum(t["linhas"] for t in tabelas)
+        celulas = sum(t["linhas"] * t["colunas"] for t in tabelas)
+        colunas = max((t["colunas"] for t in tabelas), default=0)
+
+        resumo = {
+            "dimensoes": dimensoes,
+            "variaveis": variaveis,
+            "coordenadas": coordenadas,
+            "cobertura_temporal": cobertura,
+            "atributos": {str(k): _para_json(v) for k, v in ds.attrs.items()},
+            "formato_arquivo": _formato_arquivo(caminho_nc),
+            "estimativa": {
+                "linhas_saida": linhas,
+                "colunas_saida": colunas,
+                "tamanho_csv_mb": round(celulas * BYTES_POR_CAMPO_CSV / (1024 * 1024), 1),
+                "excede_limite_excel": any(t["linhas"] > 1_048_575 for t in tabelas),
+                "tabelas": tabelas,
+            },
+        }
+
+    return resumo
+
+
+def _caminho_indice(sha256: str) -> Path:
+    return INDICE_DIR / f"{sha256}.json"
+
+
+def buscar(sha256: str) -> dict | None:
+    """Metadados já indexados para esse hash (memória, depois disco)"""
+    sha256 = sha256.lower()
+    with _lock:
+        if sha256 in _memoria:
+            return _memoria[sha256]
+    caminho = _caminho_indice(sha256)
+    if caminho.exists():
+        resumo = json.loads(caminho.read_text(encoding="utf-8"))
+        with _lock:
+            _memoria[sha256] = resumo
+        return resumo
+    return None
+
+
+def guardar(sha256: str, resumo: dict):
+    """Grava os metadados no índice"""
+    sha256 = sha256.lower()
+    caminho = _caminho_indice(sha256)
+    caminho.write_text(json.dumps(resumo, ensure_ascii=False), encoding="utf-8")
+    with _lock:
+        _memoria[sha256] = resumo
+
+
+def inspecionar_com_cache(caminho_nc: str, sha256: str) -> dict:
+    """Consulta o índice e só lê o cabeçalho se o hash ainda não foi visto"""
+    resumo = buscar(sha256)
+    if resumo is None:
+        resumo = inspecionar(caminho_nc)
+        guardar(sha256, resumo)
+    return resumo
@@ -4,26 +4,52 @@ Conversor NetCDF para CSV/Excel
 Versão 4.0 - Processamento em chunks para arquivos grandes
 """
 
-import os
-import io
 import gc
 import traceback
+import uuid
+import shutil
+import zipfile
+import hashlib
 from datetime import datetime
 from pathlib import Path
 
-from fastapi import FastAPI, UploadFile, File, HTTPException, Query
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Query, Request, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, Response, FileResponse
-import pandas as pd
-import numpy as np
+from fastapi.responses import StreamingResponse, Response, FileResponse, JSONResponse
+import asyncio
+import xarray as xr
 
+import fila_jobs
+import cache_resultados
+import upload_retomavel
+import subconjunto
+import inspecao
+import escritores
+import motor_tabular
+import conversao_paralela
+import planejador_fatias
+import grupos_variaveis
+import mascara_poligono
+import agregacao_temporal
+import alertas
+import reducao_espacial
+import indices_extremos
+import indice_spi
+import climatologia
+import series_pontos
+import registro_datasets
+import copia_zarr
+import otimizar_netcdf
+from escritores import EXTENSOES, MEDIA_TYPES, FORMATOS_COLUNARES
+
+# xarray é obrigatório (todos os módulos de conversão dependem dele);
+# sem netCDF4 o servidor sobe, mas recusa as conversões
 try:
-    import xarray as xr
     import netCDF4
     NETCDF_OK = True
 except ImportError:
     NETCDF_OK = False
-    print("[ERRO] xarray/netCDF4 não instalados")
+    print("[ERRO] netCDF4 não instalado")
 
 try:
     import openpyxl
@@ -49,7 +75,7 @@ OUTPUT_DIR.mkdir(exist_ok=True)
 
 
 def limpar_arquivos_antigos():
-    """Remove arquivos com mais de 2 horas"""
+    """Remove arquivos com mais de 2 horas (o cache tem limpeza própria, por LRU)"""
     agora = datetime.now()
     for pasta in [TEMP_DIR, OUTPUT_DIR]:
         for arquivo in pasta.iterdir():
@@ -62,108 +88,535 @@ def limpar_arquivos_antigos():
                         pass
 
 
-def converter_netcdf_para_csv_em_partes(caminho_nc: str, caminho_csv: str):
+def abrir_dataset(caminho_nc: str, opcoes: dict | None = None, dataset_id: str | None = None,
+                  acesso: str | None = None) -> xr.Dataset:
+    """
+    Abre o NetCDF de forma preguiçosa (ou a cópia Zarr, se houver uma que
+    sirva ao `acesso`) e aplica a seleção (variáveis, área, período). Com
+    agregação, só ficam as variáveis que serão agregadas; com índices de
+    extremos, SPI ou alertas, só a variável de chuva.
+    `dataset_id` é um dataset do registro: a seleção é feita sobre uma
+    cópia rasa do dataset que o registro mantém aberto, e fechar o
+    resultado não fecha o arquivo compartilhado. Operação bloqueante
+    (abrir o arquivo pode levar segundos): chamar fora do event loop.
+    """
+    acesso = acesso or copia_zarr.acesso_das_opcoes(opcoes)
+    if dataset_id is None:
+        ds = copia_zarr.abrir(caminho_nc, acesso)
+    else:
+        ds = registro_datasets.abrir(dataset_id, acesso).copy()
+    try:
+        ds = subconjunto.aplicar_subconjunto(ds, opcoes)
+        indices_extremos.validar(opcoes)
+        indice_spi.validar(opcoes)
+        alertas.validar(opcoes)
+        if (opcoes or {}).get("agregacao"):
+            ds = agregacao_temporal.preparar(ds, opcoes["agregacao"])
+        if (opcoes or {}).get("indices"):
+            ds = indices_extremos.preparar(ds)
+        if (opcoes or {}).get("spi"):
+            ds = indice_spi.preparar(ds)
+        if (opcoes or {}).get("alertas"):
+            ds = alertas.preparar(ds)
+        reducao_espacial.validar(ds, opcoes)
+        climatologia.validar(ds, opcoes)
+        return ds
+    except Exception:
+        ds.close()
+        raise
+
+
+def iterar_lotes(ds: xr.Dataset, orcamento_mb: float | None = None, esparso: bool = False,
+                 fatores: dict | None = None, estatistica_espacial: str = "media"):
+    """
+    Gera lotes de colunas (motor_tabular) das fatias planejadas para o
+    orçamento de memória. Em caso de MemoryError a fatia é replanejada
+    com 1/8 do orçamento. esparso=True descarta as linhas sem dados.
+    `fatores` (reducao_espacial) reduz a resolução de cada fatia antes da tabela.
+    """
+    orcamento_mb = orcamento_mb or planejador_fatias.ORCAMENTO_FATIA_MB
+    ds = motor_tabular.completar_coordenadas(ds)
+    for fatia in planejador_fatias.planejar(ds, orcamento_mb, fatores):
+        print(f"[3/5] Processando {planejador_fatias.descrever(fatia)}...")
+        
+        try:
+            ds_fatia = reducao_espacial.reduzir(ds.isel(fatia), fatores or {}, estatistica_espacial)
+            lote = motor_tabular.tabela_da_fatia(ds_fatia, esparso)
+            del ds_fatia
+        except MemoryError:
+            if orcamento_mb <= 1:
+                raise
+            print(f"[AVISO] MemoryError em {planejador_fatias.descrever(fatia)}, replanejando com fatias menores...")
+            yield from iterar_lotes(ds.isel(fatia), orcamento_mb / 8, esparso, fatores, estatistica_espacial)
+            continue
+        
+        yield lote
+        del lote
+
+
+def lotes_agregados(ds: xr.Dataset, caminho_nc: str | None, opcoes: dict,
+                    trabalhadores: int = 1, variaveis: list | None = None):
+    """
+    Lotes da tabela agregada no tempo (opcoes["agregacao"]). Cada fatia é
+    reduzida aos seus períodos, em paralelo quando há trabalhadores, e só
+    a tabela agregada chega ao escritor. Com redução espacial as parciais
+    já vêm na grade reduzida. Com opcoes["climatologia"] cada mês ganha
+    a normal, a anomalia, a porcentagem da normal e o percentil.
+    """
+    fatores = reducao_espacial.fatores(ds, opcoes)
+    estatistica_espacial = opcoes.get("estatistica_espacial", "media")
+    fatias = planejador_fatias.planejar(ds, multiplos=fatores)
+    if trabalhadores <= 1 or caminho_nc is None or planejador_fatias.contar_fatias(ds, multiplos=fatores) <= 1:
+        parciais = (
+            (fatia, agregacao_temporal.reduzir_fatia(
+                reducao_espacial.reduzir(ds.isel(fatia), fatores, estatistica_espacial),
+                opcoes["agregacao"], opcoes.get("estatistica", "soma")))
+            for fatia in fatias
+        )
+    else:
+        print(f"[INFO] Agregação paralela: {trabalhadores} processos")
+        parciais = (
+            (fatia, parcial) for fatia, _, parcial in conversao_paralela.iterar_fatias_paralelas(
+                caminho_nc, opcoes, fatias, trabalhadores, saida="parcial",
+                variaveis=variaveis or list(ds.data_vars),
+            )
+        )
+    yield from agregacao_temporal.iterar_agregado(
+        reducao_espacial.grade_reduzida(ds, fatores),
+        ((reducao_espacial.fatia_reduzida(fatia, fatores), parcial) for fatia, parcial in parciais),
+        opcoes["agregacao"], opcoes.get("estatistica", "soma"), bool(opcoes.get("esparso")),
+        transformar=(lambda ds_periodo: climatologia.anomalias(ds_periodo, opcoes["climatologia"]))
+        if opcoes.get("climatologia") else None,
+    )
+
+
+def lotes_indices(ds: xr.Dataset, opcoes: dict):
+    """
+    Lotes da tabela de índices de extremos (Rx1day, Rx5day, R20mm, CDD,
+    CWD e, com limiar, R95p) por célula e ano. As fatias são lidas em ordem
+    de tempo no próprio processo, porque janelas e sequências continuam de
+    uma fatia para a seguinte; com redução espacial os índices saem da
+    grade reduzida. O limiar do R95p vem da climatologia (opcoes
+    ["climatologia"]) sem ler o arquivo de novo; opcoes["r95p"] o estima
+    numa passada extra.
     """
-    Converte NetCDF para CSV processando variável por variável.
-    Evita carregar tudo na memória.
+    fatores = reducao_espacial.fatores(ds, opcoes)
+    estatistica_espacial = opcoes.get("estatistica_espacial", "media")
+    grade = reducao_espacial.grade_reduzida(ds, fatores)
+
+    def fatias():
+        for fatia in planejador_fatias.planejar(ds, multiplos=fatores):
+            yield (reducao_espacial.fatia_reduzida(fatia, fatores),
+                   reducao_espacial.reduzir(ds.isel(fatia), fatores, estatistica_espacial))
+
+    limiar_p95 = climatologia.limiar_indices(grade, opcoes["climatologia"]) \
+        if opcoes.get("climatologia") else None
+    yield from indices_extremos.iterar_indices(
+        grade, fatias, bool(opcoes.get("esparso")),
+        limiar_p95=limiar_p95, estimar_p95=bool(opcoes.get("r95p"))
+    )
+
+
+def lotes_spi(ds: xr.Dataset, caminho_nc: str | None, opcoes: dict, trabalhadores: int = 1):
+    """
+    Lotes da tabela de SPI (spi_1, spi_3, spi_6, spi_12 por célula e mês).
+    Cada fatia traz a série inteira de um bloco de células e é calculada
+    de forma independente, em paralelo quando há trabalhadores. Arquivos
+    com chunks de poucos passos de tempo são lidos várias vezes (um mapa
+    por chunk): para eles o SPI deve vir da cópia Zarr com layout series.
+    """
+    fatores = reducao_espacial.fatores(ds, opcoes)
+    dim = agregacao_temporal.dimensao_tempo(ds)
+    fatias = planejador_fatias.planejar_series(ds, dim, multiplos=fatores)
+    releituras = planejador_fatias.releituras_series(ds, dim, multiplos=fatores)
+    if releituras > 1:
+        print(f"[AVISO] Chunks do arquivo com poucos passos de tempo: o SPI descomprime cada chunk "
+              f"{releituras}x. Otimize o dataset com layout series (/api/netcdf/datasets/{{id}}/otimizar)")
+    if trabalhadores <= 1 or caminho_nc is None or planejador_fatias.contar_series(ds, dim, multiplos=fatores) <= 1:
+        esparso = bool(opcoes.get("esparso"))
+        estatistica_espacial = opcoes.get("estatistica_espacial", "media")
+        for fatia in fatias:
+            print(f"[3/5] SPI de {planejador_fatias.descrever(fatia)}...")
+            ds_fatia = reducao_espacial.reduzir(ds.isel(fatia), fatores, estatistica_espacial)
+            yield motor_tabular.tabela_da_fatia(indice_spi.calcular(ds_fatia), esparso)
+        return
+
+    print(f"[INFO] SPI paralelo: {trabalhadores} processos")
+    for fatia, _, lote in conversao_paralela.iterar_fatias_paralelas(
+        caminho_nc, opcoes, fatias, trabalhadores, saida="lote", variaveis=list(ds.data_vars),
+    ):
+        print(f"[3/5] SPI de {planejador_fatias.descrever(fatia)}")
+        yield lote
+
+
+def lotes_alertas(ds: xr.Dataset, caminho_nc: str | None, opcoes: dict,
+                  trabalhadores: int = 1, contagem: alertas.ContagemAlertas | None = None):
+    """
+    Lotes só com as células e tempos em que a chuva alcança o menor limiar
+    de opcoes["alertas"], fatia por fatia (em paralelo quando há
+    trabalhadores). `contagem` acumula as ocorrências e células por nível.
+    """
+    limiares = opcoes["alertas"]
+    fatores = reducao_espacial.fatores(ds, opcoes)
+    ds = motor_tabular.completar_coordenadas(ds)
+    fatias = planejador_fatias.planejar(ds, multiplos=fatores)
+    if trabalhadores <= 1 or caminho_nc is None or planejador_fatias.contar_fatias(ds, multiplos=fatores) <= 1:
+        fator = alertas.fator_mm_passo(ds)
+        estatistica_espacial = opcoes.get("estatistica_espacial", "media")
+        lotes = (
+            alertas.tabela_alertas(reducao_espacial.reduzir(ds.isel(fatia), fatores, estatistica_espacial),
+                                   limiares, fator)
+            for fatia in fatias
+        )
+    else:
+        print(f"[INFO] Alertas em paralelo: {trabalhadores} processos")
+        lotes = (lote for _, _, lote in conversao_paralela.iterar_fatias_paralelas(
+            caminho_nc, opcoes, fatias, trabalhadores, saida="lote", variaveis=list(ds.data_vars),
+        ))
+    for lote in lotes:
+        if contagem is not None:
+            contagem.adicionar(lote)
+        yield lote
+
+
+def varrer_alertas(caminho_nc: str, opcoes: dict, trabalhadores: int = 1,
+                   dataset_id: str | None = None) -> dict:
+    """Só as contagens da varredura de alertas (triagem, sem gravar tabela)"""
+    ds = abrir_dataset(caminho_nc, opcoes, dataset_id)
+    try:
+        contagem = alertas.contagem_para(ds, opcoes["alertas"])
+        for _ in lotes_alertas(ds, caminho_nc, opcoes, trabalhadores, contagem):
+            pass
+    finally:
+        ds.close()
+    print(f"[ALERTAS] {contagem.descrever()}")
+    return contagem.resumo()
+
+
+def series_nos_pontos(caminho_nc: str, pontos: list[dict], opcoes: dict | None = None,
+                      dataset_id: str | None = None) -> dict:
+    """Séries das células mais próximas dos pontos (series_pontos), com a seleção de variáveis/período"""
+    ds = abrir_dataset(caminho_nc, opcoes, dataset_id, acesso="series")
+    try:
+        return series_pontos.series(ds, pontos)
+    finally:
+        ds.close()
+
+
+def escrever_fatias(ds: xr.Dataset, escritor, caminho_nc: str | None = None,
+                    opcoes: dict | None = None, trabalhadores: int = 1,
+                    variaveis: list | None = None):
+    """
+    Converte o dataset fatia por fatia e entrega cada uma ao escritor,
+    gerando o número de linhas escritas após cada fatia.
+    Com trabalhadores > 1 as fatias são convertidas em processos separados
+    (cada um reabre caminho_nc com as mesmas opções e seleciona `variaveis`,
+    se ds for um grupo) e gravadas em ordem, então a saída é a mesma da
+    conversão serial. Com opcoes["esparso"] as linhas em que todas as
+    variáveis estão ausentes (NaN/_FillValue) são descartadas em cada fatia.
+    Com opcoes["agregacao"] o escritor recebe a tabela agregada por período;
+    com redução espacial (fator_espacial/resolucao) cada fatia é reduzida
+    em blocos antes de virar tabela. Com opcoes["indices"] o escritor
+    recebe os índices de extremos de chuva por célula e ano; com
+    opcoes["spi"], o SPI por célula e mês; com opcoes["alertas"], só as
+    células e tempos acima dos limiares de chuva.
+    """
+    if (opcoes or {}).get("alertas"):
+        contagem = alertas.contagem_para(ds, opcoes["alertas"])
+        for lote in lotes_alertas(ds, caminho_nc, opcoes, trabalhadores, contagem):
+            escritor.escrever(lote)
+            yield motor_tabular.linhas_do_lote(lote)
+        print(f"[ALERTAS] {contagem.descrever()}")
+        return
+
+    if (opcoes or {}).get("spi"):
+        for lote in lotes_spi(ds, caminho_nc, opcoes, trabalhadores):
+            escritor.escrever(lote)
+            yield motor_tabular.linhas_do_lote(lote)
+        return
+
+    if (opcoes or {}).get("indices"):
+        for lote in lotes_indices(ds, opcoes):
+            print(f"[3/5] Índices do ano: {motor_tabular.linhas_do_lote(lote):,} linhas")
+            escritor.escrever(lote)
+            yield motor_tabular.linhas_do_lote(lote)
+        return
+
+    if (opcoes or {}).get("agregacao"):
+        for lote in lotes_agregados(ds, caminho_nc, opcoes, trabalhadores, variaveis):
+            print(f"[3/5] Período agregado: {motor_tabular.linhas_do_lote(lote):,} linhas")
+            escritor.escrever(lote)
+            yield motor_tabular.linhas_do_lote(lote)
+        return
+    
+    esparso = bool((opcoes or {}).get("esparso"))
+    fatores = reducao_espacial.fatores(ds, opcoes)
+    if trabalhadores <= 1 or caminho_nc is None or planejador_fatias.contar_fatias(ds, multiplos=fatores) <= 1:
+        for lote in iterar_lotes(ds, esparso=esparso, fatores=fatores,
+                                 estatistica_espacial=(opcoes or {}).get("estatistica_espacial", "media")):
+            escritor.escrever(lote)
+            yield motor_tabular.linhas_do_lote(lote)
+            del lote
+        return
+    
+    codificar = isinstance(escritor, escritores.EscritorCSV)
+    print(f"[INFO] Conversão paralela: {trabalhadores} processos")
+    fatias = conversao_paralela.iterar_fatias_paralelas(
+        caminho_nc, opcoes, planejador_fatias.planejar(ds, multiplos=fatores), trabalhadores,
+        saida="csv" if codificar else "lote",
+        formato_data=escritor.formato_data if codificar else None,
+        variaveis=variaveis,
+    )
+    for fatia, linhas, parte in fatias:
+        print(f"[3/5] Gravando {planejador_fatias.descrever(fatia)}...")
+        if codificar:
+            escritor.escrever_codificado(parte, linhas)
+        else:
+            escritor.escrever(parte)
+        del parte
+        yield linhas
+
+
+def tabelas_da_conversao(ds: xr.Dataset, opcoes: dict | None = None) -> list[dict]:
+    """
+    Grupos de variáveis (por dimensões) que viram tabelas separadas.
+    Lista vazia = tabela única, como o to_dataframe (um só grupo ou
+    tabela_unica pedida).
+    """
+    if (opcoes or {}).get("tabela_unica"):
+        return []
+    grupos = grupos_variaveis.agrupar(ds)
+    return grupos if len(grupos) > 1 else []
+
+
+def formato_do_arquivo(formato: str, grupos: list) -> str:
+    """Com várias tabelas: planilhas no XLSX, um .zip nos demais formatos"""
+    return "zip" if grupos and formato not in ("xlsx", "zarr") else formato
+
+
+def tipo_do_resultado(formato: str, caminho: Path) -> str:
+    """Formato de um arquivo gravado (o .zarr.zip também termina em .zip)"""
+    if formato != "zarr" and caminho.suffix == EXTENSOES["zip"]:
+        return "zip"
+    return formato
+
+
+def exportar_zarr(ds: xr.Dataset, caminho_saida, opcoes: dict | None = None) -> str:
+    """
+    Grava a seleção como store Zarr (layout e chunks de `opcoes`) e a
+    compacta em um .zarr.zip sem recomprimir, para baixar em um arquivo só.
+    """
+    destino = Path(caminho_saida)
+    if not destino.name.endswith(EXTENSOES["zarr"]):
+        destino = destino.with_suffix(EXTENSOES["zarr"])
+    pasta = destino.with_name(destino.name.removesuffix(".zip"))
+    try:
+        copia_zarr.exportar(ds, pasta, opcoes)
+        with zipfile.ZipFile(destino, "w", zipfile.ZIP_STORED, allowZip64=True) as zf:
+            for arquivo in sorted(pasta.rglob("*")):
+                if arquivo.is_file():
+                    zf.write(arquivo, arquivo.relative_to(pasta).as_posix())
+    finally:
+        shutil.rmtree(pasta, ignore_errors=True)
+    return str(destino)
+
+
+def escrever_saida(ds: xr.Dataset, formato: str, destino, grupos: list | None = None,
+                   caminho_nc: str | None = None, opcoes: dict | None = None,
+                   trabalhadores: int = 1):
+    """
+    Grava a saída em `destino` (caminho ou file-like), gerando o número de
+    linhas após cada fatia. Sem grupos: uma tabela. Com grupos: uma planilha
+    por grupo (XLSX) ou um arquivo por grupo dentro de um zip.
+    """
+    if not grupos:
+        escritor = escritores.criar_escritor(formato, destino, ds)
+        yield from escrever_fatias(ds, escritor, caminho_nc, opcoes, trabalhadores)
+        escritor.fechar()
+        return
+    
+    if formato == "xlsx":
+        escritor = escritores.criar_escritor(formato, destino)
+        for grupo in grupos:
+            print(f"[TABELA] {grupo['nome']}: {dict(grupo['ds'].sizes)}")
+            escritor.nova_tabela(grupo["nome"])
+            yield from escrever_fatias(grupo["ds"], escritor, caminho_nc, opcoes,
+                                       trabalhadores, grupo["variaveis"])
+        escritor.fechar()
+        return
+    
+    # CSV compacta bem; Parquet/Arrow já saem comprimidos
+    compressao = zipfile.ZIP_DEFLATED if formato == "csv" else zipfile.ZIP_STORED
+    with zipfile.ZipFile(destino, "w", compression=compressao) as zf:
+        for grupo in grupos:
+            print(f"[TABELA] {grupo['nome']}: {dict(grupo['ds'].sizes)}")
+            nome_membro = f"{grupo['nome']}{EXTENSOES[formato]}"
+            with zf.open(nome_membro, "w", force_zip64=True) as membro:
+                escritor = escritores.criar_escritor(formato, membro, grupo["ds"])
+                yield from escrever_fatias(grupo["ds"], escritor, caminho_nc, opcoes,
+                                           trabalhadores, grupo["variaveis"])
+                escritor.fechar()
+
+
+def converter_grande_netcdf(ds: xr.Dataset, formato: str, destino, grupos: list | None = None,
+                            caminho_nc: str | None = None, opcoes: dict | None = None,
+                            trabalhadores: int = 1) -> int:
+    """
+    Processa o arquivo NetCDF em partes, entregando cada lote ao escritor.
+    Nunca carrega o arquivo inteiro na memória. Retorna o total de linhas.
+    """
+    variaveis = list(ds.data_vars)
+    
+    print(f"[INFO] Processando {len(variaveis)} variáveis em partes...")
+    
+    total_linhas = sum(escrever_saida(ds, formato, destino, grupos, caminho_nc, opcoes, trabalhadores))
+    
+    print(f"[4/5] Total de {total_linhas:,} linhas escritas")
+    return total_linhas
+
+
+def converter_netcdf_para_arquivo(caminho_nc: str, caminho_saida: str, formato: str = "csv",
+                                  opcoes: dict | None = None, trabalhadores: int = 1) -> str:
+    """
+    Converte NetCDF para CSV, XLSX, Parquet, Arrow ou Zarr, fatia por fatia.
+    Cada escritor grava o lote assim que ele é produzido.
+    Retorna o caminho gravado (extensão .zip quando há várias tabelas).
     """
     print(f"[1/5] Abrindo arquivo NetCDF...")
     
-    # Abrir dataset
-    ds = xr.open_dataset(caminho_nc)
+    # Abrir dataset (já recortado, se houver seleção)
+    ds = abrir_dataset(caminho_nc, opcoes)
+    if opcoes:
+        print(f"[INFO] Seleção: {opcoes}")
     
     print(f"[INFO] Variáveis: {list(ds.data_vars)}")
-    print(f"[INFO] Dimensões: {dict(ds.dims)}")
+    print(f"[INFO] Dimensões: {dict(ds.sizes)}")
+    
+    if formato == "zarr":
+        print("[2/5] Gravando Zarr em partes...")
+        try:
+            caminho_saida = exportar_zarr(ds, caminho_saida, opcoes)
+        finally:
+            ds.close()
+            gc.collect()
+        print("[5/5] Conversão concluída!")
+        return caminho_saida
+    
+    grupos = tabelas_da_conversao(ds, opcoes)
+    if grupos:
+        print(f"[INFO] {len(grupos)} tabelas (variáveis com dimensões diferentes): "
+              f"{', '.join(g['nome'] for g in grupos)}")
     
     # Calcular tamanho total estimado
-    total_pontos = 1
-    for dim in ds.dims.values():
-        total_pontos *= dim
+    tabelas = [g["ds"] for g in grupos] or [ds]
+    total_pontos = sum(grupos_variaveis.pontos(t) for t in tabelas)
     print(f"[INFO] Total de pontos: {total_pontos:,}")
+    print(f"[INFO] Fatias: {sum(planejador_fatias.contar_fatias(t) for t in tabelas):,} "
+          f"(até ~{planejador_fatias.ORCAMENTO_FATIA_MB} MB cada)")
     
-    # Se for muito grande, processar de forma diferente
-    if total_pontos > 10_000_000:  # Mais de 10 milhões de pontos
-        print("[2/5] Arquivo grande detectado - usando método otimizado...")
-        converter_grande_netcdf(ds, caminho_csv)
-    else:
-        print("[2/5] Convertendo para DataFrame...")
-        df = ds.to_dataframe().reset_index()
-        df = df.replace([np.inf, -np.inf], np.nan)
-        
-        print(f"[3/5] Salvando CSV ({len(df):,} linhas)...")
-        df.to_csv(caminho_csv, index=False, encoding='utf-8-sig')
-        del df
-    
-    ds.close()
-    gc.collect()
+    caminho_saida = str(Path(caminho_saida).with_suffix(EXTENSOES[formato_do_arquivo(formato, grupos)]))
+    print(f"[2/5] Gravando {formato.upper()} em partes...")
+    try:
+        converter_grande_netcdf(ds, formato, caminho_saida, grupos, caminho_nc, opcoes, trabalhadores)
+    finally:
+        ds.close()
+        gc.collect()
     
     print("[5/5] Conversão concluída!")
-    return caminho_csv
+    return caminho_saida
 
 
-def converter_grande_netcdf(ds: xr.Dataset, caminho_csv: str):
+def gerar_saida_streaming(ds: xr.Dataset, caminho_nc: Path, formato: str = "csv",
+                          opcoes: dict | None = None, trabalhadores: int = 1,
+                          grupos: list | None = None, liberar=None):
     """
-    Processa arquivo NetCDF muito grande em partes.
-    Salva diretamente no CSV sem carregar tudo na memória.
+    Gera os bytes da saída fatia por fatia, sem gravar a saída em disco.
+    Usado com StreamingResponse: o primeiro bloco sai assim que a
+    primeira fatia é convertida. O escritor grava em um buffer que é
+    drenado a cada fatia. Fecha o dataset e remove o .nc ao final
+    (dataset do registro: chama `liberar` e mantém o arquivo).
     """
-    variaveis = list(ds.data_vars)
-    dimensoes = list(ds.dims)
-    
-    print(f"[INFO] Processando {len(variaveis)} variáveis em partes...")
+    total_linhas = 0
+    try:
+        buffer = escritores.BufferDrenavel()
+        for linhas in escrever_saida(ds, formato, buffer, grupos, str(caminho_nc), opcoes, trabalhadores):
+            total_linhas += linhas
+            yield buffer.drenar()
+        yield buffer.drenar()
+        
+        print(f"[STREAM] Concluído: {total_linhas:,} linhas enviadas")
     
-    # Identificar a dimensão de tempo ou a maior dimensão para dividir
-    dim_dividir = dimensoes[0]
-    tamanho_dim = ds.dims[dim_dividir]
+    except Exception as e:
+        print(f"[ERRO STREAM] {type(e).__name__}: {e}")
+        traceback.print_exc()
+        raise
     
-    # Dividir em chunks de no máximo 100.000 registros por vez
-    chunk_size = min(100, tamanho_dim)  # Processar 100 índices por vez
+    finally:
+        ds.close()
+        if liberar is not None:
+            liberar()
+        else:
+            try:
+                caminho_nc.unlink()
+            except:
+                pass
+        gc.collect()
+
+
+def executar_conversao(caminho_nc: str, caminho_saida: str, formato: str,
+                       nome_base: str, opcoes: dict | None = None,
+                       trabalhadores: int = 1, manter_nc: bool = False) -> dict:
+    """
+    Executa a conversão completa para o formato pedido.
+    Roda em um processo do pool de `fila_jobs`, nunca no event loop; os
+    trabalhadores da conversão paralela são limitados para que os jobs
+    simultâneos não disputem mais processos do que há núcleos.
+    Remove o .nc ao final (exceto com manter_nc, para datasets do
+    registro) e os arquivos parciais em caso de erro.
+    """
+    caminho_nc = Path(caminho_nc)
+    caminho_saida = Path(caminho_saida)
     
-    primeiro = True
-    total_linhas = 0
+    # Cada processo do pool pode estar convertendo ao mesmo tempo
+    limite = conversao_paralela.limitar_trabalhadores(trabalhadores, fila_jobs.MAX_PROCESSOS)
+    if limite < trabalhadores:
+        print(f"[INFO] Trabalhadores limitados a {limite} ({fila_jobs.MAX_PROCESSOS} jobs simultâneos)")
+        trabalhadores = limite
     
-    for i in range(0, tamanho_dim, chunk_size):
-        fim = min(i + chunk_size, tamanho_dim)
-        print(f"[3/5] Processando {dim_dividir}[{i}:{fim}] de {tamanho_dim}...")
-        
-        # Selecionar subset
-        subset = ds.isel({dim_dividir: slice(i, fim)})
+    try:
+        gravado = Path(converter_netcdf_para_arquivo(
+            str(caminho_nc), str(caminho_saida), formato, opcoes, trabalhadores
+        ))
+        tipo = tipo_do_resultado(formato, gravado)
         
-        try:
-            # Converter subset para DataFrame
-            df_chunk = subset.to_dataframe().reset_index()
-            df_chunk = df_chunk.replace([np.inf, -np.inf], np.nan)
-            
-            # Salvar no CSV (append mode)
-            if primeiro:
-                df_chunk.to_csv(caminho_csv, index=False, encoding='utf-8-sig', mode='w')
-                primeiro = False
-            else:
-                df_chunk.to_csv(caminho_csv, index=False, encoding='utf-8-sig', mode='a', header=False)
-            
-            total_linhas += len(df_chunk)
-            del df_chunk
-            gc.collect()
-            
-        except MemoryError:
-            print(f"[AVISO] MemoryError no chunk {i}:{fim}, tentando com chunk menor...")
-            # Tentar com chunks ainda menores
-            for j in range(i, fim, 10):
-                fim_menor = min(j + 10, fim)
-                subset_menor = ds.isel({dim_dividir: slice(j, fim_menor)})
-                df_mini = subset_menor.to_dataframe().reset_index()
-                df_mini = df_mini.replace([np.inf, -np.inf], np.nan)
-                
-                if primeiro:
-                    df_mini.to_csv(caminho_csv, index=False, encoding='utf-8-sig', mode='w')
-                    primeiro = False
-                else:
-                    df_mini.to_csv(caminho_csv, index=False, encoding='utf-8-sig', mode='a', header=False)
-                
-                total_linhas += len(df_mini)
-                del df_mini
-                gc.collect()
-    
-    print(f"[4/5] Total de {total_linhas:,} linhas escritas no CSV")
+        return {
+            "caminho": str(gravado),
+            "media_type": MEDIA_TYPES[tipo],
+            "nome_download": f"{nome_base}{EXTENSOES[tipo]}",
+        }
+    
+    except BaseException:
+        for f in [caminho_saida, caminho_saida.with_suffix(EXTENSOES["zip"])]:
+            try:
+                if f.exists():
+                    f.unlink()
+            except:
+                pass
+        raise
+    
+    finally:
+        # Limpar arquivo NC
+        if not manter_nc:
+            try:
+                caminho_nc.unlink()
+            except:
+                pass
+        gc.collect()
+
+
+@app.on_event("shutdown")
+async def encerrar_pool():
+    fila_jobs.encerrar()
 
 
 @app.get("/")
@@ -181,88 +634,267 @@ async def health():
     return {"status": "healthy"}
 
 
+@app.get("/api/netcdf/cache")
+async def status_cache():
+    """Acertos, faltas e ocupação do cache de resultados"""
+    return cache_resultados.estatisticas()
+
+
 @app.options("/api/netcdf/converter")
 async def options_converter():
     return Response(status_code=200)
 
 
-@app.post("/api/netcdf/converter")
-async def converter_netcdf(
-    arquivo: UploadFile = File(...),
-    formato: str = Query("csv", regex="^(csv|xlsx)$")
-):
-    """Converte NetCDF para CSV ou Excel"""
-    
+def validar_pedido_conversao(nome_arquivo: str, formato: str, modo: str):
+    """Validações comuns aos endpoints que disparam conversão"""
     if not NETCDF_OK:
-        raise HTTPException(500, "Bibliotecas NetCDF não instaladas")
+        raise HTTPException(500, "netCDF4 não instalado")
     
-    if not arquivo.filename.lower().endswith('.nc'):
+    if not nome_arquivo.lower().endswith('.nc'):
         raise HTTPException(400, "Arquivo deve ser .nc")
     
-    limpar_arquivos_antigos()
+    if modo == "stream" and formato in ("xlsx", "zarr"):
+        raise HTTPException(400, "modo=stream não está disponível para Excel e Zarr")
     
-    # Caminhos temporários
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    nome_base = arquivo.filename.rsplit('.', 1)[0]
-    caminho_nc = TEMP_DIR / f"{timestamp}_{arquivo.filename}"
-    caminho_csv = OUTPUT_DIR / f"{timestamp}_{nome_base}.csv"
-    caminho_xlsx = OUTPUT_DIR / f"{timestamp}_{nome_base}.xlsx"
+    if formato in FORMATOS_COLUNARES and not escritores.PYARROW_OK:
+        raise HTTPException(500, "pyarrow não instalado (necessário para Parquet/Arrow)")
     
+    if formato == "zarr" and not copia_zarr.ZARR_OK:
+        raise HTTPException(500, "zarr não instalado (necessário para a saída Zarr)")
+
+
+def parametros_subconjunto(
+    variaveis: str | None = Query(None, description="Variáveis separadas por vírgula, ex.: pr,tas"),
+    lat_min: float | None = Query(None, ge=-90, le=90),
+    lat_max: float | None = Query(None, ge=-90, le=90),
+    lon_min: float | None = Query(None, ge=-180, le=360),
+    lon_max: float | None = Query(None, ge=-180, le=360),
+    inicio: str | None = Query(None, description="Data inicial, ex.: 2024-01-01"),
+    fim: str | None = Query(None, description="Data final, ex.: 2024-03-31"),
+    passo_tempo: int = Query(1, ge=1, description="Usar 1 a cada N passos de tempo"),
+    passo_espacial: int = Query(1, ge=1, description="Usar 1 a cada N pontos de grade"),
+    poligono: str | None = Query(
+        None, regex="^[0-9a-f]{32}$", description="id de um GeoJSON enviado em /api/netcdf/poligonos"
+    )
+) -> dict:
+    """Parâmetros de seleção comuns aos endpoints de conversão"""
+    caminho_poligono = None
+    if poligono:
+        caminho_poligono = mascara_poligono.caminho_poligono(poligono)
+        if caminho_poligono is None:
+            raise HTTPException(404, "Polígono não encontrado. Envie o GeoJSON em /api/netcdf/poligonos")
     try:
-        print(f"\n{'='*60}")
-        print(f"[INICIO] Conversão: {arquivo.filename}")
-        print(f"[FORMATO] {formato.upper()}")
-        print(f"{'='*60}")
-        
-        # Salvar arquivo upload
-        print("[UPLOAD] Salvando arquivo no servidor...")
-        with open(caminho_nc, "wb") as f:
-            while chunk := await arquivo.read(1024 * 1024):
-                f.write(chunk)
+        return subconjunto.montar_opcoes(
+            variaveis, lat_min, lat_max, lon_min, lon_max, inicio, fim, passo_tempo, passo_espacial,
+            caminho_poligono
+        )
+    except subconjunto.ErroSubconjunto as e:
+        raise HTTPException(400, str(e))
+
+
+def parametros_conversao(
+    opcoes: dict = Depends(parametros_subconjunto),
+    tabela_unica: bool = Query(
+        False, description="Uma só tabela com todas as variáveis (expande para a união das dimensões)"
+    ),
+    esparso: bool = Query(
+        False, description="Omitir as linhas em que todas as variáveis estão sem dados (NaN/_FillValue)"
+    ),
+    agregacao: str | None = Query(
+        None, regex="^(diario|mensal|anual)$",
+        description="Agregar no tempo: diario (de horário), mensal (de diário), anual (de mensal)"
+    ),
+    estatistica: str = Query(
+        "soma", regex="^(soma|media|maximo)$",
+        description="Estatística da agregação (a soma de taxas, ex.: kg m-2 s-1, sai em mm)"
+    ),
+    indices: bool = Query(
+        False, description="Índices de extremos de chuva (Rx1day, Rx5day, R20mm, CDD, CWD) por célula e ano"
+    ),
+    r95p: bool = Query(
+        False, description="Com os índices: incluir o R95p estimando o percentil 95 (lê a chuva duas vezes)"
+    ),
+    climatologia_id: str | None = Query(
+        None, alias="climatologia", regex="^[0-9a-f]{32}$",
+        description="id de /api/netcdf/climatologias: totais mensais com normal, anomalia e % da normal; "
+                    "com os índices, o R95p usa o percentil 95 diário guardado (uma leitura só)"
+    ),
+    spi: bool = Query(
+        False, description="SPI-1/3/6/12 (índice de seca) por célula e mês, calibrado no período do arquivo; "
+                           "arquivos com chunks no tempo precisam da cópia Zarr com layout series"
+    ),
+    alertas_chuva: bool = Query(
+        False, alias="alertas",
+        description="Só as células e tempos com chuva acima dos limiares (triagem de previsões)"
+    ),
+    limiares: str | None = Query(
+        None, description="Limiares de alerta em mm no passo de tempo, ex.: 30,50,80 (padrão)"
+    ),
+    fator_espacial: int = Query(1, ge=1, le=100, description="Juntar blocos de N x N células da grade"),
+    resolucao: float | None = Query(None, gt=0, description="Resolução de saída em graus, ex.: 0.25"),
+    estatistica_espacial: str = Query(
+        "media", regex="^(media|soma|maximo)$", description="Estatística dos blocos da redução espacial"
+    ),
+    layout: str | None = Query(
+        None, regex="^(series|mapas)$",
+        description="Saída Zarr: chunks com a série inteira (series, padrão) ou com a grade inteira (mapas)"
+    ),
+    chunks: str | None = Query(None, description="Saída Zarr: chunks por dimensão, ex.: time=365,lat=30,lon=30")
+) -> dict:
+    """Opções de conversão (entram na chave do cache junto com a seleção)"""
+    if tabela_unica:
+        opcoes["tabela_unica"] = True
+    if esparso:
+        opcoes["esparso"] = True
+    if agregacao:
+        opcoes["agregacao"] = agregacao
+        opcoes["estatistica"] = estatistica
+    if indices:
+        opcoes["indices"] = True
+    if r95p:
+        opcoes["r95p"] = True
+    if climatologia_id:
+        if not climatologia.existe(climatologia_id):
+            raise HTTPException(404, "Climatologia não encontrada. Crie em /api/netcdf/climatologias")
+        opcoes["climatologia"] = climatologia_id
+        if not indices:
+            opcoes.setdefault("agregacao", "mensal")
+            opcoes.setdefault("estatistica", estatistica)
+    if spi:
+        opcoes["spi"] = True
+    if alertas_chuva:
+        try:
+            opcoes["alertas"] = alertas.ler_limiares(limiares)
+        except alertas.ErroAlertas as e:
+            raise HTTPException(400, str(e))
+    if resolucao:
+        opcoes["resolucao"] = float(resolucao)
+    elif fator_espacial > 1:
+        opcoes["fator_espacial"] = int(fator_espacial)
+    if "resolucao" in opcoes or "fator_espacial" in opcoes:
+        opcoes["estatistica_espacial"] = estatistica_espacial
+    if layout:
+        opcoes["layout"] = layout
+    if chunks:
+        try:
+            opcoes["chunks"] = copia_zarr.ler_chunks(chunks)
+        except copia_zarr.ErroZarr as e:
+            raise HTTPException(400, str(e))
+    return opcoes
+
+
+def novo_caminho_temp(nome_arquivo: str) -> Path:
+    """Caminho único em TEMP_DIR para um .nc recebido"""
+    timestamp = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+    return TEMP_DIR / f"{timestamp}_{nome_arquivo}"
+
+
+def resposta_job(job_id: str, status: str) -> JSONResponse:
+    """
+    Resposta do modo job: sempre 202 com o mesmo formato, mesmo quando o
+    resultado veio do cache e o job já nasce concluído.
+    """
+    return JSONResponse(
+        status_code=202,
+        content={
+            "job_id": job_id,
+            "status": status,
+            "status_url": f"/api/netcdf/jobs/{job_id}",
+            "resultado_url": f"/api/netcdf/jobs/{job_id}/resultado",
+        },
+    )
+
+
+async def processar_nc_recebido(caminho_nc: Path, sha256_hex: str, nome_arquivo: str,
+                               formato: str, modo: str, opcoes: dict,
+                               trabalhadores: int | None = None, liberar=None):
+    """
+    Converte um .nc já gravado em TEMP_DIR (upload simples ou retomável)
+    ou um dataset do registro (com `liberar`: o .nc é mantido e `liberar`
+    é chamado quando a conversão termina).
+    Consulta o cache e despacha para o modo pedido (direto, job ou stream).
+    A saída não depende de `trabalhadores`, por isso ele fica fora da chave do cache.
+    """
+    trabalhadores = trabalhadores or conversao_paralela.TRABALHADORES_PADRAO
+    nome_base = nome_arquivo.rsplit('.', 1)[0]
+    extensao = EXTENSOES[formato]
+    registrado = liberar is not None
+    caminho_saida = OUTPUT_DIR / novo_caminho_temp(nome_arquivo).with_suffix(extensao).name
+    parciais = [caminho_saida, caminho_saida.with_suffix(EXTENSOES["zip"])]
+    if not registrado:
+        parciais.append(caminho_nc)
+    # Liberar/remover o .nc é responsabilidade de quem assume a conversão
+    # (stream ou job); nos demais casos, do finally abaixo
+    repassado = False
+    
+    try:
+        if formato == "zarr":
+            copia_zarr.validar_exportacao(opcoes)
         
-        tamanho_mb = caminho_nc.stat().st_size / (1024 * 1024)
-        print(f"[OK] Arquivo salvo: {tamanho_mb:.2f} MB")
+        # Mesmo arquivo + mesmas opções já convertido? Servir do cache
+        chave = cache_resultados.calcular_chave(sha256_hex, formato, opcoes)
+        em_cache = cache_resultados.buscar(chave, extensao, EXTENSOES["zip"])
+        if em_cache is not None:
+            if not registrado:
+                caminho_nc.unlink()
+            print(f"[CACHE] Resultado reaproveitado: {em_cache.name}")
+            tipo = tipo_do_resultado(formato, em_cache)
+            resultado = {
+                "caminho": str(em_cache),
+                "media_type": MEDIA_TYPES[tipo],
+                "nome_download": f"{nome_base}{EXTENSOES[tipo]}",
+            }
+            if modo == "job":
+                job_id = fila_jobs.registrar_job_concluido(
+                    resultado, arquivo=nome_arquivo, formato=formato
+                )
+                return resposta_job(job_id, "concluido")
+            return FileResponse(
+                path=resultado["caminho"],
+                filename=resultado["nome_download"],
+                media_type=resultado["media_type"],
+            )
         
-        # Converter para CSV primeiro (sempre)
-        converter_netcdf_para_csv_em_partes(str(caminho_nc), str(caminho_csv))
+        if modo == "stream":
+            # Abrir aqui para que um arquivo inválido ainda gere erro HTTP
+            ds = await asyncio.to_thread(
+                abrir_dataset, str(caminho_nc), opcoes, sha256_hex if registrado else None
+            )
+            grupos = tabelas_da_conversao(ds, opcoes)
+            tipo = formato_do_arquivo(formato, grupos)
+            print(f"[STREAM] Enviando {tipo.upper()} em partes...")
+            repassado = True
+            return StreamingResponse(
+                gerar_saida_streaming(ds, caminho_nc, formato, opcoes, trabalhadores, grupos, liberar),
+                media_type=MEDIA_TYPES[tipo],
+                headers={"Content-Disposition": f'attachment; filename="{nome_base}{EXTENSOES[tipo]}"'},
+            )
         
-        # Se pediu Excel, converter CSV para XLSX
-        if formato == "xlsx":
-            print("[EXCEL] Convertendo CSV para Excel...")
-            
-            # Ler CSV em chunks e salvar como Excel
-            tamanho_csv = caminho_csv.stat().st_size / (1024 * 1024)
-            
-            if tamanho_csv > 100:  # Maior que 100MB
-                print("[AVISO] CSV muito grande, gerando Excel com amostra de 1M linhas")
-                df = pd.read_csv(caminho_csv, nrows=1048575)
-            else:
-                df = pd.read_csv(caminho_csv)
-            
-            if len(df) > 1048575:
-                df = df.head(1048575)
-                print(f"[AVISO] Truncado para {len(df):,} linhas (limite Excel)")
-            
-            df.to_excel(caminho_xlsx, index=False, engine='openpyxl')
-            del df
-            gc.collect()
-            
-            # Remover CSV temporário
-            caminho_csv.unlink()
-            
-            arquivo_saida = caminho_xlsx
-            media_type = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-            nome_download = f"{nome_base}.xlsx"
-        else:
-            arquivo_saida = caminho_csv
-            media_type = "text/csv"
-            nome_download = f"{nome_base}.csv"
+        if modo == "job":
+            job_id = fila_jobs.criar_job(
+                executar_conversao,
+                str(caminho_nc), str(caminho_saida), formato, nome_base, opcoes, trabalhadores, registrado,
+                ao_concluir=lambda r: {
+                    **r, "caminho": str(cache_resultados.guardar(chave, Path(r["caminho"]).suffix, r["caminho"]))
+                },
+                ao_terminar=liberar,
+                arquivo=nome_arquivo,
+                formato=formato,
+            )
+            repassado = True
+            print(f"[JOB] {job_id} enfileirado")
+            return resposta_job(job_id, "na_fila")
         
-        # Limpar arquivo NC
-        try:
-            caminho_nc.unlink()
-        except:
-            pass
+        # Modo direto: a conversão roda no pool, o event loop segue livre
+        resultado = await asyncio.wrap_future(
+            fila_jobs.submeter(
+                executar_conversao,
+                str(caminho_nc), str(caminho_saida), formato, nome_base, opcoes, trabalhadores, registrado,
+            )
+        )
+        arquivo_saida = cache_resultados.guardar(chave, Path(resultado["caminho"]).suffix, resultado["caminho"])
+        media_type = resultado["media_type"]
+        nome_download = resultado["nome_download"]
         
         print(f"[SUCESSO] Arquivo gerado: {arquivo_saida.name}")
         print(f"[TAMANHO] {arquivo_saida.stat().st_size / (1024*1024):.2f} MB")
@@ -276,12 +908,22 @@ async def converter_netcdf(
             background=None  # Não deletar automaticamente
         )
         
+    except subconjunto.ErroSubconjunto as e:
+        print(f"[ERRO SELEÇÃO] {e}")
+        for f in parciais:
+            try:
+                if f.exists():
+                    f.unlink()
+            except:
+                pass
+        raise HTTPException(400, str(e))
+    
     except MemoryError as e:
         print(f"[ERRO MEMÓRIA] {e}")
         traceback.print_exc()
         
         # Limpar arquivos
-        for f in [caminho_nc, caminho_csv, caminho_xlsx]:
+        for f in parciais:
             try:
                 if f.exists():
                     f.unlink()
@@ -298,7 +940,7 @@ async def converter_netcdf(
         print(f"[ERRO] {type(e).__name__}: {e}")
         traceback.print_exc()
         
-        for f in [caminho_nc, caminho_csv, caminho_xlsx]:
+        for f in parciais:
             try:
                 if f.exists():
                     f.unlink()
@@ -307,6 +949,608 @@ async def converter_netcdf(
         
         gc.collect()
         raise HTTPException(500, f"Erro na conversão: {str(e)}")
+    
+    finally:
+        if registrado and not repassado:
+            liberar()
+
+
+
+
+def dataset_do_pedido(arquivo: UploadFile | None, dataset: str | None):
+    """
+    Confere que o pedido traz um upload ou o id de um dataset registrado
+    (um dos dois). Com o id, devolve (caminho do .nc, metadados); senão None.
+    """
+    if (arquivo is None) == (dataset is None):
+        raise HTTPException(400, "Envie o arquivo ou informe o id de um dataset registrado (apenas um dos dois)")
+    if dataset is None:
+        return None
+    try:
+        return registro_datasets.obter(dataset)
+    except registro_datasets.ErroDataset as e:
+        raise HTTPException(e.status, str(e))
+
+
+@app.post("/api/netcdf/converter")
+async def converter_netcdf(
+    arquivo: UploadFile | None = File(None),
+    dataset: str | None = Query(None, description="Id de um dataset registrado (em vez do upload)"),
+    formato: str = Query("csv", regex="^(csv|xlsx|parquet|arrow|zarr)$"),
+    modo: str = Query("direto", regex="^(direto|job|stream)$"),
+    trabalhadores: int | None = Query(None, ge=1, le=64, description="Processos para converter as fatias em paralelo"),
+    opcoes: dict = Depends(parametros_conversao)
+):
+    """
+    Converte NetCDF para CSV, Excel, Parquet, Arrow IPC ou Zarr (.zarr.zip,
+    só a seleção, com layout/chunks).
+    modo=direto devolve o arquivo na mesma requisição;
+    modo=job devolve um job_id (sempre 202; com status "concluido" se o
+    resultado já estava no cache) e a conversão segue em segundo plano;
+    modo=stream (exceto Excel) envia a saída enquanto ela é gerada.
+    Variáveis com dimensões diferentes (ex.: time_bnds ao lado de pr) viram
+    tabelas separadas: planilhas no Excel, um .zip nos demais formatos.
+    Com `dataset` (id de /api/netcdf/datasets) o arquivo não é reenviado.
+    """
+    
+    registrado = dataset_do_pedido(arquivo, dataset)
+    if registrado is not None:
+        caminho_nc, meta = registrado
+        validar_pedido_conversao(meta["nome_arquivo"], formato, modo)
+        limpar_arquivos_antigos()
+        print(f"\n{'='*60}")
+        print(f"[INICIO] Conversão do dataset {meta['id'][:12]}…: {meta['nome_arquivo']}")
+        print(f"[FORMATO] {formato.upper()}")
+        if opcoes:
+            print(f"[SELEÇÃO] {opcoes}")
+        print(f"{'='*60}")
+        return await processar_nc_recebido(
+            caminho_nc, meta["id"], meta["nome_arquivo"], formato, modo, opcoes, trabalhadores,
+            liberar=registro_datasets.reservar(meta["id"]),
+        )
+    
+    validar_pedido_conversao(arquivo.filename, formato, modo)
+    limpar_arquivos_antigos()
+    
+    caminho_nc = novo_caminho_temp(arquivo.filename)
+    
+    print(f"\n{'='*60}")
+    print(f"[INICIO] Conversão: {arquivo.filename}")
+    print(f"[FORMATO] {formato.upper()}")
+    if opcoes:
+        print(f"[SELEÇÃO] {opcoes}")
+    print(f"{'='*60}")
+    
+    try:
+        # Salvar arquivo upload
+        print("[UPLOAD] Salvando arquivo no servidor...")
+        sha256 = hashlib.sha256()
+        with open(caminho_nc, "wb") as f:
+            while chunk := await arquivo.read(1024 * 1024):
+                sha256.update(chunk)
+                f.write(chunk)
+    except Exception as e:
+        print(f"[ERRO UPLOAD] {type(e).__name__}: {e}")
+        try:
+            caminho_nc.unlink()
+        except:
+            pass
+        raise HTTPException(500, f"Erro ao receber o arquivo: {str(e)}")
+    
+    tamanho_mb = caminho_nc.stat().st_size / (1024 * 1024)
+    print(f"[OK] Arquivo salvo: {tamanho_mb:.2f} MB")
+    
+    return await processar_nc_recebido(
+        caminho_nc, sha256.hexdigest(), arquivo.filename, formato, modo, opcoes, trabalhadores
+    )
+
+
+@app.post("/api/netcdf/alertas")
+async def triagem_alertas(
+    arquivo: UploadFile | None = File(None),
+    dataset: str | None = Query(None, description="Id de um dataset registrado (em vez do upload)"),
+    limiares: str | None = Query(None, description="Limiares em mm no passo de tempo, ex.: 30,50,80 (padrão)"),
+    trabalhadores: int | None = Query(None, ge=1, le=64, description="Processos para varrer as fatias em paralelo"),
+    opcoes: dict = Depends(parametros_subconjunto)
+):
+    """
+    Triagem de previsões: varre a chuva do arquivo contra os limiares e
+    devolve só as contagens por nível (ocorrências e células), a maior
+    chuva e o intervalo com alertas. As linhas ficam em
+    /api/netcdf/converter?alertas=true.
+    """
+    registrado = dataset_do_pedido(arquivo, dataset)
+    trabalhadores = trabalhadores or conversao_paralela.TRABALHADORES_PADRAO
+    if registrado is not None:
+        caminho_nc, meta = registrado
+        liberar = registro_datasets.reservar(meta["id"])
+        try:
+            opcoes["alertas"] = alertas.ler_limiares(limiares)
+            resumo = await asyncio.to_thread(
+                varrer_alertas, str(caminho_nc), opcoes, trabalhadores, meta["id"]
+            )
+        except subconjunto.ErroSubconjunto as e:
+            raise HTTPException(400, str(e))
+        finally:
+            liberar()
+        return {"arquivo": meta["nome_arquivo"], "dataset": meta["id"], **resumo}
+
+    validar_pedido_conversao(arquivo.filename, "csv", "direto")
+    caminho_nc = novo_caminho_temp(arquivo.filename)
+    try:
+        opcoes["alertas"] = alertas.ler_limiares(limiares)
+        with open(caminho_nc, "wb") as f:
+            while chunk := await arquivo.read(1024 * 1024):
+                f.write(chunk)
+        resumo = await asyncio.to_thread(varrer_alertas, str(caminho_nc), opcoes, trabalhadores)
+    except subconjunto.ErroSubconjunto as e:
+        raise HTTPException(400, str(e))
+    finally:
+        caminho_nc.unlink(missing_ok=True)
+    return {"arquivo": arquivo.filename, **resumo}
+
+
+@app.post("/api/netcdf/pontos")
+async def series_em_pontos(
+    arquivo: UploadFile | None = File(None),
+    dataset: str | None = Query(None, description="Id de um dataset registrado (em vez do upload)"),
+    pontos: str = Form(..., description='JSON: [[lat, lon], ...] ou [{"nome": "Araruna", "lat": -6.53, "lon": -35.74}]'),
+    variaveis: str | None = Query(None, description="Variáveis separadas por vírgula, ex.: pr"),
+    inicio: str | None = Query(None, description="Data inicial, ex.: 1991-01-01"),
+    fim: str | None = Query(None, description="Data final, ex.: 2020-12-31")
+):
+    """
+    Série temporal na célula da grade mais próxima de cada ponto (ex.:
+    pluviômetros), sem converter o arquivo. O índice espacial da grade
+    fica em memória para os próximos arquivos na mesma grade. Pontos a
+    mais de um espaçamento da grade da célula mais próxima (fora da área
+    do arquivo) dão 400; cada ponto traz distancia_km e espacamento_km.
+    """
+    registrado = dataset_do_pedido(arquivo, dataset)
+    if registrado is not None:
+        caminho_nc, meta = registrado
+        liberar = registro_datasets.reservar(meta["id"])
+        try:
+            lista = series_pontos.ler_pontos(pontos)
+            opcoes = subconjunto.montar_opcoes(variaveis, inicio=inicio, fim=fim)
+            resultado = await asyncio.to_thread(
+                series_nos_pontos, str(caminho_nc), lista, opcoes, meta["id"]
+            )
+        except subconjunto.ErroSubconjunto as e:
+            raise HTTPException(400, str(e))
+        finally:
+            liberar()
+        return {"arquivo": meta["nome_arquivo"], "dataset": meta["id"], **resultado}
+
+    validar_pedido_conversao(arquivo.filename, "csv", "direto")
+    caminho_nc = novo_caminho_temp(arquivo.filename)
+    try:
+        lista = series_pontos.ler_pontos(pontos)
+        opcoes = subconjunto.montar_opcoes(variaveis, inicio=inicio, fim=fim)
+        with open(caminho_nc, "wb") as f:
+            while chunk := await arquivo.read(1024 * 1024):
+                f.write(chunk)
+        resultado = await asyncio.to_thread(series_nos_pontos, str(caminho_nc), lista, opcoes)
+    except subconjunto.ErroSubconjunto as e:
+        raise HTTPException(400, str(e))
+    finally:
+        caminho_nc.unlink(missing_ok=True)
+    return {"arquivo": arquivo.filename, **resultado}
+
+
+@app.post("/api/netcdf/inspect")
+async def inspecionar_netcdf(arquivo: UploadFile = File(...)):
+    """
+    Lê só o cabeçalho do NetCDF: dimensões, variáveis, tipos, faixas das
+    coordenadas e estimativa do tamanho da saída. Não converte nada.
+    O resultado fica indexado pelo SHA-256 do arquivo.
+    """
+    if not NETCDF_OK:
+        raise HTTPException(500, "netCDF4 não instalado")
+    
+    if not arquivo.filename.lower().endswith('.nc'):
+        raise HTTPException(400, "Arquivo deve ser .nc")
+    
+    caminho_nc = novo_caminho_temp(arquivo.filename)
+    try:
+        sha256 = hashlib.sha256()
+        with open(caminho_nc, "wb") as f:
+            while chunk := await arquivo.read(1024 * 1024):
+                sha256.update(chunk)
+                f.write(chunk)
+        
+        sha256_hex = sha256.hexdigest()
+        resumo = await asyncio.to_thread(inspecao.inspecionar_com_cache, str(caminho_nc), sha256_hex)
+    except Exception as e:
+        print(f"[ERRO INSPEÇÃO] {type(e).__name__}: {e}")
+        raise HTTPException(400, f"Não foi possível ler o cabeçalho do arquivo: {str(e)}")
+    finally:
+        try:
+            caminho_nc.unlink()
+        except:
+            pass
+    
+    return {"arquivo": arquivo.filename, "sha256": sha256_hex, **resumo}
+
+
+@app.get("/api/netcdf/inspect/{sha256}")
+async def inspecionar_por_hash(sha256: str):
+    """
+    Consulta o índice de metadados sem enviar o arquivo. O frontend pode
+    calcular o SHA-256 localmente e só fazer o upload se receber 404.
+    """
+    if len(sha256) != 64 or not all(c in "0123456789abcdefABCDEF" for c in sha256):
+        raise HTTPException(400, "SHA-256 inválido")
+    resumo = inspecao.buscar(sha256)
+    if resumo is None:
+        raise HTTPException(404, "Arquivo ainda não inspecionado")
+    return {"sha256": sha256.lower(), **resumo}
+
+
+@app.post("/api/netcdf/datasets")
+async def registrar_dataset(arquivo: UploadFile = File(...)):
+    """
+    Guarda o NetCDF no servidor e devolve o id (SHA-256 do conteúdo) para
+    usar no parâmetro `dataset` de conversão, pontos, alertas e
+    climatologias, sem reenviar o arquivo. O cabeçalho fica em
+    /api/netcdf/datasets/{id}. Os menos usados são removidos quando o
+    espaço reservado acaba.
+    """
+    if not NETCDF_OK:
+        raise HTTPException(500, "netCDF4 não instalado")
+    if not arquivo.filename.lower().endswith('.nc'):
+        raise HTTPException(400, "Arquivo deve ser .nc")
+
+    caminho_nc = novo_caminho_temp(arquivo.filename)
+    try:
+        sha256 = hashlib.sha256()
+        with open(caminho_nc, "wb") as f:
+            while chunk := await arquivo.read(1024 * 1024):
+                sha256.update(chunk)
+                f.write(chunk)
+        meta = await asyncio.to_thread(
+            registro_datasets.registrar, caminho_nc, arquivo.filename, sha256.hexdigest()
+        )
+    except registro_datasets.ErroDataset as e:
+        raise HTTPException(e.status, str(e))
+    finally:
+        caminho_nc.unlink(missing_ok=True)
+    return {**meta, "cabecalho": inspecao.buscar(meta["id"])}
+
+
+@app.get("/api/netcdf/datasets")
+async def listar_datasets():
+    """Datasets registrados (do uso mais recente para o mais antigo) e ocupação"""
+    return {"datasets": registro_datasets.listar(), **registro_datasets.estatisticas()}
+
+
+@app.get("/api/netcdf/datasets/{dataset_id}")
+async def consultar_dataset(dataset_id: str):
+    """Metadados e cabeçalho de um dataset registrado"""
+    try:
+        caminho, meta = registro_datasets.obter(dataset_id)
+    except registro_datasets.ErroDataset as e:
+        raise HTTPException(e.status, str(e))
+    cabecalho = inspecao.buscar(meta["id"])
+    if cabecalho is None and "cabecalho_otimizado" not in meta:
+        # .nc regravado: o cabeçalho dele não pode entrar no índice com o hash do envio
+        cabecalho = await asyncio.to_thread(inspecao.inspecionar_com_cache, str(caminho), meta["id"])
+    return {**meta, "cabecalho": cabecalho}
+
+
+@app.delete("/api/netcdf/datasets/{dataset_id}")
+async def remover_dataset(dataset_id: str):
+    """Remove um dataset registrado (409 se uma conversão ainda o usa)"""
+    try:
+        registro_datasets.remover(dataset_id)
+    except registro_datasets.ErroDataset as e:
+        raise HTTPException(e.status, str(e))
+    return {"removido": dataset_id.lower()}
+
+
+@app.post("/api/netcdf/datasets/{dataset_id}/otimizar")
+async def otimizar_dataset(
+    dataset_id: str,
+    formato: str = Query(
+        "zarr", regex="^(zarr|nc)$",
+        description="zarr: cópia Zarr ao lado do .nc; nc: regrava o próprio .nc (NetCDF4 zlib/shuffle)"
+    ),
+    layout: str | None = Query(
+        None, regex="^(series|mapas)$",
+        description="series: séries de pluviômetros e SPI (padrão no zarr); mapas: conversões (padrão no nc)"
+    ),
+    chunks: str | None = Query(None, description="Chunks por dimensão, ex.: time=365,lat=30,lon=30"),
+    nivel: int | None = Query(None, ge=1, le=9, description="Nível de compressão (Blosc zstd no zarr, zlib no nc)")
+):
+    """
+    Otimiza (em um job) as leituras do dataset com chunks para o acesso
+    dominante: formato=zarr cria a cópia Zarr, usada nas leituras que o
+    layout favorece; formato=nc troca o .nc por um NetCDF4 comprimido e
+    devolve no job o micro-benchmark de leitura (antes x depois).
+    """
+    if formato == "zarr" and not copia_zarr.ZARR_OK:
+        raise HTTPException(500, "zarr não instalado (necessário para a cópia otimizada)")
+    if formato == "nc" and not otimizar_netcdf.NETCDF4_OK:
+        raise HTTPException(500, "netCDF4 não instalado (necessário para regravar o .nc)")
+    try:
+        caminho_nc, meta = registro_datasets.obter(dataset_id)
+        tamanhos = copia_zarr.ler_chunks(chunks)
+    except registro_datasets.ErroDataset as e:
+        raise HTTPException(e.status, str(e))
+    except copia_zarr.ErroZarr as e:
+        raise HTTPException(400, str(e))
+
+    if formato == "zarr":
+        layout = layout or "series"
+        funcao, argumentos = copia_zarr.otimizar, (
+            str(caminho_nc), layout, tamanhos, nivel or copia_zarr.NIVEL_PADRAO
+        )
+        ao_concluir = lambda r: registro_datasets.otimizado(meta["id"]) or r
+    else:
+        # Trocar o arquivo com conversões abertas falharia no Windows
+        if registro_datasets.em_uso(meta["id"]):
+            raise HTTPException(409, "Dataset em uso por uma conversão; tente novamente mais tarde")
+        layout = layout or otimizar_netcdf.LAYOUT_PADRAO
+        funcao, argumentos = otimizar_netcdf.otimizar, (
+            str(caminho_nc), str(registro_datasets.caminho_temporario(meta["id"])), layout, tamanhos,
+            nivel or otimizar_netcdf.NIVEL_PADRAO,
+        )
+        ao_concluir = lambda r: registro_datasets.substituir_nc(meta["id"], r)
+
+    job_id = fila_jobs.criar_job(
+        funcao, *argumentos,
+        ao_concluir=ao_concluir,
+        ao_terminar=registro_datasets.reservar(meta["id"]),
+        arquivo=meta["nome_arquivo"],
+        formato=formato,
+    )
+    print(f"[JOB] {job_id} enfileirado (otimização {formato} de {meta['id'][:12]}…, layout {layout})")
+    return JSONResponse(
+        status_code=202,
+        content={
+            "job_id": job_id,
+            "status": "na_fila",
+            "status_url": f"/api/netcdf/jobs/{job_id}",
+        },
+    )
+
+
+@app.post("/api/netcdf/poligonos")
+async def enviar_poligono(arquivo: UploadFile = File(...)):
+    """
+    Guarda um GeoJSON (Polygon/MultiPolygon) e devolve o id a usar no
+    parâmetro `poligono` das conversões. A máscara de cada grade é
+    calculada na primeira conversão e reaproveitada nas seguintes.
+    """
+    dados = await arquivo.read()
+    try:
+        id_poligono, _, quantidade = mascara_poligono.guardar_poligono(dados)
+    except mascara_poligono.ErroPoligono as e:
+        raise HTTPException(400, str(e))
+    print(f"[POLÍGONO] {arquivo.filename}: {quantidade} polígono(s) → {id_poligono}")
+    return {"id": id_poligono, "poligonos": quantidade}
+
+
+@app.post("/api/netcdf/climatologias")
+async def criar_climatologia(
+    arquivos: list[UploadFile] = File([]),
+    datasets: str | None = Query(None, description="Ids de datasets registrados, separados por vírgula"),
+    inicio: int = Query(climatologia.PERIODO_PADRAO[0], ge=1800, le=2200, description="Ano inicial da normal"),
+    fim: int = Query(climatologia.PERIODO_PADRAO[1], ge=1800, le=2200, description="Ano final da normal"),
+    variavel: str | None = Query(None, description="Variável de chuva (padrão: detectada)")
+):
+    """
+    Calcula a climatologia mensal (média e percentis por célula) dos
+    arquivos históricos enviados e devolve o id a usar no parâmetro
+    `climatologia` das conversões. Os arquivos enviados não ficam no
+    servidor; `datasets` usa arquivos já registrados (podem ser combinados).
+    """
+    caminhos = []
+    registrados = []
+    nomes = []
+    liberacoes = []
+    try:
+        for dataset_id in (datasets or "").split(","):
+            if dataset_id.strip():
+                caminho, meta = registro_datasets.obter(dataset_id.strip())
+                liberacoes.append(registro_datasets.reservar(meta["id"]))
+                registrados.append(caminho)
+                nomes.append(meta["nome_arquivo"])
+        for arquivo in arquivos:
+            validar_pedido_conversao(arquivo.filename, "csv", "direto")
+            caminho = novo_caminho_temp(arquivo.filename)
+            caminhos.append(caminho)
+            with open(caminho, "wb") as f:
+                while chunk := await arquivo.read(1024 * 1024):
+                    f.write(chunk)
+        # Metadados com os nomes enviados, não os caminhos temporários
+        nomes += [Path(arquivo.filename).name for arquivo in arquivos]
+        id_climatologia = await asyncio.to_thread(
+            climatologia.criar, registrados + caminhos, inicio, fim, variavel, climatologia.PERCENTIS, nomes
+        )
+    except registro_datasets.ErroDataset as e:
+        raise HTTPException(e.status, str(e))
+    except subconjunto.ErroSubconjunto as e:
+        raise HTTPException(400, str(e))
+    finally:
+        for liberar in liberacoes:
+            liberar()
+        for caminho in caminhos:
+            caminho.unlink(missing_ok=True)
+    return {"id": id_climatologia, **climatologia.carregar(id_climatologia).meta}
+
+
+@app.get("/api/netcdf/climatologias")
+async def listar_climatologias():
+    """Climatologias já calculadas no servidor"""
+    return climatologia.listar()
+
+
+@app.post("/api/netcdf/uploads")
+async def criar_upload(
+    nome_arquivo: str = Query(...),
+    tamanho_total: int = Query(..., gt=0),
+    tamanho_parte: int | None = Query(None, gt=0),
+    sha256: str | None = Query(None, regex="^[0-9a-fA-F]{64}$")
+):
+    """
+    Inicia um upload retomável. O cliente envia as partes com
+    PUT /api/netcdf/uploads/{id}/partes/{n} (n a partir de 0, qualquer ordem)
+    e conclui com POST /api/netcdf/uploads/{id}/finalizar.
+    """
+    if not nome_arquivo.lower().endswith('.nc'):
+        raise HTTPException(400, "Arquivo deve ser .nc")
+    try:
+        return upload_retomavel.criar_sessao(Path(nome_arquivo).name, tamanho_total, tamanho_parte, sha256)
+    except upload_retomavel.ErroUpload as e:
+        raise HTTPException(e.status, str(e))
+
+
+@app.put("/api/netcdf/uploads/{sessao_id}/partes/{numero}")
+async def enviar_parte_upload(sessao_id: str, numero: int, request: Request):
+    """
+    Recebe uma parte e grava direto na posição final do arquivo.
+    A parte só conta como recebida depois que todos os bytes esperados
+    foram gravados (um reenvio interrompido a deixa faltando).
+    """
+    try:
+        arquivo, esperado = await asyncio.to_thread(upload_retomavel.abrir_parte, sessao_id, numero)
+    except upload_retomavel.ErroUpload as e:
+        raise HTTPException(e.status, str(e))
+    
+    recebidos = 0
+    with arquivo:
+        async for bloco in request.stream():
+            recebidos += len(bloco)
+            if recebidos > esperado:
+                raise HTTPException(400, f"Parte {numero} maior que o esperado ({esperado} bytes)")
+            await asyncio.to_thread(arquivo.write, bloco)
+    
+    if recebidos != esperado:
+        raise HTTPException(400, f"Parte {numero} incompleta: {recebidos} de {esperado} bytes")
+    
+    return await asyncio.to_thread(upload_retomavel.registrar_parte, sessao_id, numero)
+
+
+@app.get("/api/netcdf/uploads/{sessao_id}")
+async def status_upload(sessao_id: str):
+    """Partes e faixas de bytes já recebidas (para retomar o envio)"""
+    try:
+        return upload_retomavel.resumo_sessao(upload_retomavel.carregar_sessao(sessao_id))
+    except upload_retomavel.ErroUpload as e:
+        raise HTTPException(e.status, str(e))
+
+
+@app.delete("/api/netcdf/uploads/{sessao_id}")
+async def cancelar_upload(sessao_id: str):
+    try:
+        upload_retomavel.cancelar_sessao(sessao_id)
+    except upload_retomavel.ErroUpload as e:
+        raise HTTPException(e.status, str(e))
+    return {"status": "cancelado"}
+
+
+@app.post("/api/netcdf/uploads/{sessao_id}/finalizar")
+async def finalizar_upload(
+    sessao_id: str,
+    formato: str = Query("csv", regex="^(csv|xlsx|parquet|arrow|zarr)$"),
+    modo: str = Query("job", regex="^(direto|job|stream)$"),
+    trabalhadores: int | None = Query(None, ge=1, le=64, description="Processos para converter as fatias em paralelo"),
+    opcoes: dict = Depends(parametros_conversao)
+):
+    """Monta o arquivo em TEMP_DIR e dispara a conversão (padrão: modo=job)"""
+    try:
+        sessao = upload_retomavel.carregar_sessao(sessao_id)
+    except upload_retomavel.ErroUpload as e:
+        raise HTTPException(e.status, str(e))
+    
+    nome_arquivo = sessao["nome_arquivo"]
+    validar_pedido_conversao(nome_arquivo, formato, modo)
+    limpar_arquivos_antigos()
+    
+    caminho_nc = novo_caminho_temp(nome_arquivo)
+    try:
+        sha256_hex = await asyncio.to_thread(upload_retomavel.finalizar_sessao, sessao_id, caminho_nc)
+    except upload_retomavel.ErroUpload as e:
+        raise HTTPException(e.status, str(e))
+    
+    print(f"\n{'='*60}")
+    print(f"[INICIO] Conversão (upload retomável): {nome_arquivo}")
+    print(f"[FORMATO] {formato.upper()}")
+    print(f"{'='*60}")
+    
+    return await processar_nc_recebido(
+        caminho_nc, sha256_hex, nome_arquivo, formato, modo, opcoes, trabalhadores
+    )
+
+
+@app.post("/api/netcdf/uploads/{sessao_id}/dataset")
+async def registrar_upload(sessao_id: str):
+    """Monta o arquivo do upload retomável e o guarda como dataset (ver /api/netcdf/datasets)"""
+    try:
+        sessao = upload_retomavel.carregar_sessao(sessao_id)
+    except upload_retomavel.ErroUpload as e:
+        raise HTTPException(e.status, str(e))
+
+    nome_arquivo = sessao["nome_arquivo"]
+    if not nome_arquivo.lower().endswith('.nc'):
+        raise HTTPException(400, "Arquivo deve ser .nc")
+
+    caminho_nc = novo_caminho_temp(nome_arquivo)
+    try:
+        sha256_hex = await asyncio.to_thread(upload_retomavel.finalizar_sessao, sessao_id, caminho_nc)
+        meta = await asyncio.to_thread(registro_datasets.registrar, caminho_nc, nome_arquivo, sha256_hex)
+    except upload_retomavel.ErroUpload as e:
+        raise HTTPException(e.status, str(e))
+    except registro_datasets.ErroDataset as e:
+        raise HTTPException(e.status, str(e))
+    finally:
+        caminho_nc.unlink(missing_ok=True)
+    return {**meta, "cabecalho": inspecao.buscar(meta["id"])}
+
+
+@app.get("/api/netcdf/jobs/{job_id}")
+async def status_job(job_id: str):
+    """Consulta o andamento de uma conversão enfileirada"""
+    job = fila_jobs.obter_job(job_id)
+    if job is None:
+        raise HTTPException(404, "Job não encontrado ou expirado")
+    
+    resultado = job.pop("resultado")
+    if resultado is not None and "caminho" not in resultado:
+        job["resultado"] = resultado  # Jobs sem arquivo (ex.: cópia Zarr de um dataset)
+    elif resultado is not None:
+        caminho = Path(resultado["caminho"])
+        job["nome_download"] = resultado["nome_download"]
+        job["tamanho_mb"] = round(caminho.stat().st_size / (1024 * 1024), 2) if caminho.exists() else None
+        job["resultado_url"] = f"/api/netcdf/jobs/{job_id}/resultado"
+    return job
+
+
+@app.get("/api/netcdf/jobs/{job_id}/resultado")
+async def resultado_job(job_id: str):
+    """Baixa o arquivo gerado por um job concluído"""
+    job = fila_jobs.obter_job(job_id)
+    if job is None:
+        raise HTTPException(404, "Job não encontrado ou expirado")
+    
+    if job["status"] == "erro":
+        raise HTTPException(500, f"Erro na conversão: {job['erro']}")
+    if job["status"] != "concluido":
+        raise HTTPException(409, f"Conversão ainda não concluída (status: {job['status']})")
+    
+    resultado = job["resultado"]
+    if "caminho" not in resultado:
+        raise HTTPException(404, f"Este job não gera arquivo; o resultado está em /api/netcdf/jobs/{job_id}")
+    caminho = Path(resultado["caminho"])
+    if not caminho.exists():
+        raise HTTPException(410, "Arquivo de resultado expirou, envie o arquivo novamente")
+    
+    return FileResponse(
+        path=str(caminho),
+        filename=resultado["nome_download"],
+        media_type=resultado["media_type"],
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,183 @@
+"""
+Defesa Civil Araruna - Máscara de polígono (GeoJSON) sobre a grade
+Marca as células da grade lat/lon que caem dentro de um ou mais polígonos
+(ex.: Araruna e municípios vizinhos). O teste ponto-no-polígono é feito
+uma vez por par (grade, polígono) e a máscara fica em disco: conversões
+seguintes de arquivos na mesma grade só leem o .npy.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+
+
+MASCARAS_DIR = Path(__file__).parent / "output" / "mascaras"
+MASCARAS_DIR.mkdir(parents=True, exist_ok=True)
+
+# Polígonos enviados ao servidor (nome = hash do conteúdo)
+POLIGONOS_DIR = MASCARAS_DIR / "poligonos"
+POLIGONOS_DIR.mkdir(parents=True, exist_ok=True)
+
+_memoria: dict[str, np.ndarray] = {}
+_lock = threading.Lock()
+
+
+class ErroPoligono(ValueError):
+    """GeoJSON inválido ou sem polígonos"""
+
+
+def _aneis(coordenadas) -> list[np.ndarray]:
+    """Anéis de um Polygon GeoJSON (o primeiro é o contorno, os demais buracos)"""
+    aneis = []
+    for anel in coordenadas:
+        pontos = np.asarray(anel, dtype=np.float64)
+        if pontos.ndim != 2 or pontos.shape[0] < 3 or pontos.shape[1] < 2:
+            raise ErroPoligono("Anel de polígono com menos de 3 pontos")
+        aneis.append(pontos[:, :2])
+    return aneis
+
+
+def _geometrias(objeto) -> list:
+    """Geometrias de um GeoJSON (FeatureCollection, Feature ou geometria)"""
+    tipo = objeto.get("type") if isinstance(objeto, dict) else None
+    if tipo == "FeatureCollection":
+        return [g for f in objeto.get("features", []) for g in _geometrias(f)]
+    if tipo == "Feature":
+        return _geometrias(objeto.get("geometry") or {})
+    if tipo == "GeometryCollection":
+        return [g for geo in objeto.get("geometries", []) for g in _geometrias(geo)]
+    if tipo in ("Polygon", "MultiPolygon"):
+        return [objeto]
+    return []
+
+
+def ler_poligonos(dados: bytes) -> list[list[np.ndarray]]:
+    """Polígonos (lista de anéis lon/lat) de um GeoJSON"""
+    try:
+        objeto = json.loads(dados)
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        raise ErroPoligono(f"GeoJSON inválido: {e}")
+
+    poligonos = []
+    for geometria in _geometrias(objeto):
+        if geometria["type"] == "Polygon":
+            poligonos.append(_aneis(geometria["coordinates"]))
+        else:
+            poligonos.extend(_aneis(p) for p in geometria["coordinates"])
+    if not poligonos:
+        raise ErroPoligono("O GeoJSON não contém Polygon/MultiPolygon")
+    return poligonos
+
+
+def hash_poligonos(poligonos: list[list[np.ndarray]]) -> str:
+    """Identificador do conteúdo (independe de espaços/propriedades do arquivo)"""
+    h = hashlib.sha256()
+    for aneis in poligonos:
+        h.update(b"P")
+        for anel in aneis:
+            h.update(b"A")
+            h.update(np.ascontiguousarray(anel, dtype=np.float64).tobytes())
+    return h.hexdigest()[:32]
+
+
+def _dentro_do_anel(x: np.ndarray, y: np.ndarray, anel: np.ndarray) -> np.ndarray:
+    """Regra par-ímpar (ray casting), vetorizada sobre os pontos"""
+    dentro = np.zeros(x.shape, dtype=bool)
+    xa, ya = anel[:, 0], anel[:, 1]
+    xb, yb = np.roll(xa, 1), np.roll(ya, 1)
+    for x1, y1, x2, y2 in zip(xa, ya, xb, yb):
+        if y1 == y2:
+            continue
+        cruza = (y1 > y) != (y2 > y)
+        dentro ^= cruza & (x < (x2 - x1) * (y - y1) / (y2 - y1) + x1)
+    return dentro
+
+
+def calcular_mascara(lat: np.ndarray, lon: np.ndarray,
+                     poligonos: list[list[np.ndarray]]) -> np.ndarray:
+    """
+    Máscara booleana (lat, lon): True para os centros de célula dentro de
+    algum polígono. Só os pontos dentro da caixa de cada polígono são testados.
+    """
+    lon = np.where(lon > 180, lon - 360, lon)  # grades 0..360
+    y, x = np.meshgrid(lat.astype(np.float64), lon.astype(np.float64), indexing="ij")
+    mascara = np.zeros(y.shape, dtype=bool)
+    for aneis in poligonos:
+        contorno = aneis[0]
+        (xmin, ymin), (xmax, ymax) = contorno.min(axis=0), contorno.max(axis=0)
+        caixa = (x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax)
+        if not caixa.any():
+            continue
+        xs, ys = x[caixa], y[caixa]
+        dentro = _dentro_do_anel(xs, ys, contorno)
+        for buraco in aneis[1:]:
+            dentro &= ~_dentro_do_anel(xs, ys, buraco)
+        mascara[caixa] |= dentro
+    return mascara
+
+
+def _chave(lat: np.ndarray, lon: np.ndarray, id_poligono: str) -> str:
+    """Chave da máscara: definição da grade (coordenadas) + polígono"""
+    h = hashlib.sha256(id_poligono.encode())
+    for coord in (lat, lon):
+        coord = np.ascontiguousarray(coord, dtype=np.float64)
+        h.update(str(coord.shape).encode())
+        h.update(coord.tobytes())
+    return h.hexdigest()
+
+
+def carregar_poligonos(caminho: str) -> tuple[str, list]:
+    """(id, polígonos) de um arquivo GeoJSON local"""
+    try:
+        dados = Path(caminho).read_bytes()
+    except OSError as e:
+        raise ErroPoligono(f"Não foi possível ler o polígono: {e}")
+    poligonos = ler_poligonos(dados)
+    return hash_poligonos(poligonos), poligonos
+
+
+def mascara_da_grade(lat: np.ndarray, lon: np.ndarray, caminho_poligono: str) -> np.ndarray:
+    """
+    Máscara da grade para o polígono, calculada só na primeira vez
+    (memória do processo, depois disco).
+    """
+    id_poligono, poligonos = carregar_poligonos(caminho_poligono)
+    chave = _chave(lat, lon, id_poligono)
+    with _lock:
+        if chave in _memoria:
+            return _memoria[chave]
+
+    caminho = MASCARAS_DIR / f"{chave}.npy"
+    if caminho.exists():
+        mascara = np.load(caminho)
+    else:
+        mascara = calcular_mascara(lat, lon, poligonos)
+        temporario = caminho.with_suffix(f".{os.getpid()}.tmp")
+        with open(temporario, "wb") as f:
+            np.save(f, mascara)
+        os.replace(temporario, caminho)
+        print(f"[MÁSCARA] {int(mascara.sum()):,} de {mascara.size:,} células dentro do polígono")
+
+    with _lock:
+        _memoria[chave] = mascara
+    return mascara
+
+
+def guardar_poligono(dados: bytes) -> tuple[str, Path, int]:
+    """Valida e guarda um GeoJSON enviado: (id, caminho, nº de polígonos)"""
+    poligonos = ler_poligonos(dados)
+    id_poligono = hash_poligonos(poligonos)
+    caminho = POLIGONOS_DIR / f"{id_poligono}.geojson"
+    if not caminho.exists():
+        caminho.write_bytes(dados)
+    return id_poligono, caminho, len(poligonos)
+
+
+def caminho_poligono(id_poligono: str) -> Path | None:
+    """Arquivo de um polígono já enviado ao servidor (ou None)"""
+    caminho = POLIGONOS_DIR / f"{id_poligono}.geojson"
+    return caminho if caminho.exists() else None
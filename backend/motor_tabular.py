@@ -0,0 +1,159 @@
+"""
+Defesa Civil Araruna - Motor de conversão NetCDF -> tabela
+Substitui Dataset.to_dataframe().reset_index() nas fatias: as coordenadas
+são expandidas com numpy (repeat/tile), as variáveis são achatadas sem
+cópia quando já estão na ordem das dimensões e inf é trocado por NaN no
+próprio array. O resultado é um "lote": dict nome -> array 1-D, na mesma
+ordem de linhas e colunas que o to_dataframe produziria.
+"""
+
+import math
+
+import numpy as np
+import pandas as pd
+
+
+def _coluna_dimensao(ds, dim, tamanho: int):
+    """Valores da coordenada de uma dimensão (ou 0..n-1 se não houver)"""
+    if dim in ds.variables:
+        return np.asarray(ds.variables[dim].values)
+    return np.arange(tamanho)
+
+
+def _sanitizar(coluna: np.ndarray, proprio: bool) -> np.ndarray:
+    """
+    Troca inf/-inf por NaN. Altera no próprio array quando ele foi criado
+    aqui; caso contrário (pode ser o cache do Dataset) copia antes, e só
+    se houver algum inf.
+    """
+    if coluna.dtype.kind != "f":
+        return coluna
+    invalidos = np.isinf(coluna)
+    if invalidos.any():
+        if not proprio or not coluna.flags.writeable:
+            coluna = coluna.copy()
+        coluna[invalidos] = np.nan
+    return coluna
+
+
+def completar_coordenadas(ds):
+    """
+    Cria a coordenada 0..n-1 das dimensões que não têm uma, para que as
+    fatias isel mantenham o índice original (e não recomecem do zero).
+    """
+    faltando = {d: np.arange(n) for d, n in ds.sizes.items() if d not in ds.variables}
+    return ds.assign_coords(faltando) if faltando else ds
+
+
+def _ausentes(coluna: np.ndarray) -> np.ndarray | None:
+    """Máscara de valores ausentes (NaN/NaT); None se o tipo não tem ausentes"""
+    if coluna.dtype.kind in "fc":
+        return np.isnan(coluna)
+    if coluna.dtype.kind in "mM":
+        return np.isnat(coluna)
+    return None
+
+
+def descartar_ausentes(lote: dict, variaveis: list) -> dict:
+    """
+    Remove as linhas em que todas as `variaveis` estão ausentes (células
+    fora da máscara / _FillValue, que o xarray já entrega como NaN).
+    Devolve o mesmo lote, sem cópia, se nenhuma linha for removida.
+    """
+    vazias = None
+    for nome in variaveis:
+        ausentes = _ausentes(lote[nome])
+        if ausentes is None:
+            return lote  # variável sem valor ausente possível: nenhuma linha vazia
+        vazias = ausentes if vazias is None else (vazias & ausentes)
+    if vazias is None or not vazias.any():
+        return lote
+    manter = ~vazias
+    return {nome: coluna[manter] for nome, coluna in lote.items()}
+
+
+def tabela_da_fatia(ds, esparso: bool = False) -> dict[str, np.ndarray]:
+    """
+    Converte um Dataset (normalmente uma fatia isel) em colunas 1-D.
+    Colunas: dimensões na ordem de ds.dims, depois as demais variáveis
+    (coordenadas auxiliares e data_vars) na ordem do arquivo.
+    esparso=True descarta as linhas em que todas as data_vars estão ausentes.
+    """
+    dims = list(ds.dims)
+    forma = tuple(int(ds.sizes[d]) for d in dims)
+    total = math.prod(forma)
+
+    lote: dict[str, np.ndarray] = {}
+
+    # Coordenadas: cada valor se repete pelo produto das dimensões seguintes
+    # e o bloco inteiro se repete pelo produto das anteriores
+    for i, dim in enumerate(dims):
+        valores = _coluna_dimensao(ds, dim, forma[i])
+        depois = math.prod(forma[i + 1:])
+        antes = math.prod(forma[:i])
+        coluna = np.repeat(valores, depois) if depois > 1 else valores
+        if antes > 1:
+            coluna = np.tile(coluna, antes)
+        lote[str(dim)] = coluna
+
+    for nome, var in ds.variables.items():
+        if nome in ds.dims:
+            continue
+
+        proprio = False
+
+        ordem = [d for d in dims if d in var.dims]
+        if list(var.dims) != ordem:
+            var = var.transpose(*ordem)
+        dados = np.asarray(var.values)
+
+        forma_var = [forma[j] if d in var.dims else 1 for j, d in enumerate(dims)]
+        dados = dados.reshape(forma_var)
+        if tuple(forma_var) != forma:
+            # Variável com menos dimensões: broadcast (cópia nova ao achatar)
+            dados = np.broadcast_to(dados, forma)
+            proprio = True
+
+        coluna = dados.reshape(total)
+        lote[str(nome)] = _sanitizar(coluna, proprio)
+
+    if esparso:
+        return descartar_ausentes(lote, [str(v) for v in ds.data_vars])
+    return lote
+
+
+def tabela_das_posicoes(ds, dims: list, posicoes: tuple) -> dict[str, np.ndarray]:
+    """
+    Colunas só das linhas em `posicoes` (tupla de índices por dimensão,
+    como np.nonzero de um array na ordem `dims`), sem montar a tabela
+    inteira. Mesma ordem de colunas que tabela_da_fatia.
+    """
+    lote: dict[str, np.ndarray] = {}
+    for dim, indices in zip(dims, posicoes):
+        lote[str(dim)] = np.asarray(ds.variables[dim].values)[indices] if dim in ds.variables else indices
+
+    for nome, var in ds.variables.items():
+        if nome in dims:
+            continue
+        ordem = [d for d in dims if d in var.dims]
+        if list(var.dims) != ordem:
+            var = var.transpose(*ordem)
+        dados = np.asarray(var.values)
+        if ordem:
+            coluna = dados[tuple(indices for d, indices in zip(dims, posicoes) if d in var.dims)]
+        else:
+            coluna = np.full(len(posicoes[0]), dados)  # coordenada escalar
+        lote[str(nome)] = _sanitizar(coluna, True)
+    return lote
+
+
+def linhas_do_lote(lote: dict) -> int:
+    """Número de linhas de um lote"""
+    for coluna in lote.values():
+        return len(coluna)
+    return 0
+
+
+def para_dataframe(lote: dict) -> pd.DataFrame:
+    """DataFrame sobre as mesmas colunas (sem copiar quando possível)"""
+    return pd.DataFrame(lote, copy=False)
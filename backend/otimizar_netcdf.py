@@ -0,0 +1,240 @@
+"""
+Defesa Civil Araruna - Reescrita do NetCDF em layout otimizado
+Muitos arquivos chegam em NetCDF3 sem compressão ou em HDF5 com chunks
+que não combinam com a leitura, e toda conversão paga o I/O a mais. Aqui
+o .nc é regravado em NetCDF4 com zlib + shuffle e chunks escolhidos para
+o acesso dominante (os layouts de copia_zarr: "mapas" para as conversões
+em fatias no tempo, "series" para pluviômetros e SPI). Os valores são
+copiados crus (sem decodificar escala, _FillValue ou datas), fatia por
+fatia, e um micro-benchmark compara as leituras antes e depois.
+"""
+
+import os
+import time
+import uuid
+from pathlib import Path
+
+import numpy as np
+import xarray as xr
+
+import agregacao_temporal
+import copia_zarr
+import planejador_fatias
+import subconjunto
+
+try:
+    import netCDF4
+    NETCDF4_OK = True
+except ImportError:
+    NETCDF4_OK = False
+
+
+LAYOUT_PADRAO = "mapas"
+
+# Nível zlib (1 a 9): acima de 4 o arquivo quase não diminui e a leitura fica mais lenta
+NIVEL_PADRAO = 4
+
+# Micro-benchmark: células com a série inteira, fatias da conversão e repetições (vale a melhor)
+CELULAS_BENCHMARK = 8
+FATIAS_BENCHMARK = 3
+REPETICOES_BENCHMARK = 3
+
+# Acessos mais lentos que isso (layout contrário ao acesso) não são repetidos
+TEMPO_REPETICAO_S = 5.0
+
+
+class ErroOtimizacao(subconjunto.ErroSubconjunto):
+    """Arquivo que não pode ser regravado (vira HTTP 400 no servidor)"""
+
+
+def _exigir_netcdf4():
+    if not NETCDF4_OK:
+        raise RuntimeError("netCDF4 não instalado. Execute: pip install netCDF4")
+
+
+def caminho_otimizado(caminho_nc, pasta=None) -> Path:
+    """arquivo.nc -> arquivo_otimizado.nc (na mesma pasta ou em `pasta`)"""
+    caminho_nc = Path(caminho_nc)
+    return Path(pasta or caminho_nc.parent) / f"{caminho_nc.stem}_otimizado.nc"
+
+
+def _indice(var, fatia: dict) -> tuple:
+    """Fatia (dimensão -> slice) como índice de uma variável netCDF4"""
+    return tuple(fatia.get(d, slice(0, n)) for d, n in zip(var.dimensions, var.shape))
+
+
+def _criar_variavel(destino, var, chunks: dict, nivel: int):
+    """Mesma variável no destino, com zlib/shuffle e os chunks do layout"""
+    atributos = {k: var.getncattr(k) for k in var.ncattrs()}
+    opcoes = {}
+    if var.dimensions and var.dtype != str:
+        opcoes = dict(zlib=True, complevel=nivel, shuffle=True,
+                      chunksizes=tuple(chunks[d] for d in var.dimensions))
+    nova = destino.createVariable(var.name, var.datatype, var.dimensions,
+                                  fill_value=atributos.pop("_FillValue", None), **opcoes)
+    nova.setncatts(atributos)
+    return nova
+
+
+def reescrever(origem, destino, chunks: dict, fatias: list, nivel: int = NIVEL_PADRAO):
+    """
+    Copia o .nc para `destino` (NetCDF4) com os chunks pedidos. Variáveis
+    com as dimensões cortadas são copiadas fatia por fatia; as demais
+    (coordenadas, limites curtos, escalares) de uma vez.
+    """
+    _exigir_netcdf4()
+    cortadas = {d for fatia in fatias for d in fatia}
+    with netCDF4.Dataset(origem) as src, netCDF4.Dataset(destino, "w", format="NETCDF4") as dst:
+        if src.groups:
+            raise ErroOtimizacao("Arquivos com grupos NetCDF4 não são suportados na otimização")
+        for ds in (src, dst):
+            ds.set_auto_maskandscale(False)
+            ds.set_auto_chartostring(False)
+
+        dst.setncatts({k: src.getncattr(k) for k in src.ncattrs()})
+        for nome, dim in src.dimensions.items():
+            dst.createDimension(nome, None if dim.isunlimited() else len(dim))
+        for var in src.variables.values():
+            _criar_variavel(dst, var, chunks, nivel)
+
+        fatiadas = [n for n, v in src.variables.items() if cortadas & set(v.dimensions)]
+        for nome, var in src.variables.items():
+            if nome in fatiadas or var.size == 0:
+                continue
+            if var.ndim == 0:
+                dst[nome].assignValue(var.getValue())
+            else:
+                dst[nome][_indice(var, {})] = var[_indice(var, {})]
+
+        for i, fatia in enumerate(fatias, 1):
+            print(f"[OTIMIZAR] Fatia {i}/{len(fatias)}: {planejador_fatias.descrever(fatia)}")
+            for nome in fatiadas:
+                indice = _indice(src[nome], fatia)
+                dst[nome][indice] = src[nome][indice]
+
+
+def _plano_benchmark(ds) -> dict:
+    """
+    Leituras do micro-benchmark, iguais para o original e a cópia:
+    algumas fatias da conversão (grade inteira) e a série de algumas
+    células sorteadas com semente fixa.
+    """
+    if not ds.data_vars:
+        return {}
+    principal = max(ds.data_vars, key=lambda nome: ds[nome].size)
+    var = ds[principal]
+    fatias = list(planejador_fatias.planejar(ds[[principal]]))
+    escolhidas = sorted({0, len(fatias) // 2, len(fatias) - 1})[:FATIAS_BENCHMARK]
+    plano = {"variavel": principal, "tabela": [fatias[i] for i in escolhidas]}
+
+    try:
+        dim_tempo = agregacao_temporal.dimensao_tempo(ds)
+    except agregacao_temporal.ErroAgregacao:
+        return plano
+    if dim_tempo in var.dims and var.ndim > 1:
+        sorteio = np.random.default_rng(0)
+        plano["series"] = [
+            {str(d): int(sorteio.integers(var.sizes[d])) for d in var.dims if d != dim_tempo}
+            for _ in range(CELULAS_BENCHMARK)
+        ]
+    return plano
+
+
+def _descartar_cache(caminho) -> bool:
+    """Tira o arquivo do cache de páginas (Linux), para medir a leitura do disco"""
+    if not hasattr(os, "posix_fadvise"):
+        return False
+    fd = os.open(caminho, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+    return True
+
+
+def _ler(caminho, variavel: str, selecoes: list) -> float:
+    """Segundos para abrir o arquivo e ler as seleções da variável"""
+    _descartar_cache(caminho)
+    inicio = time.perf_counter()
+    with xr.open_dataset(caminho) as ds:
+        for selecao in selecoes:
+            ds[variavel].isel(selecao).values
+    return time.perf_counter() - inicio
+
+
+def comparar_leituras(original, otimizado, plano: dict, repeticoes: int = REPETICOES_BENCHMARK) -> dict:
+    """
+    Micro-benchmark: melhor tempo de cada acesso ("tabela" e "series") nos
+    dois arquivos, com o cache de páginas descartado antes de cada leitura
+    quando o sistema permite (senão, leituras alternadas para que o cache
+    favoreça os dois por igual). Aceleração = original / otimizado.
+    """
+    resultado = {}
+    frio = hasattr(os, "posix_fadvise")
+    for acesso in ("tabela", "series"):
+        if not plano.get(acesso):
+            continue
+        tempos = {original: [], otimizado: []}
+        for _ in range(repeticoes):
+            for caminho in tempos:
+                tempos[caminho].append(_ler(caminho, plano["variavel"], plano[acesso]))
+            if max(min(medidas) for medidas in tempos.values()) > TEMPO_REPETICAO_S:
+                break
+        antes, depois = min(tempos[original]), min(tempos[otimizado])
+        resultado[acesso] = {
+            "leituras": len(plano[acesso]),
+            "cache_frio": frio,
+            "original_s": round(antes, 4),
+            "otimizado_s": round(depois, 4),
+            "aceleracao": round(antes / depois, 2) if depois > 0 else None,
+        }
+    return resultado
+
+
+def otimizar(caminho_nc, destino=None, padrao: str = LAYOUT_PADRAO, chunks: dict | None = None,
+             nivel: int = NIVEL_PADRAO, orcamento_mb: float | None = None, medir: bool = True) -> dict:
+    """
+    Regrava o .nc em `destino` (padrão: arquivo_otimizado.nc) e devolve o
+    relatório: layout, chunks, tamanhos, tempo e o micro-benchmark. O
+    arquivo é montado em um temporário e só aparece quando está completo.
+    """
+    _exigir_netcdf4()
+    if not 1 <= nivel <= 9:
+        raise ErroOtimizacao("O nível de compressão deve ser de 1 a 9")
+    origem = Path(caminho_nc)
+    destino = Path(destino) if destino else caminho_otimizado(origem)
+    if destino.resolve() == origem.resolve():
+        raise ErroOtimizacao("O arquivo otimizado deve ter outro nome (o original é lido durante a cópia)")
+    temporario = destino.with_name(f"_criando_{uuid.uuid4().hex}_{destino.name}")
+
+    print(f"[OTIMIZAR] {origem.name}: NetCDF4 zlib nível {nivel}, layout {padrao}...")
+    inicio = time.perf_counter()
+    try:
+        with xr.open_dataset(origem) as ds:
+            tamanhos = copia_zarr.chunks_para(ds, padrao, chunks)
+            fatias = copia_zarr.fatias_alinhadas(ds, tamanhos, orcamento_mb)
+            plano = _plano_benchmark(ds) if medir else {}
+        reescrever(origem, temporario, tamanhos, fatias, nivel)
+        os.replace(temporario, destino)
+    except BaseException:
+        temporario.unlink(missing_ok=True)
+        raise
+
+    relatorio = {
+        "origem": origem.name,
+        "destino": str(destino),
+        "padrao": padrao,
+        "nivel": nivel,
+        "chunks": tamanhos,
+        "tamanho_original_mb": round(origem.stat().st_size / (1024 * 1024), 2),
+        "tamanho_otimizado_mb": round(destino.stat().st_size / (1024 * 1024), 2),
+        "tempo_reescrita_s": round(time.perf_counter() - inicio, 2),
+    }
+    print(f"[OTIMIZAR] Pronto: {destino.name} ({relatorio['tamanho_otimizado_mb']} MB, original "
+          f"{relatorio['tamanho_original_mb']} MB) | chunks {tamanhos}")
+    if plano:
+        relatorio["benchmark"] = comparar_leituras(origem, destino, plano)
+        for acesso, medida in relatorio["benchmark"].items():
+            print(f"[OTIMIZAR] Leitura {acesso}: {medida['original_s']:.3f} s -> "
+                  f"{medida['otimizado_s']:.3f} s ({medida['aceleracao']}x)")
+    return relatorio
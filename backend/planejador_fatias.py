@@ -0,0 +1,177 @@
+"""
+Defesa Civil Araruna - Planejamento das fatias de conversão
+Divide o dataset em fatias (dict dimensão -> slice para isel) que cabem em
+um orçamento de memória. As fatias seguem a ordem das linhas da saída
+(a mesma do to_dataframe): só a dimensão de corte é dividida em blocos,
+as anteriores vão de 1 em 1 índice e as seguintes ficam inteiras. Assim
+um time step com grade 4000x4000 é cortado em faixas de latitude, e uma
+primeira dimensão pequena (ex.: bnds) não impede a divisão das demais.
+O tamanho do bloco é múltiplo do chunk HDF5 do arquivo sempre que possível,
+para que cada chunk em disco seja lido e descomprimido uma vez só.
+Com `multiplos` (dim -> k, ex.: fator da redução espacial) essas dimensões
+nunca vão de 1 em 1 e são cortadas em blocos múltiplos de k.
+"""
+
+import itertools
+import math
+import os
+
+import numpy as np
+
+
+# Memória alvo por fatia (cada processo da conversão paralela usa a sua)
+ORCAMENTO_FATIA_MB = max(16, int(os.getenv("CONVERSOR_MEMORIA_FATIA_MB", "256")))
+
+# Cópias simultâneas de cada linha durante a conversão: leitura do disco,
+# colunas do lote e texto/buffers do escritor
+FATOR_PICO = 4
+
+# Largura assumida para colunas de objetos (strings, datas cftime)
+BYTES_OBJETO = 64
+
+# Até quantas vezes o orçamento uma fatia de séries pode crescer para
+# cobrir chunks inteiros do arquivo (cada chunk descomprimido uma vez)
+AMPLIACAO_SERIES_MAXIMA = 4
+
+
+def bytes_por_linha(ds) -> int:
+    """Memória estimada de uma linha da saída (todas as colunas do lote)"""
+    total = 0
+    for var in ds.variables.values():
+        total += BYTES_OBJETO if var.dtype == np.dtype(object) else var.dtype.itemsize
+    # Dimensões sem coordenada viram uma coluna de índices int64
+    total += 8 * sum(1 for d in ds.dims if d not in ds.variables)
+    return max(1, total * FATOR_PICO)
+
+
+def chunk_em_disco(ds, dim) -> int | None:
+    """Maior chunk HDF5/Zarr ao longo de `dim` entre as variáveis do dataset"""
+    maior = None
+    for var in ds.variables.values():
+        if dim not in var.dims:
+            continue
+        preferidos = var.encoding.get("preferred_chunks") or {}
+        tamanho = preferidos.get(dim)
+        if tamanho is None and var.encoding.get("chunksizes"):
+            chunks = var.encoding["chunksizes"]
+            if len(chunks) == len(var.dims):
+                tamanho = chunks[var.dims.index(dim)]
+        if tamanho:
+            maior = max(maior or 0, int(tamanho))
+    return maior
+
+
+def _corte(ds, orcamento_mb: float | None, multiplos: dict | None = None):
+    """(dims, forma, k, passo): dimensão de corte k e tamanho do bloco nela"""
+    orcamento = (orcamento_mb or ORCAMENTO_FATIA_MB) * 1024 * 1024
+    dims = list(ds.dims)
+    forma = [int(ds.sizes[d]) for d in dims]
+    max_linhas = max(1, int(orcamento // bytes_por_linha(ds)))
+    multiplos = {d: m for d, m in (multiplos or {}).items() if d in dims and m > 1}
+
+    # Dimensão de corte: a primeira cujas dimensões seguintes cabem inteiras
+    # (sem passar de uma dimensão que precisa de blocos múltiplos)
+    limite = min([dims.index(d) for d in multiplos] + [len(dims) - 1])
+    k = 0
+    while k < limite and math.prod(forma[k + 1:]) > max_linhas:
+        k += 1
+    linhas_por_indice = math.prod(forma[k + 1:])
+
+    passo = max(1, max_linhas // linhas_por_indice)
+    chunk = chunk_em_disco(ds, dims[k])
+    if chunk and passo > chunk:
+        passo -= passo % chunk
+    multiplo = multiplos.get(dims[k])
+    if multiplo:
+        passo = max(multiplo, passo - passo % multiplo)
+    passo = min(passo, forma[k])
+    return dims, forma, k, passo
+
+
+def planejar(ds, orcamento_mb: float | None = None, multiplos: dict | None = None):
+    """
+    Gera as fatias (dict dim -> slice) que cobrem o dataset na ordem
+    das linhas da saída, cada uma com no máximo ~orcamento_mb de pico.
+    """
+    if not ds.dims or 0 in ds.sizes.values():
+        yield {}
+        return
+
+    dims, forma, k, passo = _corte(ds, orcamento_mb, multiplos)
+    for prefixo in itertools.product(*[range(n) for n in forma[:k]]):
+        base = {d: slice(i, i + 1) for d, i in zip(dims, prefixo)}
+        for inicio in range(0, forma[k], passo):
+            yield {**base, dims[k]: slice(inicio, min(inicio + passo, forma[k]))}
+
+
+def contar_fatias(ds, orcamento_mb: float | None = None, multiplos: dict | None = None) -> int:
+    """Quantas fatias planejar() vai gerar"""
+    if not ds.dims or 0 in ds.sizes.values():
+        return 1
+    _, forma, k, passo = _corte(ds, orcamento_mb, multiplos)
+    return math.prod(forma[:k]) * math.ceil(forma[k] / passo)
+
+
+def _leituras_por_chunk(grade, orcamento_mb: float, multiplos: dict | None) -> int:
+    """Quantas fatias de planejar(grade) passam por um mesmo chunk em disco"""
+    if not grade.dims or 0 in grade.sizes.values():
+        return 1
+    dims, forma, k, passo = _corte(grade, orcamento_mb, multiplos)
+    leituras = 1
+    for i, dim in enumerate(dims[:k + 1]):
+        chunk = min(chunk_em_disco(grade, dim) or 1, forma[i])
+        # Antes da dimensão de corte as fatias vão de 1 em 1 índice
+        leituras *= chunk if i < k else math.ceil(chunk / passo)
+    return leituras
+
+
+def _orcamento_series(ds, dim: str, orcamento_mb: float | None, multiplos: dict | None) -> float:
+    """
+    Orçamento por passo de `dim` das fatias de séries: o normal ou, se
+    assim os chunks do arquivo forem lidos mais de uma vez, o menor
+    múltiplo dele (até AMPLIACAO_SERIES_MAXIMA) que cobre chunks inteiros
+    """
+    n = int(ds.sizes.get(dim, 1)) or 1
+    grade = ds.isel({dim: 0})
+    base = (orcamento_mb or ORCAMENTO_FATIA_MB) / n
+    fator = 1
+    while fator <= AMPLIACAO_SERIES_MAXIMA:
+        if _leituras_por_chunk(grade, base * fator, multiplos) == 1:
+            return base * fator
+        fator *= 2
+    return base
+
+
+def planejar_series(ds, dim: str, orcamento_mb: float | None = None, multiplos: dict | None = None):
+    """
+    Fatias com a série inteira ao longo de `dim` (ex.: tempo) e blocos das
+    demais dimensões, para cálculos que precisam do histórico completo de
+    cada célula. A fatia não traz `dim` (isel mantém a dimensão inteira).
+    Os blocos seguem os chunks do arquivo nas demais dimensões; veja
+    releituras_series() para arquivos com chunks só no tempo.
+    """
+    yield from planejar(ds.isel({dim: 0}), _orcamento_series(ds, dim, orcamento_mb, multiplos), multiplos)
+
+
+def contar_series(ds, dim: str, orcamento_mb: float | None = None, multiplos: dict | None = None) -> int:
+    """Quantas fatias planejar_series() vai gerar"""
+    return contar_fatias(ds.isel({dim: 0}), _orcamento_series(ds, dim, orcamento_mb, multiplos), multiplos)
+
+
+def releituras_series(ds, dim: str, orcamento_mb: float | None = None, multiplos: dict | None = None) -> int:
+    """
+    Quantas vezes planejar_series() descomprime cada chunk em disco. Passa
+    de 1 quando o arquivo tem chunks com muitas células e poucos passos de
+    tempo (ex.: um mapa por chunk): cada bloco de células lê a série
+    inteira e, com ela, os mesmos chunks. Para esses arquivos o acesso por
+    séries deve usar a cópia Zarr com layout "series" (copia_zarr).
+    """
+    return _leituras_por_chunk(ds.isel({dim: 0}), _orcamento_series(ds, dim, orcamento_mb, multiplos),
+                               multiplos)
+
+
+def descrever(fatia: dict) -> str:
+    """Texto curto para log, ex.: time[0:31] lat[0:1]"""
+    if not fatia:
+        return "dataset inteiro"
+    return " ".join(f"{d}[{s.start}:{s.stop}]" for d, s in fatia.items())
@@ -0,0 +1,160 @@
+"""
+Defesa Civil Araruna - Redução da resolução espacial (coarsen) por fatia
+Junta blocos de fator x fator células da grade com média, soma ou máximo
+antes de montar a tabela: 0,05° com fator 5 vira 0,25° e a saída tem 25
+vezes menos linhas. A redução é feita em cada fatia do planejador (que
+corta lat/lon em múltiplos do fator), sem carregar a grade inteira.
+Células que sobram na borda (grade não divisível pelo fator) são descartadas.
+"""
+
+import warnings
+
+import numpy as np
+import xarray as xr
+
+import subconjunto
+
+
+ESTATISTICAS = ("media", "soma", "maximo")
+
+
+class ErroReducao(subconjunto.ErroSubconjunto):
+    """Redução espacial impossível para o arquivo (vira HTTP 400 no servidor)"""
+
+
+def _espacamento(coord) -> float:
+    valores = np.asarray(coord.values, dtype=np.float64)
+    if valores.size < 2:
+        raise ErroReducao(f"Coordenada {coord.name} tem um só ponto: não há resolução para reduzir")
+    return float(np.abs(np.diff(valores)).mean())
+
+
+def pedida(opcoes: dict | None) -> bool:
+    """Se as opções pedem redução espacial"""
+    opcoes = opcoes or {}
+    return opcoes.get("fator_espacial", 1) > 1 or bool(opcoes.get("resolucao"))
+
+
+def fatores(ds, opcoes: dict | None) -> dict:
+    """
+    Fator por dimensão espacial (dim -> k) a partir de opcoes["fator_espacial"]
+    ou opcoes["resolucao"] (graus). Dicionário vazio = sem redução (também
+    para tabelas sem lat/lon, ex.: time_bnds).
+    """
+    if not pedida(opcoes):
+        return {}
+    fator, resolucao = opcoes.get("fator_espacial", 1), opcoes.get("resolucao")
+    dims = [subconjunto.encontrar_coordenada(ds, subconjunto.NOMES_LAT),
+            subconjunto.encontrar_coordenada(ds, subconjunto.NOMES_LON)]
+    if None in dims:
+        return {}
+
+    resultado = {}
+    for dim in dims:
+        k = fator
+        if resolucao:
+            k = int(round(resolucao / _espacamento(ds[dim]))) if dim in ds.variables else 1
+        k = min(max(1, k), int(ds.sizes[dim]))
+        if k > 1:
+            resultado[dim] = k
+    return resultado
+
+
+def validar(ds, opcoes: dict | None):
+    """Erro se a redução pedida não se aplica ao dataset"""
+    if not pedida(opcoes):
+        return
+    if opcoes.get("poligono"):
+        raise ErroReducao("A redução espacial não pode ser combinada com o recorte por polígono")
+    if opcoes.get("estatistica_espacial", "media") not in ESTATISTICAS:
+        raise ErroReducao(f"Estatística espacial desconhecida: {opcoes['estatistica_espacial']}")
+    if not fatores(ds, opcoes):
+        raise ErroReducao(
+            "Nada a reduzir: o arquivo não tem dimensões de latitude/longitude "
+            "ou a resolução pedida não é maior que a da grade"
+        )
+
+
+def _reduzir_blocos(valores: np.ndarray, eixos: list, fatores_eixo: list, estatistica: str,
+                    dtype=None) -> np.ndarray:
+    """Reduz blocos k ao longo de `eixos` (já cortados em múltiplos de k)"""
+    forma = []
+    blocos = []
+    for eixo, n in enumerate(valores.shape):
+        if eixo in eixos:
+            k = fatores_eixo[eixos.index(eixo)]
+            forma += [n // k, k]
+            blocos.append(len(forma) - 1)
+        else:
+            forma.append(n)
+    valores = valores.reshape(forma)
+    blocos = tuple(blocos)
+
+    if valores.dtype.kind not in "fc":
+        valores = valores.astype(np.float64)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # blocos só com NaN
+        if estatistica == "soma":
+            reduzido = np.nansum(valores, axis=blocos, dtype=np.float64)
+            reduzido[np.all(np.isnan(valores), axis=blocos)] = np.nan
+        elif estatistica == "maximo":
+            reduzido = np.nanmax(valores, axis=blocos)
+        else:
+            reduzido = np.nanmean(valores, axis=blocos, dtype=np.float64)
+    dtype = dtype if dtype is not None and np.dtype(dtype).kind == "f" else np.float64
+    return reduzido.astype(dtype, copy=False)
+
+
+def reduzir(ds, fatores_dim: dict, estatistica: str = "media"):
+    """
+    Aplica a redução a uma fatia: variáveis com dimensões espaciais viram
+    a estatística de cada bloco, coordenadas viram o centro (média) do bloco.
+    """
+    fatores_dim = {d: k for d, k in fatores_dim.items() if d in ds.dims}
+    if not fatores_dim:
+        return ds
+    if estatistica not in ESTATISTICAS:
+        raise ErroReducao(f"Estatística espacial desconhecida: {estatistica}")
+
+    corte = {d: slice(0, int(ds.sizes[d]) // k * k) for d, k in fatores_dim.items()}
+    ds = ds.isel(corte)
+
+    def _variavel(var, estat):
+        eixos = [var.dims.index(d) for d in fatores_dim if d in var.dims]
+        if not eixos:
+            return var
+        fatores_eixo = [fatores_dim[var.dims[e]] for e in eixos]
+        valores = _reduzir_blocos(np.asarray(var.values), eixos, fatores_eixo, estat, var.dtype)
+        return xr.Variable(var.dims, valores, var.attrs)
+
+    coords = {nome: _variavel(c.variable, "media") for nome, c in ds.coords.items()}
+    variaveis = {nome: _variavel(v.variable, estatistica) for nome, v in ds.data_vars.items()}
+    return xr.Dataset(variaveis, coords=coords, attrs=ds.attrs)
+
+
+def grade_reduzida(ds, fatores_dim: dict):
+    """
+    Dataset com as dimensões, coordenadas e tipos da grade reduzida, sem ler
+    as variáveis (os dados são arrays vazios por broadcast). Serve de molde
+    para o AcumuladorTemporal.
+    """
+    fatores_dim = {d: k for d, k in fatores_dim.items() if d in ds.dims}
+    if not fatores_dim:
+        return ds
+    corte = {d: slice(0, int(ds.sizes[d]) // k * k) for d, k in fatores_dim.items()}
+    coords = reduzir(ds.coords.to_dataset().isel(corte), fatores_dim).coords
+    variaveis = {}
+    for nome, var in ds.data_vars.items():
+        forma = [int(ds.sizes[d]) // fatores_dim[d] if d in fatores_dim else int(ds.sizes[d])
+                 for d in var.dims]
+        dtype = var.dtype if var.dtype.kind == "f" else np.float64
+        variaveis[nome] = xr.Variable(var.dims, np.broadcast_to(np.zeros((), dtype), forma), var.attrs)
+    return xr.Dataset(variaveis, coords=coords, attrs=ds.attrs)
+
+
+def fatia_reduzida(fatia: dict, fatores_dim: dict) -> dict:
+    """Posição da fatia (dim -> slice) na grade reduzida"""
+    return {
+        d: slice(s.start // fatores_dim[d], s.stop // fatores_dim[d]) if d in fatores_dim else s
+        for d, s in fatia.items()
+    }
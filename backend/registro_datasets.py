@@ -0,0 +1,357 @@
+"""
+Defesa Civil Araruna - Registro de datasets enviados
+O .nc é enviado uma vez e fica no servidor com um id (o SHA-256 do
+conteúdo). Conversões, inspeção, séries em pontos e alertas recebem o id
+em vez de um novo upload. O espaço é limitado com remoção LRU (data de
+último uso), sem remover datasets em uso. O cabeçalho fica no índice de
+inspecao e os últimos datasets usados ficam abertos neste processo.
+Um dataset pode ganhar uma cópia Zarr otimizada (copia_zarr), que conta
+no espaço ocupado e é lida no lugar do .nc quando serve ao acesso, ou ter
+o próprio .nc regravado com compressão e chunks melhores (otimizar_netcdf).
+"""
+
+import os
+import json
+import shutil
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+
+import xarray as xr
+
+import copia_zarr
+import inspecao
+
+
+DATASETS_DIR = Path(__file__).parent / "output" / "datasets"
+DATASETS_DIR.mkdir(parents=True, exist_ok=True)
+
+# Espaço máximo ocupado pelos datasets (padrão: 20 GB)
+LIMITE_BYTES = int(os.getenv("DATASETS_MAX_MB", "20480")) * 1024 * 1024
+
+# Datasets mantidos abertos (os mais recentes)
+MAXIMO_ABERTOS = int(os.getenv("DATASETS_ABERTOS", "4"))
+
+_lock = threading.Lock()
+_em_uso: dict[str, int] = {}
+_abertos: OrderedDict = OrderedDict()
+# Datasets retirados de _abertos enquanto reservados: fechados na liberação
+_pendentes: list[tuple[str, xr.Dataset]] = []
+
+
+class ErroDataset(Exception):
+    """Dataset inexistente ou impossível de guardar (vira HTTP 4xx no main)"""
+
+    def __init__(self, mensagem: str, status: int = 400):
+        super().__init__(mensagem)
+        self.status = status
+
+
+def _valido(dataset_id: str) -> bool:
+    return len(dataset_id) == 64 and all(c in "0123456789abcdef" for c in dataset_id)
+
+
+def _caminho_dados(dataset_id: str) -> Path:
+    return DATASETS_DIR / f"{dataset_id}.nc"
+
+
+def _caminho_meta(dataset_id: str) -> Path:
+    return DATASETS_DIR / f"{dataset_id}.json"
+
+
+def _ler_meta(dataset_id: str) -> dict:
+    return json.loads(_caminho_meta(dataset_id).read_text(encoding="utf-8"))
+
+
+def _marcar_uso(dataset_id: str):
+    """Data de último uso (LRU) fica no .json: o .nc não muda, e a cópia Zarr continua válida"""
+    try:
+        os.utime(_caminho_meta(dataset_id), None)
+    except OSError:
+        pass
+
+
+def _ultimo_uso(dataset_id: str) -> float:
+    try:
+        return _caminho_meta(dataset_id).stat().st_mtime
+    except OSError:
+        return 0.0
+
+
+def _tamanho(dataset_id: str) -> int:
+    """Bytes do .nc mais os da cópia Zarr, se houver"""
+    total = _caminho_dados(dataset_id).stat().st_size
+    copia = copia_zarr.caminho_copia(_caminho_dados(dataset_id))
+    if copia.is_dir():
+        total += copia_zarr.tamanho_pasta(copia)
+    return total
+
+
+def obter(dataset_id: str) -> tuple[Path, dict]:
+    """(caminho do .nc, metadados) de um dataset; marca o uso para o LRU"""
+    dataset_id = dataset_id.lower()
+    caminho = _caminho_dados(dataset_id)
+    if not _valido(dataset_id) or not caminho.is_file() or not _caminho_meta(dataset_id).is_file():
+        raise ErroDataset("Dataset não encontrado ou removido. Envie o arquivo em /api/netcdf/datasets", 404)
+    _marcar_uso(dataset_id)
+    return caminho, _ler_meta(dataset_id)
+
+
+def registrar(caminho_origem: Path, nome_arquivo: str, sha256: str) -> dict:
+    """
+    Move um .nc recebido para o registro (ou descarta, se o mesmo conteúdo
+    já está lá), aplica o limite de espaço e deixa cabeçalho e arquivo
+    prontos para uso. Operação bloqueante: chamar fora do event loop.
+    """
+    dataset_id = sha256.lower()
+    caminho_origem = Path(caminho_origem)
+    tamanho = caminho_origem.stat().st_size
+    if tamanho > LIMITE_BYTES:
+        caminho_origem.unlink(missing_ok=True)
+        raise ErroDataset(
+            f"Arquivo maior que o espaço de datasets ({LIMITE_BYTES // (1024 * 1024)} MB)", 413
+        )
+
+    destino = _caminho_dados(dataset_id)
+    if not destino.is_file():
+        # Lê o cabeçalho antes de guardar: arquivo inválido não entra no registro
+        try:
+            inspecao.inspecionar_com_cache(str(caminho_origem), dataset_id)
+        except Exception as e:
+            caminho_origem.unlink(missing_ok=True)
+            raise ErroDataset(f"Não foi possível ler o cabeçalho do arquivo: {e}")
+
+    with _lock:
+        if destino.is_file():
+            caminho_origem.unlink(missing_ok=True)
+            _marcar_uso(dataset_id)
+        else:
+            os.replace(caminho_origem, destino)
+            meta = {
+                "id": dataset_id,
+                "nome_arquivo": nome_arquivo,
+                "tamanho_bytes": tamanho,
+                "registrado_em": datetime.now().isoformat(timespec="seconds"),
+            }
+            _caminho_meta(dataset_id).write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+            print(f"[DATASETS] Registrado: {dataset_id[:12]}… ({nome_arquivo}, {tamanho / (1024 * 1024):.1f} MB)")
+        _aplicar_limite(preservar=dataset_id)
+
+    inspecao.inspecionar_com_cache(str(destino), dataset_id)
+    abrir(dataset_id)
+    return _ler_meta(dataset_id)
+
+
+def reservar(dataset_id: str):
+    """
+    Marca o dataset como em uso (não é removido pelo LRU) e devolve a
+    função que libera a reserva (pode ser chamada mais de uma vez).
+    """
+    dataset_id = dataset_id.lower()
+    with _lock:
+        _em_uso[dataset_id] = _em_uso.get(dataset_id, 0) + 1
+    liberado = [False]
+
+    def liberar():
+        with _lock:
+            if liberado[0]:
+                return
+            liberado[0] = True
+            restantes = _em_uso.get(dataset_id, 1) - 1
+            if restantes > 0:
+                _em_uso[dataset_id] = restantes
+            else:
+                _em_uso.pop(dataset_id, None)
+                _fechar_pendentes(dataset_id)
+                _aparar_abertos()
+
+    return liberar
+
+
+def _descartar(chave: tuple):
+    """Tira um dataset de _abertos (com o lock); se reservado, fecha só na liberação"""
+    ds = _abertos.pop(chave)
+    if chave[0] in _em_uso:
+        _pendentes.append((chave[0], ds))
+    else:
+        ds.close()
+
+
+def _fechar_pendentes(dataset_id: str):
+    for item in [item for item in _pendentes if item[0] == dataset_id]:
+        _pendentes.remove(item)
+        item[1].close()
+
+
+def _aparar_abertos(preservar: tuple | None = None):
+    """Fecha os datasets abertos mais antigos e sem reserva até MAXIMO_ABERTOS (com o lock)"""
+    livres = [chave for chave in _abertos if chave[0] not in _em_uso and chave != preservar]
+    for chave in livres[:max(0, len(_abertos) - MAXIMO_ABERTOS)]:
+        _abertos.pop(chave).close()
+
+
+def abrir(dataset_id: str, acesso: str = "tabela") -> xr.Dataset:
+    """
+    Dataset aberto (compartilhado) do registro: a cópia Zarr, se houver uma
+    que sirva ao `acesso`, ou o .nc. Não deve ser fechado por quem usa: as
+    seleções são feitas sobre uma cópia rasa (ver main.abrir_dataset).
+    Quem usa deve ter uma reserva (reservar): datasets reservados não são
+    fechados pelo limite de abertos, que pode ser excedido até a liberação.
+    """
+    dataset_id = dataset_id.lower()
+    caminho, _ = obter(dataset_id)
+    chave = (dataset_id, str(copia_zarr.caminho_leitura(caminho, acesso)))
+    with _lock:
+        if chave in _abertos:
+            _abertos.move_to_end(chave)
+            return _abertos[chave]
+    ds = copia_zarr.abrir(caminho, acesso)
+    with _lock:
+        if chave in _abertos:
+            ds.close()
+            return _abertos[chave]
+        _abertos[chave] = ds
+        _aparar_abertos(preservar=chave)
+    return ds
+
+
+def _fechar(dataset_id: str):
+    """Reabre o dataset na próxima leitura; quem ainda o usa continua com o antigo"""
+    for chave in [c for c in _abertos if c[0] == dataset_id]:
+        _descartar(chave)
+
+
+def _apagar(dataset_id: str):
+    """Remove .nc, cópia Zarr e metadados (com o lock)"""
+    _fechar(dataset_id)
+    caminho = _caminho_dados(dataset_id)
+    shutil.rmtree(copia_zarr.caminho_copia(caminho), ignore_errors=True)
+    caminho.unlink(missing_ok=True)
+    _caminho_meta(dataset_id).unlink(missing_ok=True)
+
+
+def em_uso(dataset_id: str) -> bool:
+    """Há conversões usando o dataset?"""
+    with _lock:
+        return dataset_id.lower() in _em_uso
+
+
+def caminho_temporario(dataset_id: str) -> Path:
+    """Arquivo de trabalho no espaço dos datasets (fora do glob *.nc do LRU)"""
+    return DATASETS_DIR / f"_otimizando_{uuid.uuid4().hex}_{dataset_id.lower()}.tmp"
+
+
+def substituir_nc(dataset_id: str, relatorio: dict) -> dict:
+    """
+    Troca o .nc do dataset pelo arquivo regravado em relatorio["destino"]
+    (mesmos valores, outro layout). O id continua o SHA-256 do envio e o
+    índice de inspecao continua com o cabeçalho do envio: o cabeçalho do
+    arquivo regravado (chunks e compressão em disco) vai para os metadados
+    do dataset, em "cabecalho_otimizado". Recusa a troca se outra conversão
+    reservou o dataset durante a otimização (a reserva do próprio job de
+    otimização já foi liberada ao chamar aqui). Só a troca e os metadados
+    ficam sob o lock; a cópia Zarr, feita a partir do arquivo antigo, deixa
+    de valer com a troca e é apagada depois.
+    """
+    dataset_id = dataset_id.lower()
+    novo = Path(relatorio.pop("destino"))
+    caminho = _caminho_dados(dataset_id)
+    try:
+        cabecalho = inspecao.inspecionar(str(novo))
+        with _lock:
+            if not caminho.is_file():
+                raise ErroDataset("Dataset removido durante a otimização", 404)
+            if dataset_id in _em_uso:
+                raise ErroDataset(
+                    "Dataset em uso por uma conversão iniciada durante a otimização; "
+                    "o .nc não foi trocado, tente novamente mais tarde", 409
+                )
+            _fechar(dataset_id)
+            os.replace(novo, caminho)
+            meta = _ler_meta(dataset_id)
+            meta["tamanho_bytes"] = caminho.stat().st_size
+            meta["otimizacao"] = relatorio
+            meta["cabecalho_otimizado"] = cabecalho
+            _caminho_meta(dataset_id).write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+    finally:
+        novo.unlink(missing_ok=True)
+    shutil.rmtree(copia_zarr.caminho_copia(caminho), ignore_errors=True)
+    print(f"[DATASETS] .nc otimizado: {dataset_id[:12]}… ({meta['tamanho_bytes'] / (1024 * 1024):.1f} MB)")
+    return relatorio
+
+
+def otimizado(dataset_id: str) -> dict:
+    """
+    Chamado depois que a cópia Zarr do dataset foi criada: reabre o
+    dataset na próxima leitura e aplica o limite (a cópia ocupa espaço).
+    """
+    dataset_id = dataset_id.lower()
+    with _lock:
+        _fechar(dataset_id)
+        _aplicar_limite(preservar=dataset_id)
+    return copia_zarr.copia_valida(_caminho_dados(dataset_id))
+
+
+def _aplicar_limite(preservar: str | None = None):
+    """Remove os datasets menos usados (e fora de uso) até caber no limite"""
+    datasets = []
+    total = 0
+    for arquivo in DATASETS_DIR.glob("*.nc"):
+        dataset_id = arquivo.stem
+        tamanho = _tamanho(dataset_id)
+        datasets.append((_ultimo_uso(dataset_id), tamanho, dataset_id))
+        total += tamanho
+
+    datasets.sort()
+    for _, tamanho, dataset_id in datasets:
+        if total <= LIMITE_BYTES:
+            break
+        if dataset_id == preservar or dataset_id in _em_uso:
+            continue
+        try:
+            _apagar(dataset_id)
+        except OSError:
+            continue  # Em uso (Windows); tenta de novo na próxima vez
+        total -= tamanho
+        print(f"[DATASETS] Removido (LRU): {dataset_id[:12]}…")
+
+
+def remover(dataset_id: str):
+    """Remove um dataset que não está em uso"""
+    caminho, _ = obter(dataset_id)
+    dataset_id = dataset_id.lower()
+    with _lock:
+        if dataset_id in _em_uso:
+            raise ErroDataset("Dataset em uso por uma conversão; tente novamente mais tarde", 409)
+        _apagar(dataset_id)
+
+
+def listar() -> list[dict]:
+    """Datasets registrados, do uso mais recente para o mais antigo"""
+    datasets = []
+    for arquivo in sorted(DATASETS_DIR.glob("*.nc"), key=lambda a: _ultimo_uso(a.stem), reverse=True):
+        try:
+            meta = _ler_meta(arquivo.stem)
+        except (OSError, ValueError):
+            continue
+        meta["ultimo_uso"] = datetime.fromtimestamp(_ultimo_uso(arquivo.stem)).isoformat(timespec="seconds")
+        copia = copia_zarr.copia_valida(arquivo)
+        if copia is not None:
+            meta["copia_zarr"] = {k: copia[k] for k in ("padrao", "chunks", "tamanho_bytes", "criado_em")}
+        datasets.append(meta)
+    return datasets
+
+
+def estatisticas() -> dict:
+    """Ocupação do registro"""
+    with _lock:
+        tamanho = sum(_tamanho(a.stem) for a in DATASETS_DIR.glob("*.nc"))
+        return {
+            "quantidade": len(list(DATASETS_DIR.glob("*.nc"))),
+            "tamanho_mb": round(tamanho / (1024 * 1024), 2),
+            "limite_mb": round(LIMITE_BYTES / (1024 * 1024), 2),
+            "abertos": len(_abertos),
+            "em_uso": sum(_em_uso.values()),
+        }
@@ -0,0 +1,304 @@
+"""
+Defesa Civil Araruna - Séries temporais em pontos (pluviômetros)
+Cada ponto lat/lon vai para a célula mais próxima da grade: grades
+regulares usam um índice 1-D separável (busca binária em lat e em lon)
+e grades curvilíneas (lat/lon 2-D) uma KD-tree em coordenadas 3-D da
+esfera. O índice é montado uma vez por grade e fica em memória. Pontos
+a mais de um espaçamento da grade da célula mais próxima (fora da área
+do arquivo) são recusados. As séries de todas as células são lidas de
+uma vez (indexação vetorizada em uma dimensão "ponto"), em lotes de
+memória limitada, sem converter o arquivo.
+"""
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import xarray as xr
+
+import agregacao_temporal
+import planejador_fatias
+import subconjunto
+
+try:
+    from scipy.spatial import cKDTree
+    SCIPY_OK = True
+except ImportError:
+    SCIPY_OK = False
+
+
+MAXIMO_PONTOS = 500
+
+# Índices de grade guardados em memória (os mais recentes)
+MAXIMO_INDICES = 16
+
+RAIO_TERRA_KM = 6371.0
+
+# Distância máxima do ponto ao centro da célula, em espaçamentos da grade
+# (o canto de uma célula fica a ~0,7; além de 1 o ponto está fora da grade)
+DISTANCIA_MAXIMA_CELULAS = 1.0
+
+_indices: OrderedDict = OrderedDict()
+_lock = threading.Lock()
+
+
+class ErroPontos(subconjunto.ErroSubconjunto):
+    """Pontos inválidos ou arquivo sem grade lat/lon (vira HTTP 400 no servidor)"""
+
+
+def ler_pontos(texto: str) -> list[dict]:
+    """
+    Pontos de um JSON: [[lat, lon], ...] ou [{"nome": ..., "lat": ..., "lon": ...}, ...].
+    Devolve [{"nome", "lat", "lon"}] (nome padrão: p1, p2, ...).
+    """
+    try:
+        itens = json.loads(texto)
+    except (json.JSONDecodeError, TypeError) as e:
+        raise ErroPontos(f"Pontos inválidos (JSON): {e}")
+    if not isinstance(itens, list) or not itens:
+        raise ErroPontos('Informe uma lista de pontos, ex.: [[-6.53, -35.74]] ou [{"lat": -6.53, "lon": -35.74}]')
+    if len(itens) > MAXIMO_PONTOS:
+        raise ErroPontos(f"No máximo {MAXIMO_PONTOS} pontos por consulta")
+
+    pontos = []
+    for i, item in enumerate(itens, 1):
+        try:
+            if isinstance(item, dict):
+                nome, lat, lon = str(item.get("nome") or f"p{i}"), float(item["lat"]), float(item["lon"])
+            else:
+                lat, lon = (float(v) for v in item)
+                nome = f"p{i}"
+        except (KeyError, TypeError, ValueError):
+            raise ErroPontos(f"Ponto {i} inválido: {item!r}")
+        if not -90 <= lat <= 90 or not -180 <= lon <= 360:
+            raise ErroPontos(f"Ponto {i} fora da faixa de lat/lon: {item!r}")
+        pontos.append({"nome": nome, "lat": lat, "lon": lon})
+    return pontos
+
+
+def _esfera(lat, lon) -> np.ndarray:
+    """Coordenadas 3-D na esfera unitária (distância euclidiana ~ distância real)"""
+    lat, lon = np.radians(np.asarray(lat, np.float64)), np.radians(np.asarray(lon, np.float64))
+    return np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis=-1)
+
+
+def distancia_km(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """Distância de grande círculo (haversine)"""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, np.float64)) for v in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * RAIO_TERRA_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+class _Eixo:
+    """Vizinho mais próximo em uma coordenada 1-D (crescente, decrescente ou fora de ordem)"""
+
+    def __init__(self, valores: np.ndarray):
+        valores = np.asarray(valores, np.float64)
+        self.ordem = np.argsort(valores, kind="stable")
+        self.ordenados = valores[self.ordem]
+
+    def vizinho(self, valores: np.ndarray) -> np.ndarray:
+        n = self.ordenados.size
+        if n == 1:
+            return np.zeros(len(valores), dtype=np.intp)
+        direita = np.clip(np.searchsorted(self.ordenados, valores), 1, n - 1)
+        esquerda = direita - 1
+        perto_esquerda = (valores - self.ordenados[esquerda]) <= (self.ordenados[direita] - valores)
+        return self.ordem[np.where(perto_esquerda, esquerda, direita)]
+
+
+class IndiceGrade:
+    """Célula mais próxima de cada ponto: {dimensão: índices}"""
+
+    def __init__(self, lat: np.ndarray, lon: np.ndarray, dims_lat: tuple, dims_lon: tuple):
+        self.lon_360 = float(np.nanmax(lon)) > 180
+        if len(dims_lat) == 1 and len(dims_lon) == 1 and dims_lat != dims_lon:
+            self.dims = (dims_lat[0], dims_lon[0])
+            self._eixos = (_Eixo(lat), _Eixo(lon))
+            self._arvore = None
+        else:
+            if dims_lat != dims_lon:
+                raise ErroPontos("Latitude e longitude da grade não têm as mesmas dimensões")
+            if not SCIPY_OK:
+                raise RuntimeError("scipy não instalado. Execute: pip install scipy")
+            self.dims = tuple(dims_lat)
+            self._forma = np.shape(lat)
+            self._arvore = cKDTree(_esfera(lat, lon).reshape(-1, 3))
+
+    def _longitude(self, lon: np.ndarray) -> np.ndarray:
+        """Longitude na convenção da grade (-180..180 ou 0..360)"""
+        if self.lon_360:
+            return np.where(lon < 0, lon + 360, lon)
+        return np.where(lon > 180, lon - 360, lon)
+
+    def localizar(self, lat, lon) -> dict:
+        lat = np.asarray(lat, np.float64)
+        lon = self._longitude(np.asarray(lon, np.float64))
+        if self._arvore is None:
+            return {self.dims[0]: self._eixos[0].vizinho(lat), self.dims[1]: self._eixos[1].vizinho(lon)}
+        _, plano = self._arvore.query(_esfera(lat, lon))
+        return dict(zip(self.dims, np.unravel_index(plano, self._forma)))
+
+
+def _coordenadas(ds) -> tuple[str, str]:
+    """Nomes das variáveis de latitude e longitude (1-D ou 2-D)"""
+    nomes = {str(nome).lower(): nome for nome in ds.variables}
+    encontrados = []
+    for candidatos in (subconjunto.NOMES_LAT + ["nav_lat"], subconjunto.NOMES_LON + ["nav_lon"]):
+        nome = next((nomes[c] for c in candidatos if c in nomes), None)
+        if nome is None:
+            raise ErroPontos("Arquivo não possui coordenadas de latitude e longitude")
+        encontrados.append(nome)
+    return encontrados[0], encontrados[1]
+
+
+def indice_da_grade(ds) -> IndiceGrade:
+    """Índice da grade de `ds`, montado só na primeira vez para cada grade"""
+    nome_lat, nome_lon = _coordenadas(ds)
+    lat, lon = ds[nome_lat], ds[nome_lon]
+    h = hashlib.sha256()
+    for coord in (lat, lon):
+        h.update(repr(coord.dims).encode())
+        h.update(np.ascontiguousarray(coord.values, dtype=np.float64).tobytes())
+    chave = h.hexdigest()
+    with _lock:
+        if chave in _indices:
+            _indices.move_to_end(chave)
+            return _indices[chave]
+
+    indice = IndiceGrade(lat.values, lon.values, lat.dims, lon.dims)
+    with _lock:
+        _indices[chave] = indice
+        while len(_indices) > MAXIMO_INDICES:
+            _indices.popitem(last=False)
+    return indice
+
+
+def _tempos_texto(tempos: np.ndarray) -> list[str]:
+    if np.issubdtype(tempos.dtype, np.datetime64):
+        return np.datetime_as_string(tempos, unit="s").tolist()
+    return [str(t) for t in tempos]
+
+
+def _valores(dados: np.ndarray) -> list:
+    """Lista JSON (NaN/inf viram null)"""
+    dados = np.asarray(dados, dtype=np.float64)
+    lista = dados.tolist()
+    ausentes = np.flatnonzero(~np.isfinite(dados))
+    for i in ausentes:
+        lista[i] = None
+    return lista
+
+
+def _na_celula(ds, nome: str, dims: tuple, celulas: np.ndarray) -> np.ndarray:
+    """Valores da coordenada `nome` (1-D ou 2-D) nas células (n, len(dims))"""
+    coord = ds[nome]
+    return np.asarray(coord.values, np.float64)[tuple(celulas[:, dims.index(d)] for d in coord.dims)]
+
+
+def _espacamento_km(ds, nome_lat: str, nome_lon: str, dims: tuple, celulas: np.ndarray) -> np.ndarray:
+    """
+    Espaçamento local da grade em cada célula: a maior distância até as
+    células vizinhas ao longo de cada dimensão (inf numa grade de 1 célula)
+    """
+    lat = _na_celula(ds, nome_lat, dims, celulas)
+    lon = _na_celula(ds, nome_lon, dims, celulas)
+    espacamento = np.full(len(celulas), -np.inf)
+    for eixo, dim in enumerate(dims):
+        n = int(ds.sizes[dim])
+        if n < 2:
+            continue
+        vizinhas = celulas.copy()
+        vizinhas[:, eixo] = np.where(celulas[:, eixo] + 1 < n, celulas[:, eixo] + 1, celulas[:, eixo] - 1)
+        distancia = distancia_km(lat, lon, _na_celula(ds, nome_lat, dims, vizinhas),
+                                 _na_celula(ds, nome_lon, dims, vizinhas))
+        espacamento = np.maximum(espacamento, distancia)
+    espacamento[np.isneginf(espacamento)] = np.inf
+    return espacamento
+
+
+def _lotes_de_celulas(celulas: np.ndarray, limite: int):
+    """
+    Grupos de células (em ordem) cujo retângulo envolvente tem no máximo
+    `limite` células: é o que o NetCDF lê em uma indexação vetorizada
+    """
+    inicio = 0
+    while inicio < len(celulas):
+        fim = inicio + 1
+        while fim < len(celulas) and np.prod(
+                [np.unique(celulas[inicio:fim + 1, e]).size for e in range(celulas.shape[1])]) <= limite:
+            fim += 1
+        yield slice(inicio, fim)
+        inicio = fim
+
+
+def series(ds, pontos: list[dict]) -> dict:
+    """
+    Série temporal das variáveis (tempo + grade) na célula mais próxima de
+    cada ponto. Pontos na mesma célula compartilham a leitura; pontos fora
+    da grade (mais de DISTANCIA_MAXIMA_CELULAS espaçamentos da célula)
+    são recusados.
+    """
+    try:
+        dim_tempo = agregacao_temporal.dimensao_tempo(ds)
+    except agregacao_temporal.ErroAgregacao as e:
+        raise ErroPontos(str(e))
+    indice = indice_da_grade(ds)
+    dims = {dim_tempo, *indice.dims}
+    variaveis = [nome for nome, var in ds.data_vars.items() if set(var.dims) == dims]
+    if not variaveis:
+        raise ErroPontos(f"Nenhuma variável com as dimensões {sorted(map(str, dims))}")
+
+    posicoes = indice.localizar([p["lat"] for p in pontos], [p["lon"] for p in pontos])
+    nome_lat, nome_lon = _coordenadas(ds)
+    por_ponto = np.stack([np.asarray(posicoes[d], np.intp) for d in indice.dims], axis=1)
+    celulas, da_celula = np.unique(por_ponto, axis=0, return_inverse=True)
+    da_celula = da_celula.reshape(-1)
+
+    lat_grade = _na_celula(ds, nome_lat, indice.dims, celulas)
+    lon_grade = _na_celula(ds, nome_lon, indice.dims, celulas)
+    distancias = distancia_km([p["lat"] for p in pontos], [p["lon"] for p in pontos],
+                              lat_grade[da_celula], lon_grade[da_celula])
+    espacamentos = _espacamento_km(ds, nome_lat, nome_lon, indice.dims, celulas)[da_celula]
+    fora = np.flatnonzero(distancias > DISTANCIA_MAXIMA_CELULAS * espacamentos)
+    if fora.size:
+        descricao = ", ".join(f"{pontos[i]['nome']} ({distancias[i]:,.1f} km)" for i in fora[:10])
+        raise ErroPontos(
+            f"{fora.size} ponto(s) fora da grade do arquivo (mais de {DISTANCIA_MAXIMA_CELULAS:g} "
+            f"espaçamento da célula mais próxima): {descricao}"
+        )
+
+    # Todas as células em uma indexação por lote ("ponto"), com memória limitada
+    n_tempo = max(1, int(ds.sizes[dim_tempo]))
+    bytes_celula = n_tempo * sum(ds[nome].dtype.itemsize for nome in variaveis)
+    limite = max(1, planejador_fatias.ORCAMENTO_FATIA_MB * 1024 * 1024 // bytes_celula)
+    dados = {str(nome): [None] * len(celulas) for nome in variaveis}
+    for lote in _lotes_de_celulas(celulas, limite):
+        indexadores = {d: xr.DataArray(celulas[lote, e], dims="ponto") for e, d in enumerate(indice.dims)}
+        selecao = ds[variaveis].isel(indexadores)
+        for nome in variaveis:
+            valores = selecao[nome].transpose("ponto", dim_tempo).values
+            for k, linha in enumerate(valores, lote.start):
+                dados[str(nome)][k] = _valores(linha)
+
+    resultado = []
+    for i, ponto in enumerate(pontos):
+        c = int(da_celula[i])
+        resultado.append({
+            **ponto,
+            "lat_grade": float(lat_grade[c]),
+            "lon_grade": float(lon_grade[c]),
+            "distancia_km": round(float(distancias[i]), 3),
+            "espacamento_km": round(float(espacamentos[i]), 3) if np.isfinite(espacamentos[i]) else None,
+            "indice": {str(d): int(celulas[c, e]) for e, d in enumerate(indice.dims)},
+            "series": {nome: valores[c] for nome, valores in dados.items()},
+        })
+
+    return {
+        "variaveis": [str(v) for v in variaveis],
+        "unidades": {str(v): str(ds[v].attrs.get("units", "")) for v in variaveis},
+        "tempo": _tempos_texto(ds[dim_tempo].values),
+        "pontos": resultado,
+    }
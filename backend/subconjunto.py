@@ -0,0 +1,202 @@
+"""
+Defesa Civil Araruna - Seleção de subconjunto antes da conversão
+Recorta variáveis, área (lat/lon), período, passo e polígono (GeoJSON)
+sobre o dataset aberto de forma preguiçosa, antes de qualquer to_dataframe.
+Assim só os dados selecionados são lidos do disco.
+"""
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+import mascara_poligono
+
+
+NOMES_LAT = ["lat", "latitude", "y"]
+NOMES_LON = ["lon", "longitude", "x"]
+NOMES_TEMPO = ["time", "tempo", "t"]
+
+
+class ErroSubconjunto(ValueError):
+    """Seleção inválida ou vazia (vira HTTP 400 no servidor)"""
+
+
+def montar_opcoes(variaveis: str | list[str] | None = None,
+                  lat_min: float | None = None, lat_max: float | None = None,
+                  lon_min: float | None = None, lon_max: float | None = None,
+                  inicio: str | None = None, fim: str | None = None,
+                  passo_tempo: int = 1, passo_espacial: int = 1,
+                  poligono: str | None = None) -> dict:
+    """
+    Normaliza os parâmetros de seleção em um dict simples (serializável,
+    usado também na chave do cache). Só inclui o que foi informado.
+    """
+    opcoes = {}
+
+    if isinstance(variaveis, str):
+        variaveis = [v.strip() for v in variaveis.split(",") if v.strip()]
+    if variaveis:
+        opcoes["variaveis"] = sorted(set(variaveis))
+
+    for nome, valor in [("lat_min", lat_min), ("lat_max", lat_max),
+                        ("lon_min", lon_min), ("lon_max", lon_max)]:
+        if valor is not None:
+            opcoes[nome] = float(valor)
+
+    if lat_min is not None and lat_max is not None and lat_min > lat_max:
+        raise ErroSubconjunto("lat_min deve ser menor ou igual a lat_max")
+    if lon_min is not None and lon_max is not None and lon_min > lon_max:
+        raise ErroSubconjunto("lon_min deve ser menor ou igual a lon_max")
+
+    for nome, valor in [("inicio", inicio), ("fim", fim)]:
+        if valor:
+            try:
+                pd.Timestamp(valor)
+            except ValueError:
+                raise ErroSubconjunto(f"{nome} não é uma data válida: {valor}")
+            opcoes[nome] = valor
+    if inicio and fim and pd.Timestamp(inicio) > pd.Timestamp(fim):
+        raise ErroSubconjunto("inicio deve ser anterior a fim")
+
+    if passo_tempo and passo_tempo > 1:
+        opcoes["passo_tempo"] = int(passo_tempo)
+    if passo_espacial and passo_espacial > 1:
+        opcoes["passo_espacial"] = int(passo_espacial)
+
+    if poligono:
+        if not Path(poligono).is_file():
+            raise ErroSubconjunto(f"Arquivo de polígono não encontrado: {poligono}")
+        opcoes["poligono"] = str(poligono)
+
+    return opcoes
+
+
+def encontrar_coordenada(ds, candidatos: list[str]) -> str | None:
+    """Nome da dimensão (coordenada 1-D) que corresponde a um dos candidatos"""
+    for dim in ds.dims:
+        if str(dim).lower() in candidatos:
+            return dim
+    return None
+
+
+def _fatia_ordenada(coord, minimo, maximo) -> slice:
+    """slice para sel() respeitando coordenadas decrescentes (ex.: lat 90 → -90)"""
+    valores = coord.values
+    decrescente = valores.size > 1 and valores[0] > valores[-1]
+    if decrescente:
+        return slice(maximo, minimo)
+    return slice(minimo, maximo)
+
+
+def _ajustar_longitude(coord, valor):
+    """Converte longitude -180..180 para 0..360 quando o arquivo usa esse padrão"""
+    if valor is None:
+        return None
+    if float(np.nanmax(coord.values)) > 180 and valor < 0:
+        return valor + 360
+    return valor
+
+
+def _recortar_poligono(ds, caminho_poligono: str):
+    """
+    Mantém só as células da grade dentro do polígono: recorta a caixa
+    envolvente e extrai as células por indexação vetorizada. As dimensões
+    lat/lon viram uma dimensão "celula" (lat e lon ficam como coordenadas).
+    """
+    nome_lat = encontrar_coordenada(ds, NOMES_LAT)
+    nome_lon = encontrar_coordenada(ds, NOMES_LON)
+    if nome_lat is None or nome_lon is None:
+        raise ErroSubconjunto("Arquivo não possui coordenadas 1-D de latitude e longitude para o polígono")
+
+    try:
+        mascara = mascara_poligono.mascara_da_grade(
+            ds[nome_lat].values, ds[nome_lon].values, caminho_poligono
+        )
+    except mascara_poligono.ErroPoligono as e:
+        raise ErroSubconjunto(str(e))
+
+    ii, jj = np.nonzero(mascara)
+    if ii.size == 0:
+        raise ErroSubconjunto("Nenhuma célula da grade está dentro do polígono")
+
+    i0, j0 = int(ii.min()), int(jj.min())
+    ds = ds.isel({nome_lat: slice(i0, int(ii.max()) + 1), nome_lon: slice(j0, int(jj.max()) + 1)})
+    return ds.isel({
+        nome_lat: xr.DataArray(ii - i0, dims="celula"),
+        nome_lon: xr.DataArray(jj - j0, dims="celula"),
+    })
+
+
+def aplicar_subconjunto(ds, opcoes: dict | None):
+    """
+    Aplica a seleção ao dataset (sem carregar dados).
+    Retorna um novo Dataset que fecha o arquivo original ao ser fechado.
+    """
+    if not opcoes:
+        return ds
+
+    original = ds
+
+    variaveis = opcoes.get("variaveis")
+    if variaveis:
+        ausentes = [v for v in variaveis if v not in ds.data_vars]
+        if ausentes:
+            raise ErroSubconjunto(
+                f"Variável(is) inexistente(s): {', '.join(ausentes)}. "
+                f"Disponíveis: {', '.join(map(str, ds.data_vars))}"
+            )
+        ds = ds[variaveis]
+
+    selecao = {}
+
+    if "lat_min" in opcoes or "lat_max" in opcoes:
+        nome_lat = encontrar_coordenada(ds, NOMES_LAT)
+        if nome_lat is None:
+            raise ErroSubconjunto("Arquivo não possui coordenada de latitude 1-D")
+        selecao[nome_lat] = _fatia_ordenada(ds[nome_lat], opcoes.get("lat_min"), opcoes.get("lat_max"))
+
+    if "lon_min" in opcoes or "lon_max" in opcoes:
+        nome_lon = encontrar_coordenada(ds, NOMES_LON)
+        if nome_lon is None:
+            raise ErroSubconjunto("Arquivo não possui coordenada de longitude 1-D")
+        selecao[nome_lon] = _fatia_ordenada(
+            ds[nome_lon],
+            _ajustar_longitude(ds[nome_lon], opcoes.get("lon_min")),
+            _ajustar_longitude(ds[nome_lon], opcoes.get("lon_max")),
+        )
+
+    if "inicio" in opcoes or "fim" in opcoes:
+        nome_tempo = encontrar_coordenada(ds, NOMES_TEMPO)
+        if nome_tempo is None:
+            raise ErroSubconjunto("Arquivo não possui coordenada de tempo")
+        selecao[nome_tempo] = slice(opcoes.get("inicio"), opcoes.get("fim"))
+
+    if selecao:
+        ds = ds.sel(selecao)
+
+    passos = {}
+    if opcoes.get("passo_tempo", 1) > 1:
+        nome_tempo = encontrar_coordenada(ds, NOMES_TEMPO)
+        if nome_tempo is None:
+            raise ErroSubconjunto("Arquivo não possui coordenada de tempo para passo_tempo")
+        passos[nome_tempo] = slice(None, None, opcoes["passo_tempo"])
+    if opcoes.get("passo_espacial", 1) > 1:
+        for nome in [encontrar_coordenada(ds, NOMES_LAT), encontrar_coordenada(ds, NOMES_LON)]:
+            if nome is not None:
+                passos[nome] = slice(None, None, opcoes["passo_espacial"])
+
+    if passos:
+        ds = ds.isel(passos)
+
+    if opcoes.get("poligono"):
+        ds = _recortar_poligono(ds, opcoes["poligono"])
+
+    vazias = [dim for dim, tamanho in ds.sizes.items() if tamanho == 0]
+    if vazias:
+        raise ErroSubconjunto(f"A seleção não contém dados (dimensão vazia: {', '.join(map(str, vazias))})")
+
+    if ds is not original:
+        ds.set_close(original.close)
+    return ds
@@ -0,0 +1,6 @@
+"""Os módulos do backend são importados pelo nome, como no servidor"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
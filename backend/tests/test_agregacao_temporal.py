@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+import agregacao_temporal
+
+
+def _diario(valores: np.ndarray, unidades: str = "mm", freq: str = "D") -> xr.Dataset:
+    tempo = pd.date_range("2024-01-25", periods=valores.shape[0], freq=freq)
+    return xr.Dataset({"pr": (("time", "lat"), valores, {"units": unidades})},
+                      coords={"time": tempo, "lat": [-7.0, -6.5]})
+
+
+def _agregar(ds, estatistica, passo: int = 3):
+    """Fatias de `passo` dias (cruzam a virada do mês); devolve os períodos e quando saíram"""
+    acumulador = agregacao_temporal.AcumuladorTemporal(ds, "mensal", estatistica)
+    periodos, entregues_na_fatia = [], []
+    for i, inicio in enumerate(range(0, ds.sizes["time"], passo)):
+        fatia = {"time": slice(inicio, inicio + passo)}
+        acumulador.adicionar(fatia, acumulador.reduzir(ds.isel(fatia)))
+        for ds_periodo in acumulador.concluidos():
+            periodos.append(ds_periodo)
+            entregues_na_fatia.append(i)
+    periodos.extend(acumulador.finalizar())
+    return xr.concat(periodos, "time"), entregues_na_fatia
+
+
+def test_periodos_fecham_entre_fatias():
+    valores = np.arange(20.0).reshape(10, 2)   # 25/01 a 03/02
+    ds = _diario(valores)
+    agregado, entregues = _agregar(ds, "soma")
+
+    # A fatia de 31/01 a 02/02 ainda pode ter vizinhas com 31/01 (corte na grade):
+    # janeiro só sai quando chega a primeira fatia que começa em fevereiro
+    assert entregues == [3]
+    assert agregado["time"].values.astype("datetime64[D]").tolist() == [
+        np.datetime64("2024-01-01").item(), np.datetime64("2024-02-01").item()]
+    esperado = ds["pr"].resample(time="MS").sum()
+    np.testing.assert_allclose(agregado["pr"].values, esperado.values)
+    assert agregado["pr"].attrs["units"] == "mm"
+
+
+def test_nan_fora_da_contagem_e_da_media():
+    valores = np.arange(20.0).reshape(10, 2)
+    valores[0:3, 0] = np.nan               # dias de janeiro sem dado na 1ª célula
+    valores[7:, 1] = np.nan                # fevereiro inteiro sem dado na 2ª célula
+    agregado, _ = _agregar(_diario(valores), ["soma", "media", "contagem", "maximo"])
+
+    assert agregado["pr_contagem"].values.tolist() == [[4, 7], [3, 0]]
+    np.testing.assert_allclose(agregado["pr_soma"].values, [[6 + 8 + 10 + 12, 49], [14 + 16 + 18, np.nan]])
+    np.testing.assert_allclose(agregado["pr_media"].values, [[9.0, 7.0], [16.0, np.nan]])
+    np.testing.assert_allclose(agregado["pr_maximo"].values, [[12.0, 13.0], [18.0, np.nan]])
+
+
+@pytest.mark.parametrize("freq, segundos", [("D", 86400.0), ("6h", 21600.0)])
+def test_soma_de_fluxo_vira_mm(freq, segundos):
+    fluxo = np.full((8, 2), 1e-4)          # kg m-2 s-1 = mm/s
+    agregado, _ = _agregar(_diario(fluxo, "kg m-2 s-1", freq), ["soma", "media"], passo=2)
+
+    total = agregado["pr_soma"].sum("time").values
+    np.testing.assert_allclose(total, 8 * 1e-4 * segundos, rtol=1e-6)
+    assert agregado["pr_soma"].attrs["units"] == "mm"
+    np.testing.assert_allclose(agregado["pr_media"].values, 1e-4, rtol=1e-6)   # média continua taxa
+    assert agregado["pr_media"].attrs["units"] == "kg m-2 s-1"
+
+
+def test_fator_so_para_taxas():
+    tempos = pd.date_range("2024-01-01", periods=3, freq="D").values
+    var = lambda unidades: xr.DataArray(np.zeros(3), attrs={"units": unidades})
+    assert agregacao_temporal.fator_soma_mm(var("mm"), tempos) == 1.0
+    assert agregacao_temporal.fator_soma_mm(var("m"), tempos) == 1.0
+    assert agregacao_temporal.fator_soma_mm(var("K"), tempos) == 1.0
+    assert agregacao_temporal.fator_soma_mm(var("kg m-2 s-1"), tempos) == 86400.0
+    assert agregacao_temporal.fator_soma_mm(var("m/day"), tempos) == 1000.0
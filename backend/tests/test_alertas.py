@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+import alertas
+
+
+def _previsao(unidades="mm", passo="3h", fator=1.0):
+    """Chuva em 3 passos x 2 x 2 células, com um NaN"""
+    valores = np.array([
+        [[10, 30], [49.9, np.nan]],
+        [[50, 0], [80, 120]],
+        [[29.99, 31], [0, 5]],
+    ]) / fator
+    return xr.Dataset(
+        {"pr": (("time", "lat", "lon"), valores, {"units": unidades})},
+        coords={"time": pd.date_range("2026-01-01", periods=3, freq=passo),
+                "lat": [-6.5, -6.75], "lon": [-35.75, -35.5]},
+    )
+
+
+def test_ler_limiares():
+    assert alertas.ler_limiares(None) == [30.0, 50.0, 80.0]
+    assert alertas.ler_limiares("80; 30,50,30") == [30.0, 50.0, 80.0]
+    for invalido in ("30,abc", "0,10", ",".join(str(i) for i in range(1, 12))):
+        with pytest.raises(alertas.ErroAlertas):
+            alertas.ler_limiares(invalido)
+
+
+def test_so_as_linhas_acima_do_menor_limiar_com_o_nivel():
+    ds = _previsao()
+    lote = alertas.tabela_alertas(ds, [30, 50, 80], alertas.fator_mm_passo(ds))
+    np.testing.assert_allclose(lote["pr_mm"], [30, 49.9, 50, 80, 120, 31], rtol=1e-6)
+    np.testing.assert_array_equal(lote["alerta_mm"], [30, 30, 50, 80, 80, 30])
+    np.testing.assert_array_equal(lote["lat"], [-6.5, -6.75, -6.5, -6.75, -6.75, -6.5])
+
+
+def test_taxa_convertida_para_mm_no_passo():
+    # kg m-2 s-1 em passos de 3 h: x 86400 x 3/24
+    ds = _previsao("kg m-2 s-1", fator=86400 * 3 / 24)
+    assert alertas.fator_mm_passo(ds) == pytest.approx(10800)
+    lote = alertas.tabela_alertas(ds, [30, 50, 80], alertas.fator_mm_passo(ds))
+    np.testing.assert_array_equal(lote["alerta_mm"], [30, 30, 50, 80, 80, 30])
+
+
+def test_contagens_por_nivel_em_varios_lotes():
+    ds = _previsao()
+    contagem = alertas.contagem_para(ds, [30, 50, 80])
+    for t in range(3):
+        parte = ds.isel(time=slice(t, t + 1))
+        contagem.adicionar(alertas.tabela_alertas(parte, [30, 50, 80], 1.0))
+    resumo = contagem.resumo()
+    assert [(n["ocorrencias"], n["celulas"]) for n in resumo["niveis"]] == [(6, 4), (3, 3), (2, 2)]
+    assert resumo["maximo_mm"] == 120
+    assert resumo["primeiro_alerta"] == "2026-01-01T00:00:00"
+    assert resumo["ultimo_alerta"] == "2026-01-01T06:00:00"
+
+
+def test_alertas_nao_combinam_com_outros_modos():
+    with pytest.raises(alertas.ErroAlertas):
+        alertas.validar({"alertas": [30.0], "indices": True})
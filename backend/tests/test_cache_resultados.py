@@ -0,0 +1,69 @@
+import os
+
+import pytest
+
+import cache_resultados
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    """Cache vazio em tmp_path, com limite de 10 bytes"""
+    pasta = tmp_path / "cache"
+    pasta.mkdir()
+    monkeypatch.setattr(cache_resultados, "CACHE_DIR", pasta)
+    monkeypatch.setattr(cache_resultados, "LIMITE_BYTES", 10)
+    monkeypatch.setattr(cache_resultados, "_estatisticas", {"acertos": 0, "faltas": 0, "removidos": 0})
+    return pasta
+
+
+def _resultado(tmp_path, nome: str, conteudo: bytes):
+    caminho = tmp_path / nome
+    caminho.write_bytes(conteudo)
+    return caminho
+
+
+def test_chave_depende_de_arquivo_formato_e_opcoes():
+    chave = cache_resultados.calcular_chave("a" * 64, "csv", {"variaveis": ["pr"], "esparso": True})
+    assert chave == cache_resultados.calcular_chave("a" * 64, "csv", {"esparso": True, "variaveis": ["pr"]})
+    assert cache_resultados.calcular_chave("a" * 64, "csv", None) == cache_resultados.calcular_chave("a" * 64, "csv", {})
+    outras = {
+        cache_resultados.calcular_chave("b" * 64, "csv", {"variaveis": ["pr"], "esparso": True}),
+        cache_resultados.calcular_chave("a" * 64, "parquet", {"variaveis": ["pr"], "esparso": True}),
+        cache_resultados.calcular_chave("a" * 64, "csv", {"variaveis": ["pr"]}),
+    }
+    assert chave not in outras and len(outras) == 3
+
+
+def test_acerto_e_falta(cache, tmp_path):
+    chave = cache_resultados.calcular_chave("a" * 64, "csv")
+    assert cache_resultados.buscar(chave, ".csv", ".zip") is None
+
+    temporario = _resultado(tmp_path, "conversao.tmp", b"abc")
+    guardado = cache_resultados.guardar(chave, ".zip", temporario)
+
+    assert not temporario.exists()  # movido (os.replace), não copiado
+    assert guardado == cache / f"{chave}.zip" and guardado.read_bytes() == b"abc"
+    assert cache_resultados.buscar(chave, ".csv", ".zip") == guardado
+    assert cache_resultados.buscar(cache_resultados.calcular_chave("a" * 64, "xlsx"), ".xlsx") is None
+    estatisticas = cache_resultados.estatisticas()
+    assert (estatisticas["acertos"], estatisticas["faltas"], estatisticas["entradas"]) == (1, 2, 1)
+
+
+def test_limite_remove_o_menos_usado(cache, tmp_path):
+    antigo = cache_resultados.guardar("antigo", ".csv", _resultado(tmp_path, "1.tmp", b"1234"))
+    usado = cache_resultados.guardar("usado", ".csv", _resultado(tmp_path, "2.tmp", b"1234"))
+    os.utime(antigo, (1_000, 1_000))
+    os.utime(usado, (2_000, 2_000))
+    assert cache_resultados.buscar("usado", ".csv") == usado  # acesso atualiza a data
+
+    novo = cache_resultados.guardar("novo", ".csv", _resultado(tmp_path, "3.tmp", b"1234"))
+
+    assert not antigo.exists()
+    assert usado.exists() and novo.exists()
+    assert cache_resultados.estatisticas()["removidos"] == 1
+
+
+def test_resultado_maior_que_o_limite_fica(cache, tmp_path):
+    grande = cache_resultados.guardar("grande", ".csv", _resultado(tmp_path, "g.tmp", b"x" * 50))
+    assert grande.exists()
+    assert cache_resultados.buscar("grande", ".csv") == grande
@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+import climatologia
+
+
+@pytest.fixture
+def historico(tmp_path, monkeypatch):
+    """
+    Chuva diária de 2001 a 2003 em 1 x 2 células: 1, 2 e 3 mm/dia conforme
+    o ano na primeira célula e o dobro na segunda; falta o último dia de
+    2003, então dezembro de 2003 fica incompleto.
+    """
+    monkeypatch.setattr(climatologia, "CLIMATOLOGIAS_DIR", tmp_path / "climatologias")
+    monkeypatch.setattr(climatologia, "_memoria", {})
+    (tmp_path / "climatologias").mkdir()
+    dias = pd.date_range("2001-01-01", "2003-12-30", freq="D")
+    por_dia = (dias.year - 2000).to_numpy(np.float32)
+    valores = np.stack([por_dia, 2 * por_dia], axis=1)[:, np.newaxis, :]
+    caminho = tmp_path / "historico.nc"
+    xr.Dataset({"pr": (("time", "lat", "lon"), valores, {"units": "mm"})},
+               coords={"time": dias, "lat": [-6.5], "lon": [-35.75, -35.5]}).to_netcdf(caminho)
+    return caminho
+
+
+def test_media_e_percentis_por_mes(historico):
+    id_clima = climatologia.criar([historico], 2001, 2003, percentis=(10, 50, 90), nomes=["original.nc"])
+    clima = climatologia.carregar(id_clima)
+    assert clima.meta["arquivos"] == ["original.nc"]
+    assert clima.meta["anos_com_dados"] == 3
+    # Janeiro: totais 31, 62 e 93 mm na primeira célula
+    np.testing.assert_allclose(clima.media[0, 0], [62, 124])
+    np.testing.assert_allclose(clima.percentis[:, 0, 0, 0], [37.2, 62, 86.8], rtol=1e-6)
+    # Fevereiro de 28 dias
+    np.testing.assert_allclose(clima.media[1, 0, 0], 56)
+    # Dezembro de 2003 incompleto fica de fora: só 31 e 62 mm
+    np.testing.assert_allclose(clima.media[11, 0, 0], 46.5)
+
+
+def test_mesmos_dados_devolvem_o_mesmo_id(historico):
+    assert climatologia.criar([historico], 2001, 2003) == climatologia.criar([historico], 2001, 2003)
+
+
+def test_percentil_95_diario(historico):
+    clima = climatologia.carregar(climatologia.criar([historico], 2001, 2003))
+    assert clima.meta["p95_umido"]
+    np.testing.assert_allclose(clima.p95_umido[0], [3, 6], rtol=0.06)
+    grade = xr.Dataset(coords={"lat": [-6.5], "lon": [-35.5, -35.75]})
+    np.testing.assert_allclose(clima.limiar_p95(grade, ["lon", "lat"])[:, 0], clima.p95_umido[0, ::-1])
+
+
+def test_anomalias_de_um_mes(historico):
+    id_clima = climatologia.criar([historico], 2001, 2003, percentis=(10, 50, 90))
+    mes = xr.Dataset({"pr": (("time", "lat", "lon"), np.array([[[124.0, 31.0]]], np.float32))},
+                     coords={"time": [np.datetime64("2010-01-01", "ns")], "lat": [-6.5], "lon": [-35.75, -35.5]})
+    resultado = climatologia.anomalias(mes, id_clima)
+    np.testing.assert_allclose(resultado["pr_normal"].values[0, 0], [62, 124])
+    np.testing.assert_allclose(resultado["pr_anomalia"].values[0, 0], [62, -93])
+    np.testing.assert_allclose(resultado["pr_pct_normal"].values[0, 0], [200, 25])
+    # Acima do maior percentil fica nele; abaixo do menor, interpolado a partir de zero
+    np.testing.assert_allclose(resultado["pr_percentil"].values[0, 0], [90, 10 * 31 / 74.4], rtol=1e-5)
+
+
+def test_grade_diferente_e_recusada(historico):
+    clima = climatologia.carregar(climatologia.criar([historico], 2001, 2003))
+    with pytest.raises(climatologia.ErroClimatologia):
+        clima.normais(xr.Dataset(coords={"lat": [-6.0], "lon": [-35.5]}), 1)
+
+
+def test_fluxo_vira_totais_em_mm(historico, tmp_path):
+    with xr.open_dataset(historico) as ds:
+        fluxo = ds.load()
+    fluxo["pr"] = (fluxo["pr"] / 86400).assign_attrs(units="kg m-2 s-1")
+    fluxo.to_netcdf(tmp_path / "fluxo.nc")
+    clima = climatologia.carregar(climatologia.criar([tmp_path / "fluxo.nc"], 2001, 2003))
+    assert clima.meta["unidades"] == "mm"
+    np.testing.assert_allclose(clima.media[0, 0], [62, 124], rtol=1e-5)
@@ -0,0 +1,42 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+import planejador_fatias
+
+
+@pytest.fixture
+def caminho_nc(tmp_path, monkeypatch):
+    """Arquivo pequeno com orçamento de fatia minúsculo: várias fatias por tabela"""
+    monkeypatch.setattr(planejador_fatias, "ORCAMENTO_FATIA_MB", 0.002)
+    gerador = np.random.default_rng(7)
+    pr = gerador.gamma(0.5, 8.0, (40, 6, 5))
+    pr[gerador.random(pr.shape) < 0.1] = np.nan
+    ds = xr.Dataset(
+        {"pr": (("time", "lat", "lon"), pr)},
+        coords={"time": pd.date_range("2020-01-01", periods=40, freq="D"),
+                "lat": np.linspace(-7.0, -6.5, 6), "lon": np.linspace(-36.0, -35.6, 5)},
+    )
+    caminho = tmp_path / "chuva.nc"
+    ds.to_netcdf(caminho)
+    return caminho
+
+
+@pytest.mark.parametrize("formato", ["csv", "parquet"])
+def test_saida_paralela_igual_a_serial(caminho_nc, tmp_path, formato):
+    if formato == "parquet":
+        pytest.importorskip("pyarrow")
+    main = pytest.importorskip("main")
+    with xr.open_dataset(caminho_nc) as ds:
+        assert planejador_fatias.contar_fatias(ds) > 4
+
+    saidas = {}
+    for trabalhadores in (1, 3):
+        saida = main.converter_netcdf_para_arquivo(
+            str(caminho_nc), str(tmp_path / f"saida_{trabalhadores}"), formato, trabalhadores=trabalhadores
+        )
+        saidas[trabalhadores] = Path(saida).read_bytes()
+    assert saidas[3] == saidas[1]
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+import escritores
+
+openpyxl = pytest.importorskip("openpyxl")
+pytest.importorskip("xlsxwriter")
+
+
+def _lote(inicio: int, n: int) -> dict:
+    valores = np.arange(inicio, inicio + n, dtype="float64")
+    valores[valores == 6] = np.nan
+    return {"indice": np.arange(inicio, inicio + n), "pr": valores}
+
+
+def test_xlsx_continua_em_nova_planilha_no_limite(tmp_path):
+    caminho = tmp_path / "saida.xlsx"
+    escritor = escritores.EscritorXLSX(str(caminho), linhas_por_planilha=4)
+    assert escritor.wb.constant_memory
+    escritor.nova_tabela("pr")
+    escritor.escrever(_lote(0, 5))      # a virada acontece no meio de um lote
+    escritor.escrever(_lote(5, 4))
+    escritor.nova_tabela("time_bnds")
+    escritor.escrever({"time": np.arange(3)})
+    escritor.fechar()
+
+    assert escritor.total_linhas == 12
+    assert escritor.planilhas == 4
+    wb = openpyxl.load_workbook(caminho, read_only=True)
+    linhas = {ws.title: list(ws.iter_rows(values_only=True)) for ws in wb.worksheets}
+    wb.close()
+    assert list(linhas) == ["pr", "pr_2", "pr_3", "time_bnds"]
+    assert [len(v) - 1 for v in linhas.values()] == [4, 4, 1, 3]   # sem o cabeçalho
+    assert all(v[0] == ("indice", "pr") for k, v in linhas.items() if k.startswith("pr"))
+    assert [l[0] for k in ("pr", "pr_2", "pr_3") for l in linhas[k][1:]] == list(range(9))
+    assert linhas["pr_2"][3] == (6, None)   # NaN vira célula vazia
+    assert linhas["time_bnds"][0] == ("time",)
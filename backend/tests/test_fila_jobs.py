@@ -0,0 +1,89 @@
+import time
+from concurrent.futures import Future
+from pathlib import Path
+
+import numpy as np
+import pytest
+import xarray as xr
+
+import cache_resultados
+import fila_jobs
+
+
+def test_ao_concluir_roda_fora_do_lock(monkeypatch):
+    futuro = Future()
+    monkeypatch.setattr(fila_jobs, "submeter", lambda funcao, *args: futuro)
+    vistos = []
+
+    def ao_concluir(resultado):
+        vistos.append(fila_jobs._lock.locked())
+        vistos.append(fila_jobs.obter_job(job_id)["status"])
+        return {**resultado, "caminho": "final"}
+
+    job_id = fila_jobs.criar_job(None, ao_concluir=ao_concluir)
+    futuro.set_result({"caminho": "temporario"})
+
+    assert vistos == [False, "processando"]
+    job = fila_jobs.obter_job(job_id)
+    assert job["status"] == "concluido"
+    assert job["resultado"] == {"caminho": "final"}
+    assert job["concluido_em"] is not None
+
+
+def test_erro_em_ao_concluir_vira_erro_do_job(monkeypatch):
+    futuro = Future()
+    monkeypatch.setattr(fila_jobs, "submeter", lambda funcao, *args: futuro)
+
+    def ao_concluir(resultado):
+        raise OSError("disco cheio")
+
+    job_id = fila_jobs.criar_job(None, ao_concluir=ao_concluir)
+    futuro.set_result({"caminho": "temporario"})
+
+    job = fila_jobs.obter_job(job_id)
+    assert job["status"] == "erro"
+    assert job["erro"] == "OSError: disco cheio"
+
+
+@pytest.fixture
+def cliente(tmp_path, monkeypatch):
+    testclient = pytest.importorskip("fastapi.testclient")
+    import main
+
+    for pasta in ("temp", "output", "cache"):
+        (tmp_path / pasta).mkdir()
+    monkeypatch.setattr(main, "TEMP_DIR", tmp_path / "temp")
+    monkeypatch.setattr(main, "OUTPUT_DIR", tmp_path / "output")
+    monkeypatch.setattr(cache_resultados, "CACHE_DIR", tmp_path / "cache")
+    yield testclient.TestClient(main.app)
+    fila_jobs.encerrar()
+
+
+def _converter_em_job(cliente, caminho_nc: Path) -> dict:
+    with open(caminho_nc, "rb") as f:
+        resposta = cliente.post("/api/netcdf/converter?formato=csv&modo=job",
+                                files={"arquivo": (caminho_nc.name, f, "application/octet-stream")})
+    assert resposta.status_code == 202
+    for _ in range(600):
+        job = cliente.get(resposta.json()["status_url"]).json()
+        if job["status"] not in ("na_fila", "processando"):
+            assert cliente.get(resposta.json()["resultado_url"]).content.startswith(b"\xef\xbb\xbftime,x,pr")
+            return fila_jobs.obter_job(job["id"])
+        time.sleep(0.05)
+    raise AssertionError("job não terminou")
+
+
+def test_jobs_com_e_sem_cache_terminam_concluidos(cliente, tmp_path):
+    caminho_nc = tmp_path / "chuva.nc"
+    xr.Dataset({"pr": (("time", "x"), np.arange(6.0).reshape(3, 2))},
+               coords={"x": [10.0, 20.0]}).to_netcdf(caminho_nc)
+
+    falta = _converter_em_job(cliente, caminho_nc)
+    acerto = _converter_em_job(cliente, caminho_nc)
+
+    for job in (falta, acerto):
+        assert job["status"] == "concluido", job["erro"]
+        caminho = Path(job["resultado"]["caminho"])
+        assert caminho.parent == tmp_path / "cache" and caminho.is_file()
+    assert acerto["resultado"]["caminho"] == falta["resultado"]["caminho"]
+    assert acerto["id"] != falta["id"]
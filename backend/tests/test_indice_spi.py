@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+import indice_spi
+
+stats = pytest.importorskip("scipy.stats")
+
+AMOSTRA = np.array([5, 12, 20, 33, 41, 50, 64, 70, 85, 100, 120, 150], np.float64)
+
+
+def _spi_thom(amostra):
+    """SPI de referência: gama de Thom ajustada aos positivos, zeros à parte"""
+    positivos = amostra[amostra > 0]
+    a = np.log(positivos.mean()) - np.log(positivos).mean()
+    alfa = (1 + np.sqrt(1 + 4 * a / 3)) / (4 * a)
+    beta = positivos.mean() / alfa
+    zeros = (amostra == 0).mean()
+    acumulada = zeros + (1 - zeros) * stats.gamma.cdf(amostra, alfa, scale=beta)
+    return np.clip(stats.norm.ppf(acumulada), -indice_spi.SPI_LIMITE, indice_spi.SPI_LIMITE)
+
+
+def _meses(n_anos):
+    return np.arange(np.datetime64("1990-01"), np.datetime64("1990-01") + 12 * n_anos)
+
+
+def test_spi_de_uma_amostra_gama():
+    # Só janeiro varia; o resto do ano é constante
+    totais = np.full((12 * AMOSTRA.size, 1), 30.0)
+    totais[::12, 0] = AMOSTRA
+    resultado = indice_spi.spi(totais, _meses(AMOSTRA.size))
+    np.testing.assert_allclose(resultado[::12, 0], _spi_thom(AMOSTRA), atol=1e-9)
+    assert resultado[::12, 0][0] < -1 < 1 < resultado[::12, 0][-1]
+
+
+def test_spi_com_anos_sem_chuva():
+    amostra = AMOSTRA.copy()
+    amostra[[2, 7]] = 0
+    totais = amostra[:, np.newaxis].repeat(12, axis=0)
+    resultado = indice_spi.spi(totais, _meses(amostra.size))
+    np.testing.assert_allclose(resultado[::12, 0], _spi_thom(amostra), atol=1e-9)
+
+
+def test_poucos_anos_ficam_vazios():
+    totais = AMOSTRA[: indice_spi.ANOS_MINIMOS - 1, np.newaxis].repeat(12, axis=0)
+    assert np.isnan(indice_spi.spi(totais, _meses(indice_spi.ANOS_MINIMOS - 1))).all()
+
+
+def test_soma_movel():
+    totais = np.array([[1.0], [2.0], [np.nan], [4.0], [5.0], [6.0]])
+    np.testing.assert_array_equal(indice_spi.soma_movel(totais, 3)[:, 0],
+                                  [np.nan, np.nan, np.nan, np.nan, np.nan, 15.0])
+    np.testing.assert_array_equal(indice_spi.soma_movel(totais, 2)[:, 0],
+                                  [np.nan, 3.0, np.nan, np.nan, 9.0, 11.0])
+
+
+def test_calcular_de_dados_diarios():
+    # Chuva diária constante no mês: SPI-1 de janeiro igual ao da amostra mensal
+    dias = pd.date_range("1990-01-01", f"{1990 + AMOSTRA.size - 1}-12-31", freq="D")
+    diaria = np.full(dias.size, 1.0)
+    for ano, total in enumerate(AMOSTRA):
+        janeiro = (dias.year == 1990 + ano) & (dias.month == 1)
+        diaria[janeiro] = total / 31
+    ds = xr.Dataset({"pr": (("time", "lat", "lon"), diaria[:, np.newaxis, np.newaxis])},
+                    coords={"time": dias, "lat": [-7.0], "lon": [-36.0]})
+    resultado = indice_spi.calcular(ds)
+    assert resultado["spi_1"].dims == ("lat", "lon", "time")
+    np.testing.assert_allclose(resultado["spi_1"].values[0, 0, ::12], _spi_thom(AMOSTRA), atol=1e-5)
+    assert np.isnan(resultado["spi_12"].values[0, 0, :11]).all()
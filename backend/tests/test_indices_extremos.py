@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+import indices_extremos
+import motor_tabular
+
+# Chuva diária de 2000-12-25 a 2001-01-05: a célula 0 calculada à mão,
+# a célula 1 com 1 mm todo dia (sequência úmida que atravessa o ano)
+CHUVA = [0, 5, 25, 0, 0, 0, 2, 3, 0, 40, 1, 0]
+
+
+def _dataset(unidades="mm/day", fator=1.0):
+    valores = np.stack([np.asarray(CHUVA, np.float64), np.ones(len(CHUVA))], axis=1)[:, :, np.newaxis]
+    return xr.Dataset(
+        {"pr": (("time", "lat", "lon"), valores / fator, {"units": unidades})},
+        coords={"time": pd.date_range("2000-12-25", periods=len(CHUVA), freq="D"),
+                "lat": [-7.5, -7.0], "lon": [-36.0]},
+    )
+
+
+def _tabela(ds, **kwargs):
+    """Índices em duas fatias de tempo (as sequências continuam entre elas)"""
+    def fatias():
+        for corte in (slice(0, 5), slice(5, len(CHUVA))):
+            fatia = {"time": corte}
+            yield fatia, ds.isel(fatia)
+
+    lotes = indices_extremos.iterar_indices(ds, fatias, **kwargs)
+    df = pd.concat([motor_tabular.para_dataframe(lote) for lote in lotes], ignore_index=True)
+    return df.set_index(["ano", "lat"])
+
+
+def test_indices_calculados_a_mao():
+    df = _tabela(_dataset(), limiar_p95=np.array([[10.0], [10.0]]))
+    celula = df.xs(-7.5, level="lat")
+    assert celula.loc[2000, ["rx1day", "rx5day", "r95p", "r20mm", "cdd", "cwd"]].tolist() == [25, 30, 25, 1, 3, 2]
+    assert celula.loc[2001, ["rx1day", "rx5day", "r95p", "r20mm", "cdd", "cwd"]].tolist() == [40, 46, 40, 1, 1, 2]
+    umida = df.xs(-7.0, level="lat")
+    assert umida.loc[2000, ["rx1day", "rx5day", "r95p", "cdd", "cwd"]].tolist() == [1, 5, 0, 0, 7]
+    assert umida.loc[2001, "cwd"] == 12
+
+
+def test_sem_limiar_o_r95p_fica_de_fora():
+    df = _tabela(_dataset())
+    assert "r95p" not in df.columns
+    assert df.xs(-7.5, level="lat").loc[2001, "rx5day"] == 46
+
+
+def test_unidade_convertida_para_mm_por_dia():
+    df = _tabela(_dataset("kg m-2 s-1", 86400.0))
+    np.testing.assert_allclose(df.xs(-7.5, level="lat")["rx1day"], [25, 40], rtol=1e-6)
+
+
+def test_percentil_95_pelo_histograma():
+    # 100 dias úmidos com 1..100 mm e 50 dias secos: P95 ~ 95 mm
+    chuva = np.concatenate([np.arange(1, 101), np.zeros(50)]).astype(np.float64)
+    valores = np.stack([chuva, np.zeros_like(chuva)], axis=1)[:, :, np.newaxis]
+    ds = xr.Dataset(
+        {"pr": (("time", "lat", "lon"), valores)},
+        coords={"time": pd.date_range("2000-01-01", periods=chuva.size, freq="D"),
+                "lat": [0.0, 1.0], "lon": [0.0]},
+    )
+    fatias = [({"time": slice(i, i + 40)}, ds.isel(time=slice(i, i + 40))) for i in range(0, chuva.size, 40)]
+    limiar = indices_extremos.limiares_p95(ds, fatias)
+    assert limiar.shape == (2, 1)
+    assert limiar[0, 0] == pytest.approx(np.percentile(np.arange(1, 101), 95), rel=0.06)
+    assert np.isnan(limiar[1, 0])  # sem dias úmidos
+
+
+def test_dados_nao_diarios_sao_recusados():
+    ds = _dataset().assign_coords(time=pd.date_range("2000-01-01", periods=len(CHUVA), freq="MS"))
+    with pytest.raises(indices_extremos.ErroIndices):
+        indices_extremos.dimensao_tempo(ds)
@@ -0,0 +1,74 @@
+import json
+
+import numpy as np
+import pytest
+
+import mascara_poligono
+
+
+QUADRADO = [[-36.0, -7.0], [-35.5, -7.0], [-35.5, -6.5], [-36.0, -6.5], [-36.0, -7.0]]
+
+
+@pytest.fixture
+def mascaras(tmp_path, monkeypatch):
+    """Pasta de máscaras vazia e contador de cálculos ponto-no-polígono"""
+    pasta = tmp_path / "mascaras"
+    pasta.mkdir()
+    monkeypatch.setattr(mascara_poligono, "MASCARAS_DIR", pasta)
+    monkeypatch.setattr(mascara_poligono, "_memoria", {})
+    calculos = []
+    original = mascara_poligono.calcular_mascara
+
+    def contar(lat, lon, poligonos):
+        calculos.append((lat.size, lon.size))
+        return original(lat, lon, poligonos)
+
+    monkeypatch.setattr(mascara_poligono, "calcular_mascara", contar)
+    return pasta, calculos
+
+
+def _geojson(tmp_path, nome: str, anel: list, propriedades: dict | None = None) -> str:
+    caminho = tmp_path / nome
+    caminho.write_text(json.dumps({"type": "Feature", "properties": propriedades or {},
+                                   "geometry": {"type": "Polygon", "coordinates": [anel]}}))
+    return str(caminho)
+
+
+def _grade(passo: float = 0.25):
+    return np.arange(-7.375, -5.9, passo), np.arange(-36.375, -34.9, passo)
+
+
+def test_mesma_grade_e_poligono_reusam_o_arquivo(mascaras, tmp_path):
+    pasta, calculos = mascaras
+    lat, lon = _grade()
+    primeira = mascara_poligono.mascara_da_grade(lat, lon, _geojson(tmp_path, "a.geojson", QUADRADO))
+    assert len(calculos) == 1 and len(list(pasta.glob("*.npy"))) == 1
+    assert primeira.shape == (lat.size, lon.size) and primeira.sum() == 4
+
+    # Outro processo (memória vazia), mesmo polígono com outras propriedades: lê o .npy
+    mascara_poligono._memoria.clear()
+    outro_arquivo = _geojson(tmp_path, "b.geojson", QUADRADO, {"nome": "Araruna"})
+    segunda = mascara_poligono.mascara_da_grade(lat.copy(), lon.copy(), outro_arquivo)
+    assert len(calculos) == 1 and len(list(pasta.glob("*.npy"))) == 1
+    np.testing.assert_array_equal(segunda, primeira)
+
+
+def test_outra_grade_ou_poligono_calculam_nova_mascara(mascaras, tmp_path):
+    pasta, calculos = mascaras
+    lat, lon = _grade()
+    quadrado = _geojson(tmp_path, "a.geojson", QUADRADO)
+    mascara_poligono.mascara_da_grade(lat, lon, quadrado)
+
+    lat_fina, lon_fina = _grade(0.125)
+    fina = mascara_poligono.mascara_da_grade(lat_fina, lon_fina, quadrado)
+    assert len(calculos) == 2 and fina.shape == (lat_fina.size, lon_fina.size)
+
+    # Mesmo tamanho de grade, coordenadas deslocadas
+    mascara_poligono.mascara_da_grade(lat + 0.1, lon, quadrado)
+    assert len(calculos) == 3
+
+    menor = [[x, y] for x, y in QUADRADO]
+    menor[1][0] = menor[2][0] = -35.75
+    estreita = mascara_poligono.mascara_da_grade(lat, lon, _geojson(tmp_path, "c.geojson", menor))
+    assert len(calculos) == 4 and estreita.sum() == 2
+    assert len(list(pasta.glob("*.npy"))) == 4
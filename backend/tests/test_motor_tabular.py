@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+import motor_tabular
+
+
+@pytest.fixture
+def ds(tmp_path):
+    """Grade curvilínea (lat/lon 2-D), tempo, NaN e _FillValue, lida de um .nc"""
+    tempo = pd.date_range("2024-01-01", periods=3, freq="D")
+    y, x = np.meshgrid(np.arange(2), np.arange(3), indexing="ij")
+    pr = np.arange(18, dtype="float32").reshape(3, 2, 3)
+    pr[0, 1, 2] = np.nan
+    pr[1, 0, 0] = -999.0           # vira NaN pelo _FillValue
+    pr[2] = np.nan                 # um tempo inteiro sem dados
+    tmax = np.full((3, 2, 3), 30.0)
+    tmax[2] = np.nan
+    tmax[1, 0, 0] = np.nan
+    origem = xr.Dataset(
+        {"pr": (("time", "y", "x"), pr), "tmax": (("time", "y", "x"), tmax)},
+        coords={
+            "time": tempo,
+            "lat": (("y", "x"), -7.0 + 0.1 * y + 0.01 * x),
+            "lon": (("y", "x"), -36.0 + 0.1 * x),
+        },
+    )
+    caminho = tmp_path / "curvilinea.nc"
+    origem.to_netcdf(caminho, encoding={"pr": {"_FillValue": -999.0}})
+    with xr.open_dataset(caminho) as aberto:
+        yield aberto.load()
+
+
+def _esperado(ds):
+    return ds.to_dataframe().reset_index()
+
+
+def test_tabela_igual_ao_to_dataframe(ds):
+    obtido = motor_tabular.para_dataframe(motor_tabular.tabela_da_fatia(ds))
+    esperado = _esperado(ds)
+    assert list(obtido.columns)[:3] == ["time", "y", "x"] and {"lat", "lon"} <= set(obtido.columns)
+    pd.testing.assert_frame_equal(obtido, esperado)
+    assert obtido["pr"].isna().sum() == 8
+
+
+def test_tabela_de_uma_fatia_mantem_as_posicoes(ds):
+    ds = motor_tabular.completar_coordenadas(ds)
+    fatia = {"time": slice(1, 3), "y": slice(1, 2)}
+    obtido = motor_tabular.para_dataframe(motor_tabular.tabela_da_fatia(ds.isel(fatia)))
+    pd.testing.assert_frame_equal(obtido, _esperado(ds.isel(fatia)))
+    assert obtido["y"].unique().tolist() == [1]
+
+
+def test_esparso_descarta_linhas_sem_dados(ds):
+    obtido = motor_tabular.para_dataframe(motor_tabular.tabela_da_fatia(ds, esparso=True))
+    esperado = _esperado(ds).dropna(subset=["pr", "tmax"], how="all").reset_index(drop=True)
+    pd.testing.assert_frame_equal(obtido.reset_index(drop=True), esperado)
+    assert len(obtido) == 18 - 6 - 1   # o tempo vazio e a célula com _FillValue e NaN
+    assert obtido["pr"].isna().sum() == 1   # tmax ainda tem valor nessa linha
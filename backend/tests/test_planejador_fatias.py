@@ -0,0 +1,31 @@
+import numpy as np
+import xarray as xr
+
+import planejador_fatias
+
+
+def _serie(chunks):
+    """3650 dias x 200 x 200 células (sem dados), com os chunks em disco informados"""
+    pr = xr.Variable(("time", "lat", "lon"), np.broadcast_to(np.float32(0), (3650, 200, 200)))
+    pr.encoding["preferred_chunks"] = dict(zip(("time", "lat", "lon"), chunks))
+    return xr.Dataset({"pr": pr}, coords={"lat": np.arange(200.0), "lon": np.arange(200.0)})
+
+
+def test_series_cobrem_a_grade_uma_vez():
+    ds = _serie((3650, 10, 200))
+    fatias = list(planejador_fatias.planejar_series(ds, "time"))
+    assert len(fatias) == planejador_fatias.contar_series(ds, "time")
+    linhas = np.concatenate([np.arange(200)[f["lat"]] for f in fatias])
+    np.testing.assert_array_equal(linhas, np.arange(200))
+
+
+def test_series_crescem_ate_chunks_inteiros():
+    ds = _serie((3650, 8, 200))
+    fatias = list(planejador_fatias.planejar_series(ds, "time"))
+    assert all((f["lat"].stop - f["lat"].start) % 8 == 0 for f in fatias)
+    assert planejador_fatias.releituras_series(ds, "time") == 1
+
+
+def test_chunks_so_no_tempo_sao_relidos():
+    ds = _serie((30, 200, 200))
+    assert planejador_fatias.releituras_series(ds, "time") == planejador_fatias.contar_series(ds, "time") > 1
@@ -0,0 +1,54 @@
+import numpy as np
+import xarray as xr
+
+import reducao_espacial
+
+
+def _grade():
+    """Grade 4 x 6 com valores 0..23 e uma célula sem dados"""
+    valores = np.arange(24, dtype=np.float32).reshape(4, 6)
+    valores[0, 0] = np.nan
+    return xr.Dataset(
+        {"pr": (("lat", "lon"), valores)},
+        coords={"lat": [-8.0, -7.5, -7.0, -6.5], "lon": [-36.0, -35.5, -35.0, -34.5, -34.0, -33.5]},
+    )
+
+
+def test_media_ignora_celulas_sem_dados():
+    reduzido = reducao_espacial.reduzir(_grade(), {"lat": 2, "lon": 2}, "media")
+    esperado = [[(1 + 6 + 7) / 3, (2 + 3 + 8 + 9) / 4, (4 + 5 + 10 + 11) / 4],
+                [(12 + 13 + 18 + 19) / 4, (14 + 15 + 20 + 21) / 4, (16 + 17 + 22 + 23) / 4]]
+    np.testing.assert_allclose(reduzido["pr"].values, esperado, rtol=1e-6)
+    np.testing.assert_allclose(reduzido["lat"].values, [-7.75, -6.75])
+    np.testing.assert_allclose(reduzido["lon"].values, [-35.75, -34.75, -33.75])
+
+
+def test_soma_e_maximo_por_bloco():
+    ds = _grade()
+    soma = reducao_espacial.reduzir(ds, {"lat": 2, "lon": 3}, "soma")
+    np.testing.assert_allclose(soma["pr"].values, [[1 + 2 + 6 + 7 + 8, 3 + 4 + 5 + 9 + 10 + 11],
+                                                   [12 + 13 + 14 + 18 + 19 + 20, 15 + 16 + 17 + 21 + 22 + 23]])
+    maximo = reducao_espacial.reduzir(ds, {"lat": 2, "lon": 3}, "maximo")
+    np.testing.assert_array_equal(maximo["pr"].values, [[8, 11], [20, 23]])
+
+
+def test_soma_de_bloco_sem_dados_fica_nan():
+    ds = _grade()
+    ds["pr"][:2, :2] = np.nan
+    soma = reducao_espacial.reduzir(ds, {"lat": 2, "lon": 2}, "soma")
+    assert np.isnan(soma["pr"].values[0, 0])
+    assert soma["pr"].values[0, 1] == 2 + 3 + 8 + 9
+
+
+def test_sobra_da_grade_e_descartada_e_fatia_reduzida():
+    reduzido = reducao_espacial.reduzir(_grade(), {"lat": 3, "lon": 4}, "media")
+    assert reduzido["pr"].shape == (1, 1)
+    molde = reducao_espacial.grade_reduzida(_grade(), {"lat": 3, "lon": 4})
+    assert molde["pr"].shape == (1, 1)
+    assert reducao_espacial.fatia_reduzida({"lat": slice(0, 4), "lon": slice(2, 6)}, {"lat": 2}) == \
+        {"lat": slice(0, 2), "lon": slice(2, 6)}
+
+
+def test_fatores_pela_resolucao():
+    assert reducao_espacial.fatores(_grade(), {"resolucao": 1.0}) == {"lat": 2, "lon": 2}
+    assert reducao_espacial.fatores(_grade(), {}) == {}
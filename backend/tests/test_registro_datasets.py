@@ -0,0 +1,88 @@
+import json
+
+import numpy as np
+import pytest
+import xarray as xr
+
+import inspecao
+import registro_datasets
+
+
+@pytest.fixture
+def registro(tmp_path, monkeypatch):
+    """Dois datasets registrados e no máximo um aberto"""
+    monkeypatch.setattr(registro_datasets, "DATASETS_DIR", tmp_path)
+    monkeypatch.setattr(registro_datasets, "MAXIMO_ABERTOS", 1)
+    monkeypatch.setattr(registro_datasets, "_em_uso", {})
+    monkeypatch.setattr(registro_datasets, "_abertos", registro_datasets.OrderedDict())
+    monkeypatch.setattr(registro_datasets, "_pendentes", [])
+    ids = []
+    for letra in "ab":
+        dataset_id = letra * 64
+        xr.Dataset({"pr": ("x", np.arange(3.0))}).to_netcdf(tmp_path / f"{dataset_id}.nc")
+        (tmp_path / f"{dataset_id}.json").write_text(json.dumps({"id": dataset_id, "nome_arquivo": f"{letra}.nc"}))
+        ids.append(dataset_id)
+    yield ids
+    for _, ds in list(registro_datasets._abertos.items()) + registro_datasets._pendentes:
+        ds.close()
+
+
+def _abertos():
+    return [chave[0] for chave in registro_datasets._abertos]
+
+
+def test_lru_nao_fecha_dataset_reservado(registro):
+    a, b = registro
+    liberar = registro_datasets.reservar(a)
+    ds_a = registro_datasets.abrir(a)
+    registro_datasets.abrir(b)
+    assert _abertos() == [a, b]  # passa do limite enquanto `a` está reservado
+    assert ds_a["pr"].values.tolist() == [0, 1, 2]
+    liberar()
+    assert _abertos() == [b]
+
+
+def test_reabertura_com_reserva_fecha_so_na_liberacao(registro):
+    a, _ = registro
+    liberar = registro_datasets.reservar(a)
+    ds_a = registro_datasets.abrir(a)
+    registro_datasets._fechar(a)
+    assert _abertos() == [] and len(registro_datasets._pendentes) == 1
+    assert ds_a["pr"].values.tolist() == [0, 1, 2]
+    liberar()
+    assert registro_datasets._pendentes == []
+
+
+def test_substituir_nc_recusa_dataset_em_uso(registro, tmp_path):
+    a, _ = registro
+    original = (tmp_path / f"{a}.nc").read_bytes()
+    novo = tmp_path / "novo.tmp"
+    xr.Dataset({"pr": ("x", np.arange(3.0))}).to_netcdf(novo)
+    liberar = registro_datasets.reservar(a)
+    with pytest.raises(registro_datasets.ErroDataset) as erro:
+        registro_datasets.substituir_nc(a, {"destino": str(novo)})
+    liberar()
+    assert erro.value.status == 409
+    assert (tmp_path / f"{a}.nc").read_bytes() == original
+    assert not novo.exists()
+
+
+def test_substituir_nc_guarda_cabecalho_nos_metadados(registro, tmp_path, monkeypatch):
+    a, _ = registro
+    monkeypatch.setattr(inspecao, "INDICE_DIR", tmp_path / "indice")
+    monkeypatch.setattr(inspecao, "_memoria", {})
+    (tmp_path / "indice").mkdir()
+    cabecalho_envio = inspecao.inspecionar_com_cache(str(tmp_path / f"{a}.nc"), a)
+    (tmp_path / f"{a}.zarr").mkdir()
+    novo = tmp_path / "novo.tmp"
+    codificacao = {"pr": {"zlib": True, "complevel": 4}}
+    xr.Dataset({"pr": ("x", np.arange(3.0))}).to_netcdf(novo, encoding=codificacao)
+
+    registro_datasets.substituir_nc(a, {"destino": str(novo), "nivel": 4})
+
+    _, meta = registro_datasets.obter(a)
+    assert meta["otimizacao"] == {"nivel": 4}
+    assert meta["cabecalho_otimizado"] == inspecao.inspecionar(str(tmp_path / f"{a}.nc"))
+    assert meta["cabecalho_otimizado"] != cabecalho_envio
+    assert inspecao.buscar(a) == cabecalho_envio
+    assert not (tmp_path / f"{a}.zarr").exists()
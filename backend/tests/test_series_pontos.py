@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+import series_pontos
+
+
+def _grade():
+    """Grade regular de 0,25° com pr = 100 * i_lat + i_lon em todo passo de tempo"""
+    lat, lon = np.arange(-8.0, -6.0, 0.25), np.arange(-37.0, -35.0, 0.25)
+    base = 100 * np.arange(lat.size)[:, None] + np.arange(lon.size)[None, :]
+    pr = base[None] + np.arange(4)[:, None, None] * 1000.0
+    return xr.Dataset({"pr": (("time", "lat", "lon"), pr)},
+                      coords={"time": pd.date_range("2024-01-01", periods=4), "lat": lat, "lon": lon})
+
+
+def test_celula_mais_proxima_e_distancia():
+    pontos = series_pontos.ler_pontos('[{"nome": "araruna", "lat": -6.53, "lon": -35.74}, [-7.9, -36.9]]')
+    resultado = series_pontos.series(_grade(), pontos)
+    araruna, canto = resultado["pontos"]
+    assert araruna["indice"] == {"lat": 6, "lon": 5}
+    assert (araruna["lat_grade"], araruna["lon_grade"]) == (-6.5, -35.75)
+    assert araruna["series"]["pr"] == [605, 1605, 2605, 3605]
+    assert araruna["distancia_km"] == pytest.approx(3.5, abs=0.2)
+    assert araruna["espacamento_km"] == pytest.approx(27.8, abs=0.1)
+    assert canto["indice"] == {"lat": 0, "lon": 0}
+
+
+def test_ponto_fora_da_grade_e_recusado():
+    # Meia célula além da borda é aceito; a 5.000 km, não
+    resultado = series_pontos.series(_grade(), [{"nome": "borda", "lat": -8.12, "lon": -37.0}])
+    assert resultado["pontos"][0]["indice"] == {"lat": 0, "lon": 0}
+    with pytest.raises(series_pontos.ErroPontos, match="longe"):
+        series_pontos.series(_grade(), [{"nome": "perto", "lat": -7.0, "lon": -36.0},
+                                        {"nome": "longe", "lat": 40.0, "lon": 10.0}])
+
+
+def test_leitura_em_lotes_igual_a_leitura_unica(monkeypatch):
+    pontos = [{"nome": f"p{i}", "lat": -8.0 + 0.25 * i, "lon": -35.25 - 0.25 * i} for i in range(8)]
+    inteiro = series_pontos.series(_grade(), pontos)
+    lotes = []
+    original = series_pontos._lotes_de_celulas
+    monkeypatch.setattr(series_pontos, "_lotes_de_celulas",
+                        lambda celulas, limite: lotes.extend(original(celulas, 4)) or lotes)
+    em_lotes = series_pontos.series(_grade(), pontos)
+    assert len(lotes) > 1
+    assert [p["series"] for p in em_lotes["pontos"]] == [p["series"] for p in inteiro["pontos"]]
+    assert [p["series"]["pr"][0] for p in inteiro["pontos"]] == [100 * i + 7 - i for i in range(8)]
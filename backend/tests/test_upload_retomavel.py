@@ -0,0 +1,85 @@
+import hashlib
+
+import pytest
+
+import upload_retomavel
+
+
+@pytest.fixture
+def sessao(tmp_path, monkeypatch):
+    """Sessão de 10 bytes em partes de 4 (4 + 4 + 2)"""
+    monkeypatch.setattr(upload_retomavel, "UPLOADS_DIR", tmp_path)
+    return upload_retomavel.criar_sessao("chuva.nc", 10, 4)["sessao_id"]
+
+
+CONTEUDO = b"0123456789"
+
+
+def _enviar(sessao_id: str, numero: int, dados: bytes, registrar: bool = True):
+    arquivo, esperado = upload_retomavel.abrir_parte(sessao_id, numero)
+    with arquivo:
+        arquivo.write(dados)
+    if registrar:
+        assert len(dados) == esperado
+        return upload_retomavel.registrar_parte(sessao_id, numero)
+
+
+def test_partes_fora_de_ordem(sessao, tmp_path):
+    for numero in (2, 0, 1):
+        resumo = _enviar(sessao, numero, CONTEUDO[numero * 4:numero * 4 + 4])
+    assert resumo["partes_recebidas"] == [0, 1, 2]
+    assert resumo["faixas_recebidas"] == [[0, 10]]
+    assert resumo["completo"]
+
+    destino = tmp_path / "montado.nc"
+    assert upload_retomavel.finalizar_sessao(sessao, destino) == hashlib.sha256(CONTEUDO).hexdigest()
+    assert destino.read_bytes() == CONTEUDO
+
+
+def test_finalizar_com_partes_faltando(sessao, tmp_path):
+    _enviar(sessao, 0, CONTEUDO[:4])
+    _enviar(sessao, 2, CONTEUDO[8:])
+    with pytest.raises(upload_retomavel.ErroUpload) as erro:
+        upload_retomavel.finalizar_sessao(sessao, tmp_path / "montado.nc")
+    assert erro.value.status == 409
+    assert upload_retomavel.resumo_sessao(upload_retomavel.carregar_sessao(sessao))["partes_faltando"] == [1]
+
+
+def test_reenvio_interrompido_deixa_a_parte_faltando(sessao, tmp_path):
+    for numero in range(3):
+        _enviar(sessao, numero, CONTEUDO[numero * 4:numero * 4 + 4])
+    _enviar(sessao, 1, b"xx", registrar=False)  # conexão caiu no meio do reenvio
+
+    resumo = upload_retomavel.resumo_sessao(upload_retomavel.carregar_sessao(sessao))
+    assert resumo["partes_faltando"] == [1] and not resumo["completo"]
+    with pytest.raises(upload_retomavel.ErroUpload):
+        upload_retomavel.finalizar_sessao(sessao, tmp_path / "montado.nc")
+
+    _enviar(sessao, 1, CONTEUDO[4:8])
+    destino = tmp_path / "montado.nc"
+    upload_retomavel.finalizar_sessao(sessao, destino)
+    assert destino.read_bytes() == CONTEUDO
+
+
+def test_tamanho_total_limitado(tmp_path, monkeypatch):
+    monkeypatch.setattr(upload_retomavel, "UPLOADS_DIR", tmp_path)
+    monkeypatch.setattr(upload_retomavel, "TAMANHO_TOTAL_MAXIMO", 100)
+    with pytest.raises(upload_retomavel.ErroUpload) as erro:
+        upload_retomavel.criar_sessao("chuva.nc", 101)
+    assert erro.value.status == 413
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_reenvio_grande_demais_pela_api(sessao):
+    testclient = pytest.importorskip("fastapi.testclient")
+    import main
+
+    cliente = testclient.TestClient(main.app)
+    url = f"/api/netcdf/uploads/{sessao}/partes"
+    for numero in (2, 1, 0):
+        assert cliente.put(f"{url}/{numero}", content=CONTEUDO[numero * 4:numero * 4 + 4]).status_code == 200
+    assert cliente.put(f"{url}/1", content=b"45678").status_code == 400
+
+    resumo = cliente.get(f"/api/netcdf/uploads/{sessao}").json()
+    assert resumo["partes_faltando"] == [1]
+    assert cliente.post(f"/api/netcdf/uploads/{sessao}/finalizar").status_code == 409
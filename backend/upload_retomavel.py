@@ -0,0 +1,224 @@
+"""
+Defesa Civil Araruna - Upload retomável em partes
+Sessões de upload onde partes numeradas chegam em qualquer ordem (inclusive
+em paralelo) e são gravadas direto na posição final do arquivo. O estado de
+cada sessão fica em disco, então o envio continua mesmo após reiniciar o
+servidor ou perder a conexão.
+"""
+
+import os
+import json
+import math
+import uuid
+import hashlib
+import threading
+from datetime import datetime
+from pathlib import Path
+
+
+UPLOADS_DIR = Path(__file__).parent / "temp" / "uploads"
+UPLOADS_DIR.mkdir(parents=True, exist_ok=True)
+
+TAMANHO_PARTE_PADRAO = 16 * 1024 * 1024      # 16 MB
+TAMANHO_PARTE_MAXIMO = 256 * 1024 * 1024     # 256 MB
+
+# Tamanho máximo do arquivo enviado (padrão: 20 GB, o espaço padrão dos datasets)
+TAMANHO_TOTAL_MAXIMO = int(os.getenv("UPLOAD_MAX_MB", "20480")) * 1024 * 1024
+
+# Sessões sem atividade são descartadas depois desse tempo (24 horas)
+VALIDADE_SESSAO_SEGUNDOS = 24 * 3600
+
+_lock = threading.Lock()
+
+
+class ErroUpload(Exception):
+    """Erro de validação do protocolo de upload (vira HTTP 4xx no main)"""
+
+    def __init__(self, mensagem: str, status: int = 400):
+        super().__init__(mensagem)
+        self.status = status
+
+
+def _caminho_dados(sessao_id: str) -> Path:
+    return UPLOADS_DIR / f"{sessao_id}.part"
+
+
+def _caminho_estado(sessao_id: str) -> Path:
+    return UPLOADS_DIR / f"{sessao_id}.json"
+
+
+def _salvar_estado(estado: dict):
+    caminho = _caminho_estado(estado["id"])
+    temporario = caminho.with_suffix(".json.tmp")
+    temporario.write_text(json.dumps(estado), encoding="utf-8")
+    os.replace(temporario, caminho)
+
+
+def carregar_sessao(sessao_id: str) -> dict:
+    """Lê o estado da sessão do disco"""
+    if not sessao_id.isalnum():
+        raise ErroUpload("Sessão inválida", 404)
+    caminho = _caminho_estado(sessao_id)
+    if not caminho.exists():
+        raise ErroUpload("Sessão de upload não encontrada ou expirada", 404)
+    return json.loads(caminho.read_text(encoding="utf-8"))
+
+
+def criar_sessao(nome_arquivo: str, tamanho_total: int,
+                 tamanho_parte: int | None = None, sha256: str | None = None) -> dict:
+    """Cria uma sessão e reserva o arquivo de destino com o tamanho final"""
+    limpar_sessoes_antigas()
+
+    if tamanho_total <= 0:
+        raise ErroUpload("tamanho_total deve ser maior que zero")
+    if tamanho_total > TAMANHO_TOTAL_MAXIMO:
+        raise ErroUpload(f"Arquivo maior que o limite de upload ({TAMANHO_TOTAL_MAXIMO // (1024 * 1024)} MB)", 413)
+
+    tamanho_parte = tamanho_parte or TAMANHO_PARTE_PADRAO
+    if not 0 < tamanho_parte <= TAMANHO_PARTE_MAXIMO:
+        raise ErroUpload(f"tamanho_parte deve estar entre 1 e {TAMANHO_PARTE_MAXIMO} bytes")
+
+    sessao_id = uuid.uuid4().hex
+    estado = {
+        "id": sessao_id,
+        "nome_arquivo": nome_arquivo,
+        "tamanho_total": tamanho_total,
+        "tamanho_parte": tamanho_parte,
+        "total_partes": math.ceil(tamanho_total / tamanho_parte),
+        "sha256": sha256.lower() if sha256 else None,
+        "partes_recebidas": [],
+        "criado_em": datetime.now().isoformat(timespec="seconds"),
+    }
+
+    # Arquivo esparso com o tamanho final: cada parte é gravada no seu offset
+    with open(_caminho_dados(sessao_id), "wb") as f:
+        f.truncate(tamanho_total)
+
+    with _lock:
+        _salvar_estado(estado)
+
+    print(f"[UPLOAD] Sessão {sessao_id}: {nome_arquivo} "
+          f"({tamanho_total / (1024 * 1024):.2f} MB, {estado['total_partes']} partes)")
+    return resumo_sessao(estado)
+
+
+def faixa_da_parte(estado: dict, numero: int) -> tuple[int, int]:
+    """Intervalo de bytes [inicio, fim) que a parte `numero` ocupa"""
+    if not 0 <= numero < estado["total_partes"]:
+        raise ErroUpload(f"Parte {numero} fora do intervalo 0..{estado['total_partes'] - 1}")
+    inicio = numero * estado["tamanho_parte"]
+    fim = min(inicio + estado["tamanho_parte"], estado["tamanho_total"])
+    return inicio, fim
+
+
+def abrir_parte(sessao_id: str, numero: int):
+    """
+    Prepara a gravação de uma parte. Retorna (arquivo aberto já posicionado
+    no offset, bytes esperados). Cada parte usa seu próprio descritor, então
+    partes diferentes podem ser gravadas ao mesmo tempo. Uma parte reenviada
+    deixa de constar como recebida até registrar_parte: se o reenvio falhar
+    no meio, a faixa sobrescrita fica faltando e finalizar_sessao recusa o
+    arquivo. Operação bloqueante: chamar fora do event loop.
+    """
+    with _lock:
+        estado = carregar_sessao(sessao_id)
+        inicio, fim = faixa_da_parte(estado, numero)
+        if numero in estado["partes_recebidas"]:
+            estado["partes_recebidas"].remove(numero)
+            _salvar_estado(estado)
+    f = open(_caminho_dados(sessao_id), "r+b")
+    f.seek(inicio)
+    return f, fim - inicio
+
+
+def registrar_parte(sessao_id: str, numero: int) -> dict:
+    """Marca a parte como recebida (após gravar todos os bytes)"""
+    with _lock:
+        estado = carregar_sessao(sessao_id)
+        if numero not in estado["partes_recebidas"]:
+            estado["partes_recebidas"].append(numero)
+            estado["partes_recebidas"].sort()
+        estado["atualizado_em"] = datetime.now().isoformat(timespec="seconds")
+        _salvar_estado(estado)
+    return resumo_sessao(estado)
+
+
+def _faixas(estado: dict, partes: list[int]) -> list[list[int]]:
+    """Agrupa partes consecutivas em intervalos de bytes [inicio, fim)"""
+    faixas: list[list[int]] = []
+    for numero in partes:
+        inicio, fim = faixa_da_parte(estado, numero)
+        if faixas and faixas[-1][1] == inicio:
+            faixas[-1][1] = fim
+        else:
+            faixas.append([inicio, fim])
+    return faixas
+
+
+def resumo_sessao(estado: dict) -> dict:
+    """Estado público: partes e faixas de bytes já recebidas e faltantes"""
+    recebidas = estado["partes_recebidas"]
+    recebidas_set = set(recebidas)
+    faltando = [n for n in range(estado["total_partes"]) if n not in recebidas_set]
+    bytes_recebidos = sum(fim - inicio for inicio, fim in _faixas(estado, recebidas))
+    return {
+        "sessao_id": estado["id"],
+        "nome_arquivo": estado["nome_arquivo"],
+        "tamanho_total": estado["tamanho_total"],
+        "tamanho_parte": estado["tamanho_parte"],
+        "total_partes": estado["total_partes"],
+        "partes_recebidas": recebidas,
+        "partes_faltando": faltando,
+        "faixas_recebidas": _faixas(estado, recebidas),
+        "bytes_recebidos": bytes_recebidos,
+        "completo": not faltando,
+    }
+
+
+def finalizar_sessao(sessao_id: str, destino: Path) -> str:
+    """
+    Confere se todas as partes chegaram, calcula o SHA-256 e move o arquivo
+    montado para `destino`. Retorna o hash (usado como chave do cache).
+    Operação bloqueante: chamar fora do event loop.
+    """
+    estado = carregar_sessao(sessao_id)
+    resumo = resumo_sessao(estado)
+    if not resumo["completo"]:
+        raise ErroUpload(
+            f"Upload incompleto: faltam {len(resumo['partes_faltando'])} parte(s)", 409
+        )
+
+    caminho = _caminho_dados(sessao_id)
+    sha256 = hashlib.sha256()
+    with open(caminho, "rb") as f:
+        while bloco := f.read(8 * 1024 * 1024):
+            sha256.update(bloco)
+    digest = sha256.hexdigest()
+
+    if estado["sha256"] and estado["sha256"] != digest:
+        raise ErroUpload("SHA-256 do arquivo montado não confere com o informado", 422)
+
+    os.replace(caminho, destino)
+    _caminho_estado(sessao_id).unlink(missing_ok=True)
+    print(f"[UPLOAD] Sessão {sessao_id} finalizada -> {destino.name}")
+    return digest
+
+
+def cancelar_sessao(sessao_id: str):
+    """Descarta a sessão e os bytes já recebidos"""
+    carregar_sessao(sessao_id)
+    _caminho_dados(sessao_id).unlink(missing_ok=True)
+    _caminho_estado(sessao_id).unlink(missing_ok=True)
+
+
+def limpar_sessoes_antigas():
+    """Remove sessões sem atividade há mais de 24 horas"""
+    agora = datetime.now().timestamp()
+    for arquivo in UPLOADS_DIR.iterdir():
+        if arquivo.is_file():
+            idade = agora - arquivo.stat().st_mtime
+            if idade > VALIDADE_SESSAO_SEGUNDOS:
+                try:
+                    arquivo.unlink()
+                except:
+                    pass